@@ -21,7 +21,7 @@ from modules.loyalty_scheduler_controller import (
 )
 
 # Importer nos modules personnalisés
-from modules.db_connection import DatabaseManager
+from modules.db_connection import DatabaseManager, fetch_dataframe, transactions_with_articles_query
 from modules.data_processor_module import DataProcessor
 from modules.clustering_module import ClusteringProcessor
 from modules.visualization_module import create_visualization, generate_report
@@ -30,8 +30,14 @@ from modules.transformations_persistence import TransformationManager
 from modules.maps_module import create_sales_map, analyze_geographical_sales, generate_geographical_insights
 from modules.store_locations import update_store_locations, verify_store_locations
 from modules.loyalty_manager import LoyaltyManager, RewardManager
+from modules.offer_codes import offer_code_sql, execute_with_code_retry
 from modules.cluster_offers_routes import cluster_offers
 from modules.settings_routes import settings_bp
+from modules.db_pool import configure_pool, get_connection, DEFAULT_DB_PATH
+from modules.migrations import apply_migrations
+from modules.query_cache import cached_execute, cached_read_sql
+from modules.analytics_mirror import get_analytics_connection, start_mirror_refresh
+from modules.read_replica import get_replica_connection, start_replica_refresh, data_lag
 # Ajoutez l'import nécessaire en haut du fichier
 from modules.cluster_offers_routes import ClusterOfferGenerator
 
@@ -51,6 +57,19 @@ app.config['ALLOWED_EXTENSIONS'] = {'csv', 'txt', 'xlsx', 'pdf', 'wav', 'mp3'}
 app.register_blueprint(cluster_offers)
 app.register_blueprint(settings_bp)
 
+# Pool de connexions SQLite partagé (pragmas appliqués à chaque nouvelle connexion)
+configure_pool()
+
+# Migrations du schéma de la base de fidélité (index, tables dérivées)
+migration_result = apply_migrations(DEFAULT_DB_PATH)
+if not migration_result['success']:
+    logger.error(f"Migrations du schéma non appliquées: {migration_result['error']}")
+
+# Miroir analytique DuckDB (LOYALTY_ANALYTICS_BACKEND=duckdb), rafraîchi en arrière-plan
+start_mirror_refresh(DEFAULT_DB_PATH)
+
+# Réplique de lecture des tableaux de bord et exports, rafraîchie en arrière-plan
+start_replica_refresh(DEFAULT_DB_PATH)
 
 # S'assurer que le dossier d'upload existe
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -63,11 +82,9 @@ history_manager = AnalysisHistory('analysis_history')
 pdf_history_manager = PDFAnalysisHistory('analysis_history/pdf')
 
 
-# Fonction pour obtenir une connexion à la base de données
-def get_db_connection(db_path='fidelity_db.sqlite'):
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Fonction pour obtenir une connexion à la base de données (empruntée au pool, à rendre avec close())
+def get_db_connection(db_path=DEFAULT_DB_PATH):
+    return get_connection(db_path, sqlite3.Row)
 
 def create_app():
     app = Flask(__name__)
@@ -106,63 +123,6 @@ def data_processing():
     produits = []
     moyens_paiement = []
     
-    def decompose_transaction_with_articles(transaction_data):
-        """
-        Décompose un enregistrement de transaction avec ses articles.
-        
-        Args:
-            transaction_data (dict): Dictionnaire contenant les détails de la transaction et ses articles
-        
-        Returns:
-            list: Liste de dictionnaires, un pour chaque article de la transaction
-        """
-        # Extraire les détails de base de la transaction
-        base_details = {
-            'id': transaction_data['id'],
-            'date_transaction': transaction_data['date_transaction'],
-            'montant_total': transaction_data['montant_total'],
-            'numero_facture': transaction_data['numero_facture'],
-            'magasin': transaction_data['magasin'],
-            'enseigne': transaction_data['enseigne'],
-            'moyen_paiement': transaction_data['moyen_paiement'],
-            'canal_vente': transaction_data['canal_vente'],
-            'points_gagnes': transaction_data['points_gagnes']
-        }
-        
-        # Ajouter les données démographiques client si disponibles
-        # Ces clés seront présentes uniquement si include_demographics est vrai
-        for key in ['client_id', 'genre', 'age', 'segment_client', 'niveau_fidelite']:
-            if key in transaction_data:
-                base_details[key] = transaction_data[key]
-        
-        # Si pas d'articles, retourner un seul enregistrement avec des détails d'article vides
-        if not transaction_data.get('articles', []):
-            base_details.update({
-                'nom_article': None,
-                'quantite': None,
-                'prix_unitaire': None,
-                'remise_pourcentage': None,
-                'montant_ligne': None,
-                'categorie': None
-            })
-            return [base_details]
-        
-        # Créer un enregistrement pour chaque article de la transaction
-        decomposed_records = []
-        for article in transaction_data['articles']:
-            record = base_details.copy()
-            record.update({
-                'nom_article': article.get('nom_article'),
-                'quantite': article.get('quantite'),
-                'prix_unitaire': article.get('prix_unitaire'),
-                'remise_pourcentage': article.get('remise_pourcentage'),
-                'montant_ligne': article.get('montant_ligne'),
-                'categorie': article.get('categorie')
-            })
-            decomposed_records.append(record)
-        
-        return decomposed_records
-
     # Bloc de connexion et récupération des données
     try:
         # Afficher le chemin complet de la base de données
@@ -171,8 +131,7 @@ def data_processing():
         # Vérifier si le fichier existe
         if os.path.exists(db_path):
             # Connexion à la base de données
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row
+            conn = get_db_connection(db_path)
             cursor = conn.cursor()
             
             # Tester la connexion en récupérant la liste des tables
@@ -204,70 +163,64 @@ def data_processing():
             if has_points_vente:
                 try:
                     # Points de vente
-                    cursor.execute("""
+                    points_vente = [dict(row) for row in cached_execute(conn, """
                         SELECT magasin_id, nom, ville, code_postal, type, email as enseigne
                         FROM points_vente
                         WHERE statut != 'fermé'
                         ORDER BY nom
-                    """)
-                    points_vente = [dict(row) for row in cursor.fetchall()]
+                    """)]
                     
                     # Enseignes
-                    cursor.execute("""
+                    enseignes = [row[0] for row in cached_execute(conn, """
                         SELECT DISTINCT email as enseigne 
                         FROM points_vente 
                         WHERE email IS NOT NULL 
                         ORDER BY email
-                    """)
-                    enseignes = [row[0] for row in cursor.fetchall() if row[0]]
+                    """) if row[0]]
                     
                     # Villes
-                    cursor.execute("""
+                    villes = [row[0] for row in cached_execute(conn, """
                         SELECT DISTINCT ville 
                         FROM points_vente 
                         WHERE ville IS NOT NULL 
                         ORDER BY ville
-                    """)
-                    villes = [row[0] for row in cursor.fetchall() if row[0]]
+                    """) if row[0]]
                 except Exception as e:
                     logger.error(f"Erreur lors de la récupération des points de vente: {e}")
             
             # Catégories de produits
             if has_categories:
                 try:
-                    cursor.execute("""
+                    categories_produits = [dict(row) for row in cached_execute(conn, """
                         SELECT categorie_id, nom, description, categorie_parent_id
                         FROM categories_produits
                         ORDER BY nom
-                    """)
-                    categories_produits = [dict(row) for row in cursor.fetchall()]
+                    """)]
                 except Exception as e:
                     logger.error(f"Erreur lors de la récupération des catégories: {e}")
             
             # Produits
             if has_produits:
                 try:
-                    cursor.execute("""
+                    produits = [dict(row) for row in cached_execute(conn, """
                         SELECT produit_id, reference, nom, categorie_id, marque, prix_standard
                         FROM produits
                         WHERE statut = 'actif'
                         ORDER BY nom
                         LIMIT 100
-                    """)
-                    produits = [dict(row) for row in cursor.fetchall()]
+                    """)]
                 except Exception as e:
                     logger.error(f"Erreur lors de la récupération des produits: {e}")
             
             # Moyens de paiement
             if has_transactions:
                 try:
-                    cursor.execute("""
+                    moyens_paiement = [row[0] for row in cached_execute(conn, """
                         SELECT DISTINCT type_paiement
                         FROM transactions
                         WHERE type_paiement IS NOT NULL
                         ORDER BY type_paiement
-                    """)
-                    moyens_paiement = [row[0] for row in cursor.fetchall() if row[0]]
+                    """) if row[0]]
                 except Exception as e:
                     logger.error(f"Erreur lors de la récupération des moyens de paiement: {e}")
             
@@ -325,9 +278,7 @@ def data_processing():
                     filters['date_debut'] = (today - timedelta(days=90)).strftime('%Y-%m-%d') if not filters['date_debut'] else filters['date_debut']
                 
                 # Connexion à la base de données
-                conn = sqlite3.connect(db_path)
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
+                conn = get_replica_connection(db_path, sqlite3.Row)
                 
                 # Construction de la requête de base
                 query = """
@@ -397,66 +348,26 @@ def data_processing():
                 if filters['categorie_id'] or filters['produit_id']:
                     query += " GROUP BY t.transaction_id"
                 
-                # Tri et limitation
-                query += " ORDER BY t.date_transaction DESC LIMIT 5000"
+                # Avec les articles: une seule requête jointe, sans limite (exports sur toute la période)
+                if filters['include_items']:
+                    query = transactions_with_articles_query(query)
+                else:
+                    # Tri et limitation
+                    query += " ORDER BY t.date_transaction DESC LIMIT 5000"
                 
                 logger.info(f"Requête SQL: {query}")
                 logger.info(f"Paramètres: {params}")
                 
-                # Exécution de la requête
-                cursor.execute(query, params)
-                rows = cursor.fetchall()
+                # Exécution de la requête et construction du DataFrame par lots
+                df = fetch_dataframe(conn, query, params)
                 
-                if not rows:
+                if df.empty:
                     flash('Aucune donnée trouvée avec les filtres spécifiés', 'warning')
                     conn.close()
                     return redirect(request.url)
                 
-                # Conversion en DataFrame
-                df = pd.DataFrame([dict(row) for row in rows])
-                
-                # Traitement des articles si demandé
                 if filters['include_items']:
-                    try:
-                        # Récupération des articles
-                        transaction_ids = df['id'].tolist()
-                        transaction_ids_str = ','.join(['?' for _ in transaction_ids])
-                        
-                        items_query = f"""
-                        SELECT dt.transaction_id, p.nom as nom_article, dt.quantite, dt.prix_unitaire, 
-                               dt.remise_pourcentage, dt.montant_ligne, cp.nom as categorie
-                        FROM details_transactions dt
-                        JOIN produits p ON dt.produit_id = p.produit_id
-                        LEFT JOIN categories_produits cp ON p.categorie_id = cp.categorie_id
-                        WHERE dt.transaction_id IN ({transaction_ids_str})
-                        """
-                        
-                        cursor.execute(items_query, transaction_ids)
-                        items = [dict(row) for row in cursor.fetchall()]
-                        
-                        # Groupement des articles par transaction
-                        items_by_transaction = {}
-                        for item in items:
-                            transaction_id = item['transaction_id']
-                            if transaction_id not in items_by_transaction:
-                                items_by_transaction[transaction_id] = []
-                            items_by_transaction[transaction_id].append(item)
-                        
-                        # Décomposition des transactions
-                        decomposed_transactions = []
-                        for _, transaction in df.iterrows():
-                            transaction_dict = transaction.to_dict()
-                            transaction_dict['articles'] = items_by_transaction.get(transaction['id'], [])
-                            decomposed_transaction = decompose_transaction_with_articles(transaction_dict)
-                            decomposed_transactions.extend(decomposed_transaction)
-                        
-                        # Mise à jour du DataFrame
-                        df = pd.DataFrame(decomposed_transactions)
-                        
-                        logger.info(f"Décomposition des transactions : {len(df)} lignes")
-                        
-                    except Exception as e:
-                        logger.error(f"Erreur lors de la décomposition des transactions : {e}")
+                    logger.info(f"Décomposition des transactions : {len(df)} lignes")
                 
                 # Fermeture de la connexion
                 conn.close()
@@ -1508,18 +1419,19 @@ def api_calendar_data():
                     'error': "Base de données non trouvée"
                 })
             
-            # Connexion à la base de données
-            conn = sqlite3.connect(db_path)
+            # Connexion à la base de données (miroir analytique si activé)
+            conn = get_analytics_connection(db_path)
             
-            # Construction de la requête SQL de base
+            # Âge du client, écrit pour SQLite comme pour le miroir DuckDB
+            age_expression = f"({datetime.now().year} - CAST(substr(c.date_naissance, 1, 4) AS INTEGER))"
+            
+            # Construction de la requête SQL de base (genre et âge servent aux filtres, pas au groupement)
             query = """
             SELECT 
                 date(t.date_transaction) as date_achat,
                 COUNT(*) as nb_achats,
                 m.nom as magasin,
-                t.type_paiement as moyen_paiement,
-                c.genre,
-                CAST(strftime('%Y', 'now') - strftime('%Y', c.date_naissance) AS INTEGER) as age
+                t.type_paiement as moyen_paiement
             FROM transactions t
             JOIN points_vente m ON t.magasin_id = m.magasin_id
             JOIN clients c ON t.client_id = c.client_id
@@ -1563,15 +1475,15 @@ def api_calendar_data():
             if age_range != 'all':
                 logger.info(f"Filtrage par tranche d'âge: {age_range}")
                 if age_range == "0-18":
-                    conditions.append("(strftime('%Y', 'now') - strftime('%Y', c.date_naissance)) < 19")
+                    conditions.append(f"{age_expression} < 19")
                 elif age_range == "19-25":
-                    conditions.append("(strftime('%Y', 'now') - strftime('%Y', c.date_naissance)) BETWEEN 19 AND 25")
+                    conditions.append(f"{age_expression} BETWEEN 19 AND 25")
                 elif age_range == "26-35":
-                    conditions.append("(strftime('%Y', 'now') - strftime('%Y', c.date_naissance)) BETWEEN 26 AND 35")
+                    conditions.append(f"{age_expression} BETWEEN 26 AND 35")
                 elif age_range == "36-50":
-                    conditions.append("(strftime('%Y', 'now') - strftime('%Y', c.date_naissance)) BETWEEN 36 AND 50")
+                    conditions.append(f"{age_expression} BETWEEN 36 AND 50")
                 elif age_range == "51+":
-                    conditions.append("(strftime('%Y', 'now') - strftime('%Y', c.date_naissance)) > 50")
+                    conditions.append(f"{age_expression} > 50")
             
             # Filtre par période
             if date_start:
@@ -1587,22 +1499,23 @@ def api_calendar_data():
             
             # Grouper par date, magasin et moyen de paiement (sans inclure genre et âge)
             query += " GROUP BY date_achat, magasin, moyen_paiement"
+            query += " ORDER BY date_achat, magasin, moyen_paiement"
             
             # Exécuter la requête
             logger.info(f"Requête SQL: {query}")
             logger.info(f"Paramètres: {params}")
             
-            df = pd.read_sql_query(query, conn, params=params)
+            df = cached_read_sql(conn, query, params=params)
             
             # Récupérer les listes de valeurs pour les filtres
             # Magasins
             brands_query = "SELECT DISTINCT nom FROM points_vente ORDER BY nom"
-            brands_df = pd.read_sql_query(brands_query, conn)
+            brands_df = cached_read_sql(conn, brands_query)
             brands = brands_df['nom'].tolist()
             
             # Moyens de paiement
             payment_query = "SELECT DISTINCT type_paiement FROM transactions WHERE type_paiement IS NOT NULL ORDER BY type_paiement"
-            payment_df = pd.read_sql_query(payment_query, conn)
+            payment_df = cached_read_sql(conn, payment_query)
             payment_methods = payment_df['type_paiement'].tolist()
             
             # Articles (produits)
@@ -1614,12 +1527,12 @@ def api_calendar_data():
             ORDER BY count DESC
             LIMIT 30
             """
-            products_df = pd.read_sql_query(products_query, conn)
+            products_df = cached_read_sql(conn, products_query)
             articles = products_df['nom'].tolist()
             
             # Genres disponibles
             genders_query = "SELECT DISTINCT genre FROM clients WHERE genre IS NOT NULL"
-            genders_df = pd.read_sql_query(genders_query, conn)
+            genders_df = cached_read_sql(conn, genders_query)
             available_genders = genders_df['genre'].tolist()
             
             conn.close()
@@ -2037,6 +1950,7 @@ def dashboard():
         'kpi_points': 0,
         'kpi_points_trend': 0,
         'recent_transactions': [],
+        'data_lag_seconds': None,
         'error': None
     }
     
@@ -2048,19 +1962,19 @@ def dashboard():
     
     try:
         # Récupérer les options pour les filtres
-        conn = get_db_connection(db_path)
+        conn = get_replica_connection(db_path, sqlite3.Row)
         
         # Liste des magasins
-        template_vars['magasins'] = conn.execute("""
+        template_vars['magasins'] = cached_execute(conn, """
             SELECT magasin_id, nom FROM points_vente ORDER BY nom
-        """).fetchall()
+        """)
         
         # Liste des moyens de paiement
-        template_vars['payment_methods'] = [row[0] for row in conn.execute("""
+        template_vars['payment_methods'] = [row[0] for row in cached_execute(conn, """
             SELECT DISTINCT type_paiement FROM transactions 
             WHERE type_paiement IS NOT NULL
             ORDER BY type_paiement
-        """).fetchall()]
+        """)]
         
         # Récupérer quelques KPIs de base pour l'affichage initial
         kpi_data = get_basic_kpis(conn)
@@ -2091,6 +2005,9 @@ def dashboard():
         # Convertir les transactions en liste de dictionnaires
         template_vars['recent_transactions'] = [dict(t) for t in recent_transactions]
         
+        # Âge des données affichées (réplique de lecture), None si lues sur la base principale
+        template_vars['data_lag_seconds'] = data_lag(conn)
+        
         conn.close()
         
         return render_template('dashboard.html', **template_vars)
@@ -2114,24 +2031,24 @@ def get_basic_kpis(conn):
     prev_end_date = (today - timedelta(days=31)).strftime("%Y-%m-%d")
     
     # Requête pour la période actuelle
-    current_data = conn.execute("""
+    current_data = cached_execute(conn, """
         SELECT 
             SUM(montant_total) as ca_total,
             COUNT(*) as nb_transactions,
             SUM(points_gagnes) as total_points
         FROM transactions
         WHERE date_transaction >= ? AND date_transaction <= ?
-    """, (start_date, end_date)).fetchone()
+    """, (start_date, end_date))[0]
     
     # Requête pour la période précédente
-    previous_data = conn.execute("""
+    previous_data = cached_execute(conn, """
         SELECT 
             SUM(montant_total) as ca_total,
             COUNT(*) as nb_transactions,
             SUM(points_gagnes) as total_points
         FROM transactions
         WHERE date_transaction >= ? AND date_transaction <= ?
-    """, (prev_start_date, prev_end_date)).fetchone()
+    """, (prev_start_date, prev_end_date))[0]
     
     # Extraire les données
     ca_current = current_data['ca_total'] or 0
@@ -2201,8 +2118,8 @@ def api_dashboard_data():
         prev_start_date = (datetime.strptime(prev_end_date, "%Y-%m-%d") - 
                           timedelta(days=days_diff)).strftime("%Y-%m-%d")
         
-        # Connexion à la base de données
-        conn = get_db_connection()
+        # Connexion à la base de données (miroir analytique si activé)
+        conn = get_analytics_connection(DEFAULT_DB_PATH, sqlite3.Row)
         
         # Construire la requête SQL avec les filtres
         params = [start_date, end_date]
@@ -2246,8 +2163,8 @@ def api_dashboard_data():
         """
         
         # Exécuter les requêtes pour les KPIs
-        current_kpis = conn.execute(current_kpis_query, params).fetchone()
-        prev_kpis = conn.execute(prev_kpis_query, prev_params).fetchone()
+        current_kpis = cached_execute(conn, current_kpis_query, params)[0]
+        prev_kpis = cached_execute(conn, prev_kpis_query, prev_params)[0]
         
         # Calculer les KPIs et les tendances
         ca_current = current_kpis['ca_total'] or 0
@@ -2287,11 +2204,13 @@ def api_dashboard_data():
         recent_transactions = conn.execute(recent_transactions_query, params).fetchall()
         recent_transactions = [dict(t) for t in recent_transactions]
         
+        lag = data_lag(conn)
         conn.close()
         
         # Construire la réponse JSON
         return jsonify({
             'success': True,
+            'data_lag_seconds': round(lag) if lag is not None else None,
             'kpis': {
                 'ca': ca_current,
                 'ca_trend': ca_trend,
@@ -2332,7 +2251,7 @@ def get_charts_data(conn, query_filters, params, start_date, end_date):
         ORDER BY date(t.date_transaction)
     """
     
-    daily_sales = conn.execute(daily_sales_query, params).fetchall()
+    daily_sales = cached_execute(conn, daily_sales_query, params)
     daily_sales = [dict(row) for row in daily_sales]
     
     # Calculer les données hebdomadaires
@@ -2392,7 +2311,7 @@ def get_charts_data(conn, query_filters, params, start_date, end_date):
         ORDER BY montant DESC
     """
     
-    store_distribution = conn.execute(store_distribution_query, params).fetchall()
+    store_distribution = cached_execute(conn, store_distribution_query, params)
     store_distribution = [dict(row) for row in store_distribution]
     
     # 3. Données pour la répartition par moyen de paiement
@@ -2407,7 +2326,7 @@ def get_charts_data(conn, query_filters, params, start_date, end_date):
         ORDER BY montant DESC
     """
     
-    payment_distribution = conn.execute(payment_distribution_query, params).fetchall()
+    payment_distribution = cached_execute(conn, payment_distribution_query, params)
     payment_distribution = [dict(row) for row in payment_distribution]
     
     # 4. Données pour la distribution par heure
@@ -2567,7 +2486,7 @@ def api_export_dashboard():
             end_date = today.strftime("%Y-%m-%d")
         
         # Connexion à la base de données
-        conn = get_db_connection()
+        conn = get_replica_connection(DEFAULT_DB_PATH, sqlite3.Row)
         
         # Construire la requête SQL avec les filtres
         params = [start_date, end_date]
@@ -3052,7 +2971,7 @@ def api_export_dashboard_pdf():
             end_date = today.strftime("%Y-%m-%d")
         
         # Connexion à la base de données
-        conn = get_db_connection()
+        conn = get_replica_connection(DEFAULT_DB_PATH, sqlite3.Row)
         
         # Construire la requête SQL avec les filtres
         params = [start_date, end_date]
@@ -3947,12 +3866,6 @@ import pandas as pd
 import uuid
 import logging
 
-# Fonction pour obtenir une connexion à la base de données
-def get_db_connection(db_path='C:/Users/baofr/Desktop/Workspace/MILAN_ticket/modules/fidelity_db.sqlite'):
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
-
 # Routes pour le programme de fidélité
 @app.route('/loyalty/dashboard')
 def loyalty_dashboard():
@@ -3973,17 +3886,16 @@ def loyalty_dashboard():
             ORDER BY r.priorite DESC
         ''').fetchall()
         
-        # Récupérer les statistiques des offres 
-        stats_offres = conn.execute('''
-            SELECT 
-                COUNT(*) as total_offres,
-                SUM(CASE WHEN statut = 'generee' THEN 1 ELSE 0 END) as offres_generees,
-                SUM(CASE WHEN statut = 'envoyee' THEN 1 ELSE 0 END) as offres_envoyees,
-                SUM(CASE WHEN statut = 'utilisee' THEN 1 ELSE 0 END) as offres_utilisees,
-                SUM(CASE WHEN statut = 'expiree' THEN 1 ELSE 0 END) as offres_expirees
-            FROM offres_client
-            WHERE date_generation >= date('now', '-30 days')
-        ''').fetchone()
+        # Récupérer les statistiques des offres (cache des statistiques du programme)
+        stats = LoyaltyManager().get_loyalty_stats(30)
+        offres_par_statut = {s['statut']: s['nb_offres'] for s in stats.get('stats_statuts', [])}
+        stats_offres = {
+            'total_offres': sum(offres_par_statut.values()),
+            'offres_generees': offres_par_statut.get('generee', 0),
+            'offres_envoyees': offres_par_statut.get('envoyee', 0),
+            'offres_utilisees': offres_par_statut.get('utilisee', 0),
+            'offres_expirees': offres_par_statut.get('expiree', 0)
+        }
         
         # Récupérer les offres récentes (anonymisées)
         offres_recentes = conn.execute('''
@@ -4102,6 +4014,8 @@ def add_loyalty_rule():
             conn.commit()
             conn.close()
             
+            LoyaltyManager.invalidate_rules_cache()
+            
             flash('Règle de fidélité ajoutée avec succès !', 'success')
             return redirect(url_for('loyalty_rules'))
             
@@ -4177,6 +4091,8 @@ def edit_loyalty_rule(regle_id):
             conn.commit()
             conn.close()
             
+            LoyaltyManager.invalidate_rules_cache()
+            
             flash('Règle de fidélité mise à jour avec succès !', 'success')
             return redirect(url_for('loyalty_rules'))
             
@@ -4246,6 +4162,8 @@ def delete_loyalty_rule(regle_id):
         conn.commit()
         conn.close()
         
+        LoyaltyManager.invalidate_rules_cache()
+        
         flash('Règle de fidélité supprimée avec succès', 'success')
         
     except Exception as e:
@@ -4348,323 +4266,13 @@ def send_loyalty_offers():
 @app.route('/loyalty/run-rules', methods=['POST'])
 def run_loyalty_rules():
     """Exécution des règles de fidélité avec génération d'offres"""
-    try:
-        conn = get_db_connection()
-        
-        # Récupérer les règles actives
-        rules = conn.execute('''
-            SELECT * FROM regles_fidelite 
-            WHERE est_active = 1
-            AND (date_debut IS NULL OR date_debut <= date('now'))
-            AND (date_fin IS NULL OR date_fin >= date('now'))
-            ORDER BY priorite DESC
-        ''').fetchall()
-        
-        total_offers_generated = 0
-        
-        # Pour chaque règle, exécuter la logique appropriée
-        for rule in rules:
-            rule_dict = dict(rule)
-            offers_for_rule = 0
-            eligible_clients = []
-            
-            # Logique par type de règle
-            if rule['type_regle'] == 'nombre_achats':
-                # Construire les conditions de période et segment
-                period_condition = ""
-                if rule['periode_jours']:
-                    period_condition = f"AND t.date_transaction >= date('now', '-{rule['periode_jours']} days')"
-                
-                segment_condition = ""
-                if rule['segments_cibles'] and rule['segments_cibles'] != '[]':
-                    try:
-                        segments = json.loads(rule['segments_cibles'])
-                        if segments:
-                            segments_str = ','.join([f"'{s.strip()}'" for s in segments])
-                            segment_condition = f"AND c.segment IN ({segments_str})"
-                    except Exception as e:
-                        print(f"Erreur de traitement segments: {e}")
-                
-                # Requête optimisée pour trouver les clients éligibles en une seule étape
-                clients_query = f'''
-                    SELECT 
-                        c.client_id,
-                        c.prenom || ' ' || c.nom as client_nom,
-                        COUNT(DISTINCT t.transaction_id) as nb_achats
-                    FROM clients c
-                    JOIN transactions t ON c.client_id = t.client_id
-                    LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
-                    WHERE c.statut = 'actif'
-                    AND (oc.offre_id IS NULL OR oc.statut = 'expiree')
-                    {period_condition}
-                    {segment_condition}
-                    GROUP BY c.client_id
-                    HAVING nb_achats >= ?
-                '''
-                
-                eligible_clients = conn.execute(clients_query, (rule['regle_id'], rule['condition_valeur'])).fetchall()
-                
-                print(f"Clients éligibles pour la règle '{rule['nom']}' (nombre_achats): {len(eligible_clients)}")
-                
-            elif rule['type_regle'] == 'montant_cumule':
-                # Construire les conditions de période et segment
-                period_condition = ""
-                if rule['periode_jours']:
-                    period_condition = f"AND t.date_transaction >= date('now', '-{rule['periode_jours']} days')"
-                
-                segment_condition = ""
-                if rule['segments_cibles'] and rule['segments_cibles'] != '[]':
-                    try:
-                        segments = json.loads(rule['segments_cibles'])
-                        if segments:
-                            segments_str = ','.join([f"'{s.strip()}'" for s in segments])
-                            segment_condition = f"AND c.segment IN ({segments_str})"
-                    except Exception as e:
-                        print(f"Erreur de traitement segments: {e}")
-                
-                # Requête optimisée pour trouver les clients éligibles en une seule étape
-                clients_query = f'''
-                    SELECT 
-                        c.client_id,
-                        c.prenom || ' ' || c.nom as client_nom,
-                        SUM(t.montant_total) as montant_cumule
-                    FROM clients c
-                    JOIN transactions t ON c.client_id = t.client_id
-                    LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
-                    WHERE c.statut = 'actif'
-                    AND (oc.offre_id IS NULL OR oc.statut = 'expiree')
-                    {period_condition}
-                    {segment_condition}
-                    GROUP BY c.client_id
-                    HAVING montant_cumule >= ?
-                '''
-                
-                eligible_clients = conn.execute(clients_query, (rule['regle_id'], rule['condition_valeur'])).fetchall()
-                
-                print(f"Clients éligibles pour la règle '{rule['nom']}' (montant_cumule): {len(eligible_clients)}")
-                
-            elif rule['type_regle'] == 'produit_specifique':
-                # Construire les conditions de période et segment
-                period_condition = ""
-                if rule['periode_jours']:
-                    period_condition = f"AND t.date_transaction >= date('now', '-{rule['periode_jours']} days')"
-                
-                segment_condition = ""
-                if rule['segments_cibles'] and rule['segments_cibles'] != '[]':
-                    try:
-                        segments = json.loads(rule['segments_cibles'])
-                        if segments:
-                            segments_str = ','.join([f"'{s.strip()}'" for s in segments])
-                            segment_condition = f"AND c.segment IN ({segments_str})"
-                    except Exception as e:
-                        print(f"Erreur de traitement segments: {e}")
-                
-                # Trouver les clients qui ont acheté le produit spécifique
-                clients_query = f'''
-                    SELECT DISTINCT
-                        c.client_id,
-                        c.prenom || ' ' || c.nom as client_nom
-                    FROM clients c
-                    JOIN transactions t ON c.client_id = t.client_id
-                    JOIN details_transactions dt ON t.transaction_id = dt.transaction_id
-                    LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
-                    WHERE c.statut = 'actif'
-                    AND dt.produit_id = ?
-                    AND (oc.offre_id IS NULL OR oc.statut = 'expiree')
-                    {period_condition}
-                    {segment_condition}
-                '''
-                
-                eligible_clients = conn.execute(clients_query, (rule['regle_id'], rule['condition_valeur'])).fetchall()
-                
-                print(f"Clients éligibles pour la règle '{rule['nom']}' (produit_specifique): {len(eligible_clients)}")
-                
-            elif rule['type_regle'] == 'categorie_specifique':
-                # Construire les conditions de période et segment
-                period_condition = ""
-                if rule['periode_jours']:
-                    period_condition = f"AND t.date_transaction >= date('now', '-{rule['periode_jours']} days')"
-                
-                segment_condition = ""
-                if rule['segments_cibles'] and rule['segments_cibles'] != '[]':
-                    try:
-                        segments = json.loads(rule['segments_cibles'])
-                        if segments:
-                            segments_str = ','.join([f"'{s.strip()}'" for s in segments])
-                            segment_condition = f"AND c.segment IN ({segments_str})"
-                    except Exception as e:
-                        print(f"Erreur de traitement segments: {e}")
-                
-                # Trouver les clients qui ont acheté dans la catégorie spécifiée
-                clients_query = f'''
-                    SELECT DISTINCT
-                        c.client_id,
-                        c.prenom || ' ' || c.nom as client_nom
-                    FROM clients c
-                    JOIN transactions t ON c.client_id = t.client_id
-                    JOIN details_transactions dt ON t.transaction_id = dt.transaction_id
-                    JOIN produits p ON dt.produit_id = p.produit_id
-                    LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
-                    WHERE c.statut = 'actif'
-                    AND p.categorie_id = ?
-                    AND (oc.offre_id IS NULL OR oc.statut = 'expiree')
-                    {period_condition}
-                    {segment_condition}
-                '''
-                
-                eligible_clients = conn.execute(clients_query, (rule['regle_id'], rule['condition_valeur'])).fetchall()
-                
-                print(f"Clients éligibles pour la règle '{rule['nom']}' (categorie_specifique): {len(eligible_clients)}")
-                
-            elif rule['type_regle'] == 'premiere_visite':
-                # Trouver les clients dont la première visite est dans la période spécifiée
-                clients_query = f'''
-                    SELECT 
-                        c.client_id,
-                        c.prenom || ' ' || c.nom as client_nom
-                    FROM clients c
-                    JOIN (
-                        SELECT 
-                            client_id,
-                            MIN(date_transaction) as premiere_visite
-                        FROM transactions
-                        GROUP BY client_id
-                        HAVING premiere_visite >= date('now', '-{rule['condition_valeur']} days')
-                        AND premiere_visite <= date('now')
-                    ) pv ON c.client_id = pv.client_id
-                    LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
-                    WHERE c.statut = 'actif'
-                    AND (oc.offre_id IS NULL OR oc.statut = 'expiree')
-                '''
-                
-                eligible_clients = conn.execute(clients_query, (rule['regle_id'],)).fetchall()
-                
-                print(f"Clients éligibles pour la règle '{rule['nom']}' (premiere_visite): {len(eligible_clients)}")
-                
-            elif rule['type_regle'] == 'anniversaire':
-                # Trouver les clients dont l'anniversaire approche
-                clients_query = f'''
-                    SELECT 
-                        c.client_id,
-                        c.prenom || ' ' || c.nom as client_nom
-                    FROM clients c
-                    LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
-                    WHERE c.statut = 'actif'
-                    AND strftime('%m-%d', c.date_naissance) BETWEEN 
-                        strftime('%m-%d', date('now')) AND 
-                        strftime('%m-%d', date('now', '+{rule['condition_valeur']} days'))
-                    AND c.date_naissance IS NOT NULL
-                    AND (oc.offre_id IS NULL OR oc.statut = 'expiree')
-                '''
-                
-                eligible_clients = conn.execute(clients_query, (rule['regle_id'],)).fetchall()
-                
-                print(f"Clients éligibles pour la règle '{rule['nom']}' (anniversaire): {len(eligible_clients)}")
-                
-            elif rule['type_regle'] == 'inactivite':
-                # Trouver les clients inactifs pendant la période spécifiée
-                clients_query = f'''
-                    SELECT 
-                        c.client_id,
-                        c.prenom || ' ' || c.nom as client_nom
-                    FROM clients c
-                    JOIN (
-                        SELECT 
-                            client_id,
-                            MAX(date_transaction) as derniere_visite
-                        FROM transactions
-                        GROUP BY client_id
-                        HAVING derniere_visite <= date('now', '-{rule['condition_valeur']} days')
-                    ) dv ON c.client_id = dv.client_id
-                    LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
-                    WHERE c.statut = 'actif'
-                    AND (oc.offre_id IS NULL OR oc.statut = 'expiree')
-                '''
-                
-                eligible_clients = conn.execute(clients_query, (rule['regle_id'],)).fetchall()
-                
-                print(f"Clients éligibles pour la règle '{rule['nom']}' (inactivite): {len(eligible_clients)}")
-            
-            # Créer des offres pour tous les clients éligibles
-            for client in eligible_clients:
-                # Déterminer la date d'expiration (par défaut 30 jours)
-                expiration_date = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
-                
-                # Préparer le commentaire en fonction du type de règle
-                if rule['type_regle'] == 'nombre_achats':
-                    commentaire = f"Offre générée après {rule['condition_valeur']} achats"
-                elif rule['type_regle'] == 'montant_cumule':
-                    commentaire = f"Offre générée après {rule['condition_valeur']}€ d'achats cumulés"
-                elif rule['type_regle'] == 'produit_specifique':
-                    # Rechercher le nom du produit pour le commentaire
-                    produit_info = conn.execute('SELECT nom FROM produits WHERE produit_id = ?', 
-                                             (rule['condition_valeur'],)).fetchone()
-                    produit_nom = produit_info['nom'] if produit_info else f"produit #{rule['condition_valeur']}"
-                    commentaire = f"Offre générée pour l'achat de {produit_nom}"
-                elif rule['type_regle'] == 'categorie_specifique':
-                    # Rechercher le nom de la catégorie pour le commentaire
-                    categorie_info = conn.execute('SELECT nom FROM categories_produits WHERE categorie_id = ?', 
-                                               (rule['condition_valeur'],)).fetchone()
-                    categorie_nom = categorie_info['nom'] if categorie_info else f"catégorie #{rule['condition_valeur']}"
-                    commentaire = f"Offre générée pour achat dans {categorie_nom}"
-                elif rule['type_regle'] == 'premiere_visite':
-                    commentaire = "Offre de bienvenue pour nouveau client"
-                elif rule['type_regle'] == 'anniversaire':
-                    commentaire = "Offre d'anniversaire"
-                elif rule['type_regle'] == 'inactivite':
-                    commentaire = "Offre pour client inactif"
-                else:
-                    commentaire = "Offre programme de fidélité"
-                
-                # Créer l'offre
-                conn.execute('''
-                    INSERT INTO offres_client (
-                        client_id, regle_id, recompense_id, date_generation, date_expiration, 
-                        statut, commentaire
-                    ) VALUES (?, ?, ?, date('now'), ?, 'generee', ?)
-                ''', (
-                    client['client_id'],
-                    rule['regle_id'],
-                    rule['recompense_id'],
-                    expiration_date,
-                    commentaire
-                ))
-                
-                offers_for_rule += 1
-                # Accéder au nom du client de manière sécurisée avec sqlite3.Row
-                client_nom = client['client_nom'] if 'client_nom' in client else 'Inconnu'
-                print(f"Offre créée pour client ID={client['client_id']}, nom={client_nom}")
-            
-            # Enregistrer les statistiques d'évaluation
-            conn.execute('''
-                INSERT INTO historique_evaluations_regles (
-                    regle_id, nombre_clients_evalues, nombre_offres_generees, commentaire
-                ) VALUES (?, ?, ?, ?)
-            ''', (
-                rule['regle_id'],
-                len(eligible_clients),
-                offers_for_rule,
-                f"Exécution manuelle le {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-            ))
-            
-            total_offers_generated += offers_for_rule
-        
-        # Générer des codes uniques pour toutes les nouvelles offres
-        conn.execute('''
-            UPDATE offres_client
-            SET code_unique = 'OF-' || offre_id || '-' || substr(hex(randomblob(4)), 1, 8)
-            WHERE code_unique IS NULL OR code_unique = ''
-        ''')
-        
-        conn.commit()
-        conn.close()
-        
-        flash(f'Évaluation des règles terminée. {total_offers_generated} offres générées.', 'success')
-        
-    except Exception as e:
-        flash(f'Erreur lors de l\'exécution des règles: {str(e)}', 'danger')
-        import traceback
-        print(traceback.format_exc())
+    # Même moteur de règles que l'API et le planificateur
+    result = LoyaltyManager().evaluate_all_rules()
+    
+    if result['success']:
+        flash(f"Évaluation des règles terminée. {result['stats']['total_offers_generated']} offres générées.", 'success')
+    else:
+        flash(f"Erreur lors de l'exécution des règles: {result['error']}", 'danger')
     
     return redirect(url_for('loyalty_dashboard'))
 
@@ -4836,6 +4444,7 @@ def loyalty_db_diagnosis():
             'transactions_sample': [],
             'clients_sample': [],
             'eligible_clients': [],
+            'rule_costs': [],
             'errors': []
         }
         
@@ -4866,6 +4475,13 @@ def loyalty_db_diagnosis():
         except Exception as e:
             diagnosis['errors'].append(f"Erreur lors de la récupération des règles: {str(e)}")
         
+        # 2 bis. Coût des règles lors de leur dernière évaluation (du plus coûteux au moins coûteux)
+        profile = LoyaltyManager().get_rule_evaluation_profile()
+        if profile['success']:
+            diagnosis['rule_costs'] = profile['rules']
+        else:
+            diagnosis['errors'].append(f"Erreur lors de la récupération du coût des règles: {profile['error']}")
+        
         # 3. Échantillon de transactions récentes
         try:
             transactions_query = '''
@@ -5179,12 +4795,6 @@ cluster_offers = Blueprint('cluster_offers', __name__)
 # Instancier le générateur d'offres
 offer_generator = ClusterOfferGenerator()
 
-# Fonction utilitaire pour se connecter à la base de données
-def get_db_connection(db_path='modules/fidelity_db.sqlite'):
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
-
 @cluster_offers.route('/api/generate_cluster_offer', methods=['POST'])
 def api_generate_cluster_offer():
     """API pour générer une offre pour un cluster spécifique"""
@@ -5530,28 +5140,23 @@ def create_cluster_offers():
             
             # Créer une offre pour chaque client
             for client_id in clients:
-                conn.execute('''
+                execute_with_code_retry(conn, f'''
                     INSERT INTO offres_client (
                         client_id, regle_id, recompense_id, date_generation,
-                        date_expiration, statut, commentaire
-                    ) VALUES (?, ?, ?, CURRENT_TIMESTAMP, ?, 'generee', ?)
+                        date_expiration, statut, code_unique, commentaire
+                    ) VALUES (?, ?, ?, CURRENT_TIMESTAMP, ?, 'generee', {offer_code_sql('?', '?')}, ?)
                 ''', (
                     client_id,
                     regle_id,
                     gift_id if action_type == 'offre_cadeau' else None,
                     expiration_date,
+                    regle_id,
+                    client_id,
                     message if message else f"Offre spéciale basée sur votre profil client"
                 ))
                 
                 offers_created += 1
             
-            # Générer des codes uniques pour toutes les nouvelles offres
-            conn.execute('''
-                UPDATE offres_client
-                SET code_unique = 'OF-' || offre_id || '-' || substr(hex(randomblob(4)), 1, 8)
-                WHERE code_unique IS NULL
-            ''')
-            
             conn.commit()
             conn.close()
         
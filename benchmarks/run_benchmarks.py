@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Banc d'essai du programme de fidélité
+
+Mesure, sur des bases générées de plusieurs tailles, le débit et la latence
+(p50, p90, p99) des opérations principales de LoyaltyManager:
+evaluate_all_rules (classique et compilé), evaluate_rules_for_client, use_offer,
+add_points et check_expired_offers.
+
+Les bases sont générées par init_database/generate_volume_data.py avec le schéma
+de la base de l'application (modules/fidelity_db.sqlite) et une graine fixe, puis
+conservées dans benchmarks/data/ (ou --data-dir). Chaque mesure part d'une copie
+fraîche de la base: aucun service externe n'est nécessaire.
+
+Les opérations unitaires (use_offer, add_points) sont dominées par la synchronisation
+disque du commit: pour des comparaisons stables, placer les bases sur un tmpfs
+(--data-dir /dev/shm/teasy_bench) et conserver la même machine pour la référence.
+
+Les résultats sont écrits en JSON. Avec --baseline, ils sont comparés à une
+référence enregistrée (--save-baseline) et le script se termine en erreur si une
+opération régresse au-delà de la tolérance. Aucune référence n'est fournie dans le
+dépôt: elle doit être enregistrée sur la machine qui exécute la comparaison.
+Le script se termine aussi en erreur si une évaluation complète ne génère aucune
+offre sur une base non vide.
+
+Usage:
+    python benchmarks/run_benchmarks.py --sizes small,medium
+    python benchmarks/run_benchmarks.py --sizes small --save-baseline benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --sizes small --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.append(os.path.join(PROJECT_DIR, 'modules'))
+sys.path.append(os.path.join(PROJECT_DIR, 'init_database'))
+
+from loyalty_manager import LoyaltyManager
+from db_pool import close_connections
+import generate_volume_data as generator
+
+DATA_DIR = os.path.join(BENCHMARK_DIR, 'data')
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, 'results')
+APP_DB_PATH = os.path.join(PROJECT_DIR, 'modules', 'fidelity_db.sqlite')
+
+# Tailles des bases générées
+SIZES = {
+    'small': {'clients': 2000, 'transactions': 40000},
+    'medium': {'clients': 20000, 'transactions': 400000},
+    'large': {'clients': 200000, 'transactions': 4000000},
+}
+
+# Règles évaluées: une règle de chaque type, comme dans la base de l'application
+# (nom, description, type_regle, condition_valeur, periode_jours, action_type, action_valeur, segments_cibles, priorite)
+BENCHMARK_RULES = [
+    ("Montant cumulé", "5 % dès 1000 euros d'achats", 'montant_cumule', '1000', 365,
+     'reduction_pourcentage', '5', '["premium"]', 2),
+    ("Nouvel achat", "Premier achat d'un nouveau client", 'premiere_visite', '365', None,
+     'reduction_pourcentage', '10', None, 1),
+    ("Produit phare", "Réduction sur un produit", 'produit_specifique', '16', 30,
+     'reduction_pourcentage', '25', None, 1),
+    ("Cadeau d'anniversaire", "Cadeau de l'enseigne", 'anniversaire', '30', None,
+     'offre_cadeau', '', None, 1),
+    ("Relance des inactifs", "Relancer les inactifs", 'inactivite', '60', None,
+     'reduction_montant', '10', None, 0),
+    ("Achats réguliers", "Bonus de points", 'nombre_achats', '5', 365,
+     'offre_points', '100', None, 3),
+]
+
+# Part des offres passées en expiration avant check_expired_offers
+EXPIRED_SHARE = 0.5
+
+
+def parse_args():
+    """Lit les paramètres du banc d'essai"""
+    parser = argparse.ArgumentParser(description="Banc d'essai du programme de fidélité")
+    parser.add_argument('--sizes', default='small,medium', help="Tailles à mesurer (small, medium, large)")
+    parser.add_argument('--repeat', type=int, default=5, help="Répétitions des opérations globales")
+    parser.add_argument('--samples', type=int, default=200, help="Appels mesurés par opération unitaire")
+    parser.add_argument('--seed', type=int, default=42, help="Graine des bases et des tirages")
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help="Dossier des bases (un tmpfs, ex. /dev/shm, limite le bruit des écritures disque)")
+    parser.add_argument('--rebuild', action='store_true', help="Régénérer les bases même si elles existent")
+    parser.add_argument('--output', help="Fichier JSON des résultats (par défaut benchmarks/results/)")
+    parser.add_argument('--baseline', help="Référence JSON à laquelle comparer les résultats")
+    parser.add_argument('--save-baseline', help="Enregistrer les résultats comme référence dans ce fichier")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Dégradation tolérée par rapport à la référence (0.25 = 25 %%)")
+    return parser.parse_args()
+
+
+def summarize(latencies, errors=0, **extra):
+    """
+    Calcule le débit et les percentiles de latence d'une série de mesures.
+
+    Args:
+        latencies (list): Durées des appels (en secondes)
+        errors (int): Nombre d'appels en échec
+
+    Returns:
+        dict: Statistiques de l'opération
+    """
+    values = np.array(latencies) * 1000
+    total = float(np.sum(values)) / 1000
+    stats = {
+        'calls': len(latencies),
+        'errors': errors,
+        'total_s': round(total, 4),
+        'ops_per_sec': round(len(latencies) / total, 2) if total else None,
+    }
+    if len(values):
+        stats.update({
+            'mean_ms': round(float(values.mean()), 3),
+            'p50_ms': round(float(np.percentile(values, 50)), 3),
+            'p90_ms': round(float(np.percentile(values, 90)), 3),
+            'p99_ms': round(float(np.percentile(values, 99)), 3),
+            'max_ms': round(float(values.max()), 3),
+        })
+    stats.update(extra)
+    return stats
+
+
+def build_database(size, seed, rebuild=False):
+    """
+    Génère (ou réutilise) la base d'une taille donnée, avec les règles du banc d'essai.
+
+    Returns:
+        str: Chemin de la base de référence
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    spec = SIZES[size]
+    path = os.path.join(DATA_DIR, f"{size}_{seed}.sqlite")
+
+    if os.path.exists(path) and not rebuild:
+        return path
+
+    generator.generate_volume_data(generator.parse_args([
+        '--db', path, '--schema', APP_DB_PATH, '--force', '--seed', str(seed),
+        '--clients', str(spec['clients']), '--transactions', str(spec['transactions']),
+    ]))
+
+    conn = sqlite3.connect(path)
+    conn.executemany('''
+        INSERT INTO regles_fidelite (
+            nom, description, type_regle, condition_valeur, periode_jours,
+            action_type, action_valeur, segments_cibles, priorite, est_active
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+    ''', BENCHMARK_RULES)
+    conn.commit()
+    conn.close()
+
+    # Mise à jour du schéma par l'application (index, tables dérivées) une fois pour toutes:
+    # elle a lieu à la première connexion du gestionnaire
+    LoyaltyManager(path)._get_connection().close()
+    return path
+
+
+def copy_database(source, target):
+    """Copie une base après fermeture des connexions du pool vers la source et la cible"""
+    # La fermeture reporte le journal WAL de la source dans le fichier copié, et aucune
+    # connexion ne doit rester projetée en mémoire sur un fichier remplacé
+    close_connections(source)
+    close_connections(target)
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(target + suffix):
+            os.remove(target + suffix)
+    shutil.copyfile(source, target)
+
+
+def fresh_copy(source, name):
+    """Copie la base de référence pour une mesure"""
+    target = os.path.join(DATA_DIR, f"run_{name}.sqlite")
+    copy_database(source, target)
+    return target
+
+
+def client_ids(db_path, count, rng):
+    """Tire des clients ayant une carte de fidélité"""
+    conn = sqlite3.connect(db_path)
+    ids = [row[0] for row in conn.execute("SELECT client_id FROM cartes_fidelite")]
+    conn.close()
+    return rng.sample(ids, min(count, len(ids)))
+
+
+def bench_evaluate_all(db_path, repeat, **options):
+    """Évaluation complète des règles, sur une copie fraîche à chaque répétition"""
+    latencies, errors, offers = [], 0, 0
+    for _ in range(repeat):
+        manager = LoyaltyManager(fresh_copy(db_path, 'evaluate'))
+        started = time.perf_counter()
+        result = manager.evaluate_all_rules(**options)
+        latencies.append(time.perf_counter() - started)
+        errors += not result.get('success')
+        offers = result.get('stats', {}).get('total_offers_generated', offers)
+    return summarize(latencies, errors, offers_generated=offers)
+
+
+def bench_evaluate_client(db_path, samples, rng):
+    """Évaluation des règles client par client"""
+    manager = LoyaltyManager(fresh_copy(db_path, 'client'))
+    latencies, errors = [], 0
+    for client_id in client_ids(db_path, samples, rng):
+        started = time.perf_counter()
+        result = manager.evaluate_rules_for_client(client_id)
+        latencies.append(time.perf_counter() - started)
+        errors += not result.get('success')
+    return summarize(latencies, errors)
+
+
+def bench_use_offer(evaluated_path, samples, rng):
+    """Utilisation d'offres générées par l'évaluation"""
+    path = fresh_copy(evaluated_path, 'use_offer')
+    conn = sqlite3.connect(path)
+    codes = [row[0] for row in conn.execute('''
+        SELECT code_unique FROM offres_client
+        WHERE statut IN ('generee', 'envoyee') AND date_expiration >= date('now')
+    ''')]
+    conn.close()
+
+    manager = LoyaltyManager(path)
+    latencies, errors = [], 0
+    for code in rng.sample(codes, min(samples, len(codes))):
+        started = time.perf_counter()
+        result = manager.use_offer(code)
+        latencies.append(time.perf_counter() - started)
+        errors += not result.get('success')
+    return summarize(latencies, errors)
+
+
+def bench_add_points(db_path, samples, rng):
+    """Ajout de points unitaire (passage en caisse)"""
+    manager = LoyaltyManager(fresh_copy(db_path, 'add_points'))
+    latencies, errors = [], 0
+    for client_id in client_ids(db_path, samples, rng):
+        started = time.perf_counter()
+        result = manager.add_points(client_id, rng.randint(1, 500))
+        latencies.append(time.perf_counter() - started)
+        errors += not result.get('success')
+    return summarize(latencies, errors)
+
+
+def bench_expired_offers(evaluated_path, repeat):
+    """Expiration des offres, une partie des offres étant échue"""
+    latencies, errors, expired = [], 0, 0
+    for _ in range(repeat):
+        path = fresh_copy(evaluated_path, 'expiry')
+        conn = sqlite3.connect(path)
+        conn.execute('''
+            UPDATE offres_client SET date_expiration = datetime('now', '-1 day')
+            WHERE offre_id % ? = 0
+        ''', (int(round(1 / EXPIRED_SHARE)),))
+        conn.commit()
+        conn.close()
+
+        manager = LoyaltyManager(path)
+        started = time.perf_counter()
+        result = manager.check_expired_offers()
+        latencies.append(time.perf_counter() - started)
+        errors += not result.get('success')
+        expired = result.get('offers_expired', expired)
+    return summarize(latencies, errors, offers_expired=expired)
+
+
+def run_size(size, args):
+    """Exécute toutes les mesures pour une taille de base"""
+    rng = random.Random(args.seed)
+    db_path = build_database(size, args.seed, args.rebuild)
+
+    # Base avec les offres d'une première évaluation (utilisation et expiration des offres)
+    evaluated_path = os.path.join(DATA_DIR, f"{size}_{args.seed}_evaluated.sqlite")
+    copy_database(db_path, evaluated_path)
+    LoyaltyManager(evaluated_path).evaluate_all_rules()
+
+    operations = {}
+    benchmarks = [
+        ('evaluate_all_rules', lambda: bench_evaluate_all(db_path, args.repeat)),
+        ('evaluate_all_rules_compiled', lambda: bench_evaluate_all(db_path, args.repeat, compiled=True)),
+        ('evaluate_rules_for_client', lambda: bench_evaluate_client(db_path, args.samples, rng)),
+        ('use_offer', lambda: bench_use_offer(evaluated_path, args.samples, rng)),
+        ('add_points', lambda: bench_add_points(db_path, args.samples, rng)),
+        ('check_expired_offers', lambda: bench_expired_offers(evaluated_path, args.repeat)),
+    ]
+    for name, bench in benchmarks:
+        operations[name] = bench()
+        stats = operations[name]
+        print(f"  {size:<7} {name:<28} p50 {stats.get('p50_ms', 0):>10.2f} ms  "
+              f"p99 {stats.get('p99_ms', 0):>10.2f} ms  {stats['ops_per_sec'] or 0:>10.1f} op/s  "
+              f"{stats['errors']} erreurs")
+
+    close_connections()
+    for name in os.listdir(DATA_DIR):
+        if name.startswith('run_'):
+            os.remove(os.path.join(DATA_DIR, name))
+
+    return dict(SIZES[size], operations=operations)
+
+
+def check_offers(results):
+    """
+    Vérifie que l'évaluation complète génère des offres sur chaque base.
+
+    Les bases générées comptent des clients éligibles aux règles du banc d'essai: une
+    évaluation sans offre est une régression, même si elle est plus rapide.
+
+    Returns:
+        list: Évaluations n'ayant généré aucune offre
+    """
+    failures = []
+    for size, current in results['sizes'].items():
+        for name in ('evaluate_all_rules', 'evaluate_all_rules_compiled'):
+            stats = current['operations'].get(name)
+            if stats is not None and current['clients'] and not stats.get('offers_generated'):
+                failures.append({'size': size, 'operation': name})
+                print(f"  {size:<7} {name:<28} aucune offre générée")
+    return failures
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare les résultats à la référence.
+
+    Une opération régresse si sa latence médiane augmente, ou si son débit baisse,
+    de plus de la tolérance.
+
+    Returns:
+        list: Régressions détectées
+    """
+    regressions = []
+    for size, current in results['sizes'].items():
+        reference = baseline.get('sizes', {}).get(size)
+        if not reference:
+            continue
+        for name, stats in current['operations'].items():
+            ref = reference['operations'].get(name)
+            if not ref or not ref.get('p50_ms') or not stats.get('p50_ms'):
+                continue
+            ratio = stats['p50_ms'] / ref['p50_ms']
+            throughput = (stats['ops_per_sec'] or 0) / ref['ops_per_sec'] if ref.get('ops_per_sec') else 1
+            status = 'OK'
+            if ratio > 1 + tolerance or throughput < 1 - tolerance or stats['errors'] > ref['errors']:
+                status = 'RÉGRESSION'
+                regressions.append({'size': size, 'operation': name, 'p50_ratio': round(ratio, 3),
+                                    'throughput_ratio': round(throughput, 3)})
+            print(f"  {size:<7} {name:<28} p50 x{ratio:.2f}  débit x{throughput:.2f}  {status}")
+    return regressions
+
+
+def main():
+    """Point d'entrée du banc d'essai"""
+    global DATA_DIR
+    args = parse_args()
+    logging.disable(logging.INFO)
+    DATA_DIR = args.data_dir
+
+    sizes = [size.strip() for size in args.sizes.split(',') if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        raise SystemExit(f"Tailles inconnues: {', '.join(unknown)} (disponibles: {', '.join(SIZES)})")
+
+    results = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+        },
+        'parameters': {'seed': args.seed, 'repeat': args.repeat, 'samples': args.samples},
+        'sizes': {},
+    }
+
+    print("Mesures:")
+    for size in sizes:
+        results['sizes'][size] = run_size(size, args)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"Résultats enregistrés: {output}")
+
+    failures = check_offers(results)
+    if failures:
+        print(f"{len(failures)} évaluation(s) sans offre générée")
+        sys.exit(1)
+
+    if args.save_baseline:
+        shutil.copyfile(output, args.save_baseline)
+        print(f"Référence enregistrée: {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"Comparaison avec la référence du {baseline.get('date')}:")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} régression(s) détectée(s)")
+            sys.exit(1)
+        print("Aucune régression")
+
+
+if __name__ == "__main__":
+    main()
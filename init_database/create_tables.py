@@ -106,6 +106,8 @@ CREATE TABLE IF NOT EXISTS historique_evaluations_regles (
     nombre_clients_evalues INTEGER,
     nombre_offres_generees INTEGER,
     duree_execution_ms INTEGER,
+    dernier_transaction_id INTEGER, -- Dernière transaction prise en compte (évaluation incrémentale)
+    mode_evaluation TEXT, -- 'complete' ou 'incrementale'
     commentaire TEXT
 );
 """)
@@ -0,0 +1,636 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Générateur de données volumineuses pour la base de fidélité client.
+
+Contrairement à python-db-init.py (quelques centaines de lignes insérées une à une),
+ce script produit des volumes comparables à la production (par exemple 1M de clients
+et 50M de transactions) avec NumPy, à partir d'une graine fixe:
+- saisonnalité journalière (jours de la semaine, soldes, fin d'année) et croissance;
+- répartition des achats entre magasins (magasin habituel du client, web);
+- clients à l'activité très inégale (loi log-normale, pondérée par segment);
+- paniers de taille variable, popularité des produits en loi de Zipf, remises.
+
+Les données sont chargées par lots dans le schéma de schema.sql (ou celui d'une base
+existante, option --schema). Les triggers qui
+travaillent ligne à ligne (points des lignes, soldes des cartes, historique,
+anonymisation) sont supprimés pendant le chargement: leurs effets sont calculés
+de façon vectorisée, puis les triggers sont recréés à l'identique.
+
+Usage:
+    python generate_volume_data.py --clients 1000000 --transactions 50000000 --seed 42
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import time
+import uuid
+import datetime
+
+import numpy as np
+import pandas as pd
+
+# Configuration
+DB_PATH = 'fidelity_volume.sqlite'
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+# Triggers ligne à ligne désactivés pendant le chargement (recréés depuis schema.sql)
+HEAVY_TRIGGERS = (
+    'update_client_anonymized',
+    'calculate_points_earned',
+    'update_client_points'
+)
+
+# Niveaux de fidélité (nom, points minimum, points maximum, multiplicateur), noms des cartes
+LEVELS = [
+    ('bronze', 0, 999, 1.0),
+    ('argent', 1000, 4999, 1.2),
+    ('or', 5000, 9999, 1.5),
+    ('platine', 10000, None, 2.0),
+]
+
+# Villes (nom, préfixe postal, latitude, longitude, poids de population)
+CITIES = [
+    ("Paris", "75", 48.856614, 2.352222, 10.0),
+    ("Lyon", "69", 45.764043, 4.835659, 3.0),
+    ("Marseille", "13", 43.296482, 5.369780, 3.0),
+    ("Lille", "59", 50.637222, 3.075000, 2.0),
+    ("Bordeaux", "33", 44.837789, -0.579180, 2.0),
+    ("Nantes", "44", 47.218371, -1.553621, 1.5),
+    ("Toulouse", "31", 43.604652, 1.444209, 2.0),
+    ("Strasbourg", "67", 48.573405, 7.752111, 1.2),
+    ("Nice", "06", 43.710173, 7.261953, 1.2),
+    ("Montpellier", "34", 43.610769, 3.876716, 1.0),
+]
+
+# Types de magasins et fréquentation relative
+STORE_TYPES = ['flagship', 'franchise', 'corner', 'pop-up']
+STORE_TYPE_SHARE = [0.10, 0.50, 0.30, 0.10]
+STORE_TRAFFIC = {'flagship': 4.0, 'franchise': 2.0, 'corner': 1.0, 'pop-up': 0.5, 'online': 25.0}
+
+# Catégories (nom, description, parent, multiplicateur), comme python-db-init.py
+CATEGORIES = [
+    ("Vêtements", "Tous types de vêtements", None, 1.0),
+    ("Chaussures", "Tous types de chaussures", None, 1.0),
+    ("Accessoires", "Accessoires de mode", None, 1.2),
+    ("Bijoux", "Bijoux et montres", None, 1.5),
+    ("Collections Limitées", "Éditions limitées et collections spéciales", None, 2.0),
+    ("Homme", "Vêtements pour homme", 1, 1.0),
+    ("Femme", "Vêtements pour femme", 1, 1.0),
+    ("Enfant", "Vêtements pour enfant", 1, 1.0),
+    ("Sport", "Vêtements et accessoires de sport", 1, 1.1),
+    ("Baskets", "Chaussures de sport et de ville", 2, 1.1),
+    ("Chaussures Ville", "Chaussures élégantes", 2, 1.0),
+    ("Chaussures Confort", "Chaussures de confort et de marche", 2, 1.0),
+    ("Sacs", "Sacs à main et bagages", 3, 1.2),
+    ("Ceintures", "Ceintures et accessoires en cuir", 3, 1.0),
+    ("Écharpes", "Écharpes et foulards", 3, 1.0),
+    ("Lunettes", "Lunettes de soleil et optiques", 3, 1.1),
+    ("Montres", "Montres de luxe et casual", 4, 1.5),
+    ("Bracelets", "Bracelets et gourmettes", 4, 1.3),
+    ("Bagues", "Bagues et alliances", 4, 1.3),
+    ("Édition Limitée", "Produits exclusifs en série limitée", 5, 2.0),
+    ("Collaborations", "Collaborations avec des artistes", 5, 2.0),
+]
+
+# Prix médian par catégorie principale (loi log-normale)
+MEDIAN_PRICE = {1: 45.0, 2: 85.0, 3: 35.0, 4: 140.0, 5: 180.0}
+
+# Saisonnalité: lundi..dimanche, puis janvier..décembre
+WEEKDAY_FACTOR = np.array([0.80, 0.85, 1.00, 0.95, 1.10, 1.50, 0.45])
+MONTH_FACTOR = np.array([1.15, 0.80, 0.90, 0.95, 1.00, 1.05, 1.15, 0.85, 0.95, 1.00, 1.25, 1.60])
+SALES_MONTHS = (1, 7)
+
+PRENOMS = ["Jean", "Marie", "Pierre", "Sophie", "Thomas", "Isabelle", "Éric", "Nathalie",
+           "Philippe", "Catherine", "Michel", "Sylvie", "Laurent", "Valérie", "Nicolas",
+           "Stéphanie", "Patrick", "Christine", "Thierry", "Sandrine"]
+NOMS = ["Martin", "Bernard", "Durand", "Dubois", "Moreau", "Laurent", "Lefebvre", "Leroy",
+        "Roux", "Morel", "Simon", "Michel", "Blanc", "Rousseau", "Girard", "Fournier",
+        "Lambert", "Dupont", "Vincent", "Fontaine"]
+DOMAINS = ['gmail.com', 'yahoo.fr', 'hotmail.com', 'outlook.fr', 'orange.fr', 'free.fr', 'sfr.fr']
+ACQUISITION_CHANNELS = ["magasin", "en_ligne", "parrainage", "événement", "publicité"]
+
+
+def parse_args(argv=None):
+    """Lit les paramètres de génération (ligne de commande, ou liste argv)"""
+    parser = argparse.ArgumentParser(description="Génère une base de fidélité volumineuse et réaliste")
+    parser.add_argument('--db', default=DB_PATH, help="Base SQLite à créer")
+    parser.add_argument('--schema', default=SCHEMA_PATH,
+                        help="Script SQL du schéma, ou base SQLite dont reprendre la structure")
+    parser.add_argument('--clients', type=int, default=100000, help="Nombre de clients")
+    parser.add_argument('--transactions', type=int, default=2000000, help="Nombre de transactions")
+    parser.add_argument('--stores', type=int, default=60, help="Nombre de magasins physiques")
+    parser.add_argument('--products', type=int, default=2000, help="Nombre de produits")
+    parser.add_argument('--years', type=int, default=3, help="Profondeur de l'historique (années)")
+    parser.add_argument('--anonymous-share', type=float, default=0.10,
+                        help="Part des transactions sans carte de fidélité")
+    parser.add_argument('--chunk-size', type=int, default=500000, help="Transactions par lot de chargement")
+    parser.add_argument('--seed', type=int, default=42, help="Graine du générateur aléatoire")
+    parser.add_argument('--force', action='store_true', help="Remplacer la base si elle existe")
+    return parser.parse_args(argv)
+
+
+def to_datetime_strings(seconds):
+    """Convertit des timestamps (secondes epoch) au format SQLite 'AAAA-MM-JJ HH:MM:SS'"""
+    strings = np.datetime_as_string(seconds.astype('datetime64[s]'), unit='s')
+    return np.char.replace(strings, 'T', ' ').tolist()
+
+
+def sqlite_round(values):
+    """Arrondi comme ROUND() de SQLite (demi à l'écart de zéro) pour des valeurs positives"""
+    return np.floor(values + 0.5)
+
+
+def load_schema(path):
+    """
+    Lit le schéma à créer: un script SQL, ou la structure d'une base SQLite existante
+    (par exemple la base de l'application, dont le schéma a évolué depuis schema.sql).
+    """
+    if path.endswith('.sql'):
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    statements = [row[0] for row in source.execute("""
+        SELECT sql FROM sqlite_master
+        WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+        ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'view' THEN 1 WHEN 'index' THEN 2 ELSE 3 END, rowid
+    """)]
+    source.close()
+    return ';\n\n'.join(statements) + ';\n'
+
+
+def create_database(db_path, schema_path=SCHEMA_PATH):
+    """Crée la base à partir du schéma et retourne la connexion de chargement"""
+    schema_sql = load_schema(schema_path)
+
+    conn = sqlite3.connect(db_path)
+    conn.executescript(schema_sql)
+
+    # Chargement en masse: pas de journal ni de synchronisation disque
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -262144")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA foreign_keys = OFF")
+
+    for trigger in HEAVY_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+    print(f"Base de données créée: {db_path}")
+    return conn, schema_sql
+
+
+def restore_triggers(conn, schema_sql):
+    """Recrée les triggers supprimés pendant le chargement, tels que définis dans schema.sql"""
+    for trigger in HEAVY_TRIGGERS:
+        match = re.search(rf"CREATE TRIGGER (?:IF NOT EXISTS )?{trigger}\b.*?\bEND;", schema_sql, re.S)
+        if match:
+            conn.execute(match.group(0))
+    conn.commit()
+
+
+def generate_reference_data(conn, rng, args):
+    """
+    Génère les niveaux, magasins, catégories et produits.
+
+    Returns:
+        dict: Tableaux utilisés pour générer les transactions
+    """
+    conn.executemany("""
+        INSERT INTO niveaux_fidelite (nom, points_minimum, points_maximum, multiplicateur_points)
+        VALUES (?, ?, ?, ?)
+    """, LEVELS)
+
+    # --- Magasins: répartis selon la population, plus la boutique en ligne ---
+    city_weights = np.array([c[4] for c in CITIES])
+    store_city = rng.choice(len(CITIES), size=args.stores, p=city_weights / city_weights.sum())
+    store_type = rng.choice(STORE_TYPES, size=args.stores, p=STORE_TYPE_SHARE)
+
+    stores = []
+    for i, (city_index, kind) in enumerate(zip(store_city, store_type), start=1):
+        city, prefix, lat, lon, _ = CITIES[city_index]
+        stores.append((
+            f"Boutique {city} {i}", kind, f"{int(rng.integers(1, 200))} rue du Commerce",
+            f"{prefix}00{i % 10}", city, "France", None, f"magasin{i}@exemple.com",
+            "Lun-Sam: 10h-19h", lat + rng.normal(0, 0.02), lon + rng.normal(0, 0.02)
+        ))
+    stores.append(("Boutique Online", "online", None, None, None, "France", "0800 123 456",
+                   "online@exemple.com", "24/7", None, None))
+
+    conn.executemany("""
+        INSERT INTO points_vente (
+            nom, type, adresse, code_postal, ville, pays,
+            telephone, email, horaires, latitude, longitude
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, stores)
+
+    online_store = len(stores)
+    store_traffic = np.array([STORE_TRAFFIC[s[1]] for s in stores])
+    print(f"Ajout de {len(stores)} magasins")
+
+    # --- Catégories et produits ---
+    conn.executemany("""
+        INSERT INTO categories_produits (
+            nom, description, categorie_parent_id, multiplicateur_points
+        ) VALUES (?, ?, ?, ?)
+    """, CATEGORIES)
+
+    subcategories = np.array([i for i, c in enumerate(CATEGORIES, start=1) if c[2] is not None])
+    parents = np.array([CATEGORIES[i - 1][2] for i in subcategories])
+    category_multiplier = np.array([c[3] for c in CATEGORIES])
+
+    product_sub = rng.integers(0, len(subcategories), size=args.products)
+    product_category = parents[product_sub]
+    product_subcategory = subcategories[product_sub]
+    median = np.array([MEDIAN_PRICE[c] for c in product_category])
+    product_price = np.round(median * rng.lognormal(0, 0.45, size=args.products), 0) - 0.01
+    product_price = np.maximum(product_price, 4.99)
+    product_multiplier = rng.choice([1.0, 1.0, 1.0, 1.5, 2.0], size=args.products)
+
+    conn.executemany("""
+        INSERT INTO produits (
+            reference, code_barres, nom, description, categorie_id,
+            sous_categorie_id, marque, prix_standard, multiplicateur_points,
+            statut, image_url
+        ) VALUES (?, ?, ?, ?, ?, ?, 'MaMarque', ?, ?, 'actif', NULL)
+    """, [
+        (f"P{i:06d}", f"EAN13{3000000000000 + i}", f"{CATEGORIES[sub - 1][0]} {i}",
+         CATEGORIES[sub - 1][1], int(cat), int(sub), float(price), float(mult))
+        for i, (cat, sub, price, mult) in enumerate(
+            zip(product_category, product_subcategory, product_price, product_multiplier), start=1
+        )
+    ])
+
+    # Popularité en loi de Zipf, dans un ordre aléatoire
+    popularity = 1.0 / np.arange(1, args.products + 1) ** 0.9
+    product_weights = rng.permutation(popularity)
+
+    print(f"Ajout de {len(CATEGORIES)} catégories et {args.products} produits")
+
+    conn.commit()
+
+    return {
+        'store_city': np.append(store_city, -1),
+        'store_traffic': store_traffic,
+        'online_store': online_store,
+        'product_price': product_price,
+        'product_cumweights': np.cumsum(product_weights),
+        # multiplicateur du produit et de sa catégorie principale (trigger calculate_points_earned)
+        'product_points_factor': product_multiplier * category_multiplier[product_category - 1],
+    }
+
+
+def generate_clients(conn, rng, args, ref, start_day, end_day):
+    """
+    Génère les clients, triés par date d'inscription (client_id croissant).
+
+    Returns:
+        dict: Tableaux par client (indice = client_id - 1)
+    """
+    n = args.clients
+
+    # 40% de clients déjà inscrits avant la période, les autres inscrits pendant la période
+    existing = rng.random(n) < 0.4
+    signup_day = np.where(
+        existing,
+        rng.integers(start_day - 5 * 365, start_day, size=n),
+        start_day + ((end_day - start_day) * np.sqrt(rng.random(n))).astype(np.int64)
+    )
+    signup_day.sort()
+    signup_ts = signup_day * 86400 + rng.integers(9 * 3600, 20 * 3600, size=n)
+
+    segment = rng.choice(['standard', 'premium', 'vip'], size=n, p=[0.80, 0.15, 0.05])
+    segment_factor = np.select([segment == 'vip', segment == 'premium'], [4.0, 2.0], 1.0)
+    activity = rng.lognormal(0, 1.0, size=n) * segment_factor
+
+    # Magasin habituel (20% de clients principalement en ligne)
+    physical = len(ref['store_traffic']) - 1
+    home_store = np.where(
+        rng.random(n) < 0.2,
+        ref['online_store'],
+        rng.choice(physical, size=n, p=ref['store_traffic'][:physical] / ref['store_traffic'][:physical].sum()) + 1
+    )
+    city_index = ref['store_city'][home_store - 1]
+    city_index = np.where(city_index < 0, rng.integers(0, len(CITIES), size=n), city_index)
+
+    age_days = (np.clip(rng.normal(41, 14, size=n), 18, 85) * 365.25).astype(np.int64)
+    birth_dates = np.datetime_as_string((end_day - age_days).astype('datetime64[D]')).tolist()
+    signup = to_datetime_strings(signup_ts)
+
+    prenom_index = rng.integers(0, len(PRENOMS), size=n)
+    nom_index = rng.integers(0, len(NOMS), size=n)
+    domain_index = rng.integers(0, len(DOMAINS), size=n)
+    phone = rng.integers(10000000, 99999999, size=n)
+    street = rng.integers(1, 200, size=n)
+    marketing = (rng.random(n) < 0.7).astype(int)
+    data_processing = (rng.random(n) < 0.8).astype(int)
+    statut = np.where(rng.random(n) < 0.95, 'actif', 'inactif')
+    channel = rng.choice(ACQUISITION_CHANNELS, size=n)
+    uuid_bits = rng.integers(0, 2 ** 63, size=(n, 2), dtype=np.int64)
+
+    for offset in range(0, n, args.chunk_size):
+        rows = []
+        for i in range(offset, min(n, offset + args.chunk_size)):
+            city, prefix = CITIES[city_index[i]][:2]
+            prenom = PRENOMS[prenom_index[i]]
+            rows.append((
+                str(uuid.UUID(int=(int(uuid_bits[i, 0]) << 64) | int(uuid_bits[i, 1]), version=4)),
+                NOMS[nom_index[i]], prenom, birth_dates[i],
+                "femme" if prenom_index[i] % 2 else "homme",
+                f"{street[i]} rue de la République", f"{prefix}0{i % 10}0", city, "France",
+                f"06{phone[i]}", f"client{i + 1}@{DOMAINS[domain_index[i]]}", signup[i],
+                int(marketing[i]), int(data_processing[i]), signup[i],
+                statut[i], segment[i], channel[i]
+            ))
+        conn.executemany("""
+            INSERT INTO clients (
+                uuid, nom, prenom, date_naissance, genre, adresse,
+                code_postal, ville, pays, telephone, email, date_inscription,
+                consentement_marketing, consentement_data_processing, date_consentement,
+                statut, segment, canal_acquisition
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.commit()
+
+    print(f"Ajout de {n} clients")
+
+    return {
+        'signup_day': signup_day,
+        'signup_ts': signup_ts,
+        'signup': signup,
+        'activity_cumweights': np.cumsum(activity),
+        'home_store': home_store,
+        'balance': np.zeros(n, dtype=np.int64),
+        'last_activity': np.zeros(n, dtype=np.int64),
+    }
+
+
+def day_weights(start_day, end_day):
+    """Poids de chaque jour de la période: croissance, jour de la semaine et mois"""
+    days = np.arange(start_day, end_day)
+    dates = days.astype('datetime64[D]')
+    weekday = (days + 3) % 7  # 1970-01-01 était un jeudi
+    month = dates.astype('datetime64[M]').astype(int) % 12
+    growth = np.linspace(1.0, 1.3, len(days))
+    return days, growth * WEEKDAY_FACTOR[weekday] * MONTH_FACTOR[month]
+
+
+def generate_transactions(conn, rng, args, ref, clients, days, tx_per_day, level_thresholds, level_multipliers):
+    """Génère et charge les transactions, leurs lignes et l'historique de points, lot par lot"""
+    n_clients = args.clients
+    next_transaction_id = 1
+    next_detail_id = 1
+    day_index = 0
+    loaded = 0
+    started = time.perf_counter()
+    physical = len(ref['store_traffic']) - 1
+    store_p = ref['store_traffic'] / ref['store_traffic'].sum()
+
+    while day_index < len(days):
+        # Jours consécutifs jusqu'à atteindre la taille de lot
+        cumulative = np.cumsum(tx_per_day[day_index:])
+        last = day_index + int(np.searchsorted(cumulative, args.chunk_size, side='left')) + 1
+        last = min(last, len(days))
+        chunk_days = days[day_index:last]
+        counts = tx_per_day[day_index:last]
+        day_index = last
+
+        m = int(counts.sum())
+        if m == 0:
+            continue
+
+        # --- Transactions ---
+        tx_day = np.repeat(chunk_days, counts)
+        hours = np.where(rng.random(m) < 0.6, rng.normal(13.0, 1.5, m), rng.normal(17.5, 1.3, m))
+        seconds = (np.clip(hours, 9, 19.99) * 3600).astype(np.int64)
+        tx_ts = tx_day * 86400 + seconds
+
+        # Clients déjà inscrits à la fin du lot, tirés selon leur activité
+        registered = int(np.searchsorted(clients['signup_day'], chunk_days[-1], side='right'))
+        identified = (rng.random(m) >= args.anonymous_share) & (registered > 0)
+        client = np.full(m, -1, dtype=np.int64)
+        if registered:
+            weights = clients['activity_cumweights'][:registered]
+            draws = rng.random(int(identified.sum())) * weights[-1]
+            client[identified] = np.searchsorted(weights, draws, side='right')
+            client = np.minimum(client, registered - 1)
+            client[~identified] = -1
+
+        store = rng.choice(physical + 1, size=m, p=store_p) + 1
+        at_home = identified & (rng.random(m) < 0.8)
+        store[at_home] = clients['home_store'][client[at_home]]
+        online = store == ref['online_store']
+        # Les achats en ligne ont lieu à toute heure
+        tx_ts = np.where(online, tx_day * 86400 + rng.integers(0, 86400, size=m), tx_ts)
+
+        # Pas d'achat avant l'inscription
+        tx_ts = np.where(identified, np.maximum(tx_ts, clients['signup_ts'][np.maximum(client, 0)]), tx_ts)
+
+        order = np.argsort(tx_ts, kind='stable')
+        tx_ts, client, identified, store, online = (
+            tx_ts[order], client[order], identified[order], store[order], online[order]
+        )
+        transaction_id = np.arange(next_transaction_id, next_transaction_id + m)
+        next_transaction_id += m
+
+        # --- Lignes de transaction ---
+        basket = np.minimum(1 + rng.poisson(1.5, size=m), 12)
+        line_tx = np.repeat(np.arange(m), basket)
+        k = len(line_tx)
+        product = np.searchsorted(ref['product_cumweights'], rng.random(k) * ref['product_cumweights'][-1], side='right')
+        product = np.minimum(product, len(ref['product_price']) - 1)
+        quantity = rng.choice([1, 2, 3], size=k, p=[0.85, 0.12, 0.03])
+        unit_price = ref['product_price'][product]
+
+        month = (tx_ts[line_tx].astype('datetime64[s]').astype('datetime64[M]').astype(int) % 12) + 1
+        in_sales = np.isin(month, SALES_MONTHS)
+        discounted = rng.random(k) < np.where(in_sales, 0.35, 0.08)
+        discount = np.where(
+            discounted,
+            np.where(in_sales, rng.choice([20, 30, 40, 50], size=k), rng.choice([10, 20], size=k)),
+            0
+        ).astype(float)
+
+        gross = quantity * unit_price
+        line_amount = np.round(gross * (1 - discount / 100), 2)
+        discount_amount = np.round(gross - line_amount, 2)
+
+        # Points de la ligne (trigger calculate_points_earned): multiplicateurs produit, catégorie
+        # et niveau de la carte, évalué sur le solde au début du lot. Pas de points sans carte.
+        card_level = np.clip(
+            np.searchsorted(level_thresholds, clients['balance'][np.maximum(client, 0)], side='right') - 1, 0, None
+        )
+        level_factor = level_multipliers[card_level]
+        line_points = sqlite_round(
+            line_amount * ref['product_points_factor'][product] * level_factor[line_tx]
+        ).astype(np.int64)
+        line_points[~identified[line_tx]] = 0
+
+        total = np.round(np.bincount(line_tx, weights=line_amount, minlength=m), 2)
+        amount_ht = np.round(total / 1.2, 2)
+        points = np.bincount(line_tx, weights=line_points, minlength=m).astype(np.int64)
+
+        payment = np.where(
+            online,
+            rng.choice(['cb', 'mobile'], size=m, p=[0.8, 0.2]),
+            rng.choice(['cb', 'mobile', 'espèces', 'chèque', 'mixte'], size=m, p=[0.68, 0.14, 0.12, 0.02, 0.04])
+        )
+        channel = np.where(online, np.where(rng.random(m) < 0.75, 'en_ligne', 'application'), 'magasin')
+
+        # --- Soldes et historique de points (trigger update_client_points) ---
+        earning = identified & (points > 0)
+        history = pd.DataFrame({'client': client[earning], 'points': points[earning]})
+        history['solde'] = history.groupby('client')['points'].cumsum() + clients['balance'][history['client']]
+        np.add.at(clients['balance'], history['client'].to_numpy(), history['points'].to_numpy())
+        np.maximum.at(clients['last_activity'], client[identified], tx_ts[identified])
+
+        tx_dates = to_datetime_strings(tx_ts)
+        client_id = np.where(identified, client + 1, 0)
+
+        conn.executemany("""
+            INSERT INTO transactions (
+                transaction_id, client_id, carte_id, magasin_id, date_transaction,
+                montant_total, montant_ht, tva_montant, type_paiement, numero_facture,
+                canal_vente, points_gagnes, points_utilises, validation_source
+            ) VALUES (?, NULLIF(?, 0), NULLIF(?, 0), ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, 'pos')
+        """, zip(
+            transaction_id.tolist(), client_id.tolist(), client_id.tolist(), store.tolist(), tx_dates,
+            total.tolist(), amount_ht.tolist(), np.round(total - amount_ht, 2).tolist(), payment.tolist(),
+            [f"F{t:010d}" for t in transaction_id.tolist()], channel.tolist(), points.tolist()
+        ))
+
+        conn.executemany("""
+            INSERT INTO details_transactions (
+                detail_id, transaction_id, produit_id, quantite, prix_unitaire,
+                remise_pourcentage, remise_montant, montant_ligne, points_ligne
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, zip(
+            range(next_detail_id, next_detail_id + k), transaction_id[line_tx].tolist(), (product + 1).tolist(),
+            quantity.tolist(), unit_price.tolist(), discount.tolist(), discount_amount.tolist(),
+            line_amount.tolist(), line_points.tolist()
+        ))
+        next_detail_id += k
+
+        earning_index = np.flatnonzero(earning)
+        conn.executemany("""
+            INSERT INTO historique_points (
+                client_id, carte_id, date_operation, type_operation, points,
+                transaction_id, description, solde_apres, validation_status
+            ) VALUES (?, ?, ?, 'gain', ?, ?, 'Points gagnés lors d''un achat', ?, 'validated')
+        """, zip(
+            client_id[earning_index].tolist(), client_id[earning_index].tolist(),
+            [tx_dates[i] for i in earning_index], points[earning_index].tolist(),
+            transaction_id[earning_index].tolist(), history['solde'].tolist()
+        ))
+
+        conn.commit()
+
+        loaded += m
+        elapsed = time.perf_counter() - started
+        print(f"  {loaded}/{args.transactions} transactions ({k} lignes dans ce lot), "
+              f"{loaded / elapsed:,.0f} transactions/s")
+
+    return next_detail_id - 1
+
+
+def finalize_cards(conn, clients, level_thresholds, end_day):
+    """Crée les cartes avec leur solde et niveau finaux, et la table anonymisée"""
+    n = len(clients['balance'])
+    level = np.clip(np.searchsorted(level_thresholds, clients['balance'], side='right') - 1, 0, None)
+    level_names = np.array([l[0] for l in LEVELS])[level]
+    # Cartes valables 3 ans, renouvelées à échéance
+    validity = 3 * 365
+    expiration_day = clients['signup_day'] + validity * ((end_day - clients['signup_day']) // validity + 1)
+    expiration = np.datetime_as_string(expiration_day.astype('datetime64[D]')).tolist()
+    last_activity = np.where(clients['last_activity'] > 0, clients['last_activity'], clients['signup_ts'])
+    last_activity = to_datetime_strings(last_activity)
+
+    conn.executemany("""
+        INSERT INTO cartes_fidelite (
+            carte_id, client_id, numero_carte, date_emission, date_expiration,
+            statut, niveau_fidelite, points_actuels, date_derniere_activite
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, zip(
+        range(1, n + 1), range(1, n + 1), [f"FID{i:08d}" for i in range(1, n + 1)],
+        clients['signup'], expiration,
+        ['active'] * n, level_names.tolist(), clients['balance'].tolist(), last_activity
+    ))
+
+    # Même calcul que le trigger update_client_anonymized
+    conn.execute("""
+        INSERT INTO clients_anonymized (
+            client_id, uuid, age, tranche_age, genre, region, segment, date_inscription, statut
+        )
+        SELECT
+            client_id,
+            uuid,
+            age,
+            CASE
+                WHEN age < 18 THEN '<18'
+                WHEN age BETWEEN 18 AND 25 THEN '18-25'
+                WHEN age BETWEEN 26 AND 35 THEN '26-35'
+                WHEN age BETWEEN 36 AND 50 THEN '36-50'
+                WHEN age BETWEEN 51 AND 65 THEN '51-65'
+                ELSE '65+'
+            END,
+            genre,
+            SUBSTR(code_postal, 1, 2),
+            segment,
+            date(date_inscription),
+            statut
+        FROM (
+            SELECT *, (strftime('%Y', 'now') - strftime('%Y', date_naissance)) as age
+            FROM clients
+        )
+    """)
+    conn.commit()
+
+    print(f"Ajout de {n} cartes de fidélité")
+
+
+def generate_volume_data(args):
+    """Génère la base complète"""
+    if os.path.exists(args.db):
+        if not args.force:
+            raise SystemExit(f"La base {args.db} existe déjà (utiliser --force pour la remplacer)")
+        os.remove(args.db)
+
+    started = time.perf_counter()
+    rng = np.random.default_rng(args.seed)
+    conn, schema_sql = create_database(args.db, args.schema)
+
+    end_day = int(np.datetime64(datetime.date.today(), 'D').astype(np.int64))
+    start_day = end_day - args.years * 365
+
+    ref = generate_reference_data(conn, rng, args)
+    clients = generate_clients(conn, rng, args, ref, start_day, end_day)
+
+    days, weights = day_weights(start_day, end_day)
+    tx_per_day = rng.multinomial(args.transactions, weights / weights.sum())
+
+    level_thresholds = np.array([l[1] for l in LEVELS])
+    level_multipliers = np.array([l[3] for l in LEVELS])
+
+    print(f"Génération de {args.transactions} transactions sur {len(days)} jours")
+    details = generate_transactions(
+        conn, rng, args, ref, clients, days, tx_per_day, level_thresholds, level_multipliers
+    )
+
+    finalize_cards(conn, clients, level_thresholds, end_day)
+
+    restore_triggers(conn, schema_sql)
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.close()
+
+    duration = time.perf_counter() - started
+    print(f"Génération terminée en {duration:.0f} s: {args.clients} clients, "
+          f"{args.transactions} transactions, {details} lignes de transaction")
+
+
+if __name__ == "__main__":
+    generate_volume_data(parse_args())
@@ -0,0 +1,779 @@
+"""
+Miroir analytique colonnaire de la base de fidélité
+
+Les requêtes analytiques (tableau de bord, calendrier, carte des ventes) parcourent
+transactions et details_transactions sur de longues périodes, ce que le stockage en
+lignes de SQLite supporte mal à grande volumétrie. Ce module copie ces tables, avec les
+dimensions qu'elles joignent (clients, points_vente, produits), dans une base DuckDB
+locale (un fichier, sans service) stockée en colonnes. Les tables de faits portent une
+colonne mois (AAAA-MM) qui sert de partition au rafraîchissement.
+
+Le rafraîchissement est incrémental:
+- les transactions et lignes d'articles dont la clé dépasse le filigrane de la
+  synchronisation précédente sont copiées; les transactions ayant reçu de nouvelles
+  lignes (points calculés par trigger) sont recopiées;
+- les clients nouveaux (client_id) ou modifiés (derniere_modification, tenue à jour par
+  le trigger clients_derniere_modification) depuis la synchronisation précédente sont
+  recopiés; les autres tables de dimension, petites, sont recopiées entièrement;
+- la vérification (verify=True, périodique) compare l'empreinte de chaque mois (lignes,
+  montants, points) entre SQLite et le miroir et recopie les mois qui diffèrent, ce qui
+  rattrape les modifications et suppressions de transactions anciennes.
+
+DuckDB n'autorise qu'un processus écrivain par fichier: le miroir est rafraîchi par un
+thread du processus web (start_mirror_refresh), qui lit aussi le miroir.
+
+Les lectures passent par get_analytics_connection(): connexion au miroir lorsque
+ANALYTICS_SETTINGS['backend'] vaut 'duckdb' et que le miroir est à jour, connexion SQLite
+sinon (réplique de lecture, voir read_replica). duckdb est une dépendance optionnelle: sans lui, tout reste sur SQLite.
+
+Usage:
+    python modules/analytics_mirror.py modules/fidelity_db.sqlite
+    python modules/analytics_mirror.py modules/fidelity_db.sqlite --verify
+    python modules/analytics_mirror.py modules/fidelity_db.sqlite --full
+"""
+
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+import pandas as pd
+
+try:
+    from modules.db_pool import get_connection, DEFAULT_DB_PATH
+    from modules.read_replica import get_replica_connection
+except ImportError:
+    from db_pool import get_connection, DEFAULT_DB_PATH
+    from read_replica import get_replica_connection
+
+# Configuration du logging
+logger = logging.getLogger(__name__)
+
+ANALYTICS_SETTINGS = {
+    'backend': os.environ.get('LOYALTY_ANALYTICS_BACKEND', 'sqlite'),  # 'sqlite' ou 'duckdb'
+    'mirror_path': os.environ.get('LOYALTY_ANALYTICS_MIRROR', 'modules/fidelity_mirror.duckdb'),
+    'refresh_interval': 300,        # secondes entre deux rafraîchissements incrémentaux
+    'verify_interval': 24 * 3600,   # secondes entre deux vérifications des empreintes mensuelles
+    'max_lag': 3600                 # retard (secondes) au-delà duquel les lectures repassent sur SQLite
+}
+
+# Tables copiées et leur clé; les tables de faits sont partitionnées par mois
+MIRROR_TABLES = {
+    'transactions': 'transaction_id',
+    'details_transactions': 'detail_id',
+    'clients': 'client_id',
+    'points_vente': 'magasin_id',
+    'produits': 'produit_id'
+}
+FACT_TABLES = ('transactions', 'details_transactions')
+
+# Colonnes stockées en texte dans SQLite et converties en TIMESTAMP dans le miroir
+TIMESTAMP_COLUMNS = {'transactions': ('date_transaction',)}
+
+# Lignes lues dans SQLite par bloc inséré dans le miroir
+MIRROR_CHUNK_SIZE = 100000
+
+# Date de modification des clients (à la milliseconde), filigrane de leur synchronisation
+# incrémentale (la valeur par défaut de la colonne ne couvre que l'insertion)
+CLIENTS_CHANGE_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS clients_derniere_modification
+    AFTER UPDATE ON clients
+    WHEN NEW.derniere_modification IS OLD.derniere_modification
+    BEGIN
+        UPDATE clients SET derniere_modification = strftime('%Y-%m-%d %H:%M:%f', 'now')
+        WHERE client_id = NEW.client_id;
+    END
+'''
+
+# Date de modification normalisée (les dates par défaut sont à la seconde)
+CLIENTS_MODIFICATION = "strftime('%Y-%m-%d %H:%M:%f', x.derniere_modification)"
+
+STATE_TABLE = "CREATE TABLE IF NOT EXISTS miroir_etat (cle VARCHAR PRIMARY KEY, valeur VARCHAR)"
+
+# Empreinte mensuelle des tables de faits: (requête SQLite, requête miroir)
+MONTH_FINGERPRINTS = {
+    'transactions': (
+        "SELECT substr(t.date_transaction, 1, 7) AS mois, COUNT(*), COALESCE(MAX(t.transaction_id), 0), "
+        "ROUND(TOTAL(t.montant_total), 2), TOTAL(t.points_gagnes) "
+        "FROM transactions t GROUP BY mois",
+        "SELECT mois, COUNT(*), COALESCE(MAX(transaction_id), 0), "
+        "ROUND(COALESCE(SUM(montant_total), 0), 2), COALESCE(SUM(points_gagnes), 0) "
+        "FROM transactions GROUP BY mois"
+    ),
+    'details_transactions': (
+        "SELECT substr(t.date_transaction, 1, 7) AS mois, COUNT(*), ROUND(TOTAL(dt.montant_ligne), 2) "
+        "FROM details_transactions dt LEFT JOIN transactions t ON t.transaction_id = dt.transaction_id "
+        "GROUP BY mois",
+        "SELECT mois, COUNT(*), ROUND(COALESCE(SUM(montant_ligne), 0), 2) "
+        "FROM details_transactions GROUP BY mois"
+    )
+}
+
+# Bases DuckDB ouvertes (une par fichier et par processus)
+_databases = {}
+_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_refresh_thread = None
+_fallback_reason = None
+
+
+def _import_duckdb():
+    """Importe duckdb, dépendance optionnelle (None s'il n'est pas installé)"""
+    try:
+        import duckdb
+        return duckdb
+    except ImportError:
+        return None
+
+
+def configure_analytics(settings=None):
+    """
+    Configure le backend analytique, à appeler une fois au démarrage de l'application.
+
+    Args:
+        settings (dict, optional): Paramètres de ANALYTICS_SETTINGS à modifier
+    """
+    for key, value in (settings or {}).items():
+        if key not in ANALYTICS_SETTINGS:
+            raise ValueError(f"Paramètre analytique inconnu: {key}")
+        ANALYTICS_SETTINGS[key] = value
+
+
+def _mirror_database(mirror_path=None):
+    """
+    Retourne la base DuckDB du miroir, ouverte une seule fois par processus.
+
+    Args:
+        mirror_path (str, optional): Fichier du miroir (ANALYTICS_SETTINGS par défaut)
+
+    Returns:
+        duckdb.DuckDBPyConnection: Connexion de base (None si duckdb n'est pas installé)
+    """
+    mirror_path = os.path.abspath(mirror_path or ANALYTICS_SETTINGS['mirror_path'])
+    with _lock:
+        database = _databases.get(mirror_path)
+        if database is None:
+            duckdb = _import_duckdb()
+            if duckdb is None:
+                return None
+            database = duckdb.connect(mirror_path)
+            database.execute(STATE_TABLE)
+            _databases[mirror_path] = database
+        return database
+
+
+def _sync_status(mirror_path=None):
+    """
+    État de synchronisation enregistré dans le miroir.
+
+    L'état est relu à chaque appel: le module peut être importé sous deux noms
+    (modules.analytics_mirror et analytics_mirror) qui partagent la même base DuckDB.
+
+    Returns:
+        dict: Base source et dates (epoch) de synchronisation et de vérification,
+        None si duckdb n'est pas installé
+    """
+    database = _mirror_database(mirror_path)
+    if database is None:
+        return None
+    cursor = database.cursor()
+    try:
+        state = dict(cursor.execute("SELECT cle, valeur FROM miroir_etat").fetchall())
+    finally:
+        cursor.close()
+    return {
+        'source': state.get('source'),
+        'last_refresh': float(state['derniere_synchronisation']) if state.get('derniere_synchronisation') else None,
+        'last_verification': float(state['derniere_verification']) if state.get('derniere_verification') else None
+    }
+
+
+def close_mirror():
+    """Ferme les bases DuckDB ouvertes par le processus."""
+    with _lock:
+        for database in _databases.values():
+            database.close()
+        _databases.clear()
+
+
+def _to_sqlite_value(value):
+    """Convertit une valeur DuckDB dans la représentation retournée par SQLite"""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+class MirrorRow:
+    """
+    Ligne du miroir, accessible par position ou par nom de colonne (comme sqlite3.Row).
+    """
+
+    __slots__ = ('_values', '_index')
+
+    def __init__(self, values, index):
+        self._values = values
+        self._index = index
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._index[key]]
+        return self._values[key]
+
+    def keys(self):
+        return list(self._index)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return f"MirrorRow({dict(zip(self._index, self._values))})"
+
+
+class MirrorCursor:
+    """
+    Résultat d'une requête sur le miroir, avec les dates converties en texte comme SQLite.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.description = cursor.description
+        self._index = {column[0]: position for position, column in enumerate(self.description or ())}
+
+    def _convert(self, row):
+        return MirrorRow(tuple(_to_sqlite_value(value) for value in row), self._index)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return None if row is None else self._convert(row)
+
+    def fetchmany(self, size=1):
+        return [self._convert(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._convert(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+
+class MirrorConnection:
+    """
+    Connexion de lecture au miroir DuckDB, utilisable à la place d'une connexion sqlite3
+    pour les requêtes analytiques (execute, read_sql_query, close).
+    """
+
+    # Jamais de transaction ouverte: le cache des requêtes SQLite est ignoré (pas de db_path)
+    in_transaction = False
+
+    def __init__(self, cursor, snapshot=None):
+        self._cursor = cursor
+        # Date (epoch) de la synchronisation lue, pour read_replica.data_lag()
+        self.snapshot = snapshot
+
+    def execute(self, sql, parameters=()):
+        self._cursor.execute(sql, list(parameters or ()))
+        return MirrorCursor(self._cursor)
+
+    def read_sql_query(self, sql, params=None):
+        """
+        Équivalent de pd.read_sql_query, le résultat étant lu en colonnes.
+
+        Args:
+            sql (str): Requête SQL
+            params (list, optional): Paramètres de la requête
+
+        Returns:
+            DataFrame: Résultat de la requête
+        """
+        result = self._cursor.execute(sql, list(params or ()))
+        types = {column[0]: str(column[1]) for column in result.description}
+        df = result.df()
+        for column, column_type in types.items():
+            if column_type == 'DATE':
+                df[column] = df[column].dt.strftime('%Y-%m-%d')
+            elif column_type.startswith('TIMESTAMP'):
+                df[column] = df[column].dt.strftime('%Y-%m-%d %H:%M:%S')
+            elif column_type.startswith('DECIMAL'):
+                df[column] = df[column].astype(float)
+        return df
+
+    def close(self):
+        self._cursor.close()
+
+
+def read_sql_query(conn, sql, params=None):
+    """
+    Exécute une requête analytique et retourne un DataFrame, sur SQLite ou sur le miroir.
+
+    Args:
+        conn: Connexion retournée par get_analytics_connection()
+        sql (str): Requête SQL
+        params (list, optional): Paramètres de la requête
+
+    Returns:
+        DataFrame: Résultat de la requête
+    """
+    if isinstance(conn, MirrorConnection):
+        return conn.read_sql_query(sql, params)
+    return pd.read_sql_query(sql, conn, params=params)
+
+
+def mirror_lag(db_path=DEFAULT_DB_PATH, mirror_path=None):
+    """
+    Retard du miroir sur la base SQLite.
+
+    Args:
+        db_path (str): Base de données SQLite source
+        mirror_path (str, optional): Fichier du miroir
+
+    Returns:
+        float: Secondes depuis la dernière synchronisation (None si le miroir n'est pas
+        synchronisé avec cette base ou si duckdb n'est pas installé)
+    """
+    status = _sync_status(mirror_path)
+    if status is None or status['last_refresh'] is None or status['source'] != os.path.abspath(db_path):
+        return None
+    return time.time() - status['last_refresh']
+
+
+def get_analytics_connection(db_path=DEFAULT_DB_PATH, row_factory=None):
+    """
+    Retourne une connexion pour les requêtes analytiques.
+
+    Avec le backend 'duckdb', la connexion lit le miroir s'il est synchronisé avec db_path
+    depuis moins de ANALYTICS_SETTINGS['max_lag'] secondes; sinon, comme avec le backend
+    'sqlite', c'est une connexion SQLite (réplique de lecture si elle est à jour, voir
+    read_replica). Dans les deux cas, close() la libère.
+
+    Args:
+        db_path (str): Base de données SQLite
+        row_factory (callable, optional): Fabrique de lignes de la connexion SQLite
+
+    Returns:
+        MirrorConnection ou sqlite3.Connection: Connexion de lecture
+    """
+    global _fallback_reason
+
+    if ANALYTICS_SETTINGS['backend'] == 'duckdb':
+        lag = mirror_lag(db_path)
+        if lag is not None and lag <= ANALYTICS_SETTINGS['max_lag']:
+            _fallback_reason = None
+            return MirrorConnection(_mirror_database().cursor(), time.time() - lag)
+
+        if _import_duckdb() is None:
+            reason = "duckdb n'est pas installé"
+        elif lag is None:
+            reason = "miroir analytique non synchronisé"
+        else:
+            reason = f"miroir analytique en retard de {int(lag)} s"
+        # Signalé une fois par changement de cause, pas à chaque requête
+        if reason != _fallback_reason:
+            logger.warning(f"Requêtes analytiques sur SQLite: {reason}")
+            _fallback_reason = reason
+
+    return get_replica_connection(db_path, row_factory)
+
+
+def ensure_clients_change_tracking(conn, commit=True):
+    """
+    Crée le trigger qui date les modifications des clients s'il est absent.
+
+    Args:
+        conn (sqlite3.Connection): Connexion à la base de données
+        commit (bool): Valider la transaction (False: l'appelant la valide, comme migrate())
+    """
+    conn.execute(CLIENTS_CHANGE_TRIGGER)
+    if commit:
+        conn.commit()
+
+
+def _source_columns(src, table):
+    """Colonnes d'une table SQLite et leur type dans le miroir"""
+    columns = []
+    for _, name, declared, *_ in src.execute(f"PRAGMA table_info({table})"):
+        declared = (declared or '').upper()
+        if name in TIMESTAMP_COLUMNS.get(table, ()):
+            mirror_type = 'TIMESTAMP'
+        elif 'INT' in declared or 'BOOL' in declared:
+            mirror_type = 'BIGINT'
+        elif any(affinity in declared for affinity in ('REAL', 'FLOA', 'DOUB', 'DEC', 'NUM')):
+            mirror_type = 'DOUBLE'
+        else:
+            mirror_type = 'VARCHAR'
+        columns.append((name, mirror_type))
+    if table in FACT_TABLES:
+        columns.append(('mois', 'VARCHAR'))
+    return columns
+
+
+def _ensure_mirror_tables(src, duck, full):
+    """
+    Crée les tables du miroir absentes ou dont les colonnes ne correspondent plus à SQLite.
+
+    Returns:
+        tuple: (colonnes de chaque table, tables recréées à recopier entièrement)
+    """
+    columns = {}
+    rebuilt = set()
+    for table in MIRROR_TABLES:
+        columns[table] = _source_columns(src, table)
+        existing = duck.execute(
+            "SELECT column_name, data_type FROM information_schema.columns "
+            "WHERE table_name = ? ORDER BY ordinal_position", [table]
+        ).fetchall()
+        if full or [tuple(column) for column in existing] != columns[table]:
+            definition = ', '.join(f"{name} {mirror_type}" for name, mirror_type in columns[table])
+            duck.execute(f"CREATE OR REPLACE TABLE {table} ({definition})")
+            rebuilt.add(table)
+    return columns, rebuilt
+
+
+def _copy_rows(src, duck, table, columns, condition='', params=()):
+    """
+    Copie dans le miroir les lignes SQLite d'une table, par blocs.
+
+    Args:
+        src (sqlite3.Connection): Connexion à la base SQLite
+        duck: Curseur DuckDB (dans la transaction du rafraîchissement)
+        table (str): Table copiée
+        columns (list): Colonnes du miroir et leur type
+        condition (str): Clause WHERE sur les alias t (transactions) et dt (lignes)
+        params (tuple): Paramètres de la condition
+
+    Returns:
+        int: Nombre de lignes copiées
+    """
+    alias = {'transactions': 't', 'details_transactions': 'dt'}.get(table, 'x')
+    selected = []
+    for name, mirror_type in columns:
+        if name == 'mois':
+            selected.append("substr(t.date_transaction, 1, 7) AS mois")
+        elif mirror_type == 'VARCHAR':
+            # Typage dynamique de SQLite: une colonne texte peut contenir des nombres
+            selected.append(f"CAST({alias}.{name} AS TEXT) AS {name}")
+        else:
+            selected.append(f"{alias}.{name}")
+
+    query = f"SELECT {', '.join(selected)} FROM {table} {alias}"
+    if table == 'details_transactions':
+        query += " LEFT JOIN transactions t ON t.transaction_id = dt.transaction_id"
+    if condition:
+        query += f" WHERE {condition}"
+
+    target = ', '.join(
+        f"TRY_CAST({name} AS {mirror_type})" for name, mirror_type in columns
+    )
+    copied = 0
+    for chunk in pd.read_sql_query(query, src, params=params, chunksize=MIRROR_CHUNK_SIZE):
+        duck.register('bloc_sqlite', chunk)
+        try:
+            duck.execute(f"INSERT INTO {table} SELECT {target} FROM bloc_sqlite")
+        finally:
+            duck.unregister('bloc_sqlite')
+        copied += len(chunk)
+    return copied
+
+
+def _sync_clients(src, duck, columns, state, full):
+    """
+    Copie dans le miroir les clients nouveaux ou modifiés depuis la synchronisation précédente.
+
+    La table est recopiée entièrement lors d'une reconstruction, sans le trigger
+    clients_derniere_modification (base non migrée), ou si des clients ont été supprimés.
+
+    Returns:
+        tuple: (lignes copiées, filigranes à enregistrer)
+    """
+    id_limit, modified_limit = src.execute(
+        f"SELECT COALESCE(MAX(x.client_id), 0), COALESCE(MAX({CLIENTS_MODIFICATION}), '') FROM clients x"
+    ).fetchone()
+    watermarks = {'filigrane_clients': str(id_limit), 'filigrane_clients_modification': modified_limit}
+
+    tracked = src.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'clients_derniere_modification'"
+    ).fetchone()
+    if not full and tracked and 'filigrane_clients' in state:
+        condition = f"x.client_id > ? OR {CLIENTS_MODIFICATION} > ?"
+        params = (int(state['filigrane_clients']), state.get('filigrane_clients_modification', ''))
+        changed = pd.read_sql_query(f"SELECT x.client_id FROM clients x WHERE {condition}", src, params=params)
+        duck.register('clients_modifies', changed)
+        try:
+            duck.execute("DELETE FROM clients WHERE client_id IN (SELECT client_id FROM clients_modifies)")
+        finally:
+            duck.unregister('clients_modifies')
+        copied = _copy_rows(src, duck, 'clients', columns, condition, params)
+
+        source_count = src.execute("SELECT COUNT(*) FROM clients").fetchone()[0]
+        if duck.execute("SELECT COUNT(*) FROM clients").fetchone()[0] == source_count:
+            return copied, watermarks
+
+    duck.execute("DELETE FROM clients")
+    return _copy_rows(src, duck, 'clients', columns), watermarks
+
+
+def _month_condition(month):
+    """Condition SQLite sur le mois des transactions (par plage, pour utiliser l'index des dates)"""
+    if month is None:
+        return "t.date_transaction IS NULL", ()
+    # U+FFFF est supérieur à tout caractère d'une date: la plage couvre le mois entier
+    return ("t.date_transaction >= ? AND t.date_transaction < ? AND substr(t.date_transaction, 1, 7) = ?",
+            (month, month + '\uffff', month))
+
+
+def _verify_months(src, duck, columns):
+    """
+    Recopie les mois dont l'empreinte diffère entre SQLite et le miroir.
+
+    Returns:
+        list: Mois recopiés
+    """
+    changed = set()
+    for table, (source_query, mirror_query) in MONTH_FINGERPRINTS.items():
+        source = {row[0]: tuple(row[1:]) for row in src.execute(source_query)}
+        mirror = {row[0]: tuple(row[1:]) for row in duck.execute(mirror_query).fetchall()}
+        changed.update(month for month in source.keys() | mirror.keys() if source.get(month) != mirror.get(month))
+
+    for month in changed:
+        condition, params = _month_condition(month)
+        for table in FACT_TABLES:
+            duck.execute(f"DELETE FROM {table} WHERE mois IS NOT DISTINCT FROM ?", [month])
+            _copy_rows(src, duck, table, columns[table], condition, params)
+
+    return sorted(changed, key=lambda month: month or '')
+
+
+def refresh_mirror(db_path=DEFAULT_DB_PATH, mirror_path=None, full=False, verify=False):
+    """
+    Rafraîchit le miroir analytique à partir de la base SQLite.
+
+    Les lectures SQLite se font dans une seule transaction (instantané cohérent) et les
+    écritures DuckDB dans une seule transaction: les lecteurs du miroir voient l'état
+    précédent jusqu'à la fin du rafraîchissement.
+
+    Args:
+        db_path (str): Base de données SQLite source
+        mirror_path (str, optional): Fichier du miroir (ANALYTICS_SETTINGS par défaut)
+        full (bool): Recopier toutes les tables
+        verify (bool): Comparer les empreintes mensuelles et recopier les mois modifiés
+
+    Returns:
+        dict: Résultat et statistiques du rafraîchissement
+    """
+    database = _mirror_database(mirror_path)
+    if database is None:
+        return {'success': False, 'error': "duckdb n'est pas installé"}
+
+    source = os.path.abspath(db_path)
+    start_time = time.perf_counter()
+
+    with _refresh_lock:
+        src = get_connection(db_path)
+        duck = database.cursor()
+        try:
+            state = dict(duck.execute("SELECT cle, valeur FROM miroir_etat").fetchall())
+            full = full or state.get('source') != source
+
+            src.execute("BEGIN")
+            duck.execute("BEGIN TRANSACTION")
+            columns, rebuilt = _ensure_mirror_tables(src, duck, full)
+
+            rows_copied = {}
+            watermarks = {}
+            for table in FACT_TABLES:
+                key = MIRROR_TABLES[table]
+                watermark = 0 if table in rebuilt else int(state.get(f'filigrane_{table}', 0))
+                limit = src.execute(f"SELECT COALESCE(MAX({key}), 0) FROM {table}").fetchone()[0]
+                watermarks[table] = (min(watermark, limit), limit)
+
+            # Transactions: nouvelles, et recopie depuis la première ayant reçu de nouvelles lignes
+            tx_from, tx_limit = watermarks['transactions']
+            dt_from, dt_limit = watermarks['details_transactions']
+            resync_from = tx_from + 1
+            if tx_from:
+                first_touched = src.execute(
+                    "SELECT MIN(transaction_id) FROM details_transactions WHERE detail_id > ? AND detail_id <= ?",
+                    (dt_from, dt_limit)
+                ).fetchone()[0]
+                if first_touched is not None:
+                    resync_from = min(resync_from, first_touched)
+            duck.execute("DELETE FROM transactions WHERE transaction_id >= ?", [resync_from])
+            rows_copied['transactions'] = _copy_rows(
+                src, duck, 'transactions', columns['transactions'],
+                "t.transaction_id >= ? AND t.transaction_id <= ?", (resync_from, tx_limit)
+            )
+
+            duck.execute("DELETE FROM details_transactions WHERE detail_id > ?", [dt_from])
+            rows_copied['details_transactions'] = _copy_rows(
+                src, duck, 'details_transactions', columns['details_transactions'],
+                "dt.detail_id > ? AND dt.detail_id <= ?", (dt_from, dt_limit)
+            )
+
+            # Dimensions: clients nouveaux et modifiés, recopie complète des autres
+            rows_copied['clients'], clients_watermarks = _sync_clients(
+                src, duck, columns['clients'], state, full or 'clients' in rebuilt
+            )
+            for table in MIRROR_TABLES:
+                if table not in FACT_TABLES and table != 'clients':
+                    duck.execute(f"DELETE FROM {table}")
+                    rows_copied[table] = _copy_rows(src, duck, table, columns[table])
+
+            months_recopied = _verify_months(src, duck, columns) if verify and not full else []
+
+            now = time.time()
+            new_state = {
+                'source': source,
+                'derniere_synchronisation': str(now),
+                'filigrane_transactions': str(tx_limit),
+                'filigrane_details_transactions': str(dt_limit),
+                **clients_watermarks
+            }
+            if verify or full:
+                new_state['derniere_verification'] = str(now)
+            for key, value in new_state.items():
+                duck.execute("INSERT OR REPLACE INTO miroir_etat VALUES (?, ?)", [key, value])
+
+            duck.execute("COMMIT")
+            src.rollback()
+
+            duration_ms = int((time.perf_counter() - start_time) * 1000)
+            logger.info(f"Miroir analytique rafraîchi en {duration_ms} ms: {rows_copied}")
+            return {
+                'success': True,
+                'mode': 'complet' if full else ('vérification' if verify else 'incrémental'),
+                'rows_copied': rows_copied,
+                'months_recopied': months_recopied,
+                'watermarks': {'transactions': tx_limit, 'details_transactions': dt_limit},
+                'duration_ms': duration_ms
+            }
+
+        except Exception as e:
+            try:
+                duck.execute("ROLLBACK")
+            except Exception:
+                pass
+            logger.error(f"Erreur lors du rafraîchissement du miroir analytique: {str(e)}")
+            return {'success': False, 'error': str(e)}
+        finally:
+            duck.close()
+            src.close()
+
+
+def _refresh_loop(db_path):
+    """Boucle du thread de rafraîchissement périodique"""
+    while True:
+        status = _sync_status() or {}
+        last_verification = status.get('last_verification')
+        verify = last_verification is None or time.time() - last_verification >= ANALYTICS_SETTINGS['verify_interval']
+        try:
+            refresh_mirror(db_path, verify=verify)
+        except Exception as e:
+            logger.error(f"Exception lors du rafraîchissement du miroir analytique: {str(e)}")
+        time.sleep(ANALYTICS_SETTINGS['refresh_interval'])
+
+
+def start_mirror_refresh(db_path=DEFAULT_DB_PATH):
+    """
+    Démarre le rafraîchissement périodique du miroir si le backend 'duckdb' est activé.
+
+    Args:
+        db_path (str): Base de données SQLite source
+
+    Returns:
+        bool: True si le thread de rafraîchissement a été démarré
+    """
+    global _refresh_thread
+
+    if ANALYTICS_SETTINGS['backend'] != 'duckdb':
+        return False
+    if _import_duckdb() is None:
+        logger.warning("Backend analytique 'duckdb' demandé mais duckdb n'est pas installé")
+        return False
+
+    with _lock:
+        if _refresh_thread is not None and _refresh_thread.is_alive():
+            return False
+        _refresh_thread = threading.Thread(
+            target=_refresh_loop, args=(db_path,), name='miroir-analytique', daemon=True
+        )
+        _refresh_thread.start()
+    return True
+
+
+def get_mirror_status(db_path=DEFAULT_DB_PATH):
+    """
+    Retourne l'état du miroir analytique (backend, synchronisation, volumes).
+
+    Args:
+        db_path (str): Base de données SQLite source
+
+    Returns:
+        dict: État du miroir
+    """
+    mirror_path = os.path.abspath(ANALYTICS_SETTINGS['mirror_path'])
+    status = {
+        'backend': ANALYTICS_SETTINGS['backend'],
+        'duckdb_installed': _import_duckdb() is not None,
+        'mirror_path': mirror_path
+    }
+    if status['backend'] != 'duckdb' or not status['duckdb_installed']:
+        return status
+
+    lag = mirror_lag(db_path)
+    sync = _sync_status()
+    status.update({
+        'source': sync['source'],
+        'last_refresh': datetime.fromtimestamp(sync['last_refresh']).isoformat() if sync['last_refresh'] else None,
+        'last_verification': (datetime.fromtimestamp(sync['last_verification']).isoformat()
+                              if sync['last_verification'] else None),
+        'lag_seconds': round(lag, 1) if lag is not None else None,
+        'in_use': lag is not None and lag <= ANALYTICS_SETTINGS['max_lag'],
+        'rows': {}
+    })
+    conn = _mirror_database().cursor()
+    try:
+        existing = {row[0] for row in conn.execute("SELECT table_name FROM information_schema.tables").fetchall()}
+        for table in MIRROR_TABLES:
+            if table in existing:
+                status['rows'][table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rafraîchissement du miroir analytique DuckDB")
+    parser.add_argument('db', nargs='?', default=DEFAULT_DB_PATH, help="Base de données SQLite")
+    parser.add_argument('--mirror', default=ANALYTICS_SETTINGS['mirror_path'], help="Fichier DuckDB du miroir")
+    parser.add_argument('--full', action='store_true', help="Recopier toutes les tables")
+    parser.add_argument('--verify', action='store_true',
+                        help="Comparer les empreintes mensuelles et recopier les mois modifiés")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    result = refresh_mirror(args.db, args.mirror, full=args.full, verify=args.verify)
+    close_mirror()
+    if not result['success']:
+        print(f"Échec du rafraîchissement: {result['error']}")
+        return 1
+
+    print(f"Rafraîchissement {result['mode']} en {result['duration_ms']} ms")
+    for table, count in result['rows_copied'].items():
+        print(f"  {table:<24} {count:>12} lignes copiées")
+    if result['months_recopied']:
+        print(f"  Mois recopiés: {', '.join(str(month) for month in result['months_recopied'])}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -6,15 +6,32 @@ permettant l'intégration avec d'autres systèmes et applications.
 """
 
 from flask import Blueprint, request, jsonify
-from loyalty_manager import LoyaltyManager, RewardManager
 import logging
 
+# Mêmes instances de modules que les gestionnaires (pool, cache, miroir partagés)
+try:
+    from modules.loyalty_manager import LoyaltyManager, RewardManager, STATS_CACHE_MAX_AGE
+    from modules.loyalty_simulator import RuleSimulator
+    from modules.offer_delivery import OfferDeliveryService
+    from modules.db_pool import get_pool_stats, DEFAULT_DB_PATH
+    from modules.query_cache import get_query_cache_stats
+    from modules.analytics_mirror import get_mirror_status, refresh_mirror
+except ImportError:
+    from loyalty_manager import LoyaltyManager, RewardManager, STATS_CACHE_MAX_AGE
+    from loyalty_simulator import RuleSimulator
+    from offer_delivery import OfferDeliveryService
+    from db_pool import get_pool_stats, DEFAULT_DB_PATH
+    from query_cache import get_query_cache_stats
+    from analytics_mirror import get_mirror_status, refresh_mirror
+
 # Création du Blueprint pour les routes d'API de fidélité
 loyalty_api = Blueprint('loyalty_api', __name__, url_prefix='/api/loyalty')
 
 # Initialisation des gestionnaires
 loyalty_manager = LoyaltyManager()
 reward_manager = RewardManager()
+rule_simulator = RuleSimulator()
+delivery_service = OfferDeliveryService(loyalty_manager.db_path)
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -28,8 +45,12 @@ def api_loyalty_stats():
         # Récupérer le paramètre de période
         period = request.args.get('period', 30, type=int)
         
-        # Obtenir les statistiques
-        stats = loyalty_manager.get_loyalty_stats(period)
+        # Obtenir les statistiques (depuis le cache, sauf recalcul demandé)
+        if request.args.get('refresh', 'false').lower() == 'true':
+            stats = loyalty_manager.refresh_loyalty_stats(period)
+        else:
+            max_age = request.args.get('max_age', STATS_CACHE_MAX_AGE, type=int)
+            stats = loyalty_manager.get_loyalty_stats(period, max_age=max_age)
         
         return jsonify(stats)
     
@@ -148,6 +169,8 @@ def api_create_rule():
         conn.commit()
         conn.close()
         
+        loyalty_manager.invalidate_rules_cache()
+        
         return jsonify({
             'success': True,
             'rule_id': rule_id,
@@ -216,6 +239,8 @@ def api_update_rule(rule_id):
         conn.commit()
         conn.close()
         
+        loyalty_manager.invalidate_rules_cache()
+        
         return jsonify({
             'success': True,
             'rule_id': rule_id,
@@ -250,6 +275,8 @@ def api_delete_rule(rule_id):
         conn.commit()
         conn.close()
         
+        loyalty_manager.invalidate_rules_cache()
+        
         return jsonify({
             'success': True,
             'message': f"Règle #{rule_id} supprimée avec succès"
@@ -262,6 +289,37 @@ def api_delete_rule(rule_id):
             'error': str(e)
         })
 
+@loyalty_api.route('/rules/simulate', methods=['POST'])
+def api_simulate_rule():
+    """API pour simuler une règle de fidélité (dry-run) sur l'historique, sans générer d'offres"""
+    try:
+        # Récupérer les données de la requête
+        data = request.json
+        
+        # Vérifier les champs obligatoires
+        required_fields = ['type_regle', 'condition_valeur', 'action_type']
+        for field in required_fields:
+            if field not in data:
+                return jsonify({
+                    'success': False,
+                    'error': f"Champ obligatoire manquant: {field}"
+                })
+        
+        # Recharger l'instantané des données si demandé
+        if data.get('refresh'):
+            rule_simulator.load_snapshot(force=True)
+        
+        result = rule_simulator.simulate(data, data.get('reference_date'))
+        
+        return jsonify(result)
+    
+    except Exception as e:
+        logger.error(f"Erreur lors de la simulation de la règle: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
+
 # Routes des offres
 @loyalty_api.route('/offers', methods=['GET'])
 def api_get_offers():
@@ -384,6 +442,19 @@ def api_send_offers():
             'error': str(e)
         })
 
+@loyalty_api.route('/offers/delivery', methods=['GET'])
+def api_offer_delivery_stats():
+    """API pour suivre la file d'envoi des offres (statuts et latence par canal)"""
+    try:
+        return jsonify(delivery_service.get_delivery_stats())
+    
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération des statistiques d'envoi: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
+
 @loyalty_api.route('/offers/use', methods=['POST'])
 def api_use_offer():
     """API pour utiliser une offre"""
@@ -558,14 +629,43 @@ def api_use_points(client_id):
         })
 
 # Routes d'exécution des règles (administrateur)
+@loyalty_api.route('/points/batch', methods=['POST'])
+def api_points_batch():
+    """API pour appliquer un lot de mouvements de points (fin de journée des caisses)"""
+    try:
+        # Récupérer les données de la requête
+        data = request.json
+        movements = data.get('movements') if isinstance(data, dict) else data
+        
+        if not isinstance(movements, list):
+            return jsonify({
+                'success': False,
+                'error': "Liste de mouvements requise"
+            })
+        
+        # Appliquer le lot en une seule transaction
+        result = loyalty_manager.apply_points_batch(movements)
+        
+        return jsonify(result)
+    
+    except Exception as e:
+        logger.error(f"Erreur lors de l'application du lot de points: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
+
 @loyalty_api.route('/evaluate-rules', methods=['POST'])
 def api_evaluate_rules():
     """API pour évaluer toutes les règles de fidélité"""
     try:
         # Vérifier l'authentification (à implémenter)
         
-        # Évaluer les règles
-        result = loyalty_manager.evaluate_all_rules()
+        # Évaluer les règles (incremental=true pour ne traiter que les nouvelles transactions)
+        incremental = request.args.get('incremental', 'false').lower() == 'true'
+        compiled = request.args.get('compiled', 'false').lower() == 'true'
+        workers = request.args.get('workers', None, type=int)
+        result = loyalty_manager.evaluate_all_rules(incremental=incremental, compiled=compiled, workers=workers)
         
         return jsonify(result)
     
@@ -576,6 +676,106 @@ def api_evaluate_rules():
             'error': str(e)
         })
 
+@loyalty_api.route('/evaluate-rules/plan', methods=['GET'])
+def api_evaluate_rules_plan():
+    """API pour afficher le plan compilé d'évaluation des règles (EXPLAIN)"""
+    try:
+        result = loyalty_manager.explain_compiled_rules()
+        
+        return jsonify(result)
+    
+    except Exception as e:
+        logger.error(f"Erreur lors de la compilation des règles: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
+
+@loyalty_api.route('/evaluate-rules/latency', methods=['GET'])
+def api_evaluate_rules_latency():
+    """API pour consulter la latence de l'évaluation des règles au scan de ticket"""
+    try:
+        return jsonify({
+            'success': True,
+            'latency': loyalty_manager.get_client_evaluation_latency()
+        })
+    
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération de la latence: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
+
+@loyalty_api.route('/db/pool', methods=['GET'])
+def api_db_pool_stats():
+    """API pour consulter les statistiques du pool de connexions SQLite"""
+    try:
+        return jsonify({
+            'success': True,
+            'pool': get_pool_stats()
+        })
+    
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération des statistiques du pool: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
+
+@loyalty_api.route('/db/cache', methods=['GET'])
+def api_query_cache_stats():
+    """API pour consulter les statistiques du cache des requêtes (taux de succès, taille)"""
+    try:
+        return jsonify({
+            'success': True,
+            'cache': get_query_cache_stats()
+        })
+    
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération des statistiques du cache: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
+
+@loyalty_api.route('/db/mirror', methods=['GET'])
+def api_analytics_mirror_status():
+    """API pour consulter l'état du miroir analytique (backend, retard, volumes copiés)"""
+    try:
+        return jsonify({
+            'success': True,
+            'mirror': get_mirror_status(DEFAULT_DB_PATH)
+        })
+    
+    except Exception as e:
+        logger.error(f"Erreur lors de la récupération de l'état du miroir analytique: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
+
+@loyalty_api.route('/db/mirror/refresh', methods=['POST'])
+def api_refresh_analytics_mirror():
+    """API pour rafraîchir le miroir analytique (full: recopie complète, verify: comparaison des mois)"""
+    try:
+        data = request.json or {}
+        
+        result = refresh_mirror(
+            DEFAULT_DB_PATH,
+            full=bool(data.get('full', False)),
+            verify=bool(data.get('verify', False))
+        )
+        
+        return jsonify(result)
+    
+    except Exception as e:
+        logger.error(f"Erreur lors du rafraîchissement du miroir analytique: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
+
 @loyalty_api.route('/check-expired-offers', methods=['POST'])
 def api_check_expired_offers():
     """API pour vérifier les offres expirées"""
@@ -0,0 +1,476 @@
+"""
+Module des statistiques clients matérialisées
+
+Ce module maintient la table client_stats, qui conserve pour chaque client les
+agrégats d'achat utilisés par les règles de fidélité, les fiches client et le
+clustering: nombre d'achats et montants sur 30/90/365 jours et depuis l'inscription,
+première et dernière visite, catégorie favorite.
+
+La table est mise à jour par des triggers à chaque écriture sur les transactions.
+Les fenêtres glissantes vieillissent avec le temps: refresh() les recalcule
+(tâche planifiée quotidienne). La catégorie favorite, qui dépend de tout l'historique
+d'achats du client, n'est pas maintenue par les triggers: refresh() la recalcule avec
+les fenêtres, et refresh_favourite_categories() pour les clients d'un lot de tickets.
+
+Le module maintient aussi clients.jour_anniversaire (date de naissance au format
+MMJJ, indexée), qui permet de trouver les anniversaires à venir par une recherche
+de plage sur l'index plutôt qu'un strftime() sur chaque client.
+"""
+
+import sqlite3
+import logging
+import time
+from datetime import datetime, timedelta
+
+try:
+    from modules.db_pool import get_connection
+except ImportError:
+    from db_pool import get_connection
+
+# Configuration du logging
+logger = logging.getLogger(__name__)
+
+# Fenêtres glissantes standard (en jours)
+STATS_WINDOWS = (30, 90, 365)
+
+CLIENT_STATS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS client_stats (
+        client_id INTEGER PRIMARY KEY,
+        nb_achats_30j INTEGER DEFAULT 0,
+        montant_30j REAL DEFAULT 0,
+        nb_achats_90j INTEGER DEFAULT 0,
+        montant_90j REAL DEFAULT 0,
+        nb_achats_365j INTEGER DEFAULT 0,
+        montant_365j REAL DEFAULT 0,
+        nb_achats_total INTEGER DEFAULT 0,
+        montant_total REAL DEFAULT 0,
+        premiere_visite DATETIME,
+        derniere_visite DATETIME,
+        categorie_favorite_id INTEGER,
+        date_calcul DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (client_id) REFERENCES clients(client_id)
+    )
+'''
+
+
+def _favourite_category_query(client_expression):
+    """
+    Construit la sous-requête de la catégorie la plus achetée (en montant) par un client.
+
+    Args:
+        client_expression (str): Expression SQL de l'identifiant client
+
+    Returns:
+        str: Sous-requête SQL
+    """
+    return f'''(
+        SELECT p.categorie_id
+        FROM transactions tf
+        JOIN details_transactions dtf ON tf.transaction_id = dtf.transaction_id
+        JOIN produits p ON dtf.produit_id = p.produit_id
+        WHERE tf.client_id = {client_expression}
+        GROUP BY p.categorie_id
+        ORDER BY SUM(dtf.montant_ligne) DESC
+        LIMIT 1
+    )'''
+
+
+def _recompute_query(client_filter):
+    """
+    Construit la requête recalculant entièrement les statistiques de clients.
+
+    Args:
+        client_filter (str): Condition SQL sur t.client_id
+
+    Returns:
+        str: Requête INSERT OR REPLACE ... SELECT
+    """
+    window_columns = []
+    for days in STATS_WINDOWS:
+        window_columns.append(
+            f"SUM(CASE WHEN t.date_transaction >= date('now', '-{days} days') THEN 1 ELSE 0 END)"
+        )
+        window_columns.append(
+            f"SUM(CASE WHEN t.date_transaction >= date('now', '-{days} days') THEN t.montant_total ELSE 0 END)"
+        )
+
+    return f'''
+        INSERT OR REPLACE INTO client_stats (
+            client_id,
+            nb_achats_30j, montant_30j, nb_achats_90j, montant_90j, nb_achats_365j, montant_365j,
+            nb_achats_total, montant_total, premiere_visite, derniere_visite,
+            categorie_favorite_id, date_calcul
+        )
+        SELECT
+            t.client_id,
+            {', '.join(window_columns)},
+            COUNT(*),
+            COALESCE(SUM(t.montant_total), 0),
+            MIN(t.date_transaction),
+            MAX(t.date_transaction),
+            {_favourite_category_query('t.client_id')},
+            datetime('now')
+        FROM transactions t
+        WHERE {client_filter}
+        GROUP BY t.client_id
+    '''
+
+
+def _window_increment(days):
+    """Expression SQL incrémentant une fenêtre si la nouvelle transaction en fait partie."""
+    return f"CASE WHEN NEW.date_transaction >= date('now', '-{days} days') THEN 1 ELSE 0 END"
+
+
+def _window_amount(days):
+    """Expression SQL du montant ajouté à une fenêtre par la nouvelle transaction."""
+    return f"CASE WHEN NEW.date_transaction >= date('now', '-{days} days') THEN NEW.montant_total ELSE 0 END"
+
+
+# Triggers de maintenance de client_stats
+CLIENT_STATS_TRIGGERS = {
+    # Nouvelle transaction: mise à jour incrémentale, sans relire l'historique du client
+    'client_stats_transaction_insert': f'''
+        CREATE TRIGGER IF NOT EXISTS client_stats_transaction_insert
+        AFTER INSERT ON transactions
+        WHEN NEW.client_id IS NOT NULL
+        BEGIN
+            INSERT INTO client_stats (
+                client_id,
+                nb_achats_30j, montant_30j, nb_achats_90j, montant_90j, nb_achats_365j, montant_365j,
+                nb_achats_total, montant_total, premiere_visite, derniere_visite, date_calcul
+            )
+            VALUES (
+                NEW.client_id,
+                {_window_increment(30)}, {_window_amount(30)},
+                {_window_increment(90)}, {_window_amount(90)},
+                {_window_increment(365)}, {_window_amount(365)},
+                1, NEW.montant_total, NEW.date_transaction, NEW.date_transaction, datetime('now')
+            )
+            ON CONFLICT(client_id) DO UPDATE SET
+                nb_achats_30j = nb_achats_30j + excluded.nb_achats_30j,
+                montant_30j = montant_30j + excluded.montant_30j,
+                nb_achats_90j = nb_achats_90j + excluded.nb_achats_90j,
+                montant_90j = montant_90j + excluded.montant_90j,
+                nb_achats_365j = nb_achats_365j + excluded.nb_achats_365j,
+                montant_365j = montant_365j + excluded.montant_365j,
+                nb_achats_total = nb_achats_total + 1,
+                montant_total = montant_total + excluded.montant_total,
+                premiere_visite = MIN(COALESCE(premiere_visite, excluded.premiere_visite), excluded.premiere_visite),
+                derniere_visite = MAX(COALESCE(derniere_visite, excluded.derniere_visite), excluded.derniere_visite),
+                date_calcul = excluded.date_calcul;
+        END
+    ''',
+    # Modification d'une transaction: recalcul complet des clients concernés
+    'client_stats_transaction_update': f'''
+        CREATE TRIGGER IF NOT EXISTS client_stats_transaction_update
+        AFTER UPDATE OF client_id, date_transaction, montant_total ON transactions
+        BEGIN
+            DELETE FROM client_stats WHERE client_id IN (OLD.client_id, NEW.client_id);
+            {_recompute_query('t.client_id IN (OLD.client_id, NEW.client_id)')};
+        END
+    ''',
+    'client_stats_transaction_delete': f'''
+        CREATE TRIGGER IF NOT EXISTS client_stats_transaction_delete
+        AFTER DELETE ON transactions
+        BEGIN
+            DELETE FROM client_stats WHERE client_id = OLD.client_id;
+            {_recompute_query('t.client_id = OLD.client_id')};
+        END
+    '''
+}
+
+# Anciens triggers de client_stats, supprimés des bases existantes
+# (client_stats_detail_insert recalculait la catégorie favorite sur tout l'historique
+# du client à chaque ligne de ticket insérée)
+OBSOLETE_CLIENT_STATS_TRIGGERS = ('client_stats_detail_insert',)
+
+
+# Triggers de maintenance de clients.jour_anniversaire
+BIRTHDAY_KEY_TRIGGERS = {
+    'clients_jour_anniversaire_insert': '''
+        CREATE TRIGGER IF NOT EXISTS clients_jour_anniversaire_insert
+        AFTER INSERT ON clients
+        BEGIN
+            UPDATE clients
+            SET jour_anniversaire = CAST(strftime('%m%d', NEW.date_naissance) AS INTEGER)
+            WHERE client_id = NEW.client_id;
+        END
+    ''',
+    'clients_jour_anniversaire_update': '''
+        CREATE TRIGGER IF NOT EXISTS clients_jour_anniversaire_update
+        AFTER UPDATE OF date_naissance ON clients
+        BEGIN
+            UPDATE clients
+            SET jour_anniversaire = CAST(strftime('%m%d', NEW.date_naissance) AS INTEGER)
+            WHERE client_id = NEW.client_id;
+        END
+    '''
+}
+
+
+def ensure_birthday_key(conn, commit=True):
+    """
+    Ajoute la colonne indexée clients.jour_anniversaire et ses triggers s'ils sont absents.
+
+    Args:
+        conn (sqlite3.Connection): Connexion à la base de données
+        commit (bool): Valider la transaction (False: l'appelant la valide, comme migrate())
+    """
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(clients)")]
+
+    if 'jour_anniversaire' not in columns:
+        conn.execute("ALTER TABLE clients ADD COLUMN jour_anniversaire INTEGER")
+        conn.execute("UPDATE clients SET jour_anniversaire = CAST(strftime('%m%d', date_naissance) AS INTEGER)")
+        logger.info("Colonne clients.jour_anniversaire créée et initialisée")
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clients_jour_anniversaire ON clients(jour_anniversaire)")
+    for trigger_sql in BIRTHDAY_KEY_TRIGGERS.values():
+        conn.execute(trigger_sql)
+
+    if commit:
+        conn.commit()
+
+
+def birthday_condition(column, days):
+    """
+    Construit la condition « anniversaire dans les N prochains jours » sur jour_anniversaire.
+
+    La fenêtre part de la date du jour (UTC, comme date('now') dans SQLite) et peut
+    chevaucher la fin de l'année, auquel cas elle est découpée en deux plages.
+
+    Args:
+        column (str): Colonne SQL contenant le jour d'anniversaire (MMJJ)
+        days (int): Nombre de jours de la fenêtre
+
+    Returns:
+        tuple: (condition SQL, paramètres)
+    """
+    today = datetime.utcnow().date()
+
+    if days >= 365:
+        return f"{column} IS NOT NULL", []
+
+    start = int(today.strftime('%m%d'))
+    end = int((today + timedelta(days=days)).strftime('%m%d'))
+
+    if start <= end:
+        return f"{column} BETWEEN ? AND ?", [start, end]
+
+    return f"({column} >= ? OR {column} <= ?)", [start, end]
+
+
+def ensure_client_stats(conn, commit=True):
+    """
+    Crée la table client_stats et ses triggers s'ils sont absents.
+
+    La table est initialisée à partir des transactions existantes lors de sa création.
+
+    Args:
+        conn (sqlite3.Connection): Connexion à la base de données
+        commit (bool): Valider la transaction (False: l'appelant la valide, comme migrate())
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'client_stats'"
+    ).fetchone()
+
+    conn.execute(CLIENT_STATS_TABLE)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_client_stats_derniere_visite ON client_stats(derniere_visite)")
+    for trigger in OBSOLETE_CLIENT_STATS_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    for trigger_sql in CLIENT_STATS_TRIGGERS.values():
+        conn.execute(trigger_sql)
+
+    if not exists:
+        conn.execute(_recompute_query('t.client_id IS NOT NULL'))
+        logger.info("Table client_stats créée et initialisée")
+
+    if commit:
+        conn.commit()
+
+
+def update_favourite_categories(conn, client_ids=None, since_transaction_id=None):
+    """
+    Recalcule la catégorie favorite de clients, sans valider la transaction.
+
+    Étape différée de l'insertion des tickets: un ticket ou un lot de tickets coûte un
+    calcul par client concerné, et non un calcul par ligne de ticket.
+
+    Args:
+        conn (sqlite3.Connection): Connexion à la base de données
+        client_ids (list, optional): IDs des clients à recalculer
+        since_transaction_id (int, optional): Recalculer les clients ayant une transaction
+            d'identifiant supérieur (sans l'un ni l'autre, tous les clients)
+
+    Returns:
+        int: Nombre de clients recalculés
+    """
+    condition = '1'
+    params = []
+    if client_ids:
+        condition = f"client_id IN ({','.join(['?'] * len(client_ids))})"
+        params = list(client_ids)
+    elif since_transaction_id is not None:
+        condition = "client_id IN (SELECT client_id FROM transactions WHERE transaction_id > ?)"
+        params = [since_transaction_id]
+
+    cursor = conn.execute(f'''
+        UPDATE client_stats
+        SET categorie_favorite_id = {_favourite_category_query('client_stats.client_id')}
+        WHERE {condition}
+    ''', params)
+    return cursor.rowcount
+
+
+class ClientStatsManager:
+    """
+    Classe d'accès aux statistiques clients matérialisées.
+    """
+
+    def __init__(self, db_path='modules/fidelity_db.sqlite'):
+        """
+        Initialise le gestionnaire de statistiques clients.
+
+        Args:
+            db_path (str): Chemin vers la base de données SQLite
+        """
+        self.db_path = db_path
+
+    def _get_connection(self):
+        """
+        Emprunte une connexion au pool (à rendre avec close()).
+
+        Returns:
+            sqlite3.Connection: Connexion à la base de données
+        """
+        return get_connection(self.db_path, sqlite3.Row)
+
+    def refresh(self, client_ids=None):
+        """
+        Recalcule les statistiques (fenêtres glissantes comprises) de tous les clients
+        ou d'une liste de clients.
+
+        Args:
+            client_ids (list, optional): IDs des clients à recalculer. Si None, tous les clients.
+
+        Returns:
+            dict: Résultat de l'opération
+        """
+        conn = None
+        try:
+            conn = self._get_connection()
+            start_time = time.perf_counter()
+
+            if client_ids:
+                placeholders = ','.join(['?'] * len(client_ids))
+                conn.execute(f"DELETE FROM client_stats WHERE client_id IN ({placeholders})", client_ids)
+                cursor = conn.execute(_recompute_query(f"t.client_id IN ({placeholders})"), client_ids)
+            else:
+                conn.execute("DELETE FROM client_stats")
+                cursor = conn.execute(_recompute_query('t.client_id IS NOT NULL'))
+
+            clients_refreshed = cursor.rowcount
+            conn.commit()
+
+            duration_ms = int((time.perf_counter() - start_time) * 1000)
+            logger.info(f"Statistiques clients recalculées: {clients_refreshed} clients en {duration_ms} ms")
+
+            return {
+                'success': True,
+                'clients_refreshed': clients_refreshed,
+                'duration_ms': duration_ms
+            }
+
+        except Exception as e:
+            logger.error(f"Erreur lors du recalcul des statistiques clients: {str(e)}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def refresh_favourite_categories(self, client_ids=None, since_transaction_id=None):
+        """
+        Recalcule la catégorie favorite de clients, sans toucher aux autres agrégats.
+
+        Args:
+            client_ids (list, optional): IDs des clients à recalculer
+            since_transaction_id (int, optional): Recalculer les clients ayant une
+                transaction d'identifiant supérieur (sans l'un ni l'autre, tous les clients)
+
+        Returns:
+            dict: Résultat de l'opération
+        """
+        conn = None
+        try:
+            conn = self._get_connection()
+            start_time = time.perf_counter()
+
+            clients_refreshed = update_favourite_categories(conn, client_ids, since_transaction_id)
+            conn.commit()
+
+            duration_ms = int((time.perf_counter() - start_time) * 1000)
+            logger.info(f"Catégories favorites recalculées: {clients_refreshed} clients en {duration_ms} ms")
+
+            return {
+                'success': True,
+                'clients_refreshed': clients_refreshed,
+                'duration_ms': duration_ms
+            }
+
+        except Exception as e:
+            logger.error(f"Erreur lors du recalcul des catégories favorites: {str(e)}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def get_client_stats(self, client_id):
+        """
+        Récupère les statistiques matérialisées d'un client.
+
+        Args:
+            client_id (int): ID du client
+
+        Returns:
+            dict: Statistiques du client (vide si le client n'a aucune transaction)
+        """
+        conn = self._get_connection()
+        try:
+            row = conn.execute("SELECT * FROM client_stats WHERE client_id = ?", (client_id,)).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row else {}
+
+    def get_clustering_features(self):
+        """
+        Construit le tableau de variables client pour le clustering à partir de client_stats.
+
+        Returns:
+            pandas.DataFrame: Une ligne par client avec récence, fréquence et montants
+        """
+        import pandas as pd
+
+        conn = self._get_connection()
+        try:
+            df = pd.read_sql_query('''
+                SELECT
+                    cs.client_id,
+                    cs.nb_achats_30j, cs.montant_30j,
+                    cs.nb_achats_90j, cs.montant_90j,
+                    cs.nb_achats_365j, cs.montant_365j,
+                    cs.nb_achats_total, cs.montant_total,
+                    CASE WHEN cs.nb_achats_total > 0 THEN cs.montant_total / cs.nb_achats_total ELSE 0 END as panier_moyen,
+                    CAST(julianday('now') - julianday(cs.derniere_visite) AS INTEGER) as jours_depuis_derniere_visite,
+                    CAST(julianday('now') - julianday(cs.premiere_visite) AS INTEGER) as anciennete_jours,
+                    cs.categorie_favorite_id
+                FROM client_stats cs
+                JOIN clients c ON cs.client_id = c.client_id
+            ''', conn)
+        finally:
+            conn.close()
+        return df
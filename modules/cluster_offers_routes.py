@@ -8,6 +8,8 @@ from datetime import datetime, timedelta
 import sqlite3
 import pandas as pd
 from modules.loyalty_manager import LoyaltyManager, RewardManager
+from modules.offer_codes import offer_code_sql, execute_with_code_retry
+from modules.db_pool import get_connection, DEFAULT_DB_PATH
 import logging
 
 # Classe ClusterOfferGenerator qui utilise le modèle d'intelligence artificielle
@@ -199,10 +201,9 @@ cluster_offers = Blueprint('cluster_offers', __name__)
 offer_generator = ClusterOfferGenerator()
 
 # Fonction utilitaire pour se connecter à la base de données
-def get_db_connection(db_path='modules/fidelity_db.sqlite'):
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+# (connexion du pool: pragmas communs, écritures invalidées dans le cache des requêtes)
+def get_db_connection(db_path=DEFAULT_DB_PATH):
+    return get_connection(db_path, sqlite3.Row)
 
 @cluster_offers.route('/api/generate_cluster_offer', methods=['POST'])
 def api_generate_cluster_offer():
@@ -291,8 +292,10 @@ def api_preview_cluster_offers():
                 elif action_type == 'offre_cadeau':
                     # Récupérer le nom du cadeau
                     conn = get_db_connection()
-                    reward = conn.execute('SELECT nom FROM recompenses WHERE recompense_id = ?', (gift_id,)).fetchone()
-                    conn.close()
+                    try:
+                        reward = conn.execute('SELECT nom FROM recompenses WHERE recompense_id = ?', (gift_id,)).fetchone()
+                    finally:
+                        conn.close()
                     
                     reward_name = reward['nom'] if reward else "cadeau"
                     description = f"Offre d'un {reward_name}"
@@ -518,61 +521,58 @@ def create_cluster_offers():
             
             # Créer une règle de fidélité temporaire pour ce cluster
             conn = get_db_connection()
-            
-            # Préparer les paramètres de la règle
-            regle_nom = f"Offre cluster {cluster_id} - {datetime.now().strftime('%Y-%m-%d')}"
-            regle_description = f"Règle générée automatiquement pour le cluster {cluster_id} du clustering {clustering_id}"
-            
-            # Insérer la règle
-            cursor = conn.execute('''
-                INSERT INTO regles_fidelite (
-                    nom, description, type_regle, condition_valeur, 
-                    action_type, action_value, recompense_id,
-                    est_active, priorite, date_creation
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (
-                regle_nom,
-                regle_description,
-                'cluster_specific',  # Type spécifique pour les règles de cluster
-                str(cluster_id),     # L'ID du cluster comme valeur de condition
-                action_type,
-                action_value,
-                gift_id if action_type == 'offre_cadeau' else None,
-                1,  # Règle active
-                10  # Priorité moyenne
-            ))
-            
-            regle_id = cursor.lastrowid
-            
-            # Récupérer les clients de ce cluster
-            clients = df[df[cluster_col] == cluster_id]['client_id'].unique()
-            
-            # Créer une offre pour chaque client
-            for client_id in clients:
-                conn.execute('''
-                    INSERT INTO offres_client (
-                        client_id, regle_id, recompense_id, date_generation,
-                        date_expiration, statut, commentaire
-                    ) VALUES (?, ?, ?, CURRENT_TIMESTAMP, ?, 'generee', ?)
+            try:
+                # Préparer les paramètres de la règle
+                regle_nom = f"Offre cluster {cluster_id} - {datetime.now().strftime('%Y-%m-%d')}"
+                regle_description = f"Règle générée automatiquement pour le cluster {cluster_id} du clustering {clustering_id}"
+                
+                # Insérer la règle
+                cursor = conn.execute('''
+                    INSERT INTO regles_fidelite (
+                        nom, description, type_regle, condition_valeur, 
+                        action_type, action_value, recompense_id,
+                        est_active, priorite, date_creation
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
                 ''', (
-                    client_id,
-                    regle_id,
+                    regle_nom,
+                    regle_description,
+                    'cluster_specific',  # Type spécifique pour les règles de cluster
+                    str(cluster_id),     # L'ID du cluster comme valeur de condition
+                    action_type,
+                    action_value,
                     gift_id if action_type == 'offre_cadeau' else None,
-                    expiration_date,
-                    message if message else f"Offre spéciale basée sur votre profil client"
+                    1,  # Règle active
+                    10  # Priorité moyenne
                 ))
                 
-                offers_created += 1
-            
-            # Générer des codes uniques pour toutes les nouvelles offres
-            conn.execute('''
-                UPDATE offres_client
-                SET code_unique = 'OF-' || offre_id || '-' || substr(hex(randomblob(4)), 1, 8)
-                WHERE code_unique IS NULL
-            ''')
-            
-            conn.commit()
-            conn.close()
+                regle_id = cursor.lastrowid
+                
+                # Récupérer les clients de ce cluster
+                clients = df[df[cluster_col] == cluster_id]['client_id'].unique()
+                
+                # Créer une offre pour chaque client
+                for client_id in clients:
+                    execute_with_code_retry(conn, f'''
+                        INSERT INTO offres_client (
+                            client_id, regle_id, recompense_id, date_generation,
+                            date_expiration, statut, code_unique, commentaire
+                        ) VALUES (?, ?, ?, CURRENT_TIMESTAMP, ?, 'generee', {offer_code_sql('?', '?')}, ?)
+                    ''', (
+                        client_id,
+                        regle_id,
+                        gift_id if action_type == 'offre_cadeau' else None,
+                        expiration_date,
+                        regle_id,
+                        client_id,
+                        message if message else f"Offre spéciale basée sur votre profil client"
+                    ))
+                    
+                    offers_created += 1
+                
+                conn.commit()
+            finally:
+                # Rend la connexion au pool, qui annule la transaction si elle n'est pas validée
+                conn.close()
         
         # Message de succès
         flash(f'{offers_created} offres créées pour {clusters_processed} clusters', 'success')
@@ -1,13 +1,114 @@
 import sqlite3
 import os
+import time
 import pandas as pd
 import logging
 from typing import Optional, List, Dict, Any, Tuple
 
+try:
+    from modules.db_pool import get_connection
+    from modules.query_cache import get_query_cache
+except ImportError:
+    from db_pool import get_connection
+    from query_cache import get_query_cache
+
 # Configuration du logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Tables alimentées par import CSV: colonnes insérées et colonnes obligatoires
+CSV_IMPORT_TABLES = {
+    'tickets': {
+        'columns': ['date_achat', 'heure_achat', 'magasin_id', 'montant_total', 'moyen_paiement', 'numero_ticket'],
+        'required': ['date_achat', 'magasin_id', 'montant_total']
+    },
+    'articles': {
+        'columns': ['ticket_id', 'nom_article', 'quantite', 'prix_unitaire', 'categorie_id', 'code_barre'],
+        'required': ['ticket_id', 'nom_article', 'quantite', 'prix_unitaire']
+    },
+    'magasins': {
+        'columns': ['nom', 'adresse', 'ville', 'code_postal', 'enseigne', 'type'],
+        'required': ['nom']
+    },
+    'categories': {
+        'columns': ['nom', 'description'],
+        'required': ['nom']
+    }
+}
+
+# Lignes lues, insérées et validées ensemble lors d'un import CSV
+IMPORT_CHUNK_SIZE = 50000
+
+# Taille des blocs lus par le moteur pyarrow (en octets)
+PYARROW_BLOCK_SIZE = 8 * 1024 * 1024
+
+# Lignes lues par appel à fetchmany lors du chargement d'un DataFrame
+FETCH_BATCH_SIZE = 10000
+
+
+def fetch_dataframe(conn, query: str, params=(), batch_size: int = FETCH_BATCH_SIZE) -> pd.DataFrame:
+    """
+    Exécute une requête et construit le DataFrame colonne par colonne
+    
+    Les lignes sont lues par lots avec fetchmany et réparties directement dans une liste
+    par colonne, sans dictionnaire intermédiaire par ligne.
+    
+    Args:
+        conn: Connexion à la base de données
+        query: Requête SQL
+        params: Paramètres de la requête
+        batch_size: Nombre de lignes lues par appel à fetchmany
+        
+    Returns:
+        DataFrame pandas du résultat (vide avec ses colonnes si aucune ligne)
+    """
+    cursor = conn.execute(query, params)
+    columns = [desc[0] for desc in cursor.description]
+    values = [[] for _ in columns]
+    
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for column_values, batch_values in zip(values, zip(*rows)):
+            column_values.extend(batch_values)
+    
+    return pd.DataFrame(dict(zip(columns, values)), columns=columns)
+
+
+def transactions_with_articles_query(transactions_query: str, order_by: str = 'date_transaction DESC') -> str:
+    """
+    Construit la requête transactions × articles à partir d'une requête de transactions
+    
+    Chaque transaction sélectionnée (colonne id) est jointe à ses lignes d'articles, une ligne
+    par article; une transaction sans article donne une ligne aux colonnes d'articles vides.
+    Les filtres de la requête de transactions (y compris produit ou catégorie) ne
+    restreignent que les transactions: tous leurs articles sont retournés.
+    
+    Args:
+        transactions_query: Requête de sélection des transactions, sans ORDER BY ni LIMIT
+        order_by: Ordre des transactions (colonnes de la requête de transactions)
+        
+    Returns:
+        Requête SQL d'une ligne par transaction et par article
+    """
+    return f"""
+    WITH selection AS ({transactions_query})
+    SELECT 
+        s.*,
+        p.nom as nom_article, 
+        dt.quantite, 
+        dt.prix_unitaire, 
+        dt.remise_pourcentage, 
+        dt.montant_ligne, 
+        cp.nom as categorie
+    FROM selection s
+    LEFT JOIN details_transactions dt ON dt.transaction_id = s.id
+    LEFT JOIN produits p ON dt.produit_id = p.produit_id
+    LEFT JOIN categories_produits cp ON p.categorie_id = cp.categorie_id
+    ORDER BY s.{order_by}, s.id, dt.detail_id
+    """
+
 class DatabaseManager:
     """Classe pour gérer les connexions et opérations avec la base de données SQLite"""
     
@@ -119,12 +220,10 @@ class DatabaseManager:
         cursor.execute('CREATE INDEX idx_articles_categorie ON articles(categorie_id)')
     
     def get_connection(self):
-        """Obtient une connexion à la base de données"""
+        """Emprunte une connexion au pool (à rendre avec close())"""
         try:
-            conn = sqlite3.connect(self.db_path)
             # Pour avoir les résultats sous forme de dictionnaire
-            conn.row_factory = sqlite3.Row
-            return conn
+            return get_connection(self.db_path, sqlite3.Row)
         except sqlite3.Error as e:
             self.logger.error(f"Erreur de connexion à la base de données: {e}")
             raise e
@@ -133,6 +232,9 @@ class DatabaseManager:
         """
         Exécute une requête SQL et retourne les résultats
         
+        Les résultats des requêtes de lecture sont servis par le cache des requêtes tant
+        que les tables lues n'ont pas été modifiées (voir query_cache).
+        
         Args:
             query: Requête SQL à exécuter
             params: Paramètres pour la requête
@@ -143,22 +245,26 @@ class DatabaseManager:
         conn = None
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
             
-            # Récupérer les noms de colonnes
-            column_names = [desc[0] for desc in cursor.description] if cursor.description else []
-            
-            # Convertir les résultats en liste de dictionnaires
-            results = []
-            for row in cursor.fetchall():
-                results.append(dict(zip(column_names, row)))
+            def run_query():
+                cursor = conn.cursor()
+                
+                if params:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
+                
+                # Récupérer les noms de colonnes
+                column_names = [desc[0] for desc in cursor.description] if cursor.description else []
+                
+                # Convertir les résultats en liste de dictionnaires
+                results = []
+                for row in cursor.fetchall():
+                    results.append(dict(zip(column_names, row)))
+                
+                return results
             
-            return results
+            return get_query_cache().get_or_compute(conn, query, params, run_query)
         except sqlite3.Error as e:
             self.logger.error(f"Erreur lors de l'exécution de la requête: {e}")
             self.logger.error(f"Requête: {query}")
@@ -335,15 +441,15 @@ class DatabaseManager:
         """
         return self.get_articles_dataframe()
     
-    def get_transactions(self, filters: Dict[str, Any] = None) -> pd.DataFrame:
+    def _transactions_query(self, filters: Dict[str, Any] = None) -> Tuple[str, List[Any]]:
         """
-        Récupère les transactions avec les informations des clients depuis la base de données
+        Construit la requête filtrée des transactions avec infos client, sans tri ni limite
         
         Args:
-            filters: Dictionnaire de filtres à appliquer (ex: {'date_debut': '2023-01-01', 'date_fin': '2023-01-31', 'genre': 'homme'})
+            filters: Dictionnaire de filtres à appliquer
             
         Returns:
-            DataFrame pandas contenant les transactions avec infos client
+            Tuple (requête SQL, paramètres)
         """
         base_query = """
         SELECT 
@@ -448,6 +554,19 @@ class DatabaseManager:
         if filters and (filters.get('categorie_id', '') or filters.get('produit_id', '')):
             base_query += " GROUP BY t.transaction_id"
         
+        return base_query, params
+    
+    def get_transactions(self, filters: Dict[str, Any] = None) -> pd.DataFrame:
+        """
+        Récupère les transactions avec les informations des clients depuis la base de données
+        
+        Args:
+            filters: Dictionnaire de filtres à appliquer (ex: {'date_debut': '2023-01-01', 'date_fin': '2023-01-31', 'genre': 'homme'})
+            
+        Returns:
+            DataFrame pandas contenant les transactions avec infos client
+        """
+        base_query, params = self._transactions_query(filters)
         base_query += " ORDER BY t.date_transaction DESC LIMIT 5000"
         
         try:
@@ -479,113 +598,47 @@ class DatabaseManager:
         """
         Récupère les transactions avec leurs articles, enrichies avec les informations client
         
+        Les transactions filtrées et leurs articles sont lus en une seule requête jointe,
+        sans limite de nombre de transactions: une ligne par transaction et par article.
+        
         Args:
             filters: Dictionnaire de filtres à appliquer
             
         Returns:
             DataFrame pandas contenant les transactions avec leurs articles et les infos client
         """
-        # Récupérer d'abord les transactions
-        transactions_df = self.get_transactions(filters)
-        
-        if transactions_df.empty:
-            return pd.DataFrame()
-        
-        # Récupérer les identifiants de transaction
-        transaction_ids = transactions_df['id'].tolist()
-        
-        # Requête pour obtenir les articles
-        articles_query = """
-        SELECT 
-            dt.transaction_id, 
-            p.nom as nom_article, 
-            dt.quantite, 
-            dt.prix_unitaire, 
-            dt.remise_pourcentage, 
-            dt.montant_ligne, 
-            cp.nom as categorie
-        FROM details_transactions dt
-        JOIN produits p ON dt.produit_id = p.produit_id
-        LEFT JOIN categories_produits cp ON p.categorie_id = cp.categorie_id
-        WHERE dt.transaction_id IN ({})
-        """.format(','.join(['?' for _ in transaction_ids]))
+        transactions_query, params = self._transactions_query(filters)
+        query = transactions_with_articles_query(transactions_query)
         
+        conn = None
         try:
-            # Exécuter la requête pour les articles
-            articles_results = self.execute_query(articles_query, tuple(transaction_ids))
-            
-            if not articles_results:
-                # Pas d'articles trouvés, retourner les transactions telles quelles
-                return transactions_df
+            conn = self.get_connection()
+            df = fetch_dataframe(conn, query, tuple(params))
             
-            # Convertir les résultats des articles en DataFrame
-            articles_df = pd.DataFrame(articles_results)
+            if df.empty:
+                return pd.DataFrame()
             
             # Convertir les types de données
-            if 'prix_unitaire' in articles_df.columns:
-                articles_df['prix_unitaire'] = pd.to_numeric(articles_df['prix_unitaire'])
+            df['date_transaction'] = pd.to_datetime(df['date_transaction'])
+            for column in ('montant_total', 'age', 'quantite', 'prix_unitaire', 'montant_ligne'):
+                df[column] = pd.to_numeric(df[column])
             
-            if 'quantite' in articles_df.columns:
-                articles_df['quantite'] = pd.to_numeric(articles_df['quantite'])
-            
-            if 'montant_ligne' in articles_df.columns:
-                articles_df['montant_ligne'] = pd.to_numeric(articles_df['montant_ligne'])
-            
-            # Créer un dictionnaire d'articles groupés par transaction_id
-            articles_grouped = articles_df.groupby('transaction_id')
-            
-            # Décomposer les transactions par article
-            decomposed_transactions = []
-            
-            for _, transaction in transactions_df.iterrows():
-                transaction_id = transaction['id']
-                
-                # Vérifier si cette transaction a des articles
-                if transaction_id in articles_grouped.groups:
-                    # Récupérer tous les articles de cette transaction
-                    transaction_articles = articles_grouped.get_group(transaction_id)
-                    
-                    for _, article in transaction_articles.iterrows():
-                        # Créer un dictionnaire pour cette ligne
-                        transaction_row = transaction.to_dict()
-                        
-                        # Ajouter les détails de l'article
-                        transaction_row.update({
-                            'nom_article': article['nom_article'],
-                            'quantite': article['quantite'],
-                            'prix_unitaire': article['prix_unitaire'],
-                            'remise_pourcentage': article['remise_pourcentage'],
-                            'montant_ligne': article['montant_ligne'],
-                            'categorie': article['categorie']
-                        })
-                        
-                        decomposed_transactions.append(transaction_row)
-                else:
-                    # Pas d'articles pour cette transaction
-                    transaction_row = transaction.to_dict()
-                    transaction_row.update({
-                        'nom_article': None,
-                        'quantite': None,
-                        'prix_unitaire': None,
-                        'remise_pourcentage': None,
-                        'montant_ligne': None,
-                        'categorie': None
-                    })
-                    decomposed_transactions.append(transaction_row)
-            
-            # Créer un nouveau DataFrame à partir des transactions décomposées
-            result_df = pd.DataFrame(decomposed_transactions)
-            
-            return result_df
+            return df
         
         except Exception as e:
             self.logger.error(f"Erreur lors de la récupération des transactions avec articles: {e}")
-            return transactions_df
+            return pd.DataFrame()
+        finally:
+            if conn:
+                conn.close()
     
     def import_csv_to_database(self, csv_file: str, table_type: str = 'tickets') -> Tuple[bool, str]:
         """
         Importe un fichier CSV dans la base de données
         
+        Le fichier est importé par blocs (voir import_csv_streaming): en cas d'échec, les blocs
+        déjà validés restent en base et le message indique le bloc de reprise.
+        
         Args:
             csv_file: Chemin vers le fichier CSV
             table_type: Type de table ('tickets', 'articles', 'magasins', 'categories')
@@ -593,97 +646,146 @@ class DatabaseManager:
         Returns:
             Tuple (succès, message)
         """
+        result = self.import_csv_streaming(csv_file, table_type)
+        
+        if not result['success']:
+            # Colonnes manquantes ou table inconnue: rien n'a été lu
+            if 'rows_imported' not in result:
+                return False, result['error']
+            if result['rows_imported']:
+                return False, (f"Erreur: {result['error']} ({result['rows_imported']} lignes importées, "
+                               f"reprise possible au bloc {result['resume_chunk']})")
+            return False, f"Erreur: {result['error']}"
+        
+        return True, f"Importation réussie dans la table {table_type} ({result['rows_imported']} lignes)"
+    
+    def _iter_csv_chunks(self, csv_file: str, columns: List[str], chunksize: int, skip_rows: int, engine: str):
+        """
+        Lit un fichier CSV par blocs de chunksize lignes, sans le charger en mémoire
+        
+        Args:
+            csv_file: Chemin vers le fichier CSV
+            columns: Colonnes à lire
+            chunksize: Nombre de lignes par bloc
+            skip_rows: Nombre de lignes de données à ignorer (reprise d'un import)
+            engine: 'c' (pandas) ou 'pyarrow'
+            
+        Yields:
+            DataFrame de chunksize lignes au plus
+        """
+        if engine == 'pyarrow':
+            import pyarrow.csv as pa_csv
+            
+            # Le lecteur pyarrow produit des lots de taille variable, redécoupés en blocs
+            # de chunksize lignes pour que les numéros de blocs de reprise restent valables
+            reader = pa_csv.open_csv(
+                csv_file,
+                read_options=pa_csv.ReadOptions(block_size=PYARROW_BLOCK_SIZE, skip_rows_after_names=skip_rows),
+                convert_options=pa_csv.ConvertOptions(include_columns=columns, strings_can_be_null=True)
+            )
+            pending = None
+            for batch in reader:
+                frame = batch.to_pandas()
+                pending = frame if pending is None else pd.concat([pending, frame], ignore_index=True)
+                while len(pending) >= chunksize:
+                    yield pending.iloc[:chunksize]
+                    pending = pending.iloc[chunksize:].reset_index(drop=True)
+            if pending is not None and len(pending):
+                yield pending
+            return
+        
+        skiprows = range(1, skip_rows + 1) if skip_rows else None
+        yield from pd.read_csv(csv_file, usecols=columns, chunksize=chunksize, skiprows=skiprows)
+    
+    def import_csv_streaming(self, csv_file: str, table_type: str = 'tickets', chunksize: int = IMPORT_CHUNK_SIZE,
+                             engine: str = 'c', start_chunk: int = 0, progress_callback=None) -> Dict[str, Any]:
+        """
+        Importe un fichier CSV par blocs, en mémoire constante quelle que soit sa taille
+        
+        Chaque bloc est lu, inséré avec executemany et validé dans sa propre transaction. Si un
+        bloc échoue, il est annulé et resume_chunk indique le bloc à passer en start_chunk pour
+        reprendre l'import sans réinsérer les blocs déjà validés.
+        
+        Args:
+            csv_file: Chemin vers le fichier CSV
+            table_type: Type de table ('tickets', 'articles', 'magasins', 'categories')
+            chunksize: Nombre de lignes par bloc
+            engine: Moteur de lecture, 'c' (pandas) ou 'pyarrow' (si installé)
+            start_chunk: Premier bloc à importer (reprise d'un import interrompu)
+            progress_callback: Fonction appelée après chaque bloc avec les statistiques de l'import
+            
+        Returns:
+            Dictionnaire avec le résultat et les statistiques de l'import
+        """
+        if table_type not in CSV_IMPORT_TABLES:
+            return {'success': False, 'error': f"Type de table inconnu: {table_type}"}
+        
+        table = CSV_IMPORT_TABLES[table_type]
+        
+        if engine == 'pyarrow':
+            try:
+                import pyarrow.csv  # noqa: F401
+            except ImportError:
+                self.logger.warning("pyarrow n'est pas installé, lecture du CSV avec le moteur pandas")
+                engine = 'c'
+        
+        stats = {
+            'success': True,
+            'table': table_type,
+            'rows_imported': 0,
+            'chunks_imported': 0,
+            'resume_chunk': start_chunk,
+            'duration_seconds': 0.0,
+            'rows_per_sec': 0.0
+        }
+        conn = None
+        
         try:
-            # Lire le fichier CSV
-            df = pd.read_csv(csv_file)
+            # Vérification des colonnes nécessaires sur l'en-tête du fichier
+            header = list(pd.read_csv(csv_file, nrows=0).columns)
+            if not all(col in header for col in table['required']):
+                return {'success': False, 'error': f"Colonnes manquantes. Colonnes requises: {', '.join(table['required'])}"}
+            
+            columns = [col for col in table['columns'] if col in header]
+            query = f"INSERT INTO {table_type} ({', '.join(table['columns'])}) VALUES ({', '.join('?' for _ in table['columns'])})"
             
             conn = self.get_connection()
-            cursor = conn.cursor()
+            start_time = time.perf_counter()
             
-            if table_type == 'tickets':
-                # Vérification des colonnes nécessaires
-                required_columns = ['date_achat', 'magasin_id', 'montant_total']
-                if not all(col in df.columns for col in required_columns):
-                    return False, f"Colonnes manquantes. Colonnes requises: {', '.join(required_columns)}"
+            for chunk in self._iter_csv_chunks(csv_file, columns, chunksize, start_chunk * chunksize, engine):
+                # Colonnes facultatives absentes à NULL, valeurs manquantes à None et
+                # types numpy convertis en types Python pour sqlite3
+                chunk = chunk.reindex(columns=table['columns']).astype(object)
+                rows = chunk.where(chunk.notna(), None).itertuples(index=False, name=None)
                 
-                # Insérer chaque ligne dans la table tickets
-                for _, row in df.iterrows():
-                    cursor.execute('''
-                    INSERT INTO tickets (date_achat, heure_achat, magasin_id, montant_total, moyen_paiement, numero_ticket)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (
-                        row['date_achat'], 
-                        row.get('heure_achat'), 
-                        row['magasin_id'], 
-                        row['montant_total'], 
-                        row.get('moyen_paiement'), 
-                        row.get('numero_ticket')
-                    ))
-            
-            elif table_type == 'articles':
-                # Vérification des colonnes nécessaires
-                required_columns = ['ticket_id', 'nom_article', 'quantite', 'prix_unitaire']
-                if not all(col in df.columns for col in required_columns):
-                    return False, f"Colonnes manquantes. Colonnes requises: {', '.join(required_columns)}"
-                
-                # Insérer chaque ligne dans la table articles
-                for _, row in df.iterrows():
-                    cursor.execute('''
-                    INSERT INTO articles (ticket_id, nom_article, quantite, prix_unitaire, categorie_id, code_barre)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (
-                        row['ticket_id'], 
-                        row['nom_article'], 
-                        row['quantite'], 
-                        row['prix_unitaire'], 
-                        row.get('categorie_id'), 
-                        row.get('code_barre')
-                    ))
-            
-            elif table_type == 'magasins':
-                # Vérification des colonnes nécessaires
-                required_columns = ['nom']
-                if not all(col in df.columns for col in required_columns):
-                    return False, f"Colonnes manquantes. Colonnes requises: {', '.join(required_columns)}"
+                try:
+                    conn.executemany(query, rows)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
                 
-                # Insérer chaque ligne dans la table magasins
-                for _, row in df.iterrows():
-                    cursor.execute('''
-                    INSERT INTO magasins (nom, adresse, ville, code_postal, enseigne, type)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (
-                        row['nom'], 
-                        row.get('adresse'), 
-                        row.get('ville'), 
-                        row.get('code_postal'), 
-                        row.get('enseigne'), 
-                        row.get('type')
-                    ))
-            
-            elif table_type == 'categories':
-                # Vérification des colonnes nécessaires
-                required_columns = ['nom']
-                if not all(col in df.columns for col in required_columns):
-                    return False, f"Colonnes manquantes. Colonnes requises: {', '.join(required_columns)}"
+                stats['rows_imported'] += len(chunk)
+                stats['chunks_imported'] += 1
+                stats['resume_chunk'] += 1
+                stats['duration_seconds'] = round(time.perf_counter() - start_time, 3)
+                stats['rows_per_sec'] = round(stats['rows_imported'] / max(time.perf_counter() - start_time, 1e-9), 1)
                 
-                # Insérer chaque ligne dans la table categories
-                for _, row in df.iterrows():
-                    cursor.execute('''
-                    INSERT INTO categories (nom, description)
-                    VALUES (?, ?)
-                    ''', (
-                        row['nom'], 
-                        row.get('description')
-                    ))
-            
-            else:
-                return False, f"Type de table inconnu: {table_type}"
-            
-            conn.commit()
-            conn.close()
+                self.logger.info(
+                    f"Import {table_type}: bloc {stats['resume_chunk'] - 1}, {stats['rows_imported']} lignes "
+                    f"({stats['rows_per_sec']:,.0f} lignes/s)"
+                )
+                if progress_callback:
+                    progress_callback(dict(stats))
             
-            return True, f"Importation réussie dans la table {table_type}"
+            return stats
         
         except Exception as e:
-            self.logger.error(f"Erreur lors de l'importation du fichier CSV: {e}")
-            return False, f"Erreur: {str(e)}"
\ No newline at end of file
+            self.logger.error(f"Erreur lors de l'importation du fichier CSV (bloc {stats['resume_chunk']}): {e}")
+            stats['success'] = False
+            stats['error'] = str(e)
+            return stats
+        
+        finally:
+            if conn is not None:
+                conn.close()
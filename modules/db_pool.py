@@ -0,0 +1,414 @@
+"""
+Pool de connexions SQLite
+
+Ce module fournit les connexions à la base de données de l'application: chaque thread
+réutilise ses propres connexions, ouvertes une seule fois avec les pragmas de POOL_SETTINGS
+(journal WAL, synchronous=NORMAL, mmap, cache, busy_timeout).
+
+Une connexion du pool s'utilise comme une connexion sqlite3 ordinaire: close() la rend au
+pool du thread après annulation de toute transaction en cours. Les instructions exécutées
+hors transaction et les commit sont retentés lorsque la base est verrouillée.
+
+Les écritures validées par une connexion du pool invalident les résultats en cache des
+tables modifiées (voir query_cache).
+
+Les statistiques du pool (ouvertures, réutilisations, attente, verrous) sont disponibles
+avec get_pool_stats().
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    from modules.query_cache import record_write, invalidate_tables
+except ImportError:
+    from query_cache import record_write, invalidate_tables
+
+# Configuration du logging
+logger = logging.getLogger(__name__)
+
+# Base de données de l'application
+DEFAULT_DB_PATH = 'modules/fidelity_db.sqlite'
+
+# Pragmas appliqués à l'ouverture de chaque connexion (dans cet ordre)
+POOL_SETTINGS = {
+    'busy_timeout': 5000,               # ms d'attente d'un verrou avant erreur
+    'journal_mode': 'WAL',              # lectures concurrentes pendant les écritures
+    'synchronous': 'NORMAL',            # sûr en WAL, sans fsync à chaque commit
+    'mmap_size': 256 * 1024 * 1024,     # lecture de la base par projection mémoire
+    'cache_size': -64000,               # cache de pages de 64 Mo par connexion
+    'temp_store': 'MEMORY'              # tables temporaires du moteur de règles en mémoire
+}
+
+# Connexions inactives conservées par thread et par base
+MAX_IDLE_PER_THREAD = 2
+
+# Nouvelles tentatives après « database is locked » et délai initial entre deux tentatives (en secondes)
+LOCK_RETRIES = 3
+LOCK_RETRY_DELAY = 0.05
+
+
+class PooledCursor(sqlite3.Cursor):
+    """
+    Curseur d'une connexion du pool (reprise sur verrou et suivi des écritures).
+    """
+
+    def execute(self, sql, parameters=()):
+        conn = self.connection
+        cursor = conn.pool._run_with_lock_retry(conn, super().execute, sql, parameters)
+        conn._track_write(sql)
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        conn = self.connection
+        cursor = conn.pool._run_with_lock_retry(conn, super().executemany, sql, seq_of_parameters)
+        conn._track_write(sql)
+        return cursor
+
+    def executescript(self, sql_script):
+        cursor = super().executescript(sql_script)
+        invalidate_tables(self.connection.db_path)
+        return cursor
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Connexion SQLite rendue au pool à sa fermeture.
+
+    execute, executemany et commit sont retentés si la base est verrouillée, lorsque
+    c'est sans risque: hors transaction ouverte pour les instructions, toujours pour
+    commit (la transaction reste active après un échec de COMMIT).
+
+    Les tables écrites sont invalidées dans le cache des requêtes à la validation de la
+    transaction, ou immédiatement hors transaction.
+    """
+
+    pool = None
+    db_path = None
+    # Tables écrites par la transaction en cours (None: schéma modifié)
+    _pending_tables = frozenset()
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or PooledCursor)
+
+    def execute(self, sql, parameters=()):
+        cursor = self.pool._run_with_lock_retry(self, super().execute, sql, parameters)
+        self._track_write(sql)
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        cursor = self.pool._run_with_lock_retry(self, super().executemany, sql, seq_of_parameters)
+        self._track_write(sql)
+        return cursor
+
+    def executescript(self, sql_script):
+        cursor = super().executescript(sql_script)
+        invalidate_tables(self.db_path)
+        return cursor
+
+    def commit(self):
+        result = self.pool._run_with_lock_retry(self, super().commit, retry_in_transaction=True)
+        self._flush_writes()
+        return result
+
+    def rollback(self):
+        self._pending_tables = frozenset()
+        return super().rollback()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # « with conn: » valide ou annule sans passer par commit() et rollback()
+        result = super().__exit__(exc_type, exc_value, traceback)
+        if exc_type is None:
+            self._flush_writes()
+        else:
+            self._pending_tables = frozenset()
+        return result
+
+    def _track_write(self, sql):
+        """Enregistre les tables modifiées par une instruction exécutée"""
+        if self._pending_tables is None:
+            return
+        tables = record_write(self, self.db_path, sql)
+        if tables is None:
+            self._pending_tables = None
+        elif tables:
+            self._pending_tables = self._pending_tables | tables
+        else:
+            return
+        if not self.in_transaction:
+            self._flush_writes()
+
+    def _flush_writes(self):
+        """Invalide dans le cache les tables écrites par la transaction validée"""
+        tables, self._pending_tables = self._pending_tables, frozenset()
+        if tables is None:
+            invalidate_tables(self.db_path)
+        elif tables:
+            invalidate_tables(self.db_path, tables)
+
+    def close(self):
+        """Rend la connexion au pool (elle reste ouverte pour le prochain emprunt du thread)."""
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    def discard(self):
+        """Ferme réellement la connexion."""
+        super().close()
+
+
+class ConnectionPool:
+    """
+    Pool de connexions SQLite par thread et par base de données.
+    """
+
+    def __init__(self, settings=None, max_idle=MAX_IDLE_PER_THREAD):
+        """
+        Initialise le pool.
+
+        Args:
+            settings (dict, optional): Pragmas appliqués à chaque connexion (POOL_SETTINGS par défaut)
+            max_idle (int): Connexions inactives conservées par thread et par base
+        """
+        self.settings = dict(POOL_SETTINGS if settings is None else settings)
+        self.max_idle = max_idle
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {
+            'checkouts': 0,
+            'connections_opened': 0,
+            'connections_reused': 0,
+            'connections_closed': 0,
+            'in_use': 0,
+            'wait_ms': 0.0,
+            'max_wait_ms': 0.0,
+            'lock_retries': 0,
+            'lock_wait_ms': 0.0,
+            'lock_failures': 0
+        }
+
+    def _idle_connections(self, db_path):
+        """Connexions inactives du thread courant pour une base"""
+        # Après un fork, les connexions héritées appartiennent au processus parent
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.pid = os.getpid()
+            self._local.idle = {}
+        return self._local.idle.setdefault(db_path, [])
+
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self._stats[key] += value
+
+    def _open(self, db_path):
+        """
+        Ouvre une connexion et lui applique les pragmas du pool.
+
+        Args:
+            db_path (str): Chemin vers la base de données SQLite
+
+        Returns:
+            PooledConnection: Nouvelle connexion
+        """
+        conn = sqlite3.connect(db_path, factory=PooledConnection)
+        conn.pool = self
+        conn.db_path = db_path
+        for pragma, value in self.settings.items():
+            try:
+                conn.execute(f"PRAGMA {pragma} = {value}")
+            except sqlite3.Error as e:
+                logger.warning(f"Pragma {pragma} non appliqué sur {db_path}: {str(e)}")
+        return conn
+
+    def get_connection(self, db_path=DEFAULT_DB_PATH, row_factory=None):
+        """
+        Emprunte une connexion du thread courant, ou en ouvre une nouvelle.
+
+        Args:
+            db_path (str): Chemin vers la base de données SQLite
+            row_factory (callable, optional): Fabrique de lignes (ex: sqlite3.Row)
+
+        Returns:
+            PooledConnection: Connexion à rendre avec close()
+        """
+        start_time = time.perf_counter()
+        idle = self._idle_connections(db_path)
+
+        if idle:
+            conn = idle.pop()
+            reused = 1
+        else:
+            conn = self._open(db_path)
+            reused = 0
+        conn.row_factory = row_factory
+
+        wait_ms = (time.perf_counter() - start_time) * 1000
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['connections_reused'] += reused
+            self._stats['connections_opened'] += 1 - reused
+            self._stats['in_use'] += 1
+            self._stats['wait_ms'] += wait_ms
+            self._stats['max_wait_ms'] = max(self._stats['max_wait_ms'], wait_ms)
+        return conn
+
+    def release(self, conn):
+        """
+        Rend une connexion au pool du thread courant.
+
+        La transaction en cours est annulée. Les connexions en excès, celles d'un autre
+        thread et celles devenues inutilisables sont fermées.
+
+        Args:
+            conn (PooledConnection): Connexion empruntée
+        """
+        idle = self._idle_connections(conn.db_path)
+        if conn in idle:
+            # Connexion déjà rendue (close() appelé deux fois): elle doit rester disponible
+            return
+
+        self._count(in_use=-1)
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.set_progress_handler(None, 0)
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        except sqlite3.Error:
+            # Connexion fermée, utilisée par un autre thread ou inutilisable
+            pass
+
+        self._count(connections_closed=1)
+        try:
+            conn.discard()
+        except sqlite3.Error:
+            pass
+
+    def _run_with_lock_retry(self, conn, method, *args, retry_in_transaction=False):
+        """
+        Exécute une méthode de la connexion, en la retentant si la base est verrouillée.
+
+        Args:
+            conn (PooledConnection): Connexion concernée
+            method (callable): Méthode à exécuter
+            *args: Arguments de la méthode
+            retry_in_transaction (bool): Retenter même si une transaction est ouverte
+
+        Returns:
+            Résultat de la méthode
+        """
+        retriable = retry_in_transaction or not conn.in_transaction
+        delay = LOCK_RETRY_DELAY
+
+        for attempt in range(LOCK_RETRIES + 1):
+            try:
+                return method(*args)
+            except sqlite3.OperationalError as e:
+                locked = 'locked' in str(e) or 'busy' in str(e)
+                if not (locked and retriable):
+                    raise
+                if attempt == LOCK_RETRIES:
+                    self._count(lock_failures=1)
+                    raise
+                time.sleep(delay)
+                self._count(lock_retries=1, lock_wait_ms=delay * 1000)
+                delay *= 2
+
+    def close_idle(self, db_path=None):
+        """
+        Ferme les connexions inactives du thread courant.
+
+        Args:
+            db_path (str, optional): Base concernée (toutes les bases par défaut)
+        """
+        for path, idle in getattr(self._local, 'idle', {}).items():
+            if db_path is not None and path != db_path:
+                continue
+            while idle:
+                idle.pop().discard()
+                self._count(connections_closed=1)
+
+    def stats(self):
+        """
+        Retourne les statistiques du pool.
+
+        Returns:
+            dict: Emprunts, ouvertures, réutilisations, attente (en ms) et verrous
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats['avg_wait_ms'] = round(stats['wait_ms'] / stats['checkouts'], 3) if stats['checkouts'] else 0.0
+        stats['wait_ms'] = round(stats['wait_ms'], 1)
+        stats['max_wait_ms'] = round(stats['max_wait_ms'], 3)
+        stats['lock_wait_ms'] = round(stats['lock_wait_ms'], 1)
+        stats['settings'] = dict(self.settings)
+        return stats
+
+
+# Pool partagé par l'application
+_pool = ConnectionPool()
+
+
+def configure_pool(settings=None, max_idle=None):
+    """
+    Configure le pool partagé, à appeler une fois au démarrage de l'application.
+
+    Les pragmas s'appliquent aux connexions ouvertes après l'appel.
+
+    Args:
+        settings (dict, optional): Pragmas à modifier ou ajouter (valeur None pour en retirer un)
+        max_idle (int, optional): Connexions inactives conservées par thread et par base
+    """
+    if _pool.stats()['connections_opened']:
+        logger.warning("Pool de connexions reconfiguré après l'ouverture de connexions")
+
+    for pragma, value in (settings or {}).items():
+        if value is None:
+            _pool.settings.pop(pragma, None)
+        else:
+            _pool.settings[pragma] = value
+    if max_idle is not None:
+        _pool.max_idle = max_idle
+
+
+def get_connection(db_path=DEFAULT_DB_PATH, row_factory=None):
+    """
+    Emprunte une connexion au pool partagé.
+
+    Args:
+        db_path (str): Chemin vers la base de données SQLite
+        row_factory (callable, optional): Fabrique de lignes (ex: sqlite3.Row)
+
+    Returns:
+        PooledConnection: Connexion à rendre avec close()
+    """
+    return _pool.get_connection(db_path, row_factory)
+
+
+def close_connections(db_path=None):
+    """
+    Ferme les connexions inactives du thread courant vers une base.
+
+    À appeler avant de copier, remplacer ou supprimer le fichier de la base: la fermeture
+    de la dernière connexion reporte le journal WAL dans la base, et une connexion
+    conservée sur un fichier remplacé lirait une projection mémoire invalide.
+
+    Args:
+        db_path (str, optional): Chemin vers la base de données SQLite (toutes les bases par défaut)
+    """
+    _pool.close_idle(db_path)
+
+
+def get_pool_stats():
+    """
+    Retourne les statistiques du pool partagé.
+
+    Returns:
+        dict: Statistiques du pool
+    """
+    return _pool.stats()
@@ -8,20 +8,64 @@ notamment l'évaluation des règles, la génération d'offres, et la gestion des
 import sqlite3
 import json
 import logging
+import math
+import threading
+import time
 import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    from modules.rule_compiler import RuleCompiler, RULE_SOURCES
+    from modules.client_stats import ClientStatsManager, update_favourite_categories
+    from modules.offer_codes import offer_code_sql, execute_with_code_retry
+    from modules.offer_delivery import enqueue_offers
+    from modules.rule_engine import RuleEngine, QueryProfiler, OFFER_VALIDITY_DAYS, query_plan, full_scans
+    from modules.db_pool import get_connection, DEFAULT_DB_PATH
+    from modules.migrations import migrate
+except ImportError:
+    from rule_compiler import RuleCompiler, RULE_SOURCES
+    from client_stats import ClientStatsManager, update_favourite_categories
+    from offer_codes import offer_code_sql, execute_with_code_retry
+    from offer_delivery import enqueue_offers
+    from rule_engine import RuleEngine, QueryProfiler, OFFER_VALIDITY_DAYS, query_plan, full_scans
+    from db_pool import get_connection, DEFAULT_DB_PATH
+    from migrations import migrate
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Durée de vie maximale du cache des règles actives (en secondes)
+RULES_CACHE_TTL = 60
+
+# Âge maximal par défaut des statistiques servies sans recalcul (en secondes)
+STATS_CACHE_MAX_AGE = 300
+
+# Niveaux des cartes de fidélité, dans l'ordre des paliers de niveaux_fidelite
+CARD_LEVELS = ('bronze', 'argent', 'or', 'platine')
+
+# Types de mouvements acceptés par apply_points_batch (les utilisations sont débitées)
+POINT_OPERATIONS = ('gain', 'bonus', 'ajustement', 'utilisation')
+
+# Nombre de cartes réécrites par transaction lors du recalcul des niveaux
+LEVEL_UPDATE_CHUNK_SIZE = 5000
+
+# Nombre d'offres marquées expirées par transaction
+EXPIRY_CHUNK_SIZE = 1000
+
 class LoyaltyManager:
     """
     Classe principale pour la gestion du programme de fidélité.
     Gère l'évaluation des règles, la génération et l'envoi d'offres, et la gestion des points.
     """
     
-    def __init__(self, db_path='modules/fidelity_db.sqlite'):
+    def __init__(self, db_path=DEFAULT_DB_PATH):
         """
         Initialise le gestionnaire de fidélité.
         
@@ -29,36 +73,149 @@ class LoyaltyManager:
             db_path (str): Chemin vers la base de données SQLite
         """
         self.db_path = db_path
+        self.rule_engine = RuleEngine(OFFER_VALIDITY_DAYS)
+    
+    # Bases de données dont le schéma a déjà été vérifié
+    _schema_checked = set()
     
+    # Cache des règles actives par base de données (évaluation au scan de ticket)
+    _rules_cache = {}
+    
+    # Latences des dernières évaluations par client (en ms)
+    _client_latencies = deque(maxlen=1000)
+
+    # Cache des statistiques du programme par (base de données, période)
+    _stats_cache = {}
+    _stats_refreshing = set()
+    _stats_lock = threading.Lock()
+
     def _get_connection(self):
         """
-        Établit et retourne une connexion à la base de données.
+        Emprunte une connexion au pool (à rendre avec close(), qui annule la
+        transaction si elle n'a pas été validée).
         
         Returns:
             sqlite3.Connection: Connexion à la base de données
         """
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        conn = get_connection(self.db_path, sqlite3.Row)
+        
+        if self.db_path not in LoyaltyManager._schema_checked:
+            self._ensure_schema(conn)
+            LoyaltyManager._schema_checked.add(self.db_path)
+        
         return conn
     
-    def evaluate_all_rules(self):
+    def _ensure_schema(self, conn):
+        """
+        Applique les migrations du schéma de fidélité manquantes (voir migrations).
+        
+        Args:
+            conn (sqlite3.Connection): Connexion à la base de données
+        """
+        result = migrate(conn)
+        if not result['success']:
+            logger.warning(f"Impossible de mettre à jour le schéma de fidélité: {result['error']}")
+    
+    def _get_rule_watermark(self, conn, rule):
+        """
+        Récupère la dernière transaction prise en compte lors d'une évaluation de la règle.
+        
+        Le repère est ignoré si la règle a été modifiée depuis cette évaluation,
+        afin de forcer une réévaluation complète avec ses nouveaux paramètres.
+        
+        Args:
+            conn (sqlite3.Connection): Connexion à la base de données
+            rule (dict): Informations sur la règle
+            
+        Returns:
+            int: ID de la dernière transaction évaluée, ou None si aucun repère utilisable
+        """
+        last = conn.execute('''
+            SELECT dernier_transaction_id, date_evaluation
+            FROM historique_evaluations_regles
+            WHERE regle_id = ? AND dernier_transaction_id IS NOT NULL
+            ORDER BY dernier_transaction_id DESC
+            LIMIT 1
+        ''', (rule['regle_id'],)).fetchone()
+        
+        if not last:
+            return None
+        
+        if rule.get('modification_date') and last['date_evaluation'] and rule['modification_date'] > last['date_evaluation']:
+            return None
+        
+        return last['dernier_transaction_id']
+    
+    def _record_rule_evaluation(self, conn, rule, clients_evaluated, offers_generated, duration_ms,
+                                high_water_mark, mode, commentaire, profile):
+        """
+        Enregistre l'évaluation d'une règle et son profil d'exécution dans historique_evaluations_regles.
+        
+        Args:
+            conn (sqlite3.Connection): Connexion à la base de données
+            rule (dict): Informations sur la règle évaluée
+            clients_evaluated (int): Nombre de clients évalués
+            offers_generated (int): Nombre d'offres générées
+            duration_ms (int): Durée de l'évaluation (en ms)
+            high_water_mark (int): Dernière transaction prise en compte
+            mode (str): Mode d'évaluation (complete, incrementale, compilee)
+            commentaire (str): Commentaire de l'évaluation
+            profile (dict): Clients éligibles, instructions exécutées, plan d'exécution et parcours complets
+        """
+        conn.execute('''
+            INSERT INTO historique_evaluations_regles (
+                regle_id, nombre_clients_evalues, nombre_offres_generees, 
+                duree_execution_ms, dernier_transaction_id, mode_evaluation, commentaire,
+                clients_eligibles, instructions_vm, plan_requete, scans_complets
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            rule['regle_id'],
+            clients_evaluated,
+            offers_generated,
+            duration_ms,
+            high_water_mark,
+            mode,
+            commentaire,
+            profile['clients_eligible'],
+            profile['vm_steps'],
+            json.dumps(profile['plan'], ensure_ascii=False),
+            ','.join(profile['full_scans']) or None
+        ))
+    
+    def evaluate_all_rules(self, incremental=False, compiled=False, workers=None):
         """
         Évalue toutes les règles de fidélité actives et génère des offres pour les clients éligibles.
         
+        En mode incrémental, les règles basées sur l'activité ne réévaluent que les clients
+        ayant de nouvelles transactions depuis la dernière évaluation de la règle (repère
+        enregistré dans historique_evaluations_regles). Les règles calendaires sont toujours
+        réévaluées entièrement.
+        
+        En mode compilé, les règles sont regroupées par fenêtre temporelle et évaluées
+        en une seule passe sur les transactions (voir rule_compiler). Ce mode réévalue
+        toujours l'ensemble des clients.
+        
+        En mode parallèle (workers > 1), les clients sont répartis en partitions
+        (client_id % workers) évaluées dans des processus distincts en lecture seule ;
+        le processus principal insère seul les offres. La base passe en mode WAL.
+        
+        Args:
+            incremental (bool): Activer l'évaluation incrémentale
+            compiled (bool): Évaluer toutes les règles avec le compilateur de règles
+            workers (int, optional): Nombre de processus pour l'évaluation parallèle
+        
         Returns:
             dict: Résultat de l'évaluation avec des statistiques
         """
+        conn = None
         try:
             conn = self._get_connection()
             
+            # Repère de fin: dernière transaction connue au début de l'évaluation
+            high_water_mark = conn.execute('SELECT MAX(transaction_id) FROM transactions').fetchone()[0] or 0
+            
             # Récupérer les règles actives
-            rules = conn.execute('''
-                SELECT * FROM regles_fidelite 
-                WHERE est_active = 1
-                AND (date_debut IS NULL OR date_debut <= date('now'))
-                AND (date_fin IS NULL OR date_fin >= date('now'))
-                ORDER BY priorite DESC
-            ''').fetchall()
+            rules = self.rule_engine.get_active_rules(conn)
             
             stats = {
                 'total_rules_evaluated': len(rules),
@@ -67,79 +224,63 @@ class LoyaltyManager:
                 'rules_details': []
             }
             
-            # Pour chaque règle, exécuter la logique appropriée
-            for rule in rules:
-                rule_dict = dict(rule)
-                offers_for_rule = 0
-                clients_evaluated = 0
-                
-                # Appeler la méthode spécifique selon le type de règle
-                if rule['type_regle'] == 'nombre_achats':
-                    result = self._evaluate_purchase_count_rule(conn, rule_dict)
-                    offers_for_rule = result['offers_generated']
-                    clients_evaluated = result['clients_evaluated']
-                
-                elif rule['type_regle'] == 'montant_cumule':
-                    result = self._evaluate_cumulative_amount_rule(conn, rule_dict)
-                    offers_for_rule = result['offers_generated']
-                    clients_evaluated = result['clients_evaluated']
-                
-                elif rule['type_regle'] == 'produit_specifique':
-                    result = self._evaluate_specific_product_rule(conn, rule_dict)
-                    offers_for_rule = result['offers_generated']
-                    clients_evaluated = result['clients_evaluated']
-                
-                elif rule['type_regle'] == 'categorie_specifique':
-                    result = self._evaluate_specific_category_rule(conn, rule_dict)
-                    offers_for_rule = result['offers_generated']
-                    clients_evaluated = result['clients_evaluated']
-                
-                elif rule['type_regle'] == 'premiere_visite':
-                    result = self._evaluate_first_visit_rule(conn, rule_dict)
-                    offers_for_rule = result['offers_generated']
-                    clients_evaluated = result['clients_evaluated']
-                
-                elif rule['type_regle'] == 'anniversaire':
-                    result = self._evaluate_birthday_rule(conn, rule_dict)
-                    offers_for_rule = result['offers_generated']
-                    clients_evaluated = result['clients_evaluated']
-                
-                elif rule['type_regle'] == 'inactivite':
-                    result = self._evaluate_inactivity_rule(conn, rule_dict)
+            if compiled:
+                # Une seule passe sur les transactions pour toutes les règles
+                self._evaluate_compiled_rules(conn, rules, stats, high_water_mark)
+            elif workers and workers > 1:
+                # Évaluation répartie sur plusieurs processus
+                self._evaluate_sharded_rules(conn, rules, stats, high_water_mark, incremental, workers)
+            else:
+                # Chaque règle est évaluée par l'évaluateur de son type
+                for rule in rules:
+                    start_time = time.perf_counter()
+                    
+                    # Restreindre l'évaluation aux clients ayant de nouvelles transactions
+                    scope = None
+                    if incremental and self.rule_engine.supports_incremental(rule):
+                        watermark = self._get_rule_watermark(conn, rule)
+                        if watermark is not None:
+                            scope = [('IN (SELECT client_id FROM transactions WHERE transaction_id > ?)', [watermark])]
+                    
+                    result = self.rule_engine.evaluate_rule(conn, rule, scope)
                     offers_for_rule = result['offers_generated']
                     clients_evaluated = result['clients_evaluated']
-                
-                # Enregistrer les statistiques d'évaluation
-                conn.execute('''
-                    INSERT INTO historique_evaluations_regles (
-                        regle_id, nombre_clients_evalues, nombre_offres_generees, commentaire
-                    ) VALUES (?, ?, ?, ?)
-                ''', (
-                    rule['regle_id'],
-                    clients_evaluated,
-                    offers_for_rule,
-                    f"Évaluation automatique le {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-                ))
-                
-                # Ajouter les statistiques de cette règle au résultat global
-                stats['total_clients_evaluated'] += clients_evaluated
-                stats['total_offers_generated'] += offers_for_rule
-                stats['rules_details'].append({
-                    'rule_id': rule['regle_id'],
-                    'rule_name': rule['nom'],
-                    'clients_evaluated': clients_evaluated,
-                    'offers_generated': offers_for_rule
-                })
-            
-            # Générer des codes uniques pour toutes les nouvelles offres
-            conn.execute('''
-                UPDATE offres_client
-                SET code_unique = 'OF-' || offre_id || '-' || substr(hex(randomblob(4)), 1, 8)
-                WHERE code_unique IS NULL
-            ''')
+                    profile = result['profile']
+                    
+                    # Débit de génération de la règle
+                    duration = time.perf_counter() - start_time
+                    duration_ms = int(duration * 1000)
+                    rows_per_sec = round(offers_for_rule / duration, 1) if duration > 0 else 0.0
+                    
+                    # Enregistrer les statistiques d'évaluation
+                    self._record_rule_evaluation(
+                        conn, rule, clients_evaluated, offers_for_rule, duration_ms, high_water_mark,
+                        'incrementale' if scope else 'complete',
+                        f"Évaluation automatique le {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                        profile
+                    )
+                    
+                    logger.info(
+                        f"Règle '{rule['nom']}': {offers_for_rule} offres en {duration_ms} ms "
+                        f"({rows_per_sec} lignes/s, {profile['vm_steps']} instructions)"
+                    )
+                    
+                    # Ajouter les statistiques de cette règle au résultat global
+                    stats['total_clients_evaluated'] += clients_evaluated
+                    stats['total_offers_generated'] += offers_for_rule
+                    stats['rules_details'].append({
+                        'rule_id': rule['regle_id'],
+                        'rule_name': rule['nom'],
+                        'clients_evaluated': clients_evaluated,
+                        'offers_generated': offers_for_rule,
+                        'duration_ms': duration_ms,
+                        'rows_per_sec': rows_per_sec,
+                        'incremental': scope is not None,
+                        'vm_steps': profile['vm_steps'],
+                        'full_scans': profile['full_scans']
+                    })
             
             conn.commit()
-            conn.close()
             
             logger.info(f"Évaluation des règles terminée: {stats['total_offers_generated']} offres générées")
             return {'success': True, 'stats': stats}
@@ -147,528 +288,322 @@ class LoyaltyManager:
         except Exception as e:
             logger.error(f"Erreur lors de l'évaluation des règles: {str(e)}")
             return {'success': False, 'error': str(e)}
+        finally:
+            if conn is not None:
+                conn.close()
     
-    def _evaluate_purchase_count_rule(self, conn, rule):
+    def _evaluate_compiled_rules(self, conn, rules, stats, high_water_mark):
         """
-        Évalue une règle basée sur le nombre d'achats.
+        Évalue les règles avec le compilateur et complète les statistiques d'évaluation.
         
         Args:
             conn (sqlite3.Connection): Connexion à la base de données
-            rule (dict): Informations sur la règle à évaluer
-            
-        Returns:
-            dict: Résultat de l'évaluation
+            rules (list): Règles actives à évaluer
+            stats (dict): Statistiques globales à compléter
+            high_water_mark (int): Dernière transaction prise en compte
         """
-        # Préparer la condition de période
-        period_condition = ''
-        if rule['periode_jours']:
-            period_condition = f"AND t.date_transaction >= date('now', '-{rule['periode_jours']} days')"
-        
-        # Vérifier les restrictions de segment si spécifiées
-        segment_condition = ''
-        if rule['segments_cibles']:
-            try:
-                segments = json.loads(rule['segments_cibles'])
-                if segments:
-                    segments_str = ','.join([f"'{s}'" for s in segments])
-                    segment_condition = f"AND c.segment IN ({segments_str})"
-            except:
-                pass
-        
-        # Trouver les clients éligibles
-        query = f'''
-            SELECT 
-                c.client_id
-            FROM clients c
-            JOIN (
-                SELECT 
-                    client_id, 
-                    COUNT(DISTINCT transaction_id) as nb_achats
-                FROM transactions
-                WHERE 1=1 {period_condition}
-                GROUP BY client_id
-                HAVING nb_achats >= ?
-            ) achats ON c.client_id = achats.client_id
-            LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
-            WHERE oc.offre_id IS NULL
-            AND c.statut = 'actif'
-            {segment_condition}
-        '''
-        
-        eligible_clients = conn.execute(query, (rule['condition_valeur'], rule['regle_id'])).fetchall()
-        
-        # Générer des offres pour chaque client éligible
-        offers_generated = 0
-        for client in eligible_clients:
-            # Déterminer la date d'expiration (par défaut 30 jours)
-            expiration_date = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
-            
-            # Créer l'offre
-            conn.execute('''
-                INSERT INTO offres_client (
-                    client_id, regle_id, recompense_id, date_generation, date_expiration, 
-                    statut, commentaire
-                ) VALUES (?, ?, ?, date('now'), ?, 'generee', ?)
-            ''', (
-                client['client_id'],
-                rule['regle_id'],
-                rule['recompense_id'],
-                expiration_date,
-                f"Offre générée après {rule['condition_valeur']} achats"
-            ))
-            offers_generated += 1
-        
-        return {
-            'clients_evaluated': len(eligible_clients),
-            'offers_generated': offers_generated
+        start_time = time.perf_counter()
+        compiled_rules = [rule for rule in rules if rule['type_regle'] in RULE_SOURCES]
+        result = RuleCompiler(self, OFFER_VALIDITY_DAYS).evaluate(conn, compiled_rules)
+        
+        # Types de règles sans plan compilé: évaluation règle par règle par le moteur
+        profiles = {}
+        for rule in rules:
+            if rule['type_regle'] not in RULE_SOURCES:
+                evaluation = self.rule_engine.evaluate_rule(conn, rule)
+                result['offers_by_rule'][rule['regle_id']] = evaluation['offers_generated']
+                profiles[rule['regle_id']] = evaluation['profile']
+        duration_ms = int((time.perf_counter() - start_time) * 1000)
+        
+        for rule in rules:
+            offers_for_rule = result['offers_by_rule'].get(rule['regle_id'], 0)
+            
+            # La durée et les instructions enregistrées sont celles de la passe complète,
+            # partagées par toutes les règles compilées
+            plan = result['plans_by_rule'].get(rule['regle_id'], [])
+            profile = profiles.get(rule['regle_id']) or {
+                'clients_eligible': offers_for_rule,
+                'vm_steps': result['vm_steps'],
+                'plan': plan,
+                'full_scans': full_scans(plan)
+            }
+            self._record_rule_evaluation(
+                conn, rule, offers_for_rule, offers_for_rule, duration_ms, high_water_mark, 'compilee',
+                f"Évaluation compilée le {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ({len(rules)} règles)",
+                profile
+            )
+            
+            stats['total_clients_evaluated'] += offers_for_rule
+            stats['total_offers_generated'] += offers_for_rule
+            stats['rules_details'].append({
+                'rule_id': rule['regle_id'],
+                'rule_name': rule['nom'],
+                'clients_evaluated': offers_for_rule,
+                'offers_generated': offers_for_rule,
+                'duration_ms': duration_ms,
+                'rows_per_sec': round(offers_for_rule / (duration_ms / 1000), 1) if duration_ms > 0 else 0.0,
+                'incremental': False
+            })
+        
+        stats['compiled_plan'] = {
+            'scan_ms': result['scan_ms'],
+            'predicate_ms': result['predicate_ms'],
+            'insert_ms': result['insert_ms'],
+            'duration_ms': duration_ms
         }
     
-    def _evaluate_cumulative_amount_rule(self, conn, rule):
+    def _evaluate_sharded_rules(self, conn, rules, stats, high_water_mark, incremental, workers):
         """
-        Évalue une règle basée sur le montant cumulé d'achats.
+        Évalue les règles par partitions de clients dans un pool de processus.
+        
+        Chaque processus lit sa partition (client_id % workers) et retourne les clients
+        éligibles ; les offres sont insérées ici, par un seul écrivain, au fur et à mesure
+        que les partitions se terminent.
         
         Args:
             conn (sqlite3.Connection): Connexion à la base de données
-            rule (dict): Informations sur la règle à évaluer
-            
-        Returns:
-            dict: Résultat de l'évaluation
+            rules (list): Règles actives à évaluer
+            stats (dict): Statistiques globales à compléter
+            high_water_mark (int): Dernière transaction prise en compte
+            incremental (bool): Activer l'évaluation incrémentale
+            workers (int): Nombre de processus
         """
-        # Préparer la condition de période
-        period_condition = ''
-        if rule['periode_jours']:
-            period_condition = f"AND t.date_transaction >= date('now', '-{rule['periode_jours']} days')"
-        
-        # Vérifier les restrictions de segment si spécifiées
-        segment_condition = ''
-        if rule['segments_cibles']:
-            try:
-                segments = json.loads(rule['segments_cibles'])
-                if segments:
-                    segments_str = ','.join([f"'{s}'" for s in segments])
-                    segment_condition = f"AND c.segment IN ({segments_str})"
-            except:
-                pass
-        
-        # Trouver les clients éligibles
-        query = f'''
-            SELECT 
-                c.client_id
-            FROM clients c
-            JOIN (
-                SELECT 
-                    client_id, 
-                    SUM(montant_total) as montant_cumule
-                FROM transactions
-                WHERE 1=1 {period_condition}
-                GROUP BY client_id
-                HAVING montant_cumule >= ?
-            ) achats ON c.client_id = achats.client_id
-            LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
-            WHERE oc.offre_id IS NULL
-            AND c.statut = 'actif'
-            {segment_condition}
-        '''
-        
-        eligible_clients = conn.execute(query, (rule['condition_valeur'], rule['regle_id'])).fetchall()
-        
-        # Générer des offres pour chaque client éligible
-        offers_generated = 0
-        for client in eligible_clients:
-            # Déterminer la date d'expiration (par défaut 30 jours)
-            expiration_date = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
-            
-            # Créer l'offre
-            conn.execute('''
-                INSERT INTO offres_client (
-                    client_id, regle_id, recompense_id, date_generation, date_expiration, 
-                    statut, commentaire
-                ) VALUES (?, ?, ?, date('now'), ?, 'generee', ?)
-            ''', (
-                client['client_id'],
-                rule['regle_id'],
-                rule['recompense_id'],
-                expiration_date,
-                f"Offre générée après {rule['condition_valeur']}€ d'achats cumulés"
-            ))
-            offers_generated += 1
-        
-        return {
-            'clients_evaluated': len(eligible_clients),
-            'offers_generated': offers_generated
-        }
+        # Le mode WAL permet aux processus de lire pendant l'écriture des offres
+        conn.execute('PRAGMA journal_mode=WAL')
+        
+        # Restriction incrémentale de chaque règle, calculée avant la répartition
+        scopes = {}
+        for rule in rules:
+            scopes[rule['regle_id']] = None
+            if incremental and self.rule_engine.supports_incremental(rule):
+                watermark = self._get_rule_watermark(conn, rule)
+                if watermark is not None:
+                    scopes[rule['regle_id']] = [('IN (SELECT client_id FROM transactions WHERE transaction_id > ?)', [watermark])]
+        
+        rules_by_id = {rule['regle_id']: rule for rule in rules}
+        rule_stats = {rule['regle_id']: {'offers': 0, 'read_ms': 0, 'write_ms': 0, 'vm_steps': 0} for rule in rules}
+        
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_evaluate_shard, self.db_path, rules, scopes, shard, workers)
+                for shard in range(workers)
+            ]
+            
+            for future in as_completed(futures):
+                for regle_id, shard_result in future.result().items():
+                    rule = rules_by_id[regle_id]
+                    start_time = time.perf_counter()
+                    
+                    with QueryProfiler(conn) as profiler:
+                        execute_with_code_retry(conn, f'''
+                            INSERT INTO offres_client (
+                                client_id, regle_id, recompense_id, date_generation, date_expiration, 
+                                statut, code_unique, commentaire
+                            ) VALUES (
+                                ?, ?, ?, date('now'), ?, 'generee', {offer_code_sql('?', '?')}, ?
+                            )
+                        ''', [
+                            (client_id, regle_id, rule['recompense_id'], date_expiration,
+                             regle_id, client_id, shard_result['commentaire'])
+                            for client_id, date_expiration in shard_result['eligible']
+                        ], many=True)
+                    
+                    # Les partitions sont lues en parallèle: la durée de lecture est celle de la plus lente
+                    rule_stats[regle_id]['offers'] += len(shard_result['eligible'])
+                    rule_stats[regle_id]['read_ms'] = max(rule_stats[regle_id]['read_ms'], shard_result['duration_ms'])
+                    rule_stats[regle_id]['write_ms'] += (time.perf_counter() - start_time) * 1000
+                    rule_stats[regle_id]['vm_steps'] += shard_result['vm_steps'] + profiler.vm_steps
+        
+        for rule in rules:
+            offers_for_rule = rule_stats[rule['regle_id']]['offers']
+            duration_ms = int(rule_stats[rule['regle_id']]['read_ms'] + rule_stats[rule['regle_id']]['write_ms'])
+            rows_per_sec = round(offers_for_rule / (duration_ms / 1000), 1) if duration_ms > 0 else 0.0
+            scope = scopes[rule['regle_id']]
+            
+            # Plan de la requête d'une partition (identique pour toutes les partitions)
+            query, params, _ = self.rule_engine.eligibility_query(rule, (scope or []) + [('% ? = ?', [workers, 0])])
+            plan = query_plan(conn, query, params)
+            self._record_rule_evaluation(
+                conn, rule, offers_for_rule, offers_for_rule, duration_ms, high_water_mark,
+                'incrementale' if scope else 'complete',
+                f"Évaluation parallèle le {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ({workers} processus)",
+                {
+                    'clients_eligible': offers_for_rule,
+                    'vm_steps': rule_stats[rule['regle_id']]['vm_steps'],
+                    'plan': plan,
+                    'full_scans': full_scans(plan)
+                }
+            )
+            
+            stats['total_clients_evaluated'] += offers_for_rule
+            stats['total_offers_generated'] += offers_for_rule
+            stats['rules_details'].append({
+                'rule_id': rule['regle_id'],
+                'rule_name': rule['nom'],
+                'clients_evaluated': offers_for_rule,
+                'offers_generated': offers_for_rule,
+                'duration_ms': duration_ms,
+                'rows_per_sec': rows_per_sec,
+                'incremental': scope is not None
+            })
+        
+        stats['workers'] = workers
     
-    def _evaluate_specific_product_rule(self, conn, rule):
+    def get_rule_evaluation_profile(self):
         """
-        Évalue une règle basée sur l'achat d'un produit spécifique.
+        Classe les règles par coût, d'après le profil de leur dernière évaluation.
+        
+        Le coût est le nombre d'instructions de la machine virtuelle SQLite exécutées,
+        puis la durée pour les évaluations antérieures au profilage.
         
-        Args:
-            conn (sqlite3.Connection): Connexion à la base de données
-            rule (dict): Informations sur la règle à évaluer
-            
         Returns:
-            dict: Résultat de l'évaluation
+            dict: Résultat avec, pour chaque règle, sa dernière évaluation et son plan d'exécution
         """
-        # Préparer la condition de période
-        period_condition = ''
-        if rule['periode_jours']:
-            period_condition = f"AND t.date_transaction >= date('now', '-{rule['periode_jours']} days')"
-        
-        # Vérifier les restrictions de segment si spécifiées
-        segment_condition = ''
-        if rule['segments_cibles']:
-            try:
-                segments = json.loads(rule['segments_cibles'])
-                if segments:
-                    segments_str = ','.join([f"'{s}'" for s in segments])
-                    segment_condition = f"AND c.segment IN ({segments_str})"
-            except:
-                pass
-        
-        # Trouver les clients éligibles
-        query = f'''
-            SELECT DISTINCT
-                c.client_id
-            FROM clients c
-            JOIN transactions t ON c.client_id = t.client_id
-            JOIN details_transactions dt ON t.transaction_id = dt.transaction_id
-            LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
-            WHERE dt.produit_id = ?
-            {period_condition}
-            AND oc.offre_id IS NULL
-            AND c.statut = 'actif'
-            {segment_condition}
-        '''
-        
-        eligible_clients = conn.execute(query, (rule['regle_id'], rule['condition_valeur'])).fetchall()
-        
-        # Générer des offres pour chaque client éligible
-        offers_generated = 0
-        for client in eligible_clients:
-            # Déterminer la date d'expiration (par défaut 30 jours)
-            expiration_date = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
-            
-            # Créer l'offre
-            conn.execute('''
-                INSERT INTO offres_client (
-                    client_id, regle_id, recompense_id, date_generation, date_expiration, 
-                    statut, commentaire
-                ) VALUES (?, ?, ?, date('now'), ?, 'generee', ?)
-            ''', (
-                client['client_id'],
-                rule['regle_id'],
-                rule['recompense_id'],
-                expiration_date,
-                f"Offre générée après achat du produit #{rule['condition_valeur']}"
-            ))
-            offers_generated += 1
-        
-        return {
-            'clients_evaluated': len(eligible_clients),
-            'offers_generated': offers_generated
-        }
+        conn = None
+        try:
+            conn = self._get_connection()
+            
+            rows = conn.execute('''
+                SELECT 
+                    r.regle_id, r.nom, r.type_regle, r.est_active,
+                    h.date_evaluation, h.mode_evaluation, h.duree_execution_ms,
+                    h.nombre_clients_evalues, h.clients_eligibles, h.nombre_offres_generees,
+                    h.instructions_vm, h.plan_requete, h.scans_complets
+                FROM regles_fidelite r
+                JOIN historique_evaluations_regles h ON h.evaluation_id = (
+                    SELECT MAX(evaluation_id) FROM historique_evaluations_regles
+                    WHERE regle_id = r.regle_id
+                )
+                ORDER BY h.instructions_vm IS NULL, h.instructions_vm DESC, h.duree_execution_ms DESC
+            ''').fetchall()
+            
+            rules = []
+            for row in rows:
+                rule = dict(row)
+                rule['plan_requete'] = json.loads(rule['plan_requete']) if rule['plan_requete'] else []
+                rule['scans_complets'] = rule['scans_complets'].split(',') if rule['scans_complets'] else []
+                rules.append(rule)
+            
+            return {'success': True, 'rules': rules}
+            
+        except Exception as e:
+            logger.error(f"Erreur lors de la récupération du profil des règles: {str(e)}")
+            return {'success': False, 'error': str(e)}
+        finally:
+            if conn is not None:
+                conn.close()
     
-    def _evaluate_specific_category_rule(self, conn, rule):
+    def refresh_client_stats(self, client_ids=None):
         """
-        Évalue une règle basée sur l'achat dans une catégorie spécifique.
+        Recalcule les statistiques matérialisées des clients (fenêtres glissantes comprises).
         
         Args:
-            conn (sqlite3.Connection): Connexion à la base de données
-            rule (dict): Informations sur la règle à évaluer
+            client_ids (list, optional): IDs des clients à recalculer. Si None, tous les clients.
             
         Returns:
-            dict: Résultat de l'évaluation
+            dict: Résultat de l'opération
         """
-        # Préparer la condition de période
-        period_condition = ''
-        if rule['periode_jours']:
-            period_condition = f"AND t.date_transaction >= date('now', '-{rule['periode_jours']} days')"
-        
-        # Vérifier les restrictions de segment si spécifiées
-        segment_condition = ''
-        if rule['segments_cibles']:
-            try:
-                segments = json.loads(rule['segments_cibles'])
-                if segments:
-                    segments_str = ','.join([f"'{s}'" for s in segments])
-                    segment_condition = f"AND c.segment IN ({segments_str})"
-            except:
-                pass
-        
-        # Trouver les clients éligibles
-        query = f'''
-            SELECT DISTINCT
-                c.client_id
-            FROM clients c
-            JOIN transactions t ON c.client_id = t.client_id
-            JOIN details_transactions dt ON t.transaction_id = dt.transaction_id
-            JOIN produits p ON dt.produit_id = p.produit_id
-            LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
-            WHERE p.categorie_id = ?
-            {period_condition}
-            AND oc.offre_id IS NULL
-            AND c.statut = 'actif'
-            {segment_condition}
-        '''
-        
-        eligible_clients = conn.execute(query, (rule['regle_id'], rule['condition_valeur'])).fetchall()
-        
-        # Générer des offres pour chaque client éligible
-        offers_generated = 0
-        for client in eligible_clients:
-            # Déterminer la date d'expiration (par défaut 30 jours)
-            expiration_date = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
-            
-            # Créer l'offre
-            conn.execute('''
-                INSERT INTO offres_client (
-                    client_id, regle_id, recompense_id, date_generation, date_expiration, 
-                    statut, commentaire
-                ) VALUES (?, ?, ?, date('now'), ?, 'generee', ?)
-            ''', (
-                client['client_id'],
-                rule['regle_id'],
-                rule['recompense_id'],
-                expiration_date,
-                f"Offre générée après achat dans catégorie #{rule['condition_valeur']}"
-            ))
-            offers_generated += 1
-        
-        return {
-            'clients_evaluated': len(eligible_clients),
-            'offers_generated': offers_generated
-        }
+        return ClientStatsManager(self.db_path).refresh(client_ids)
     
-    def _evaluate_first_visit_rule(self, conn, rule):
+    def explain_compiled_rules(self):
         """
-        Évalue une règle basée sur la première visite d'un client.
+        Retourne le plan compilé des règles actives avec l'EXPLAIN QUERY PLAN de chaque étape.
         
-        Args:
-            conn (sqlite3.Connection): Connexion à la base de données
-            rule (dict): Informations sur la règle à évaluer
-            
         Returns:
-            dict: Résultat de l'évaluation
+            dict: Résultat avec les étapes du plan compilé
         """
-        # Vérifier les restrictions de segment si spécifiées
-        segment_condition = ''
-        if rule['segments_cibles']:
-            try:
-                segments = json.loads(rule['segments_cibles'])
-                if segments:
-                    segments_str = ','.join([f"'{s}'" for s in segments])
-                    segment_condition = f"AND c.segment IN ({segments_str})"
-            except:
-                pass
-        
-        # Trouver les clients éligibles (nouveaux clients dans les X jours)
-        # Utilisation de date_creation au lieu de première transaction
-        query = f'''
-            SELECT 
-                c.client_id
-            FROM clients c
-            LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
-            WHERE c.date_creation >= date('now', '-{rule['condition_valeur']} days')
-            AND c.date_creation <= date('now')
-            AND c.statut = 'actif'
-            AND c.marketing_consent = 1
-            AND oc.offre_id IS NULL
-            {segment_condition}
-        '''
-        
-        # Logs pour le débogage
-        logger.info(f"Requête SQL pour première visite: {query}")
-        logger.info(f"Paramètres: {(rule['regle_id'],)}")
-        
-        eligible_clients = conn.execute(query, (rule['regle_id'],)).fetchall()
-        
-        logger.info(f"Nombre de clients éligibles pour première visite: {len(eligible_clients)}")
-        
-        # Générer des offres pour chaque client éligible
-        offers_generated = 0
-        for client in eligible_clients:
-            # Déterminer la date d'expiration (par défaut 30 jours)
-            expiration_date = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
-            
-            # Créer l'offre
-            conn.execute('''
-                INSERT INTO offres_client (
-                    client_id, regle_id, recompense_id, date_generation, date_expiration, 
-                    statut, commentaire
-                ) VALUES (?, ?, ?, date('now'), ?, 'generee', ?)
-            ''', (
-                client['client_id'],
-                rule['regle_id'],
-                rule['recompense_id'],
-                expiration_date,
-                "Offre de bienvenue"
-            ))
-            offers_generated += 1
-        
-        logger.info(f"Nombre d'offres générées pour première visite: {offers_generated}")
-        
-        return {
-            'clients_evaluated': len(eligible_clients),
-            'offers_generated': offers_generated
-        }
+        conn = None
+        try:
+            conn = self._get_connection()
+            
+            rules = self.rule_engine.get_active_rules(conn)
+            
+            plan = RuleCompiler(self, OFFER_VALIDITY_DAYS).explain(conn, rules)
+            
+            return {'success': True, 'plan': plan}
+            
+        except Exception as e:
+            logger.error(f"Erreur lors de la compilation des règles: {str(e)}")
+            return {'success': False, 'error': str(e)}
+        finally:
+            if conn is not None:
+                conn.close()
     
-    def _evaluate_birthday_rule(self, conn, rule):
+    @classmethod
+    def invalidate_rules_cache(cls, db_path=None):
         """
-        Évalue une règle basée sur l'anniversaire des clients.
+        Invalide le cache des règles actives utilisé par l'évaluation au scan de ticket.
+        
+        À appeler après toute création, modification ou suppression de règle.
         
         Args:
-            conn (sqlite3.Connection): Connexion à la base de données
-            rule (dict): Informations sur la règle à évaluer
-            
-        Returns:
-            dict: Résultat de l'évaluation
+            db_path (str, optional): Base de données concernée. Si None, tous les caches sont vidés.
         """
-        # Vérifier les restrictions de segment si spécifiées
-        segment_condition = ''
-        if rule['segments_cibles']:
-            try:
-                segments = json.loads(rule['segments_cibles'])
-                if segments:
-                    segments_str = ','.join([f"'{s}'" for s in segments])
-                    segment_condition = f"AND c.segment IN ({segments_str})"
-            except:
-                pass
-        
-        # Trouver les clients dont l'anniversaire approche
-        query = f'''
-            SELECT 
-                c.client_id
-            FROM clients c
-            LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
-            WHERE 
-                strftime('%m-%d', c.date_naissance) BETWEEN 
-                strftime('%m-%d', date('now')) AND 
-                strftime('%m-%d', date('now', '+{rule['condition_valeur']} days'))
-            AND oc.offre_id IS NULL
-            AND c.statut = 'actif'
-            AND c.date_naissance IS NOT NULL
-            {segment_condition}
-        '''
-        
-        eligible_clients = conn.execute(query, (rule['regle_id'],)).fetchall()
-        
-        # Générer des offres pour chaque client éligible
-        offers_generated = 0
-        for client in eligible_clients:
-            # Déterminer la date d'expiration (par défaut 30 jours après l'anniversaire)
-            # Trouver l'anniversaire cette année
-            current_year = datetime.now().year
-            client_data = conn.execute('SELECT date_naissance FROM clients WHERE client_id = ?', 
-                                     (client['client_id'],)).fetchone()
-            
-            birthday_date = client_data['date_naissance']
-            birthday_parts = birthday_date.split('-')
-            
-            if len(birthday_parts) >= 3:
-                month = int(birthday_parts[1])
-                day = int(birthday_parts[2])
-                
-                this_year_birthday = datetime(current_year, month, day)
-                if this_year_birthday < datetime.now():
-                    this_year_birthday = datetime(current_year + 1, month, day)
-                
-                expiration_date = (this_year_birthday + timedelta(days=30)).strftime('%Y-%m-%d')
-            else:
-                # Fallback si le format de date est incorrect
-                expiration_date = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
-            
-            # Créer l'offre
-            conn.execute('''
-                INSERT INTO offres_client (
-                    client_id, regle_id, recompense_id, date_generation, date_expiration, 
-                    statut, commentaire
-                ) VALUES (?, ?, ?, date('now'), ?, 'generee', ?)
-            ''', (
-                client['client_id'],
-                rule['regle_id'],
-                rule['recompense_id'],
-                expiration_date,
-                "Offre d'anniversaire"
-            ))
-            offers_generated += 1
-        
-        return {
-            'clients_evaluated': len(eligible_clients),
-            'offers_generated': offers_generated
-        }
+        if db_path is None:
+            cls._rules_cache.clear()
+        else:
+            cls._rules_cache.pop(db_path, None)
     
-    def _evaluate_inactivity_rule(self, conn, rule):
+    def _get_client_rules_plan(self, conn):
         """
-        Évalue une règle basée sur l'inactivité des clients.
+        Retourne les règles actives et la requête d'éligibilité par client, depuis le cache si possible.
+        
+        Le cache est invalidé explicitement lors de l'édition des règles, au changement de jour
+        (dates de validité des règles) et au plus tard après RULES_CACHE_TTL secondes pour
+        prendre en compte les modifications faites par un autre processus.
         
         Args:
             conn (sqlite3.Connection): Connexion à la base de données
-            rule (dict): Informations sur la règle à évaluer
             
         Returns:
-            dict: Résultat de l'évaluation
+            dict: Règles actives, requête d'éligibilité et ses paramètres
         """
-        # Vérifier les restrictions de segment si spécifiées
-        segment_condition = ''
-        if rule['segments_cibles']:
-            try:
-                segments = json.loads(rule['segments_cibles'])
-                if segments:
-                    segments_str = ','.join([f"'{s}'" for s in segments])
-                    segment_condition = f"AND c.segment IN ({segments_str})"
-            except:
-                pass
-        
-        # Trouver les clients inactifs
-        query = f'''
-            SELECT 
-                c.client_id
-            FROM clients c
-            JOIN (
-                SELECT 
-                    client_id,
-                    MAX(date_transaction) as derniere_visite
-                FROM transactions
-                GROUP BY client_id
-                HAVING derniere_visite <= date('now', '-{rule['condition_valeur']} days')
-            ) dv ON c.client_id = dv.client_id
-            LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
-            WHERE oc.offre_id IS NULL
-            AND c.statut = 'actif'
-            {segment_condition}
-        '''
-        
-        eligible_clients = conn.execute(query, (rule['regle_id'],)).fetchall()
-        
-        # Générer des offres pour chaque client éligible
-        offers_generated = 0
-        for client in eligible_clients:
-            # Déterminer la date d'expiration (par défaut 30 jours)
-            expiration_date = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
-            
-            # Créer l'offre
-            conn.execute('''
-                INSERT INTO offres_client (
-                    client_id, regle_id, recompense_id, date_generation, date_expiration, 
-                    statut, commentaire
-                ) VALUES (?, ?, ?, date('now'), ?, 'generee', ?)
-            ''', (
-                client['client_id'],
-                rule['regle_id'],
-                rule['recompense_id'],
-                expiration_date,
-                "Offre pour client inactif"
-            ))
-            offers_generated += 1
-        
-        return {
-            'clients_evaluated': len(eligible_clients),
-            'offers_generated': offers_generated
+        today = datetime.now().strftime('%Y-%m-%d')
+        cached = LoyaltyManager._rules_cache.get(self.db_path)
+        if cached and cached['date'] == today and time.monotonic() - cached['loaded_at'] < RULES_CACHE_TTL:
+            return cached
+        
+        rules = self.rule_engine.get_active_rules(conn)
+        
+        # Une colonne par règle: 1 si le client est éligible et n'a pas encore l'offre
+        columns = []
+        params = []
+        for rule in rules:
+            predicate, predicate_params = self.rule_engine.client_predicate(rule)
+            columns.append(f'''
+                CASE WHEN ({predicate})
+                     AND NOT EXISTS (
+                        SELECT 1 FROM offres_client oc 
+                        WHERE oc.client_id = c.client_id AND oc.regle_id = ?
+                     )
+                THEN 1 ELSE 0 END as r_{rule['regle_id']}''')
+            params.extend(predicate_params + [rule['regle_id']])
+        
+        query = None
+        if columns:
+            query = f'''
+                SELECT {','.join(columns)}
+                FROM clients c
+                LEFT JOIN client_stats cs ON c.client_id = cs.client_id
+                WHERE c.client_id = ?
+            '''
+        
+        cached = {
+            'date': today,
+            'loaded_at': time.monotonic(),
+            'rules': rules,
+            'query': query,
+            'params': params
         }
+        LoyaltyManager._rules_cache[self.db_path] = cached
+        return cached
     
     def evaluate_rules_for_client(self, client_id):
         """
-        Évalue les règles de fidélité pour un client spécifique
+        Évalue les règles de fidélité pour un client spécifique (chemin rapide du scan de ticket).
+        
+        Les règles actives sont conservées en cache et l'éligibilité du client à toutes
+        les règles est calculée en une seule requête.
         
         Args:
             client_id: ID du client à évaluer
@@ -676,101 +611,64 @@ class LoyaltyManager:
         Returns:
             dict: Résultat de l'évaluation
         """
+        start_time = time.perf_counter()
+        
+        conn = None
         try:
             conn = self._get_connection()
             
-            # Récupérer les règles actives
-            rules = conn.execute('''
-                SELECT * FROM regles_fidelite 
-                WHERE est_active = 1
-                AND (date_debut IS NULL OR date_debut <= date('now'))
-                AND (date_fin IS NULL OR date_fin >= date('now'))
-                ORDER BY priorite DESC
-            ''').fetchall()
+            plan = self._get_client_rules_plan(conn)
             
             offers_generated = 0
             rules_applied = []
             
-            # Pour chaque règle, vérifier si le client est éligible
-            for rule in rules:
-                rule_dict = dict(rule)
-                
-                # Appeler la méthode spécifique selon le type de règle
-                eligible = False
-                
-                if rule['type_regle'] == 'nombre_achats':
-                    eligible = self._check_purchase_count_eligibility(conn, client_id, rule_dict)
-                
-                elif rule['type_regle'] == 'montant_cumule':
-                    eligible = self._check_cumulative_amount_eligibility(conn, client_id, rule_dict)
-                
-                elif rule['type_regle'] == 'produit_specifique':
-                    eligible = self._check_specific_product_eligibility(conn, client_id, rule_dict)
+            if plan['query']:
+                eligibility = conn.execute(plan['query'], plan['params'] + [client_id]).fetchone()
                 
-                elif rule['type_regle'] == 'categorie_specifique':
-                    eligible = self._check_specific_category_eligibility(conn, client_id, rule_dict)
-                
-                elif rule['type_regle'] == 'premiere_visite':
-                    eligible = self._check_first_visit_eligibility(conn, client_id, rule_dict)
-                
-                elif rule['type_regle'] == 'anniversaire':
-                    eligible = self._check_birthday_eligibility(conn, client_id, rule_dict)
-                
-                elif rule['type_regle'] == 'inactivite':
-                    eligible = self._check_inactivity_eligibility(conn, client_id, rule_dict)
-                
-                # Si le client est éligible, créer l'offre
-                if eligible:
-                    # Vérifier que le client n'a pas déjà cette offre
-                    existing_offer = conn.execute('''
-                        SELECT offre_id FROM offres_client 
-                        WHERE client_id = ? AND regle_id = ?
-                    ''', (client_id, rule['regle_id'])).fetchone()
-                    
-                    if not existing_offer:
-                        # Créer l'offre
-                        expiration_date = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
-                        
-                        conn.execute('''
-                            INSERT INTO offres_client (
-                                client_id, regle_id, recompense_id, date_generation, date_expiration, 
-                                statut, commentaire
-                            ) VALUES (?, ?, ?, date('now'), ?, 'generee', ?)
-                        ''', (
+                # Créer les offres des règles auxquelles le client est éligible
+                new_offers = []
+                for rule in plan['rules']:
+                    if eligibility and eligibility[f"r_{rule['regle_id']}"]:
+                        new_offers.append((
                             client_id,
                             rule['regle_id'],
                             rule['recompense_id'],
-                            expiration_date,
-                            f"Offre générée après scan de ticket"
+                            rule['regle_id'],
+                            client_id,
+                            "Offre générée après scan de ticket"
                         ))
-                        
-                        # Récupérer le nom de la règle
-                        rule_name = rule['nom']
-                        
-                        # Ajouter aux statistiques
-                        offers_generated += 1
                         rules_applied.append({
                             'rule_id': rule['regle_id'],
-                            'rule_name': rule_name,
+                            'rule_name': rule['nom'],
                             'rule_type': rule['type_regle']
                         })
-                        
-                        logger.info(f"Offre créée pour le client {client_id} selon la règle '{rule_name}'")
-            
-            # Générer des codes uniques pour les nouvelles offres
-            conn.execute('''
-                UPDATE offres_client
-                SET code_unique = 'OF-' || offre_id || '-' || substr(hex(randomblob(4)), 1, 8)
-                WHERE code_unique IS NULL OR code_unique = ''
-            ''')
+                        logger.info(f"Offre créée pour le client {client_id} selon la règle '{rule['nom']}'")
+                
+                if new_offers:
+                    execute_with_code_retry(conn, f'''
+                        INSERT INTO offres_client (
+                            client_id, regle_id, recompense_id, date_generation, date_expiration, 
+                            statut, code_unique, commentaire
+                        ) VALUES (
+                            ?, ?, ?, date('now'), date('now', '+{OFFER_VALIDITY_DAYS} days'), 'generee',
+                            {offer_code_sql('?', '?')}, ?
+                        )
+                    ''', new_offers, many=True)
+                    offers_generated = len(new_offers)
+            
+            # Catégorie favorite: recalculée une fois par ticket scanné, pas par ligne de ticket
+            update_favourite_categories(conn, [client_id])
             
             conn.commit()
-            conn.close()
+            
+            duration_ms = (time.perf_counter() - start_time) * 1000
+            LoyaltyManager._client_latencies.append(duration_ms)
             
             return {
                 'success': True,
                 'offers_generated': offers_generated,
-                'rules_applied': rules_applied
+                'rules_applied': rules_applied,
+                'duration_ms': round(duration_ms, 2)
             }
             
         except Exception as e:
@@ -781,191 +679,64 @@ class LoyaltyManager:
                 'offers_generated': 0,
                 'rules_applied': []
             }
+        finally:
+            if conn is not None:
+                conn.close()
+    
+    def get_client_evaluation_latency(self):
+        """
+        Retourne la latence des dernières évaluations par client (scan de ticket).
         
-    def _check_purchase_count_eligibility(self, conn, client_id, rule):
-        """Vérifie si le client est éligible selon le nombre d'achats"""
-        period_condition = ""
-        if rule['periode_jours']:
-            period_condition = f"AND date_transaction >= date('now', '-{rule['periode_jours']} days')"
-        
-        query = f'''
-            SELECT COUNT(DISTINCT transaction_id) as nb_achats
-            FROM transactions
-            WHERE client_id = ?
-            {period_condition}
-        '''
-        
-        result = conn.execute(query, (client_id,)).fetchone()
-        return result and result['nb_achats'] >= rule['condition_valeur']
-
-    def _check_cumulative_amount_eligibility(self, conn, client_id, rule):
-        """Vérifie si le client est éligible selon le montant cumulé"""
-        period_condition = ""
-        if rule['periode_jours']:
-            period_condition = f"AND date_transaction >= date('now', '-{rule['periode_jours']} days')"
-        
-        query = f'''
-            SELECT SUM(montant_total) as montant_cumule
-            FROM transactions
-            WHERE client_id = ?
-            {period_condition}
-        '''
-        
-        result = conn.execute(query, (client_id,)).fetchone()
-        return result and result['montant_cumule'] and result['montant_cumule'] >= rule['condition_valeur']
-
-    def _check_specific_product_eligibility(self, conn, client_id, rule):
-        """Vérifie si le client est éligible selon l'achat d'un produit spécifique"""
-        period_condition = ""
-        if rule['periode_jours']:
-            period_condition = f"AND t.date_transaction >= date('now', '-{rule['periode_jours']} days')"
-        
-        query = f'''
-            SELECT COUNT(*) as count
-            FROM transactions t
-            JOIN details_transactions dt ON t.transaction_id = dt.transaction_id
-            WHERE t.client_id = ?
-            AND dt.produit_id = ?
-            {period_condition}
-        '''
-        
-        result = conn.execute(query, (client_id, rule['condition_valeur'])).fetchone()
-        return result and result['count'] > 0
-
-    def _check_specific_category_eligibility(self, conn, client_id, rule):
-        """Vérifie si le client est éligible selon l'achat dans une catégorie spécifique"""
-        period_condition = ""
-        if rule['periode_jours']:
-            period_condition = f"AND t.date_transaction >= date('now', '-{rule['periode_jours']} days')"
-        
-        query = f'''
-            SELECT COUNT(*) as count
-            FROM transactions t
-            JOIN details_transactions dt ON t.transaction_id = dt.transaction_id
-            JOIN produits p ON dt.produit_id = p.produit_id
-            WHERE t.client_id = ?
-            AND p.categorie_id = ?
-            {period_condition}
-        '''
-        
-        result = conn.execute(query, (client_id, rule['condition_valeur'])).fetchone()
-        return result and result['count'] > 0
-
-    def _check_first_visit_eligibility(self, conn, client_id, rule):
-        """Vérifie si le client est éligible selon sa première visite"""
-        query = '''
-            SELECT MIN(date_transaction) as premiere_visite
-            FROM transactions
-            WHERE client_id = ?
-        '''
-        
-        result = conn.execute(query, (client_id,)).fetchone()
-        if not result or not result['premiere_visite']:
-            return False
-        
-        # Calculer le nombre de jours depuis la première visite
-        first_visit_date = datetime.strptime(result['premiere_visite'], '%Y-%m-%d')
-        days_since_first_visit = (datetime.now() - first_visit_date).days
-        
-        return days_since_first_visit <= rule['condition_valeur']
-
-    def _check_birthday_eligibility(self, conn, client_id, rule):
-        """Vérifie si le client est éligible selon son anniversaire"""
-        # Récupérer la date de naissance
-        query = '''
-            SELECT date_naissance
-            FROM clients
-            WHERE client_id = ?
-        '''
-        
-        result = conn.execute(query, (client_id,)).fetchone()
-        if not result or not result['date_naissance']:
-            return False
-        
-        # Calculer les jours jusqu'au prochain anniversaire
-        birth_date = datetime.strptime(result['date_naissance'], '%Y-%m-%d')
-        today = datetime.now()
-        
-        # Prochain anniversaire cette année
-        next_birthday = datetime(today.year, birth_date.month, birth_date.day)
-        
-        # Si l'anniversaire est déjà passé cette année, prendre celui de l'année prochaine
-        if next_birthday < today:
-            next_birthday = datetime(today.year + 1, birth_date.month, birth_date.day)
+        Returns:
+            dict: Nombre de mesures et percentiles p50/p99 en millisecondes
+        """
+        latencies = sorted(LoyaltyManager._client_latencies)
+        if not latencies:
+            return {'count': 0, 'p50_ms': None, 'p99_ms': None}
         
-        days_until_birthday = (next_birthday - today).days
+        def percentile(p):
+            # Méthode du rang le plus proche
+            index = max(0, math.ceil(p / 100 * len(latencies)) - 1)
+            return round(latencies[index], 2)
         
-        return days_until_birthday <= rule['condition_valeur']
-
-    def _check_inactivity_eligibility(self, conn, client_id, rule):
-        """Vérifie si le client est éligible selon son inactivité"""
-        query = '''
-            SELECT MAX(date_transaction) as derniere_transaction
-            FROM transactions
-            WHERE client_id = ?
-        '''
-        
-        result = conn.execute(query, (client_id,)).fetchone()
-        if not result or not result['derniere_transaction']:
-            return False
-        
-        # Calculer le nombre de jours depuis la dernière transaction
-        last_transaction_date = datetime.strptime(result['derniere_transaction'], '%Y-%m-%d')
-        days_since_last_transaction = (datetime.now() - last_transaction_date).days
-        
-        return days_since_last_transaction >= rule['condition_valeur']
+        return {
+            'count': len(latencies),
+            'p50_ms': percentile(50),
+            'p99_ms': percentile(99),
+            'max_ms': round(latencies[-1], 2)
+        }
     
     def send_offers(self, offer_ids=None, channel='email'):
         """
-        Envoie les offres générées aux clients.
+        Met en file d'envoi les offres générées.
+        
+        La livraison est assurée par les workers d'OfferDeliveryService, qui passent
+        les offres au statut 'envoyee' une fois livrées: cette méthode n'attend pas l'envoi.
         
         Args:
             offer_ids (list, optional): Liste des IDs d'offres à envoyer. Si None, toutes les offres générées seront envoyées.
-            channel (str): Canal d'envoi (email, sms, push, etc.)
+            channel (str): Canal d'envoi (email, sms, notification_app)
             
         Returns:
             dict: Résultat de l'opération
         """
+        conn = None
         try:
             conn = self._get_connection()
             
-            # Préparer la requête SQL
-            if offer_ids:
-                placeholders = ','.join(['?' for _ in offer_ids])
-                query = f'''
-                    UPDATE offres_client
-                    SET statut = 'envoyee', 
-                        date_envoi = CURRENT_TIMESTAMP,
-                        canal_envoi = ?
-                    WHERE offre_id IN ({placeholders})
-                    AND statut = 'generee'
-                '''
-                params = [channel] + offer_ids
-            else:
-                query = '''
-                    UPDATE offres_client
-                    SET statut = 'envoyee', 
-                        date_envoi = CURRENT_TIMESTAMP,
-                        canal_envoi = ?
-                    WHERE statut = 'generee'
-                '''
-                params = [channel]
-            
-            # Exécuter la mise à jour
-            cursor = conn.execute(query, params)
-            
-            # Récupérer le nombre d'offres envoyées
-            offers_sent = cursor.rowcount
+            offers_queued = enqueue_offers(conn, offer_ids, channel)
             
             conn.commit()
-            conn.close()
             
-            logger.info(f"{offers_sent} offres envoyées via {channel}")
-            return {'success': True, 'offers_sent': offers_sent}
+            logger.info(f"{offers_queued} offres mises en file d'envoi via {channel}")
+            return {'success': True, 'offers_queued': offers_queued}
             
         except Exception as e:
             logger.error(f"Erreur lors de l'envoi des offres: {str(e)}")
             return {'success': False, 'error': str(e)}
+        finally:
+            if conn is not None:
+                conn.close()
     
     def use_offer(self, offer_code, transaction_id=None):
         """
@@ -978,6 +749,7 @@ class LoyaltyManager:
         Returns:
             dict: Résultat de l'opération
         """
+        conn = None
         try:
             conn = self._get_connection()
             
@@ -998,61 +770,19 @@ class LoyaltyManager:
                     'error': 'Code offre invalide, expiré ou déjà utilisé'
                 }
             
-            # Mettre à jour le statut de l'offre
+            # Mettre à jour le statut de l'offre; pour les offres 'offre_points', le trigger
+            # after_offer_used crédite les points et les inscrit dans l'historique
             conn.execute('''
                 UPDATE offres_client
-                SET statut = 'utilisee', 
-                    date_utilisation = CURRENT_TIMESTAMP,
-                    transaction_utilisation_id = ?
+                SET statut = 'utilisee',
+                    utilisation_transaction_id = ?
                 WHERE offre_id = ?
             ''', (transaction_id, offer['offre_id']))
             
-            # Appliquer la récompense selon le type d'action
-            if offer['action_type'] == 'offre_points':
-                # Ajouter les points au client
-                points_to_add = int(offer['action_valeur'])
-                
-                # Récupérer les points actuels
-                client_points = conn.execute('''
-                    SELECT points_actuels FROM cartes_fidelite WHERE client_id = ?
-                ''', (offer['client_id'],)).fetchone()
-                
-                if client_points:
-                    new_points = client_points['points_actuels'] + points_to_add
-                    
-                    # Mettre à jour les points
-                    conn.execute('''
-                        UPDATE cartes_fidelite
-                        SET points_actuels = ?,
-                            date_derniere_activite = CURRENT_TIMESTAMP
-                        WHERE client_id = ?
-                    ''', (new_points, offer['client_id']))
-                    
-                    # Ajouter à l'historique des points
-                    conn.execute('''
-                        INSERT INTO historique_points (
-                            client_id, date_operation, type_operation, points, 
-                            transaction_id, commentaire
-                        ) VALUES (?, CURRENT_TIMESTAMP, 'ajout', ?, ?, ?)
-                    ''', (
-                        offer['client_id'],
-                        points_to_add,
-                        transaction_id,
-                        f"Points offerts via programme de fidélité (offre #{offer['offre_id']})"
-                    ))
-                else:
-                    return {
-                        'success': False,
-                        'error': 'Carte de fidélité non trouvée pour le client'
-                    }
-            
-            elif offer['action_type'] in ['reduction_pourcentage', 'reduction_montant']:
-                # Pour les réductions, rien à faire ici car elles sont appliquées 
-                # directement au moment de la transaction
-                pass
+            # Pour les réductions, rien à faire ici car elles sont appliquées
+            # directement au moment de la transaction
             
             conn.commit()
-            conn.close()
             
             return {
                 'success': True,
@@ -1064,37 +794,68 @@ class LoyaltyManager:
         except Exception as e:
             logger.error(f"Erreur lors de l'utilisation de l'offre: {str(e)}")
             return {'success': False, 'error': str(e)}
+        finally:
+            if conn is not None:
+                conn.close()
     
-    def check_expired_offers(self):
+    def check_expired_offers(self, chunk_size=EXPIRY_CHUNK_SIZE):
         """
         Vérifie et marque les offres expirées.
         
+        Les offres sont parcourues par l'index (statut, date_expiration) et marquées par lots,
+        chaque lot étant validé séparément pour ne jamais garder longtemps le verrou d'écriture.
+        Le coût dépend du nombre d'offres arrivant à expiration, pas de la taille de la table.
+        
+        Args:
+            chunk_size (int): Nombre d'offres marquées par transaction
+        
         Returns:
             dict: Résultat de l'opération
         """
+        conn = None
         try:
+            start_time = time.perf_counter()
             conn = self._get_connection()
             
-            # Marquer les offres expirées
-            cursor = conn.execute('''
-                UPDATE offres_client
-                SET statut = 'expiree'
-                WHERE date_expiration < date('now')
-                AND statut IN ('generee', 'envoyee')
-            ''')
-            
-            # Récupérer le nombre d'offres expirées
-            offers_expired = cursor.rowcount
+            offers_expired = 0
+            chunks = 0
             
-            conn.commit()
-            conn.close()
+            while True:
+                # Marquer un lot d'offres expirées
+                cursor = conn.execute('''
+                    UPDATE offres_client
+                    SET statut = 'expiree'
+                    WHERE offre_id IN (
+                        SELECT offre_id
+                        FROM offres_client
+                        WHERE statut IN ('generee', 'envoyee')
+                        AND date_expiration < date('now')
+                        LIMIT ?
+                    )
+                ''', (chunk_size,))
+                conn.commit()
+                
+                offers_expired += cursor.rowcount
+                chunks += 1
+                
+                if cursor.rowcount < chunk_size:
+                    break
             
-            logger.info(f"{offers_expired} offres marquées comme expirées")
-            return {'success': True, 'offers_expired': offers_expired}
+            duration_ms = int((time.perf_counter() - start_time) * 1000)
+            logger.info(f"{offers_expired} offres marquées comme expirées en {chunks} lots ({duration_ms} ms)")
+            return {
+                'success': True,
+                'offers_expired': offers_expired,
+                'chunks': chunks,
+                'duration_ms': duration_ms
+            }
             
         except Exception as e:
             logger.error(f"Erreur lors de la vérification des offres expirées: {str(e)}")
             return {'success': False, 'error': str(e)}
+        finally:
+            if conn is not None:
+                conn.close()
     
     def add_points(self, client_id, points, transaction_id=None, comment=None):
         """
@@ -1109,6 +870,7 @@ class LoyaltyManager:
         Returns:
             dict: Résultat de l'opération
         """
+        conn = None
         try:
             conn = self._get_connection()
             
@@ -1121,17 +883,20 @@ class LoyaltyManager:
             
             if not carte:
                 # Créer une nouvelle carte de fidélité
-                conn.execute('''
-                    INSERT INTO cartes_fidelite (
-                        client_id, points_actuels, points_en_attente, niveau_fidelite,
-                        date_creation, date_derniere_activite
-                    ) VALUES (?, ?, 0, 'standard', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                ''', (client_id, points))
-                
                 new_points = points
-                old_level = 'standard'
-                new_level = 'standard'
+                new_level = self._calculate_loyalty_level(new_points)
+                old_level = new_level
+                
+                cursor = conn.execute('''
+                    INSERT INTO cartes_fidelite (
+                        client_id, numero_carte, points_actuels, points_en_attente, niveau_fidelite,
+                        date_emission, date_derniere_activite
+                    ) VALUES (?, ?, ?, 0, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                ''', (client_id, f"FID{client_id:06d}", new_points, new_level))
+                carte_id = cursor.lastrowid
             else:
+                carte_id = carte['carte_id']
+                
                 # Mettre à jour les points
                 new_points = carte['points_actuels'] + points
                 old_level = carte['niveau_fidelite']
@@ -1150,14 +915,16 @@ class LoyaltyManager:
             # Ajouter à l'historique des points
             conn.execute('''
                 INSERT INTO historique_points (
-                    client_id, date_operation, type_operation, points, 
-                    transaction_id, commentaire
-                ) VALUES (?, CURRENT_TIMESTAMP, 'ajout', ?, ?, ?)
+                    client_id, carte_id, date_operation, type_operation, points,
+                    transaction_id, description, solde_apres
+                ) VALUES (?, ?, CURRENT_TIMESTAMP, 'gain', ?, ?, ?, ?)
             ''', (
                 client_id,
+                carte_id,
                 points,
                 transaction_id,
-                comment or "Ajout de points"
+                comment or "Ajout de points",
+                new_points
             ))
             
             # Si le niveau a changé, enregistrer l'événement
@@ -1176,7 +943,6 @@ class LoyaltyManager:
                 ))
             
             conn.commit()
-            conn.close()
             
             return {
                 'success': True,
@@ -1189,6 +955,9 @@ class LoyaltyManager:
         except Exception as e:
             logger.error(f"Erreur lors de l'ajout de points: {str(e)}")
             return {'success': False, 'error': str(e)}
+        finally:
+            if conn is not None:
+                conn.close()
     
     def use_points(self, client_id, points, transaction_id=None, comment=None):
         """
@@ -1203,6 +972,7 @@ class LoyaltyManager:
         Returns:
             dict: Résultat de l'opération
         """
+        conn = None
         try:
             conn = self._get_connection()
             
@@ -1243,14 +1013,16 @@ class LoyaltyManager:
             # Ajouter à l'historique des points
             conn.execute('''
                 INSERT INTO historique_points (
-                    client_id, date_operation, type_operation, points, 
-                    transaction_id, commentaire
-                ) VALUES (?, CURRENT_TIMESTAMP, 'utilisation', ?, ?, ?)
+                    client_id, carte_id, date_operation, type_operation, points,
+                    transaction_id, description, solde_apres
+                ) VALUES (?, ?, CURRENT_TIMESTAMP, 'utilisation', ?, ?, ?, ?)
             ''', (
                 client_id,
+                carte['carte_id'],
                 points,
                 transaction_id,
-                comment or "Utilisation de points"
+                comment or "Utilisation de points",
+                new_points
             ))
             
             # Si le niveau a changé, enregistrer l'événement
@@ -1269,7 +1041,6 @@ class LoyaltyManager:
                 ))
             
             conn.commit()
-            conn.close()
             
             return {
                 'success': True,
@@ -1282,6 +1053,326 @@ class LoyaltyManager:
         except Exception as e:
             logger.error(f"Erreur lors de l'utilisation de points: {str(e)}")
             return {'success': False, 'error': str(e)}
+        finally:
+            if conn is not None:
+                conn.close()
+    
+    def apply_points_batch(self, movements):
+        """
+        Applique un lot de mouvements de points (fin de journée des caisses) en une seule transaction.
+        
+        Les mouvements d'un même client sont appliqués dans l'ordre du lot; une utilisation
+        dépassant le solde disponible est rejetée sans bloquer le reste du lot. Comme avec
+        add_points, un client sans carte en reçoit une à son premier gain. Les soldes sont
+        calculés en un seul passage sur le lot, puis écrits avec executemany.
+        
+        Args:
+            movements (list): Mouvements {'client_id', 'points', 'type_operation' (gain par défaut),
+                'transaction_id', 'comment'}
+        
+        Returns:
+            dict: Résultat de l'opération avec le détail de chaque mouvement
+        """
+        conn = None
+        try:
+            start_time = time.perf_counter()
+            
+            if not movements:
+                return {'success': True, 'applied': 0, 'rejected': 0, 'results': [], 'duration_ms': 0}
+            
+            df = pd.DataFrame({
+                'client_id': pd.to_numeric([m.get('client_id') for m in movements], errors='coerce'),
+                'points': pd.to_numeric([m.get('points') for m in movements], errors='coerce'),
+                'type_operation': [m.get('type_operation') or 'gain' for m in movements],
+                'transaction_id': [m.get('transaction_id') for m in movements],
+                'comment': [m.get('comment') for m in movements],
+                'error': None
+            })
+            
+            df.loc[~df['type_operation'].isin(POINT_OPERATIONS), 'error'] = "Type d'opération invalide"
+            df.loc[df['points'].isna() | (df['points'] <= 0) | (df['points'] % 1 != 0), 'error'] = "Format de points invalide"
+            df.loc[df['client_id'].isna(), 'error'] = "Client non spécifié"
+            
+            conn = self._get_connection()
+            
+            # Carte créée pour les clients qui gagnent leurs premiers points, comme add_points
+            credits = df['error'].isna() & (df['type_operation'] != 'utilisation')
+            new_clients = [row[0] for row in conn.execute('''
+                SELECT c.client_id FROM clients c
+                WHERE c.client_id IN (SELECT value FROM json_each(?))
+                AND NOT EXISTS (SELECT 1 FROM cartes_fidelite cf WHERE cf.client_id = c.client_id)
+            ''', (json.dumps(df.loc[credits, 'client_id'].astype(np.int64).unique().tolist()),))]
+            initial_level = self._levels_for_points(conn, np.zeros(1), pd.Series([CARD_LEVELS[0]]))[0]
+            conn.executemany('''
+                INSERT INTO cartes_fidelite (
+                    client_id, numero_carte, points_actuels, points_en_attente, niveau_fidelite,
+                    date_emission, date_derniere_activite
+                ) VALUES (?, ?, 0, 0, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+            ''', [(client_id, f"FID{client_id:06d}", str(initial_level)) for client_id in new_clients])
+            
+            # Cartes de tous les clients du lot en une seule requête
+            client_ids = df['client_id'].dropna().astype(np.int64).unique().tolist()
+            cards = pd.read_sql_query('''
+                SELECT client_id, carte_id, points_actuels, niveau_fidelite
+                FROM cartes_fidelite
+                WHERE client_id IN (SELECT value FROM json_each(?))
+                AND statut = 'active'
+            ''', conn, params=(json.dumps(client_ids),)).drop_duplicates('client_id')
+            
+            df = df.merge(cards, on='client_id', how='left')
+            df.loc[df['error'].isna() & df['carte_id'].isna(), 'error'] = "Carte de fidélité non trouvée pour le client"
+            df['delta'] = np.where(df['type_operation'] == 'utilisation', -df['points'], df['points'])
+            
+            # Soldes successifs en un seul passage dans l'ordre du lot: une utilisation
+            # rendant le solde négatif est rejetée et ne compte pas pour la suite
+            balances = dict(zip(cards['carte_id'], cards['points_actuels'].fillna(0)))
+            errors = [None if pd.isna(error) else error for error in df['error']]
+            soldes = [None] * len(df)
+            for index, (carte_id, delta) in enumerate(zip(df['carte_id'], df['delta'])):
+                if errors[index] is not None:
+                    continue
+                balance = balances[carte_id] + delta
+                if balance < 0:
+                    errors[index] = 'Points insuffisants'
+                    continue
+                balances[carte_id] = soldes[index] = balance
+            df['error'] = pd.Series(errors, index=df.index, dtype=object)
+            df['solde_apres'] = pd.to_numeric(pd.Series(soldes, index=df.index, dtype=object))
+            
+            applied = df[df['error'].isna()]
+            
+            # Solde et niveau final de chaque carte
+            final = applied.groupby('carte_id').agg(
+                client_id=('client_id', 'last'),
+                points_actuels=('solde_apres', 'last'),
+                ancien_niveau=('niveau_fidelite', 'last')
+            ).reset_index()
+            final['niveau_fidelite'] = self._levels_for_points(
+                conn, final['points_actuels'].to_numpy(), final['ancien_niveau']
+            )
+            # Pas d'événement de changement de niveau pour une carte créée par le lot
+            created = final['client_id'].isin(new_clients)
+            final.loc[created, 'ancien_niveau'] = final.loc[created, 'niveau_fidelite']
+            
+            conn.executemany('''
+                UPDATE cartes_fidelite
+                SET points_actuels = ?,
+                    niveau_fidelite = ?,
+                    date_derniere_activite = CURRENT_TIMESTAMP
+                WHERE carte_id = ?
+            ''', zip(
+                final['points_actuels'].astype(int).tolist(),
+                final['niveau_fidelite'].tolist(),
+                final['carte_id'].astype(int).tolist()
+            ))
+            
+            conn.executemany('''
+                INSERT INTO historique_points (
+                    client_id, carte_id, date_operation, type_operation, points,
+                    transaction_id, description, solde_apres
+                ) VALUES (?, ?, CURRENT_TIMESTAMP, ?, ?, ?, ?, ?)
+            ''', zip(
+                applied['client_id'].astype(int).tolist(),
+                applied['carte_id'].astype(int).tolist(),
+                applied['type_operation'].tolist(),
+                applied['points'].astype(int).tolist(),
+                [None if pd.isna(t) else t for t in applied['transaction_id']],
+                [c or ("Utilisation de points" if t == 'utilisation' else "Ajout de points")
+                 for c, t in zip(applied['comment'], applied['type_operation'])],
+                applied['solde_apres'].astype(int).tolist()
+            ))
+            
+            # Si le niveau a changé, enregistrer l'événement
+            changed = final[final['niveau_fidelite'] != final['ancien_niveau']]
+            conn.executemany('''
+                INSERT INTO evenements_client (
+                    client_id, type_evenement, date_evenement, details
+                ) VALUES (?, 'changement_niveau', CURRENT_TIMESTAMP, ?)
+            ''', [
+                (int(row.client_id), json.dumps({
+                    'ancien_niveau': row.ancien_niveau,
+                    'nouveau_niveau': row.niveau_fidelite,
+                    'points': int(row.points_actuels)
+                }))
+                for row in changed.itertuples(index=False)
+            ])
+            
+            conn.commit()
+            
+            levels = dict(zip(final['carte_id'], final['niveau_fidelite']))
+            results = []
+            for index, row in enumerate(df.itertuples(index=False)):
+                if row.error is None:
+                    results.append({
+                        'index': index,
+                        'client_id': int(row.client_id),
+                        'success': True,
+                        'new_total': int(row.solde_apres),
+                        'loyalty_level': levels[row.carte_id]
+                    })
+                else:
+                    results.append({
+                        'index': index,
+                        'client_id': None if pd.isna(row.client_id) else int(row.client_id),
+                        'success': False,
+                        'error': row.error
+                    })
+            
+            duration = time.perf_counter() - start_time
+            logger.info(
+                f"Lot de points appliqué: {len(applied)} mouvements, "
+                f"{len(df) - len(applied)} rejetés en {duration * 1000:.0f} ms"
+            )
+            
+            return {
+                'success': True,
+                'applied': len(applied),
+                'rejected': len(df) - len(applied),
+                'level_changes': len(changed),
+                'cards_created': len(new_clients),
+                'results': results,
+                'duration_ms': round(duration * 1000, 2),
+                'movements_per_sec': round(len(df) / duration, 1)
+            }
+        
+        except Exception as e:
+            logger.error(f"Erreur lors de l'application du lot de points: {str(e)}")
+            return {'success': False, 'error': str(e)}
+        finally:
+            if conn is not None:
+                conn.close()
+    
+    def _levels_for_points(self, conn, points, current_levels):
+        """
+        Calcule le niveau de carte correspondant à chaque solde de points.
+        
+        Les paliers de niveaux_fidelite, triés par points minimum, correspondent dans
+        l'ordre aux niveaux de carte de CARD_LEVELS.
+        
+        Args:
+            conn (sqlite3.Connection): Connexion à la base de données
+            points (numpy.ndarray): Soldes de points
+            current_levels (pandas.Series): Niveaux actuels, conservés si aucun palier n'est défini
+        
+        Returns:
+            numpy.ndarray: Niveau de chaque carte
+        """
+        thresholds = np.array([
+            row[0] for row in conn.execute("SELECT points_minimum FROM niveaux_fidelite ORDER BY points_minimum")
+        ][:len(CARD_LEVELS)])
+        
+        if len(thresholds) == 0:
+            return current_levels.to_numpy()
+        
+        tiers = np.clip(np.searchsorted(thresholds, points, side='right') - 1, 0, None)
+        return np.array(CARD_LEVELS)[tiers]
+    
+    def recompute_loyalty_levels(self, chunk_size=LEVEL_UPDATE_CHUNK_SIZE):
+        """
+        Recalcule le niveau de toutes les cartes de fidélité selon les paliers actuels.
+        
+        Les cartes sont lues par blocs (fetchmany) et classées avec NumPy; seules celles
+        dont le niveau change sont réécrites, par lots, avec les événements de changement
+        de niveau correspondants. Une carte dont le solde a changé depuis sa lecture n'est
+        pas modifiée: son niveau a déjà été recalculé par l'opération concurrente.
+        
+        Args:
+            chunk_size (int): Nombre de cartes lues par bloc et mises à jour par transaction
+        
+        Returns:
+            dict: Résultat de l'opération
+        """
+        conn = None
+        try:
+            start_time = time.perf_counter()
+            conn = self._get_connection()
+            
+            # Les cartes à modifier sont posées dans une table temporaire avec le solde lu:
+            # la mise à jour et les événements de chaque lot sont ensuite écrits en deux
+            # requêtes ensemblistes, limitées aux cartes dont le solde n'a pas changé
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS niveaux_recalcules (carte_id INTEGER PRIMARY KEY, niveau TEXT, points INTEGER)")
+            conn.execute("DELETE FROM temp.niveaux_recalcules")
+            
+            cards_checked = 0
+            by_level = {}
+            cursor = conn.execute("SELECT carte_id, COALESCE(points_actuels, 0), niveau_fidelite FROM cartes_fidelite")
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                
+                points = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+                current_levels = pd.Series([row[2] for row in rows], dtype=object)
+                levels = self._levels_for_points(conn, points, current_levels)
+                changed = np.flatnonzero(levels != current_levels.to_numpy())
+                
+                conn.executemany(
+                    "INSERT INTO temp.niveaux_recalcules (carte_id, niveau, points) VALUES (?, ?, ?)",
+                    [(rows[index][0], str(levels[index]), int(points[index])) for index in changed]
+                )
+                
+                cards_checked += len(rows)
+                for level, count in pd.Series(levels).value_counts().items():
+                    by_level[str(level)] = by_level.get(str(level), 0) + int(count)
+            
+            # Fin de la lecture: les écritures partent des soldes actuels
+            conn.commit()
+            
+            cards_updated = 0
+            last_rowid = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM temp.niveaux_recalcules").fetchone()[0]
+            for offset in range(0, last_rowid, chunk_size):
+                bounds = (offset, offset + chunk_size)
+                
+                conn.execute('''
+                    INSERT INTO evenements_client (
+                        client_id, type_evenement, date_evenement, details
+                    )
+                    SELECT
+                        cf.client_id, 'changement_niveau', CURRENT_TIMESTAMP,
+                        json_object(
+                            'ancien_niveau', cf.niveau_fidelite,
+                            'nouveau_niveau', n.niveau,
+                            'points', cf.points_actuels,
+                            'origine', 'recalcul_niveaux'
+                        )
+                    FROM temp.niveaux_recalcules n
+                    JOIN cartes_fidelite cf ON cf.carte_id = n.carte_id
+                    WHERE n.rowid > ? AND n.rowid <= ?
+                    AND cf.points_actuels = n.points AND cf.niveau_fidelite IS NOT n.niveau
+                ''', bounds)
+                
+                cursor = conn.execute('''
+                    UPDATE cartes_fidelite
+                    SET niveau_fidelite = n.niveau
+                    FROM temp.niveaux_recalcules n
+                    WHERE n.carte_id = cartes_fidelite.carte_id
+                    AND n.rowid > ? AND n.rowid <= ?
+                    AND cartes_fidelite.points_actuels = n.points
+                    AND cartes_fidelite.niveau_fidelite IS NOT n.niveau
+                ''', bounds)
+                cards_updated += cursor.rowcount
+                
+                conn.commit()
+            
+            conn.execute("DROP TABLE IF EXISTS temp.niveaux_recalcules")
+            
+            duration_ms = int((time.perf_counter() - start_time) * 1000)
+            logger.info(f"Niveaux recalculés: {cards_updated} cartes modifiées sur {cards_checked} en {duration_ms} ms")
+            
+            return {
+                'success': True,
+                'cards_checked': cards_checked,
+                'cards_updated': cards_updated,
+                'by_level': by_level,
+                'duration_ms': duration_ms
+            }
+        
+        except Exception as e:
+            logger.error(f"Erreur lors du recalcul des niveaux de fidélité: {str(e)}")
+            return {'success': False, 'error': str(e)}
+        finally:
+            if conn is not None:
+                conn.close()
     
     def _calculate_loyalty_level(self, points):
             """
@@ -1293,29 +1384,21 @@ class LoyaltyManager:
             Returns:
                 str: Niveau de fidélité
             """
+            conn = None
             try:
                 conn = self._get_connection()
                 
-                # Récupérer le niveau correspondant aux points
-                level = conn.execute("""
-                    SELECT nom
-                    FROM niveaux_fidelite
-                    WHERE points_minimum <= ? AND (points_maximum >= ? OR points_maximum IS NULL)
-                    ORDER BY points_minimum DESC
-                    LIMIT 1
-                """, (points, points)).fetchone()
-                
-                conn.close()
+                # Niveau de carte correspondant au palier de niveaux_fidelite atteint
+                level = self._levels_for_points(conn, np.array([points]), pd.Series([CARD_LEVELS[0]]))[0]
                 
-                # Retourner le niveau trouvé ou le niveau par défaut
-                if level:
-                    return level['nom']
-                else:
-                    return 'Standard'  # Niveau par défaut
+                return str(level)
                     
             except Exception as e:
                 logger.error(f"Erreur lors du calcul du niveau de fidélité: {str(e)}")
-                return 'Standard'  # En cas d'erreur, utiliser le niveau par défaut
+                return CARD_LEVELS[0]  # En cas d'erreur, utiliser le niveau par défaut
+            finally:
+                if conn is not None:
+                    conn.close()
     
     def get_client_loyalty_info(self, client_id):
         """
@@ -1327,6 +1410,7 @@ class LoyaltyManager:
         Returns:
             dict: Informations de fidélité
         """
+        conn = None
         try:
             conn = self._get_connection()
             
@@ -1334,7 +1418,7 @@ class LoyaltyManager:
             client = conn.execute('''
                 SELECT 
                     c.client_id, c.prenom, c.nom, c.email, c.telephone, 
-                    c.date_naissance, c.date_creation, c.segment,
+                    c.date_naissance, c.date_inscription, c.segment,
                     cf.carte_id, cf.points_actuels, cf.points_en_attente, 
                     cf.niveau_fidelite, cf.date_derniere_activite
                 FROM clients c
@@ -1355,13 +1439,15 @@ class LoyaltyManager:
             offres = conn.execute('''
                 SELECT 
                     oc.offre_id, oc.regle_id, oc.recompense_id, 
-                    oc.date_generation, oc.date_envoi, oc.date_utilisation, 
+                    oc.date_generation, oc.date_envoi, oc.canal_envoi,
                     oc.date_expiration, oc.statut, oc.code_unique,
+                    oc.utilisation_transaction_id, tu.date_transaction as date_utilisation,
                     r.nom as nom_regle, r.action_type, r.action_valeur,
                     rec.nom as nom_recompense
                 FROM offres_client oc
                 JOIN regles_fidelite r ON oc.regle_id = r.regle_id
                 LEFT JOIN recompenses rec ON oc.recompense_id = rec.recompense_id
+                LEFT JOIN transactions tu ON oc.utilisation_transaction_id = tu.transaction_id
                 WHERE oc.client_id = ?
                 ORDER BY oc.date_generation DESC
             ''', (client_id,)).fetchall()
@@ -1372,7 +1458,7 @@ class LoyaltyManager:
             historique = conn.execute('''
                 SELECT 
                     hp.historique_id, hp.date_operation, hp.type_operation, 
-                    hp.points, hp.transaction_id, hp.commentaire,
+                    hp.points, hp.transaction_id, hp.description, hp.solde_apres,
                     t.montant_total, t.date_transaction
                 FROM historique_points hp
                 LEFT JOIN transactions t ON hp.transaction_id = t.transaction_id
@@ -1403,22 +1489,26 @@ class LoyaltyManager:
                         pass
                 client_info['evenements'].append(evt_dict)
             
-            # Statistiques supplémentaires
+            # Statistiques supplémentaires (agrégats matérialisés dans client_stats)
             stats = conn.execute('''
                 SELECT 
-                    COUNT(t.transaction_id) as nb_transactions,
-                    SUM(t.montant_total) as montant_total,
-                    AVG(t.montant_total) as panier_moyen,
-                    SUM(t.points_gagnes) as points_gagnes_total,
-                    MAX(t.date_transaction) as derniere_transaction
-                FROM transactions t
-                WHERE t.client_id = ?
+                    cs.nb_achats_total as nb_transactions,
+                    cs.montant_total,
+                    CASE WHEN cs.nb_achats_total > 0 THEN cs.montant_total / cs.nb_achats_total END as panier_moyen,
+                    (SELECT SUM(t.points_gagnes) FROM transactions t 
+                     WHERE t.client_id = cs.client_id) as points_gagnes_total,
+                    cs.derniere_visite as derniere_transaction,
+                    cs.premiere_visite as premiere_transaction,
+                    cs.nb_achats_30j, cs.montant_30j,
+                    cs.nb_achats_90j, cs.montant_90j,
+                    cs.nb_achats_365j, cs.montant_365j,
+                    cs.categorie_favorite_id
+                FROM client_stats cs
+                WHERE cs.client_id = ?
             ''', (client_id,)).fetchone()
             
             client_info['statistiques'] = dict(stats) if stats else {}
             
-            conn.close()
-            
             return {
                 'success': True,
                 'client_info': client_info
@@ -1427,38 +1517,124 @@ class LoyaltyManager:
         except Exception as e:
             logger.error(f"Erreur lors de la récupération des informations de fidélité: {str(e)}")
             return {'success': False, 'error': str(e)}
+        finally:
+            if conn is not None:
+                conn.close()
     
-    def get_loyalty_stats(self, period=30):
+    def get_loyalty_stats(self, period=30, max_age=STATS_CACHE_MAX_AGE):
         """
         Récupère les statistiques du programme de fidélité.
         
+        Les statistiques sont servies depuis un cache par période. Au-delà de max_age
+        secondes, la valeur en cache est tout de même retournée et un recalcul est lancé
+        en arrière-plan; seul le tout premier appel pour une période calcule en direct.
+        
         Args:
             period (int): Période en jours pour les statistiques
-            
+            max_age (int): Âge maximal (en secondes) des statistiques servies sans recalcul
+        
         Returns:
             dict: Statistiques du programme
         """
+        cached = LoyaltyManager._stats_cache.get((self.db_path, period))
+        
+        if not cached:
+            return self.refresh_loyalty_stats(period)
+        
+        age = time.monotonic() - cached['computed_at']
+        if age > max_age:
+            self._refresh_loyalty_stats_async(period)
+        
+        return dict(cached['result'], cache_age_s=round(age, 1))
+    
+    def refresh_loyalty_stats(self, period=30):
+        """
+        Recalcule les statistiques du programme de fidélité et met à jour le cache.
+        
+        Args:
+            period (int): Période en jours pour les statistiques
+        
+        Returns:
+            dict: Statistiques du programme
+        """
+        result = self._compute_loyalty_stats(period)
+        
+        if result['success']:
+            LoyaltyManager._stats_cache[(self.db_path, period)] = {
+                'computed_at': time.monotonic(),
+                'result': result
+            }
+        
+        return dict(result, cache_age_s=0.0)
+    
+    def _refresh_loyalty_stats_async(self, period):
+        """
+        Lance le recalcul des statistiques d'une période dans un thread, s'il n'est pas déjà en cours.
+        
+        Args:
+            period (int): Période en jours pour les statistiques
+        """
+        key = (self.db_path, period)
+        
+        with LoyaltyManager._stats_lock:
+            if key in LoyaltyManager._stats_refreshing:
+                return
+            LoyaltyManager._stats_refreshing.add(key)
+        
+        def refresh():
+            try:
+                self.refresh_loyalty_stats(period)
+            finally:
+                with LoyaltyManager._stats_lock:
+                    LoyaltyManager._stats_refreshing.discard(key)
+        
+        threading.Thread(target=refresh, name=f"loyalty-stats-{period}", daemon=True).start()
+    
+    def _compute_loyalty_stats(self, period):
+        """
+        Calcule les statistiques du programme de fidélité.
+        
+        Les statistiques d'offres sont lues dans le résumé journalier offres_stats_jour.
+        
+        Args:
+            period (int): Période en jours pour les statistiques
+        
+        Returns:
+            dict: Statistiques du programme
+        """
+        conn = None
         try:
+            start_time = time.perf_counter()
             conn = self._get_connection()
             
             # Statistiques générales
-            stats = conn.execute('''
-                SELECT 
+            stats = dict(conn.execute('''
+                SELECT
                     COUNT(DISTINCT c.client_id) as total_clients,
-                    COUNT(DISTINCT oc.offre_id) as total_offres,
-                    SUM(CASE WHEN oc.statut = 'utilisee' THEN 1 ELSE 0 END) as offres_utilisees,
-                    AVG(CASE WHEN oc.statut = 'utilisee' THEN 1.0 ELSE 0.0 END) * 100 as taux_utilisation,
                     COUNT(DISTINCT cf.carte_id) as total_cartes,
                     AVG(cf.points_actuels) as points_moyens
                 FROM clients c
-                LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.date_generation >= date('now', '-' || ? || ' days')
                 LEFT JOIN cartes_fidelite cf ON c.client_id = cf.client_id
                 WHERE c.statut = 'actif'
+            ''').fetchone())
+            
+            offres = conn.execute('''
+                SELECT
+                    COALESCE(SUM(nb_offres), 0) as total_offres,
+                    COALESCE(SUM(CASE WHEN statut = 'utilisee' THEN nb_offres ELSE 0 END), 0) as offres_utilisees
+                FROM offres_stats_jour
+                WHERE jour >= date('now', '-' || ? || ' days')
             ''', (period,)).fetchone()
             
+            stats['total_offres'] = offres['total_offres']
+            stats['offres_utilisees'] = offres['offres_utilisees']
+            stats['taux_utilisation'] = (
+                offres['offres_utilisees'] / offres['total_offres'] * 100 if offres['total_offres'] else 0.0
+            )
+            
             # Statistiques par niveau de fidélité
             stats_niveaux = conn.execute('''
-                SELECT 
+                SELECT
                     cf.niveau_fidelite,
                     COUNT(cf.client_id) as nb_clients,
                     AVG(cf.points_actuels) as points_moyens
@@ -1470,56 +1646,102 @@ class LoyaltyManager:
             
             # Statistiques par statut d'offre
             stats_statuts = conn.execute('''
-                SELECT 
+                SELECT
                     statut,
-                    COUNT(*) as nb_offres
-                FROM offres_client
-                WHERE date_generation >= date('now', '-' || ? || ' days')
+                    SUM(nb_offres) as nb_offres
+                FROM offres_stats_jour
+                WHERE jour >= date('now', '-' || ? || ' days')
                 GROUP BY statut
+                HAVING nb_offres > 0
             ''', (period,)).fetchall()
             
             # Nombre d'offres par mois (dernière année)
             offres_par_mois = conn.execute('''
-                SELECT 
-                    strftime('%Y-%m', date_generation) as mois,
-                    COUNT(*) as nb_offres
-                FROM offres_client
-                WHERE date_generation >= date('now', '-1 year')
+                SELECT
+                    strftime('%Y-%m', jour) as mois,
+                    SUM(nb_offres) as nb_offres
+                FROM offres_stats_jour
+                WHERE jour >= date('now', '-1 year')
                 GROUP BY mois
+                HAVING nb_offres > 0
                 ORDER BY mois
             ''').fetchall()
             
             # Règles les plus efficaces (taux d'utilisation)
             regles_efficaces = conn.execute('''
-                SELECT 
+                SELECT
                     r.regle_id, r.nom, r.type_regle,
-                    COUNT(oc.offre_id) as offres_generees,
-                    SUM(CASE WHEN oc.statut = 'utilisee' THEN 1 ELSE 0 END) as offres_utilisees,
-                    CAST(SUM(CASE WHEN oc.statut = 'utilisee' THEN 1 ELSE 0 END) AS FLOAT) / 
-                    CAST(COUNT(oc.offre_id) AS FLOAT) * 100 as taux_utilisation
+                    SUM(s.nb_offres) as offres_generees,
+                    SUM(CASE WHEN s.statut = 'utilisee' THEN s.nb_offres ELSE 0 END) as offres_utilisees,
+                    CAST(SUM(CASE WHEN s.statut = 'utilisee' THEN s.nb_offres ELSE 0 END) AS FLOAT) /
+                    CAST(SUM(s.nb_offres) AS FLOAT) * 100 as taux_utilisation
                 FROM regles_fidelite r
-                JOIN offres_client oc ON r.regle_id = oc.regle_id
-                WHERE oc.date_generation >= date('now', '-' || ? || ' days')
+                JOIN offres_stats_jour s ON r.regle_id = s.regle_id
+                WHERE s.jour >= date('now', '-' || ? || ' days')
                 GROUP BY r.regle_id
                 HAVING offres_generees > 0
                 ORDER BY taux_utilisation DESC
                 LIMIT 5
             ''', (period,)).fetchall()
             
-            conn.close()
-            
             return {
                 'success': True,
-                'stats': dict(stats),
+                'stats': stats,
                 'stats_niveaux': [dict(x) for x in stats_niveaux],
                 'stats_statuts': [dict(x) for x in stats_statuts],
                 'offres_par_mois': [dict(x) for x in offres_par_mois],
-                'regles_efficaces': [dict(x) for x in regles_efficaces]
+                'regles_efficaces': [dict(x) for x in regles_efficaces],
+                'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'duration_ms': round((time.perf_counter() - start_time) * 1000, 2)
             }
-            
+        
         except Exception as e:
             logger.error(f"Erreur lors de la récupération des statistiques de fidélité: {str(e)}")
             return {'success': False, 'error': str(e)}
+        finally:
+            if conn is not None:
+                conn.close()
+
+def _evaluate_shard(db_path, rules, scopes, shard, shard_count):
+    """
+    Évalue les règles pour une partition de clients (exécuté dans un processus du pool).
+    
+    La connexion est ouverte en lecture seule: les offres sont écrites par le processus principal.
+    
+    Args:
+        db_path (str): Chemin vers la base de données SQLite
+        rules (list): Règles actives à évaluer
+        scopes (dict): Restriction incrémentale de chaque règle (ou None)
+        shard (int): Numéro de la partition
+        shard_count (int): Nombre total de partitions
+        
+    Returns:
+        dict: Pour chaque règle, clients éligibles (client_id, date_expiration), commentaire,
+              durée et instructions exécutées
+    """
+    engine = RuleEngine(OFFER_VALIDITY_DAYS)
+    conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+    shard_scope = [('% ? = ?', [shard_count, shard])]
+    results = {}
+    
+    try:
+        for rule in rules:
+            scope = (scopes.get(rule['regle_id']) or []) + shard_scope
+            query, params, commentaire = engine.eligibility_query(rule, scope)
+            
+            with QueryProfiler(conn) as profiler:
+                eligible = conn.execute(query, params).fetchall()
+            
+            results[rule['regle_id']] = {
+                'eligible': eligible,
+                'commentaire': commentaire,
+                'duration_ms': profiler.duration_ms,
+                'vm_steps': profiler.vm_steps
+            }
+    finally:
+        conn.close()
+    
+    return results
 
 
 class RewardManager:
@@ -1527,7 +1749,7 @@ class RewardManager:
     Classe pour gérer les récompenses du programme de fidélité.
     """
     
-    def __init__(self, db_path='modules/fidelity_db.sqlite'):
+    def __init__(self, db_path=DEFAULT_DB_PATH):
         """
         Initialise le gestionnaire de récompenses.
         
@@ -1538,14 +1760,13 @@ class RewardManager:
     
     def _get_connection(self):
         """
-        Établit et retourne une connexion à la base de données.
+        Emprunte une connexion au pool (à rendre avec close(), qui annule la
+        transaction si elle n'a pas été validée).
         
         Returns:
             sqlite3.Connection: Connexion à la base de données
         """
-        conn = sqlite3.connect(self.db_path, timeout=30.0)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return get_connection(self.db_path, sqlite3.Row)
     
     def get_available_rewards(self, client_id=None):
         """
@@ -1557,6 +1778,7 @@ class RewardManager:
         Returns:
             dict: Liste des récompenses disponibles
         """
+        conn = None
         try:
             conn = self._get_connection()
             
@@ -1593,8 +1815,6 @@ class RewardManager:
                 
                 reward_list.append(reward_dict)
             
-            conn.close()
-            
             return {
                 'success': True,
                 'rewards': reward_list,
@@ -1604,6 +1824,9 @@ class RewardManager:
         except Exception as e:
             logger.error(f"Erreur lors de la récupération des récompenses: {str(e)}")
             return {'success': False, 'error': str(e)}
+        finally:
+            if conn is not None:
+                conn.close()
     
     def redeem_reward(self, client_id, reward_id, transaction_id=None):
         """
@@ -1617,6 +1840,7 @@ class RewardManager:
         Returns:
             dict: Résultat de l'opération
         """
+        conn = None
         try:
             conn = self._get_connection()
             
@@ -1713,7 +1937,6 @@ class RewardManager:
                 ))
             
             conn.commit()
-            conn.close()
             
             return {
                 'success': True,
@@ -1728,3 +1951,6 @@ class RewardManager:
         except Exception as e:
             logger.error(f"Erreur lors de l'échange de récompense: {str(e)}")
             return {'success': False, 'error': str(e)}
+        finally:
+            if conn is not None:
+                conn.close()
@@ -11,6 +11,7 @@ import time
 import schedule
 from datetime import datetime
 from loyalty_manager import LoyaltyManager
+from offer_delivery import OfferDeliveryService
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO, 
@@ -21,11 +22,38 @@ logger = logging.getLogger(__name__)
 # Instancier le gestionnaire de fidélité
 loyalty_manager = LoyaltyManager()
 
+# Service d'envoi des offres (workers par canal)
+delivery_service = OfferDeliveryService(loyalty_manager.db_path)
+
+def refresh_client_stats_task():
+    """Tâche pour recalculer les statistiques clients (fenêtres glissantes)"""
+    logger.info("Démarrage de la tâche de recalcul des statistiques clients")
+    try:
+        result = loyalty_manager.refresh_client_stats()
+        if result['success']:
+            logger.info(f"Statistiques recalculées pour {result['clients_refreshed']} clients en {result['duration_ms']} ms")
+        else:
+            logger.error(f"Échec du recalcul des statistiques clients: {result.get('error', 'Erreur inconnue')}")
+    except Exception as e:
+        logger.error(f"Exception lors du recalcul des statistiques clients: {str(e)}")
+
+def recompute_levels_task():
+    """Tâche pour recalculer les niveaux de fidélité de toutes les cartes"""
+    logger.info("Démarrage de la tâche de recalcul des niveaux de fidélité")
+    try:
+        result = loyalty_manager.recompute_loyalty_levels()
+        if result['success']:
+            logger.info(f"Niveaux recalculés: {result['cards_updated']} cartes modifiées sur {result['cards_checked']} en {result['duration_ms']} ms")
+        else:
+            logger.error(f"Échec du recalcul des niveaux: {result.get('error', 'Erreur inconnue')}")
+    except Exception as e:
+        logger.error(f"Exception lors du recalcul des niveaux: {str(e)}")
+
 def evaluate_rules_task():
     """Tâche pour évaluer les règles de fidélité"""
     logger.info("Démarrage de la tâche d'évaluation des règles")
     try:
-        result = loyalty_manager.evaluate_all_rules()
+        result = loyalty_manager.evaluate_all_rules(incremental=True)
         if result['success']:
             stats = result['stats']
             logger.info(f"Évaluation terminée: {stats['total_offers_generated']} offres générées pour {stats['total_clients_evaluated']} clients")
@@ -40,7 +68,7 @@ def check_expired_offers_task():
     try:
         result = loyalty_manager.check_expired_offers()
         if result['success']:
-            logger.info(f"{result['offers_expired']} offres marquées comme expirées")
+            logger.info(f"{result['offers_expired']} offres marquées comme expirées en {result['duration_ms']} ms")
         else:
             logger.error(f"Échec de la vérification des offres expirées: {result.get('error', 'Erreur inconnue')}")
     except Exception as e:
@@ -52,7 +80,7 @@ def send_pending_offers_task():
     try:
         result = loyalty_manager.send_offers(channel='email')
         if result['success']:
-            logger.info(f"{result['offers_sent']} offres envoyées")
+            logger.info(f"{result['offers_queued']} offres mises en file d'envoi")
         else:
             logger.error(f"Échec de l'envoi des offres: {result.get('error', 'Erreur inconnue')}")
     except Exception as e:
@@ -60,6 +88,12 @@ def send_pending_offers_task():
 
 def setup_schedules():
     """Configure les tâches planifiées"""
+    # Recalcul des statistiques clients tous les jours à 01:30, avant l'évaluation des règles
+    schedule.every().day.at("01:30").do(refresh_client_stats_task)
+    
+    # Recalcul des niveaux de fidélité tous les jours à 00:30
+    schedule.every().day.at("00:30").do(recompute_levels_task)
+    
     # Évaluation des règles tous les jours à 2h00
     schedule.every().day.at("02:00").do(evaluate_rules_task)
     
@@ -75,7 +109,12 @@ def run_scheduler():
     """Démarre le planificateur et exécute les tâches en continu"""
     logger.info("Démarrage du planificateur de tâches du programme de fidélité")
     
+    # Démarrer les workers d'envoi des offres
+    delivery_service.start()
+    
     # Exécuter les tâches au démarrage
+    refresh_client_stats_task()
+    recompute_levels_task()
     evaluate_rules_task()
     check_expired_offers_task()
     send_pending_offers_task()
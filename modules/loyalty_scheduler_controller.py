@@ -28,6 +28,24 @@ LOG_FILE = 'loyalty_scheduler.log'
 
 # Tâches par défaut
 DEFAULT_TASKS = [
+    {
+        "id": "refresh_client_stats",
+        "name": "Recalcul des statistiques clients",
+        "function": "refresh_client_stats_task",
+        "enabled": True,
+        "schedule_type": "daily",
+        "time": "01:30",
+        "description": "Recalcule les agrégats par client (fenêtres de 30, 90 et 365 jours) utilisés par les règles de fidélité."
+    },
+    {
+        "id": "recompute_levels",
+        "name": "Recalcul des niveaux de fidélité",
+        "function": "recompute_levels_task",
+        "enabled": True,
+        "schedule_type": "daily",
+        "time": "00:30",
+        "description": "Recalcule le niveau de toutes les cartes de fidélité selon les paliers de points actuels."
+    },
     {
         "id": "evaluate_rules",
         "name": "Évaluation des règles de fidélité",
@@ -140,6 +158,7 @@ except ImportError:
 
 import time
 from loyalty_manager import LoyaltyManager
+from offer_delivery import OfferDeliveryService
 import logging
 from datetime import datetime
 
@@ -152,11 +171,38 @@ logger = logging.getLogger(__name__)
 # Initialiser le gestionnaire de fidélité
 loyalty_manager = LoyaltyManager()
 
+# Service d'envoi des offres (workers par canal)
+delivery_service = OfferDeliveryService(loyalty_manager.db_path)
+
+def refresh_client_stats_task():
+    # Tache pour recalculer les statistiques clients (fenetres glissantes)
+    logger.info("Démarrage de la tâche de recalcul des statistiques clients")
+    try:
+        result = loyalty_manager.refresh_client_stats()
+        if result['success']:
+            logger.info(f"Statistiques recalculées pour {{result['clients_refreshed']}} clients en {{result['duration_ms']}} ms")
+        else:
+            logger.error(f"Échec du recalcul des statistiques clients: {{result.get('error', 'Erreur inconnue')}}")
+    except Exception as e:
+        logger.error(f"Exception lors du recalcul des statistiques clients: {{str(e)}}")
+
+def recompute_levels_task():
+    # Tache pour recalculer les niveaux de fidelite de toutes les cartes
+    logger.info("Démarrage de la tâche de recalcul des niveaux de fidélité")
+    try:
+        result = loyalty_manager.recompute_loyalty_levels()
+        if result['success']:
+            logger.info(f"Niveaux recalculés: {{result['cards_updated']}} cartes modifiées sur {{result['cards_checked']}} en {{result['duration_ms']}} ms")
+        else:
+            logger.error(f"Échec du recalcul des niveaux: {{result.get('error', 'Erreur inconnue')}}")
+    except Exception as e:
+        logger.error(f"Exception lors du recalcul des niveaux: {{str(e)}}")
+
 def evaluate_rules_task():
     # Tache pour evaluer les regles de fidelite
     logger.info("Démarrage de la tâche d'évaluation des règles")
     try:
-        result = loyalty_manager.evaluate_all_rules()
+        result = loyalty_manager.evaluate_all_rules(incremental=True)
         if result['success']:
             stats = result['stats']
             logger.info(f"Évaluation terminée: {{stats['total_offers_generated']}} offres générées pour {{stats['total_clients_evaluated']}} clients")
@@ -171,7 +217,7 @@ def check_expired_offers_task():
     try:
         result = loyalty_manager.check_expired_offers()
         if result['success']:
-            logger.info(f"{{result['offers_expired']}} offres marquées comme expirées")
+            logger.info(f"{{result['offers_expired']}} offres marquées comme expirées en {{result['duration_ms']}} ms")
         else:
             logger.error(f"Échec de la vérification des offres expirées: {{result.get('error', 'Erreur inconnue')}}")
     except Exception as e:
@@ -183,7 +229,7 @@ def send_pending_offers_task():
     try:
         result = loyalty_manager.send_offers(channel='email')
         if result['success']:
-            logger.info(f"{{result['offers_sent']}} offres envoyées")
+            logger.info(f"{{result['offers_queued']}} offres mises en file d'envoi")
         else:
             logger.error(f"Échec de l'envoi des offres: {{result.get('error', 'Erreur inconnue')}}")
     except Exception as e:
@@ -219,6 +265,9 @@ def run_scheduler():
     # Configurer les tâches planifiées
     setup_schedules()
     
+    # Démarrer les workers d'envoi des offres
+    delivery_service.start()
+    
     # Exécuter les tâches au démarrage
 """
     
@@ -451,6 +500,7 @@ sys.path.append(current_dir)
 sys.path.append(project_dir)
 
 from loyalty_manager import LoyaltyManager
+from offer_delivery import OfferDeliveryService
 import logging
 from datetime import datetime
 
@@ -463,6 +513,52 @@ logger = logging.getLogger(__name__)
 # Initialiser le gestionnaire de fidélité
 loyalty_manager = LoyaltyManager()
 
+def refresh_client_stats_task():
+    logger.info("Exécution manuelle de la tâche de recalcul des statistiques clients")
+    try:
+        result = loyalty_manager.refresh_client_stats()
+        if result['success']:
+            logger.info(f"Statistiques recalculées pour {{result['clients_refreshed']}} clients en {{result['duration_ms']}} ms")
+            return {{
+                'success': True,
+                'clients_refreshed': result['clients_refreshed']
+            }}
+        else:
+            logger.error(f"Échec du recalcul des statistiques clients: {{result.get('error', 'Erreur inconnue')}}")
+            return {{
+                'success': False,
+                'error': result.get('error', 'Erreur inconnue')
+            }}
+    except Exception as e:
+        logger.error(f"Exception lors du recalcul des statistiques clients: {{str(e)}}")
+        return {{
+            'success': False,
+            'error': str(e)
+        }}
+
+def recompute_levels_task():
+    logger.info("Exécution manuelle de la tâche de recalcul des niveaux de fidélité")
+    try:
+        result = loyalty_manager.recompute_loyalty_levels()
+        if result['success']:
+            logger.info(f"Niveaux recalculés: {{result['cards_updated']}} cartes modifiées sur {{result['cards_checked']}} en {{result['duration_ms']}} ms")
+            return {{
+                'success': True,
+                'cards_updated': result['cards_updated']
+            }}
+        else:
+            logger.error(f"Échec du recalcul des niveaux: {{result.get('error', 'Erreur inconnue')}}")
+            return {{
+                'success': False,
+                'error': result.get('error', 'Erreur inconnue')
+            }}
+    except Exception as e:
+        logger.error(f"Exception lors du recalcul des niveaux: {{str(e)}}")
+        return {{
+            'success': False,
+            'error': str(e)
+        }}
+
 def evaluate_rules_task():
     logger.info("Exécution manuelle de la tâche d'évaluation des règles")
     try:
@@ -492,10 +588,11 @@ def check_expired_offers_task():
     try:
         result = loyalty_manager.check_expired_offers()
         if result['success']:
-            logger.info(f"{{result['offers_expired']}} offres marquées comme expirées")
+            logger.info(f"{{result['offers_expired']}} offres marquées comme expirées en {{result['duration_ms']}} ms")
             return {{
                 'success': True,
-                'offers_expired': result['offers_expired']
+                'offers_expired': result['offers_expired'],
+                'duration_ms': result['duration_ms']
             }}
         else:
             logger.error(f"Échec de la vérification des offres expirées: {{result.get('error', 'Erreur inconnue')}}")
@@ -515,10 +612,15 @@ def send_pending_offers_task():
     try:
         result = loyalty_manager.send_offers(channel='email')
         if result['success']:
-            logger.info(f"{{result['offers_sent']}} offres envoyées")
+            # Livrer immédiatement les offres dues plutôt que d'attendre les workers du planificateur
+            delivery = OfferDeliveryService(loyalty_manager.db_path).drain()
+            offers_sent = sum(channel['sent'] for channel in delivery.values())
+            logger.info(f"{{result['offers_queued']}} offres mises en file, {{offers_sent}} offres envoyées")
             return {{
                 'success': True,
-                'offers_sent': result['offers_sent']
+                'offers_queued': result['offers_queued'],
+                'offers_sent': offers_sent,
+                'delivery': delivery
             }}
         else:
             logger.error(f"Échec de l'envoi des offres: {{result.get('error', 'Erreur inconnue')}}")
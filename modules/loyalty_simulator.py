@@ -0,0 +1,343 @@
+"""
+Module de simulation des règles de fidélité
+
+Ce module permet d'estimer, avant activation, le nombre d'offres qu'une règle
+générerait et leur coût, sans écrire dans offres_client. Les transactions, lignes
+de tickets et clients sont chargés une fois en mémoire (tableaux NumPy) puis chaque
+simulation est entièrement vectorisée.
+"""
+
+import sqlite3
+import json
+import logging
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    from modules.db_pool import get_connection
+except ImportError:
+    from db_pool import get_connection
+
+# Configuration du logging
+logger = logging.getLogger(__name__)
+
+# Durée de validité de l'instantané des données (en secondes)
+SNAPSHOT_TTL = 300
+
+
+class RuleSimulator:
+    """
+    Classe de simulation (dry-run) des règles de fidélité sur un instantané des données.
+    """
+
+    # Instantanés par base de données
+    _snapshots = {}
+
+    def __init__(self, db_path='modules/fidelity_db.sqlite'):
+        """
+        Initialise le simulateur de règles.
+
+        Args:
+            db_path (str): Chemin vers la base de données SQLite
+        """
+        self.db_path = db_path
+
+    def _get_connection(self):
+        """
+        Emprunte une connexion au pool (à rendre avec close()).
+
+        Returns:
+            sqlite3.Connection: Connexion à la base de données
+        """
+        return get_connection(self.db_path, sqlite3.Row)
+
+    def load_snapshot(self, force=False):
+        """
+        Charge (ou réutilise) l'instantané en mémoire des données nécessaires à la simulation.
+
+        Args:
+            force (bool): Recharger l'instantané même s'il est encore valide
+
+        Returns:
+            dict: Instantané des données
+        """
+        snapshot = RuleSimulator._snapshots.get(self.db_path)
+        if snapshot and not force and time.monotonic() - snapshot['loaded_at'] < SNAPSHOT_TTL:
+            return snapshot
+
+        start_time = time.perf_counter()
+        conn = self._get_connection()
+        try:
+            clients = pd.read_sql_query('''
+                SELECT client_id, segment, statut, date_naissance, date_inscription, consentement_marketing
+                FROM clients
+                ORDER BY client_id
+            ''', conn)
+            transactions = pd.read_sql_query('''
+                SELECT transaction_id, client_id, date_transaction, montant_total
+                FROM transactions
+                WHERE client_id IS NOT NULL
+            ''', conn)
+            details = pd.read_sql_query('''
+                SELECT dt.transaction_id, dt.produit_id, p.categorie_id
+                FROM details_transactions dt
+                LEFT JOIN produits p ON dt.produit_id = p.produit_id
+            ''', conn)
+            offers = pd.read_sql_query('SELECT client_id, regle_id FROM offres_client', conn)
+            point_value = conn.execute('''
+                SELECT SUM(valeur_monetaire) / SUM(points_necessaires)
+                FROM recompenses
+                WHERE valeur_monetaire IS NOT NULL AND points_necessaires > 0
+            ''').fetchone()[0]
+            reward_values = dict(conn.execute(
+                'SELECT recompense_id, valeur_monetaire FROM recompenses'
+            ).fetchall())
+        finally:
+            conn.close()
+
+        client_ids = clients['client_id'].to_numpy()
+
+        # Transactions: position du client et jour (nombre de jours depuis l'epoch)
+        tx_pos = np.searchsorted(client_ids, transactions['client_id'].to_numpy())
+        tx_pos = np.minimum(tx_pos, len(client_ids) - 1)
+        tx_valid = client_ids[tx_pos] == transactions['client_id'].to_numpy()
+        tx_days = self._to_days(transactions['date_transaction'])
+        tx_valid &= tx_days >= 0
+
+        # Lignes de tickets: rattachées au client et au jour de leur transaction
+        tx_index = pd.Series(np.arange(len(transactions)), index=transactions['transaction_id'].to_numpy())
+        det_tx = tx_index.reindex(details['transaction_id'].to_numpy()).to_numpy()
+        det_valid = ~np.isnan(det_tx)
+        det_tx = np.where(det_valid, det_tx, 0).astype(np.int64)
+        det_valid &= tx_valid[det_tx] if len(transactions) else det_valid
+
+        birth = pd.to_datetime(clients['date_naissance'], errors='coerce')
+
+        snapshot = {
+            'loaded_at': time.monotonic(),
+            'loaded_on': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'client_ids': client_ids,
+            'segments': clients['segment'].fillna('standard').to_numpy(),
+            'active': (clients['statut'] == 'actif').to_numpy(),
+            'consent': (clients['consentement_marketing'].fillna(0).astype(int) == 1).to_numpy(),
+            'inscription_days': self._to_days(clients['date_inscription']),
+            'birth_month': birth.dt.month.fillna(0).astype(int).to_numpy(),
+            'birth_day': birth.dt.day.fillna(0).astype(int).to_numpy(),
+            'tx_pos': tx_pos[tx_valid],
+            'tx_days': tx_days[tx_valid],
+            'tx_amounts': transactions['montant_total'].fillna(0).to_numpy(dtype=float)[tx_valid],
+            'det_pos': tx_pos[det_tx][det_valid],
+            'det_days': tx_days[det_tx][det_valid],
+            'det_products': details['produit_id'].fillna(-1).to_numpy(dtype=np.int64)[det_valid],
+            'det_categories': details['categorie_id'].fillna(-1).to_numpy(dtype=np.int64)[det_valid],
+            'offers': offers,
+            'point_value': point_value or 0.0,
+            'reward_values': reward_values,
+            'load_ms': 0
+        }
+        snapshot['load_ms'] = int((time.perf_counter() - start_time) * 1000)
+        RuleSimulator._snapshots[self.db_path] = snapshot
+
+        logger.info(
+            f"Instantané de simulation chargé: {len(snapshot['tx_pos'])} transactions, "
+            f"{len(snapshot['det_pos'])} lignes en {snapshot['load_ms']} ms"
+        )
+        return snapshot
+
+    @staticmethod
+    def _to_days(values):
+        """
+        Convertit une série de dates en nombre de jours depuis l'epoch (-1 si invalide).
+
+        Args:
+            values (pandas.Series): Dates au format texte
+
+        Returns:
+            numpy.ndarray: Jours depuis le 1970-01-01
+        """
+        dates = pd.to_datetime(values, errors='coerce')
+        days = dates.values.astype('datetime64[D]').astype(np.int64)
+        return np.where(dates.isna().to_numpy(), -1, days)
+
+    def simulate(self, rule, reference_date=None):
+        """
+        Simule une règle à une date de référence, sans générer d'offres.
+
+        Args:
+            rule (dict): Définition de la règle (mêmes champs que la création de règle)
+            reference_date (str, optional): Date de référence (YYYY-MM-DD), aujourd'hui par défaut
+
+        Returns:
+            dict: Nombre de clients éligibles, répartition par segment et valeur estimée des récompenses
+        """
+        try:
+            start_time = time.perf_counter()
+            snapshot = self.load_snapshot()
+
+            reference = pd.Timestamp(reference_date) if reference_date else pd.Timestamp(datetime.now().date())
+            ref_day = int(np.datetime64(reference.date(), 'D').astype(np.int64))
+
+            eligible = self._eligible_mask(snapshot, rule, reference, ref_day)
+
+            # Clients ciblés: actifs, dans les segments de la règle, sans offre existante pour cette règle
+            eligible &= snapshot['active']
+            segments = rule.get('segments_cibles')
+            if isinstance(segments, str) and segments:
+                segments = json.loads(segments)
+            if segments:
+                eligible &= np.isin(snapshot['segments'], segments)
+            if rule.get('regle_id'):
+                offers = snapshot['offers']
+                existing = offers.loc[offers['regle_id'] == int(rule['regle_id']), 'client_id'].to_numpy()
+                eligible &= ~np.isin(snapshot['client_ids'], existing)
+
+            eligible_count = int(eligible.sum())
+            segment_values, segment_counts = np.unique(snapshot['segments'][eligible], return_counts=True)
+
+            value = self._estimate_value(snapshot, rule, eligible, ref_day)
+
+            return {
+                'success': True,
+                'reference_date': reference.strftime('%Y-%m-%d'),
+                'eligible_clients': eligible_count,
+                'by_segment': {str(s): int(c) for s, c in zip(segment_values, segment_counts)},
+                'estimated_value': value['total'],
+                'value_details': value,
+                'snapshot_loaded_on': snapshot['loaded_on'],
+                'duration_ms': round((time.perf_counter() - start_time) * 1000, 2)
+            }
+
+        except Exception as e:
+            logger.error(f"Erreur lors de la simulation de la règle: {str(e)}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+    def _eligible_mask(self, snapshot, rule, reference, ref_day):
+        """
+        Calcule le masque des clients remplissant la condition de la règle.
+
+        Args:
+            snapshot (dict): Instantané des données
+            rule (dict): Définition de la règle
+            reference (pandas.Timestamp): Date de référence
+            ref_day (int): Date de référence en jours depuis l'epoch
+
+        Returns:
+            numpy.ndarray: Masque booléen aligné sur snapshot['client_ids']
+        """
+        n_clients = len(snapshot['client_ids'])
+        rule_type = rule['type_regle']
+        valeur = rule['condition_valeur']
+        periode = int(rule['periode_jours']) if rule.get('periode_jours') else None
+        start_day = ref_day - periode if periode else None
+
+        def window(days):
+            mask = days <= ref_day
+            if start_day is not None:
+                mask &= days >= start_day
+            return mask
+
+        if rule_type in ('nombre_achats', 'montant_cumule'):
+            mask = window(snapshot['tx_days'])
+            weights = None if rule_type == 'nombre_achats' else snapshot['tx_amounts'][mask]
+            totals = np.bincount(snapshot['tx_pos'][mask], weights=weights, minlength=n_clients)
+            return totals >= float(valeur)
+
+        if rule_type in ('produit_specifique', 'categorie_specifique'):
+            column = 'det_products' if rule_type == 'produit_specifique' else 'det_categories'
+            mask = window(snapshot['det_days']) & (snapshot[column] == int(valeur))
+            eligible = np.zeros(n_clients, dtype=bool)
+            eligible[snapshot['det_pos'][mask]] = True
+            return eligible
+
+        if rule_type == 'premiere_visite':
+            inscription = snapshot['inscription_days']
+            return (inscription >= ref_day - int(valeur)) & (inscription <= ref_day) & snapshot['consent']
+
+        if rule_type == 'anniversaire':
+            days_until = self._days_until_birthday(snapshot, reference, ref_day)
+            return (days_until >= 0) & (days_until <= int(valeur))
+
+        if rule_type == 'inactivite':
+            mask = snapshot['tx_days'] <= ref_day
+            last_visit = np.full(n_clients, -1, dtype=np.int64)
+            np.maximum.at(last_visit, snapshot['tx_pos'][mask], snapshot['tx_days'][mask])
+            # Même borne que le moteur (derniere_visite <= date('now', '-N days')): la dernière
+            # visite est horodatée, elle doit donc précéder strictement le jour limite
+            return (last_visit >= 0) & (last_visit < ref_day - int(valeur))
+
+        raise ValueError(f"Type de règle inconnu: {rule_type}")
+
+    def _days_until_birthday(self, snapshot, reference, ref_day):
+        """
+        Calcule le nombre de jours jusqu'au prochain anniversaire de chaque client.
+
+        Un 29 février tombe le 1er mars les années non bissextiles (comme SQLite).
+
+        Returns:
+            numpy.ndarray: Jours jusqu'au prochain anniversaire (-1 si date de naissance inconnue)
+        """
+        months = snapshot['birth_month']
+        days = snapshot['birth_day']
+        known = months > 0
+
+        def birthday_in(year):
+            month_starts = np.array(
+                [np.datetime64(f"{year}-{m:02d}-01", 'D').astype(np.int64) for m in range(1, 13)]
+            )
+            return month_starts[np.clip(months - 1, 0, 11)] + days - 1
+
+        this_year = birthday_in(reference.year)
+        next_birthday = np.where(this_year < ref_day, birthday_in(reference.year + 1), this_year)
+        return np.where(known, next_birthday - ref_day, -1)
+
+    def _estimate_value(self, snapshot, rule, eligible, ref_day):
+        """
+        Estime la valeur monétaire des récompenses des clients éligibles.
+
+        Args:
+            snapshot (dict): Instantané des données
+            rule (dict): Définition de la règle
+            eligible (numpy.ndarray): Masque des clients éligibles
+            ref_day (int): Date de référence en jours depuis l'epoch
+
+        Returns:
+            dict: Valeur totale et détail du calcul
+        """
+        count = int(eligible.sum())
+        action_type = rule.get('action_type')
+        action_valeur = float(rule.get('action_valeur') or 0)
+
+        if action_type == 'offre_points':
+            points = action_valeur * count
+            return {
+                'total': round(points * snapshot['point_value'], 2),
+                'points': int(points),
+                'point_value': round(snapshot['point_value'], 4)
+            }
+
+        if action_type == 'reduction_montant':
+            return {'total': round(action_valeur * count, 2)}
+
+        if action_type == 'reduction_pourcentage':
+            # Réduction appliquée au panier moyen de chaque client éligible
+            mask = snapshot['tx_days'] <= ref_day
+            n_clients = len(snapshot['client_ids'])
+            amounts = np.bincount(snapshot['tx_pos'][mask], weights=snapshot['tx_amounts'][mask], minlength=n_clients)
+            counts = np.bincount(snapshot['tx_pos'][mask], minlength=n_clients)
+            average_basket = np.divide(amounts, counts, out=np.zeros(n_clients), where=counts > 0)
+            return {
+                'total': round(float(average_basket[eligible].sum() * action_valeur / 100), 2),
+                'average_basket': round(float(average_basket[eligible].mean()), 2) if count else 0.0
+            }
+
+        if action_type == 'offre_cadeau':
+            reward_value = snapshot['reward_values'].get(rule.get('recompense_id') and int(rule['recompense_id'])) or 0.0
+            return {'total': round(reward_value * count, 2), 'reward_value': reward_value}
+
+        return {'total': 0.0}
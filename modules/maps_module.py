@@ -8,6 +8,13 @@ import json
 import numpy as np
 from colour import Color
 
+try:
+    from modules.db_pool import get_connection, DEFAULT_DB_PATH
+    from modules.analytics_mirror import get_analytics_connection, read_sql_query
+except ImportError:
+    from db_pool import get_connection, DEFAULT_DB_PATH
+    from analytics_mirror import get_analytics_connection, read_sql_query
+
 def create_sales_map(conn=None, filters=None):
     """
     Crée une carte de ventes avec des marqueurs personnalisés.
@@ -22,7 +29,7 @@ def create_sales_map(conn=None, filters=None):
     # Gestion de la connexion à la base de données
     close_conn = False
     if conn is None:
-        conn = sqlite3.connect('C:/Users/baofr/Desktop/Workspace/MILAN_ticket/modules/fidelity_db.sqlite')
+        conn = get_analytics_connection(DEFAULT_DB_PATH)
         close_conn = True
     
     try:
@@ -54,10 +61,10 @@ def create_sales_map(conn=None, filters=None):
             if conditions:
                 query += " AND " + " AND ".join(conditions)
         
-        query += " GROUP BY pv.magasin_id, pv.nom, pv.latitude, pv.longitude"
+        query += " GROUP BY pv.magasin_id, pv.nom, pv.latitude, pv.longitude ORDER BY pv.magasin_id"
         
         # Exécuter la requête
-        df = pd.read_sql_query(query, conn, params=params)
+        df = read_sql_query(conn, query, params)
         
         # Vérifier s'il y a des données
         if df.empty:
@@ -130,7 +137,7 @@ def analyze_geographical_sales(conn=None, filters=None):
     # Gestion de la connexion à la base de données
     close_conn = False
     if conn is None:
-        conn = sqlite3.connect('C:/Users/baofr/Desktop/Workspace/MILAN_ticket/modules/fidelity_db.sqlite')
+        conn = get_connection(DEFAULT_DB_PATH)
         close_conn = True
     
     try:
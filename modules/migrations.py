@@ -0,0 +1,342 @@
+"""
+Migrations du schéma de la base de fidélité
+
+Chaque migration est une étape idempotente identifiée par un numéro de version. Les
+versions appliquées sont enregistrées dans la table schema_versions: migrate() applique
+dans l'ordre les étapes manquantes, puis met à jour les statistiques de l'optimiseur
+(ANALYZE) pour que les nouveaux index soient utilisés.
+
+Les étapes restent idempotentes (IF NOT EXISTS, vérification des colonnes) afin de
+pouvoir migrer une base dont une partie du schéma a déjà été créée.
+
+Usage:
+    python modules/migrations.py modules/fidelity_db.sqlite
+    python modules/migrations.py benchmarks/data/small_42.sqlite --report
+"""
+
+import argparse
+import logging
+import sqlite3
+import time
+from datetime import datetime
+from functools import partial
+
+try:
+    from modules.db_pool import get_connection, DEFAULT_DB_PATH
+    from modules.offer_codes import ensure_offer_code_index
+    from modules.client_stats import ensure_client_stats, ensure_birthday_key, OBSOLETE_CLIENT_STATS_TRIGGERS
+    from modules.offer_stats import ensure_offer_daily_stats
+    from modules.offer_delivery import ensure_delivery_outbox
+    from modules.analytics_mirror import ensure_clients_change_tracking
+except ImportError:
+    from db_pool import get_connection, DEFAULT_DB_PATH
+    from offer_codes import ensure_offer_code_index
+    from client_stats import ensure_client_stats, ensure_birthday_key, OBSOLETE_CLIENT_STATS_TRIGGERS
+    from offer_stats import ensure_offer_daily_stats
+    from offer_delivery import ensure_delivery_outbox
+    from analytics_mirror import ensure_clients_change_tracking
+
+# Configuration du logging
+logger = logging.getLogger(__name__)
+
+VERSIONS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS schema_versions (
+        version INTEGER PRIMARY KEY,
+        nom TEXT NOT NULL,
+        date_application DATETIME DEFAULT CURRENT_TIMESTAMP,
+        duree_ms INTEGER
+    )
+'''
+
+# Index des tables les plus sollicitées: (nom, table, colonnes)
+ANALYTICAL_INDEXES = [
+    # Filtres de période et de magasin des tableaux de bord
+    ('idx_transactions_date', 'transactions', 'date_transaction'),
+    ('idx_transactions_magasin_date', 'transactions', 'magasin_id, date_transaction'),
+    # Règles sur un produit spécifique
+    ('idx_details_transactions_produit', 'details_transactions', 'produit_id'),
+    # Carte d'un client (points, niveau, passage en caisse)
+    ('idx_cartes_fidelite_client', 'cartes_fidelite', 'client_id')
+]
+
+# Requêtes chronométrées par le rapport avant/après migration: (description, requête, paramètres)
+REPORT_QUERIES = [
+    ("Chiffre d'affaires sur 90 jours",
+     "SELECT SUM(montant_total), COUNT(*) FROM transactions "
+     "WHERE date_transaction >= date('now', '-90 days') AND date_transaction <= date('now')", []),
+    ("Chiffre d'affaires d'un magasin sur 90 jours",
+     "SELECT SUM(montant_total), COUNT(*) FROM transactions "
+     "WHERE magasin_id = (SELECT MIN(magasin_id) FROM transactions) "
+     "AND date_transaction >= date('now', '-90 days')", []),
+    ("Historique d'achats d'un client",
+     "SELECT transaction_id, date_transaction, montant_total FROM transactions "
+     "WHERE client_id = (SELECT MAX(client_id) FROM clients) ORDER BY date_transaction DESC", []),
+    ("Lignes d'un ticket",
+     "SELECT * FROM details_transactions WHERE transaction_id = (SELECT MAX(transaction_id) FROM transactions)", []),
+    ("Acheteurs d'un produit",
+     "SELECT COUNT(DISTINCT t.client_id) FROM details_transactions dt "
+     "JOIN transactions t ON dt.transaction_id = t.transaction_id "
+     "WHERE dt.produit_id = (SELECT MIN(produit_id) FROM produits)", []),
+    ("Offres existantes par client et règle",
+     "SELECT COUNT(*) FROM clients c "
+     "LEFT JOIN offres_client oc ON oc.client_id = c.client_id AND oc.regle_id = 1 "
+     "WHERE oc.offre_id IS NULL", []),
+    ("Carte d'un client",
+     "SELECT * FROM cartes_fidelite WHERE client_id = (SELECT MAX(client_id) FROM clients)", [])
+]
+
+
+def _table_exists(conn, table):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone() is not None
+
+
+def _evaluation_history_columns(conn):
+    """Colonnes de suivi incrémental et de profil d'exécution des évaluations de règles"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(historique_evaluations_regles)")]
+    for column, definition in (
+        ('dernier_transaction_id', 'INTEGER'),
+        ('mode_evaluation', 'TEXT'),
+        # Profil d'exécution de la règle
+        ('clients_eligibles', 'INTEGER'),
+        ('instructions_vm', 'INTEGER'),
+        ('plan_requete', 'TEXT'),
+        ('scans_complets', 'TEXT')
+    ):
+        if columns and column not in columns:
+            conn.execute(f"ALTER TABLE historique_evaluations_regles ADD COLUMN {column} {definition}")
+
+
+def _rule_evaluation_indexes(conn):
+    """Index de l'évaluation des règles et de la purge des offres expirées"""
+    # Index nécessaires à la réévaluation ciblée des clients actifs
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_historique_evaluations_regle ON historique_evaluations_regles(regle_id, dernier_transaction_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_client_date ON transactions(client_id, date_transaction)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_details_transactions_transaction ON details_transactions(transaction_id)")
+
+    # Index de l'anti-jointure « offre déjà générée pour cette règle »
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_offres_client_client_regle ON offres_client(client_id, regle_id)")
+
+    # Index de la purge des offres expirées (check_expired_offers)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_offres_client_statut_expiration ON offres_client(statut, date_expiration)")
+
+
+def _drop_fidelity_level_trigger(conn):
+    """Supprime le trigger de niveau des cartes, incompatible avec la contrainte CHECK"""
+    # Le niveau des cartes est recalculé par l'application (apply_points_batch): ce trigger
+    # écrivait les noms de niveaux_fidelite ('Silver', ...), refusés par la contrainte CHECK
+    # de cartes_fidelite.niveau_fidelite, et faisait échouer toute mise à jour de points
+    conn.execute("DROP TRIGGER IF EXISTS check_fidelity_level")
+
+
+def _drop_obsolete_client_stats_triggers(conn):
+    """Supprime les triggers de client_stats remplacés par un recalcul différé"""
+    # La catégorie favorite est recalculée une fois par ticket (update_favourite_categories)
+    # et par refresh(), et non plus à chaque ligne de ticket insérée
+    for trigger in OBSOLETE_CLIENT_STATS_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+
+def _analytical_indexes(conn):
+    """Index des filtres des tableaux de bord et des recherches par client"""
+    for name, table, columns in ANALYTICAL_INDEXES:
+        if _table_exists(conn, table):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})")
+
+
+def _drop_unusable_offers_index(conn):
+    """Supprime l'index partiel des offres utilisables, jamais choisi par le planificateur"""
+    # use_offer recherche l'offre par code_unique, déjà servi par idx_offres_client_code_unique;
+    # l'index sur (client_id, date_expiration) ne servait aucune requête et ralentissait les écritures
+    conn.execute("DROP INDEX IF EXISTS idx_offres_client_utilisables")
+
+
+# Migrations dans l'ordre d'application: (version, nom, étape)
+# Les étapes partagées avec les modules (ensure_*) ne valident pas elles-mêmes:
+# migrate() valide l'étape avec l'enregistrement de sa version
+MIGRATIONS = [
+    (1, 'colonnes_historique_evaluations', _evaluation_history_columns),
+    (2, 'index_evaluation_regles', _rule_evaluation_indexes),
+    (3, 'suppression_trigger_niveau_fidelite', _drop_fidelity_level_trigger),
+    (4, 'codes_offres_uniques', partial(ensure_offer_code_index, commit=False)),
+    (5, 'statistiques_clients', partial(ensure_client_stats, commit=False)),
+    (6, 'jour_anniversaire_clients', partial(ensure_birthday_key, commit=False)),
+    (7, 'statistiques_offres_jour', partial(ensure_offer_daily_stats, commit=False)),
+    (8, 'file_envoi_offres', partial(ensure_delivery_outbox, commit=False)),
+    (9, 'index_analytiques', _analytical_indexes),
+    (10, 'suppression_trigger_details_client_stats', _drop_obsolete_client_stats_triggers),
+    (11, 'date_modification_clients', partial(ensure_clients_change_tracking, commit=False)),
+    (12, 'suppression_index_offres_utilisables', _drop_unusable_offers_index)
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    """
+    Retourne la version du schéma de la base.
+
+    Args:
+        conn (sqlite3.Connection): Connexion à la base de données
+
+    Returns:
+        int: Dernière version appliquée (0 si aucune)
+    """
+    if not _table_exists(conn, 'schema_versions'):
+        return 0
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_versions").fetchone()[0]
+
+
+def migrate(conn, analyze=True):
+    """
+    Applique les migrations manquantes, puis met à jour les statistiques de l'optimiseur.
+
+    Chaque étape est exécutée dans une transaction IMMEDIATE, validée avec
+    l'enregistrement de sa version: une étape interrompue n'est ni appliquée ni
+    enregistrée. La version est relue après la prise du verrou: deux processus
+    démarrant en même temps n'appliquent pas deux fois la même migration.
+
+    Args:
+        conn (sqlite3.Connection): Connexion à la base de données
+        analyze (bool): Exécuter ANALYZE si des migrations ont été appliquées
+
+    Returns:
+        dict: Version du schéma et migrations appliquées
+    """
+    try:
+        start_time = time.perf_counter()
+
+        if get_schema_version(conn) >= LATEST_VERSION:
+            return {'success': True, 'version': LATEST_VERSION, 'applied': []}
+
+        conn.execute(VERSIONS_TABLE)
+        conn.commit()
+
+        applied = []
+        for version, name, step in MIGRATIONS:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM schema_versions WHERE version = ?", (version,)).fetchone():
+                conn.rollback()
+                continue
+
+            step_start = time.perf_counter()
+            step(conn)
+            duration_ms = int((time.perf_counter() - step_start) * 1000)
+
+            conn.execute(
+                "INSERT OR IGNORE INTO schema_versions (version, nom, date_application, duree_ms) VALUES (?, ?, ?, ?)",
+                (version, name, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), duration_ms)
+            )
+            conn.commit()
+            applied.append({'version': version, 'nom': name, 'duree_ms': duration_ms})
+            logger.info(f"Migration {version} ({name}) appliquée en {duration_ms} ms")
+
+        analyze_ms = None
+        if applied and analyze:
+            analyze_start = time.perf_counter()
+            conn.execute("ANALYZE")
+            conn.commit()
+            analyze_ms = int((time.perf_counter() - analyze_start) * 1000)
+
+        return {
+            'success': True,
+            'version': get_schema_version(conn),
+            'applied': applied,
+            'analyze_ms': analyze_ms,
+            'duration_ms': int((time.perf_counter() - start_time) * 1000)
+        }
+
+    except sqlite3.Error as e:
+        if conn.in_transaction:
+            conn.rollback()
+        logger.error(f"Erreur lors de la migration du schéma: {str(e)}")
+        return {'success': False, 'error': str(e)}
+
+
+def apply_migrations(db_path=DEFAULT_DB_PATH):
+    """
+    Migre une base de données, à appeler au démarrage de l'application.
+
+    Args:
+        db_path (str): Chemin vers la base de données SQLite
+
+    Returns:
+        dict: Résultat de migrate()
+    """
+    conn = get_connection(db_path)
+    try:
+        return migrate(conn)
+    finally:
+        conn.close()
+
+
+def time_report_queries(conn, repeat=5):
+    """
+    Chronomètre les requêtes de REPORT_QUERIES (meilleur temps sur plusieurs exécutions).
+
+    Args:
+        conn (sqlite3.Connection): Connexion à la base de données
+        repeat (int): Nombre d'exécutions par requête
+
+    Returns:
+        dict: Durée en ms et parcours complets de chaque requête, par description
+    """
+    timings = {}
+    for description, query, params in REPORT_QUERIES:
+        best = None
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            conn.execute(query, params).fetchall()
+            elapsed = (time.perf_counter() - start_time) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+        timings[description] = {
+            'ms': round(best, 3),
+            'scans': [line for line in plan if line.startswith('SCAN ') and ' USING ' not in line]
+        }
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrations du schéma de la base de fidélité")
+    parser.add_argument('db', nargs='?', default=DEFAULT_DB_PATH, help="Base de données SQLite")
+    parser.add_argument('--report', action='store_true',
+                        help="Chronométrer les requêtes principales avant et après la migration")
+    parser.add_argument('--repeat', type=int, default=5, help="Exécutions par requête chronométrée")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    conn = sqlite3.connect(args.db)
+    print(f"Version du schéma: {get_schema_version(conn)} (dernière: {LATEST_VERSION})")
+
+    before = time_report_queries(conn, args.repeat) if args.report else None
+    result = migrate(conn)
+    if not result['success']:
+        print(f"Échec de la migration: {result['error']}")
+        return 1
+
+    for migration in result['applied']:
+        print(f"  {migration['version']:>3} {migration['nom']:<40} {migration['duree_ms']:>8} ms")
+    if result.get('analyze_ms') is not None:
+        print(f"  ANALYZE {result['analyze_ms']} ms")
+    print(f"Version du schéma: {result['version']}")
+
+    if before:
+        after = time_report_queries(conn, args.repeat)
+        print(f"\n{'Requête':<48} {'avant (ms)':>12} {'après (ms)':>12} {'gain':>8}")
+        for description, timing in before.items():
+            new = after[description]
+            gain = timing['ms'] / new['ms'] if new['ms'] else 0
+            print(f"{description:<48} {timing['ms']:>12.3f} {new['ms']:>12.3f} {gain:>7.1f}x")
+            for scan in new['scans']:
+                print(f"{'':<4}parcours complet restant: {scan}")
+
+    conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
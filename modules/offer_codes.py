@@ -0,0 +1,109 @@
+"""
+Module des codes d'offres
+
+Ce module centralise la génération des codes uniques des offres clients.
+Les codes sont attribués dans l'instruction d'insertion elle-même (plus de mise à jour
+globale de offres_client après chaque évaluation) et sont garantis uniques par un
+index UNIQUE sur offres_client.code_unique.
+
+Format: OF-<regle_id>-<client_id>-<8 caractères hexadécimaux aléatoires>.
+Le préfixe règle/client limite une éventuelle collision aux offres d'une même règle
+pour un même client; dans ce cas l'insertion est rejouée avec un nouveau tirage.
+"""
+
+import sqlite3
+import logging
+
+# Configuration du logging
+logger = logging.getLogger(__name__)
+
+# Nombre maximal de tentatives d'insertion en cas de collision de code
+OFFER_CODE_RETRIES = 5
+
+
+def offer_code_sql(regle_expression, client_expression):
+    """
+    Construit l'expression SQL générant le code unique d'une offre.
+
+    Args:
+        regle_expression (str): Expression SQL de l'identifiant de la règle
+        client_expression (str): Expression SQL de l'identifiant du client
+
+    Returns:
+        str: Expression SQL du code
+    """
+    return f"'OF-' || {regle_expression} || '-' || {client_expression} || '-' || hex(randomblob(4))"
+
+
+def ensure_offer_code_index(conn, commit=True):
+    """
+    Crée l'index unique des codes d'offres.
+
+    Cet index sert aussi la recherche d'une offre par son code au passage en caisse
+    (use_offer): un index partiel sur les offres utilisables n'apporte rien de plus.
+
+    Les offres existantes sans code reçoivent un code (format historique OF-<offre_id>-...)
+    et les doublons éventuels sont suffixés par leur identifiant avant la création de l'index.
+
+    Args:
+        conn (sqlite3.Connection): Connexion à la base de données
+        commit (bool): Valider la transaction (False: l'appelant la valide, comme migrate())
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_offres_client_code_unique'"
+    ).fetchone()
+
+    if not exists:
+        conn.execute('''
+            UPDATE offres_client
+            SET code_unique = 'OF-' || offre_id || '-' || hex(randomblob(4))
+            WHERE code_unique IS NULL OR code_unique = ''
+        ''')
+        cursor = conn.execute('''
+            UPDATE offres_client
+            SET code_unique = code_unique || '-' || offre_id
+            WHERE offre_id NOT IN (
+                SELECT MIN(offre_id) FROM offres_client GROUP BY code_unique
+            )
+        ''')
+        if cursor.rowcount:
+            logger.warning(f"{cursor.rowcount} codes d'offres en double renommés")
+
+        conn.execute("CREATE UNIQUE INDEX idx_offres_client_code_unique ON offres_client(code_unique)")
+        logger.info("Index unique des codes d'offres créé")
+
+    if commit:
+        conn.commit()
+
+
+def execute_with_code_retry(conn, query, params, many=False):
+    """
+    Exécute une insertion d'offres en la rejouant si un code généré est déjà attribué.
+
+    L'insertion est encadrée par un point de sauvegarde: une collision annule l'ensemble
+    des lignes de la tentative avant de rejouer la requête avec de nouveaux codes.
+
+    Args:
+        conn (sqlite3.Connection): Connexion à la base de données
+        query (str): Requête INSERT générant les codes avec offer_code_sql()
+        params (list): Paramètres de la requête (liste de tuples si many=True)
+        many (bool): Utiliser executemany
+
+    Returns:
+        sqlite3.Cursor: Curseur de la tentative réussie
+    """
+    if many:
+        params = list(params)
+
+    for attempt in range(1, OFFER_CODE_RETRIES + 1):
+        conn.execute("SAVEPOINT offres_codes")
+        try:
+            cursor = conn.executemany(query, params) if many else conn.execute(query, params)
+            conn.execute("RELEASE SAVEPOINT offres_codes")
+            return cursor
+        except sqlite3.IntegrityError as e:
+            conn.execute("ROLLBACK TO SAVEPOINT offres_codes")
+            conn.execute("RELEASE SAVEPOINT offres_codes")
+            if 'code_unique' not in str(e) or attempt == OFFER_CODE_RETRIES:
+                raise
+            logger.warning(f"Collision de code d'offre, nouvelle tentative ({attempt}/{OFFER_CODE_RETRIES})")
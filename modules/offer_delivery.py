@@ -0,0 +1,625 @@
+"""
+Module d'envoi des offres de fidélité
+
+Ce module gère la livraison des offres générées par les règles de fidélité:
+- une file d'envoi persistante (table file_envoi_offres) alimentée par send_offers(),
+  qui ne fait qu'insérer des lignes: l'évaluation des règles n'attend jamais l'envoi;
+- des workers par canal (email, sms, notification_app) qui prennent les offres par lots,
+  respectent un débit maximal par canal, réessaient avec un délai croissant et
+  enregistrent la latence entre la mise en file et la livraison.
+
+Les canaux sont configurés par variables d'environnement; par défaut ils pointent vers
+des serveurs locaux (SMTP sur le port 1025, HTTP sur le port 8025), ce qui permet de
+les remplacer par des bouchons en développement.
+"""
+
+import sqlite3
+import json
+import logging
+import math
+import os
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+import requests
+
+try:
+    from modules.db_pool import get_connection
+except ImportError:
+    from db_pool import get_connection
+
+# Configuration du logging
+logger = logging.getLogger(__name__)
+
+# Statuts d'un envoi dans la file
+STATUS_PENDING = 'en_attente'
+STATUS_IN_PROGRESS = 'en_cours'
+STATUS_SENT = 'envoye'
+STATUS_FAILED = 'echec'
+
+# Nombre maximal de tentatives avant abandon, et délai de la première nouvelle tentative (en secondes)
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 30
+
+# Préfixe des erreurs définitives (contact absent): l'envoi passe en échec sans nouvelle tentative
+MISSING_CONTACT = 'Contact manquant'
+
+# Durée après laquelle un lot « en cours » non terminé (worker arrêté) est remis en file (en secondes)
+CLAIM_LEASE = 600
+
+# Configuration par défaut des canaux: débit (messages/s), taille des lots, nombre de workers
+CHANNEL_SETTINGS = {
+    'email': {'rate': 50, 'batch_size': 100, 'workers': 2},
+    'sms': {'rate': 10, 'batch_size': 50, 'workers': 1},
+    'notification_app': {'rate': 200, 'batch_size': 500, 'workers': 1}
+}
+
+OUTBOX_TABLE = '''
+    CREATE TABLE IF NOT EXISTS file_envoi_offres (
+        envoi_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        offre_id INTEGER NOT NULL,
+        canal TEXT NOT NULL,
+        statut TEXT NOT NULL DEFAULT 'en_attente',
+        tentatives INTEGER NOT NULL DEFAULT 0,
+        prochaine_tentative DATETIME DEFAULT CURRENT_TIMESTAMP,
+        date_creation DATETIME DEFAULT CURRENT_TIMESTAMP,
+        date_verrou DATETIME,
+        date_envoi DATETIME,
+        latence_ms INTEGER,
+        derniere_erreur TEXT,
+        UNIQUE (offre_id, canal),
+        FOREIGN KEY (offre_id) REFERENCES offres_client(offre_id)
+    )
+'''
+
+
+def ensure_delivery_outbox(conn, commit=True):
+    """
+    Crée la file d'envoi des offres et ses index s'ils sont absents.
+
+    Args:
+        conn (sqlite3.Connection): Connexion à la base de données
+        commit (bool): Valider la transaction (False: l'appelant la valide, comme migrate())
+    """
+    conn.execute(OUTBOX_TABLE)
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_file_envoi_offres_canal
+        ON file_envoi_offres(canal, statut, prochaine_tentative)
+    ''')
+    if commit:
+        conn.commit()
+
+
+def enqueue_offers(conn, offer_ids=None, channel='email'):
+    """
+    Met en file d'envoi les offres générées, sans attendre leur livraison.
+
+    Args:
+        conn (sqlite3.Connection): Connexion à la base de données
+        offer_ids (list, optional): IDs des offres à envoyer. Si None, toutes les offres générées.
+        channel (str): Canal d'envoi
+
+    Returns:
+        int: Nombre d'offres mises en file
+    """
+    offer_condition = ''
+    params = [channel]
+    if offer_ids:
+        offer_condition = 'AND offre_id IN (SELECT value FROM json_each(?))'
+        params.append(json.dumps([int(offer_id) for offer_id in offer_ids]))
+
+    cursor = conn.execute(f'''
+        INSERT OR IGNORE INTO file_envoi_offres (offre_id, canal)
+        SELECT offre_id, ?
+        FROM offres_client
+        WHERE statut = 'generee'
+        {offer_condition}
+    ''', params)
+
+    return cursor.rowcount
+
+
+class TokenBucket:
+    """
+    Limiteur de débit à jetons, partagé par les workers d'un même canal.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Initialise le limiteur.
+
+        Args:
+            rate (float): Nombre de messages autorisés par seconde
+            capacity (int, optional): Nombre maximal de jetons accumulés (par défaut, une seconde de débit)
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, count, stop_event=None):
+        """
+        Attend que count jetons soient disponibles puis les consomme.
+
+        Args:
+            count (int): Nombre de messages à envoyer
+            stop_event (threading.Event, optional): Interrompt l'attente à l'arrêt du service
+
+        Returns:
+            bool: True si les jetons ont été obtenus
+        """
+        count = min(count, self.capacity)
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+
+                if self.tokens >= count:
+                    self.tokens -= count
+                    return True
+
+                wait = (count - self.tokens) / self.rate
+
+            if stop_event is not None and stop_event.wait(wait):
+                return False
+            if stop_event is None:
+                time.sleep(wait)
+
+
+def contact_errors(channel, messages):
+    """
+    Erreurs définitives des messages sans coordonnée pour le canal.
+
+    Args:
+        channel (EmailChannel|HttpChannel): Canal d'envoi
+        messages (list): Messages du lot
+
+    Returns:
+        dict: Erreur par envoi_id des messages sans contact
+    """
+    field = getattr(channel, 'contact_field', None)
+    if not field:
+        return {}
+    return {
+        message['envoi_id']: f"{MISSING_CONTACT} ({field})"
+        for message in messages if not message[field]
+    }
+
+
+class EmailChannel:
+    """
+    Canal email: un lot est envoyé sur une seule connexion SMTP.
+    """
+
+    name = 'email'
+    contact_field = 'email'
+
+    def __init__(self, host=None, port=None, sender=None, timeout=10):
+        self.host = host or os.environ.get('LOYALTY_SMTP_HOST', 'localhost')
+        self.port = int(port or os.environ.get('LOYALTY_SMTP_PORT', 1025))
+        self.sender = sender or os.environ.get('LOYALTY_SMTP_SENDER', 'fidelite@localhost')
+        self.timeout = timeout
+
+    def send_batch(self, messages):
+        """
+        Envoie un lot d'offres par email.
+
+        Args:
+            messages (list): Messages à envoyer (dict avec envoi_id, destinataire, sujet, texte)
+
+        Returns:
+            dict: Erreur par envoi_id (absent si l'envoi a réussi)
+        """
+        errors = contact_errors(self, messages)
+
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            for message in messages:
+                if message['envoi_id'] in errors:
+                    continue
+
+                email = EmailMessage()
+                email['From'] = self.sender
+                email['To'] = message['email']
+                email['Subject'] = message['sujet']
+                email.set_content(message['texte'])
+
+                try:
+                    smtp.send_message(email)
+                except smtplib.SMTPException as e:
+                    errors[message['envoi_id']] = str(e)
+
+        return errors
+
+
+class HttpChannel:
+    """
+    Canal HTTP (passerelle SMS ou notifications): un lot est envoyé en une seule requête.
+
+    La passerelle peut répondre {"failed": {"<envoi_id>": "erreur", ...}} pour signaler
+    des échecs individuels.
+    """
+
+    def __init__(self, name, url, contact_field, timeout=10):
+        self.name = name
+        self.url = url
+        self.contact_field = contact_field
+        self.timeout = timeout
+
+    def send_batch(self, messages):
+        """
+        Envoie un lot d'offres à la passerelle HTTP du canal.
+
+        Args:
+            messages (list): Messages à envoyer
+
+        Returns:
+            dict: Erreur par envoi_id (absent si l'envoi a réussi)
+        """
+        errors = contact_errors(self, messages)
+        payload = []
+
+        for message in messages:
+            if message['envoi_id'] in errors:
+                continue
+            payload.append({
+                'id': message['envoi_id'],
+                'client_id': message['client_id'],
+                'destinataire': message[self.contact_field] if self.contact_field else None,
+                'texte': message['texte']
+            })
+
+        if payload:
+            response = requests.post(self.url, json={'messages': payload}, timeout=self.timeout)
+            response.raise_for_status()
+
+            failed = response.json().get('failed', {}) if response.content else {}
+            for envoi_id, error in failed.items():
+                errors[int(envoi_id)] = error
+
+        return errors
+
+
+def default_channels():
+    """
+    Construit les canaux d'envoi à partir des variables d'environnement.
+
+    Returns:
+        dict: Canal par nom
+    """
+    gateway = os.environ.get('LOYALTY_GATEWAY_URL', 'http://localhost:8025')
+    return {
+        'email': EmailChannel(),
+        'sms': HttpChannel('sms', os.environ.get('LOYALTY_SMS_URL', f"{gateway}/sms"), 'telephone'),
+        'notification_app': HttpChannel(
+            'notification_app', os.environ.get('LOYALTY_PUSH_URL', f"{gateway}/push"), None
+        )
+    }
+
+
+class OfferDeliveryService:
+    """
+    Service de livraison des offres: un groupe de workers par canal consomme la file d'envoi.
+    """
+
+    def __init__(self, db_path='modules/fidelity_db.sqlite', channels=None, settings=None):
+        """
+        Initialise le service d'envoi.
+
+        Args:
+            db_path (str): Chemin vers la base de données SQLite
+            channels (dict, optional): Canaux par nom (par défaut default_channels())
+            settings (dict, optional): Débit, taille des lots et workers par canal (voir CHANNEL_SETTINGS)
+        """
+        self.db_path = db_path
+        self.channels = channels or default_channels()
+        self.settings = {name: dict(CHANNEL_SETTINGS.get(name, CHANNEL_SETTINGS['email'])) for name in self.channels}
+        for name, overrides in (settings or {}).items():
+            self.settings.setdefault(name, {}).update(overrides)
+
+        self.buckets = {name: TokenBucket(self.settings[name]['rate']) for name in self.channels}
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def _get_connection(self):
+        """
+        Emprunte une connexion au pool (à rendre avec close()).
+
+        Returns:
+            sqlite3.Connection: Connexion à la base de données
+        """
+        return get_connection(self.db_path, sqlite3.Row)
+
+    def start(self):
+        """Démarre les workers de tous les canaux en arrière-plan."""
+        self.stop_event.clear()
+        self._release_stale_claims()
+
+        for name in self.channels:
+            for index in range(self.settings[name]['workers']):
+                thread = threading.Thread(
+                    target=self._worker_loop, args=(name,), name=f"offres-{name}-{index}", daemon=True
+                )
+                thread.start()
+                self.threads.append(thread)
+
+        logger.info(f"Service d'envoi des offres démarré ({len(self.threads)} workers)")
+
+    def stop(self, timeout=30):
+        """
+        Arrête les workers après le lot en cours.
+
+        Args:
+            timeout (int): Délai maximal d'attente par worker (en secondes)
+        """
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+        logger.info("Service d'envoi des offres arrêté")
+
+    def drain(self, channel=None):
+        """
+        Livre de façon synchrone toutes les offres actuellement dues (tâche manuelle, bancs d'essai).
+
+        Args:
+            channel (str, optional): Canal à traiter. Si None, tous les canaux.
+
+        Returns:
+            dict: Nombre d'offres envoyées et en échec par canal
+        """
+        self._release_stale_claims()
+        results = {}
+
+        for name in ([channel] if channel else self.channels):
+            sent = failed = 0
+            while True:
+                batch = self._process_batch(name)
+                if batch is None:
+                    break
+                sent += batch['sent']
+                failed += batch['failed']
+            results[name] = {'sent': sent, 'failed': failed}
+
+        return results
+
+    def _worker_loop(self, channel):
+        """
+        Boucle d'un worker: prend un lot, l'envoie, et ralentit quand le canal est en erreur.
+
+        Args:
+            channel (str): Nom du canal
+        """
+        pause = 1
+
+        while not self.stop_event.is_set():
+            try:
+                batch = self._process_batch(channel)
+            except Exception as e:
+                logger.error(f"Erreur du worker {channel}: {str(e)}")
+                batch = {'sent': 0, 'failed': 1}
+
+            if batch is None:
+                # File vide: attendre de nouvelles offres
+                self.stop_event.wait(5)
+            elif batch['failed'] and not batch['sent']:
+                # Canal indisponible: pause croissante jusqu'à 5 minutes
+                self.stop_event.wait(pause)
+                pause = min(pause * 2, 300)
+            else:
+                pause = 1
+
+    def _claim_batch(self, conn, channel, size):
+        """
+        Réserve un lot d'envois dus pour un canal.
+
+        Args:
+            conn (sqlite3.Connection): Connexion à la base de données
+            channel (str): Nom du canal
+            size (int): Taille maximale du lot
+
+        Returns:
+            list: Messages réservés
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        claimed = [row[0] for row in conn.execute('''
+            UPDATE file_envoi_offres
+            SET statut = 'en_cours', date_verrou = datetime('now')
+            WHERE envoi_id IN (
+                SELECT envoi_id
+                FROM file_envoi_offres
+                WHERE canal = ? AND statut = 'en_attente'
+                AND prochaine_tentative <= datetime('now')
+                ORDER BY prochaine_tentative
+                LIMIT ?
+            )
+            RETURNING envoi_id
+        ''', (channel, size)).fetchall()]
+        conn.commit()
+
+        if not claimed:
+            return []
+
+        rows = conn.execute('''
+            SELECT
+                f.envoi_id, f.offre_id, f.tentatives,
+                oc.client_id, oc.code_unique, oc.date_expiration, oc.commentaire,
+                c.prenom, c.email, c.telephone,
+                r.nom as regle_nom
+            FROM file_envoi_offres f
+            JOIN offres_client oc ON f.offre_id = oc.offre_id
+            JOIN clients c ON oc.client_id = c.client_id
+            LEFT JOIN regles_fidelite r ON oc.regle_id = r.regle_id
+            WHERE f.envoi_id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(claimed),)).fetchall()
+
+        return [dict(row, **self._render_message(row)) for row in rows]
+
+    def _render_message(self, offer):
+        """
+        Construit le sujet et le texte du message d'une offre.
+
+        Args:
+            offer (sqlite3.Row): Offre et informations du client
+
+        Returns:
+            dict: Sujet et texte du message
+        """
+        return {
+            'sujet': f"Votre offre fidélité : {offer['regle_nom'] or 'offre spéciale'}",
+            'texte': (
+                f"Bonjour {offer['prenom'] or ''},\n\n"
+                f"{offer['commentaire'] or 'Une offre vous attend'}.\n"
+                f"Code : {offer['code_unique']} (valable jusqu'au {offer['date_expiration']})."
+            )
+        }
+
+    def _process_batch(self, channel):
+        """
+        Prend, envoie et enregistre un lot d'offres pour un canal.
+
+        Args:
+            channel (str): Nom du canal
+
+        Returns:
+            dict: Nombre d'envois réussis et en échec, ou None si aucune offre n'est due
+        """
+        settings = self.settings[channel]
+        size = min(settings['batch_size'], int(self.buckets[channel].capacity))
+
+        conn = self._get_connection()
+        try:
+            messages = self._claim_batch(conn, channel, size)
+            if not messages:
+                return None
+
+            if not self.buckets[channel].acquire(len(messages), self.stop_event):
+                # Arrêt demandé: remettre le lot en file
+                self._release(conn, [m['envoi_id'] for m in messages])
+                return {'sent': 0, 'failed': 0}
+
+            try:
+                errors = self.channels[channel].send_batch(messages)
+            except Exception as e:
+                logger.warning(f"Échec de l'envoi d'un lot {channel}: {str(e)}")
+                errors = {m['envoi_id']: str(e) for m in messages}
+                # Les contacts manquants restent des échecs définitifs, même canal indisponible
+                errors.update(contact_errors(self.channels[channel], messages))
+
+            self._record_results(conn, channel, messages, errors)
+            return {'sent': len(messages) - len(errors), 'failed': len(errors)}
+        finally:
+            conn.close()
+
+    def _record_results(self, conn, channel, messages, errors):
+        """
+        Enregistre le résultat d'un lot: offres envoyées, nouvelles tentatives ou abandons.
+
+        Args:
+            conn (sqlite3.Connection): Connexion à la base de données
+            channel (str): Nom du canal
+            messages (list): Messages du lot
+            errors (dict): Erreur par envoi_id
+        """
+        sent = [m for m in messages if m['envoi_id'] not in errors]
+        failed = [m for m in messages if m['envoi_id'] in errors]
+
+        conn.executemany('''
+            UPDATE file_envoi_offres
+            SET statut = 'envoye',
+                date_envoi = datetime('now'),
+                latence_ms = CAST((julianday('now') - julianday(date_creation)) * 86400000 AS INTEGER),
+                tentatives = tentatives + 1
+            WHERE envoi_id = ?
+        ''', [(m['envoi_id'],) for m in sent])
+
+        conn.executemany('''
+            UPDATE offres_client
+            SET statut = 'envoyee', date_envoi = CURRENT_TIMESTAMP, canal_envoi = ?
+            WHERE offre_id = ? AND statut = 'generee'
+        ''', [(channel, m['offre_id']) for m in sent])
+
+        # Nouvelle tentative avec un délai doublé à chaque échec, abandon après MAX_ATTEMPTS
+        # ou immédiatement si l'erreur est définitive
+        conn.executemany('''
+            UPDATE file_envoi_offres
+            SET statut = CASE WHEN tentatives + 1 >= ? OR ? THEN 'echec' ELSE 'en_attente' END,
+                tentatives = tentatives + 1,
+                prochaine_tentative = datetime('now', '+' || ? || ' seconds'),
+                derniere_erreur = ?
+            WHERE envoi_id = ?
+        ''', [
+            (
+                MAX_ATTEMPTS,
+                errors[m['envoi_id']].startswith(MISSING_CONTACT),
+                int(RETRY_BASE_DELAY * math.pow(2, m['tentatives'])),
+                errors[m['envoi_id']],
+                m['envoi_id']
+            )
+            for m in failed
+        ])
+
+        conn.commit()
+
+        if failed:
+            logger.warning(f"{len(failed)} envois {channel} en échec sur {len(messages)}")
+
+    def _release(self, conn, envoi_ids):
+        """Remet en file des envois réservés mais non traités."""
+        conn.executemany(
+            "UPDATE file_envoi_offres SET statut = 'en_attente' WHERE envoi_id = ? AND statut = 'en_cours'",
+            [(envoi_id,) for envoi_id in envoi_ids]
+        )
+        conn.commit()
+
+    def _release_stale_claims(self):
+        """Remet en file les lots restés « en cours » après l'arrêt brutal d'un worker."""
+        conn = self._get_connection()
+        cursor = conn.execute('''
+            UPDATE file_envoi_offres
+            SET statut = 'en_attente'
+            WHERE statut = 'en_cours' AND date_verrou <= datetime('now', ?)
+        ''', (f"-{CLAIM_LEASE} seconds",))
+        conn.commit()
+        conn.close()
+
+        if cursor.rowcount:
+            logger.info(f"{cursor.rowcount} envois remis en file")
+
+    def get_delivery_stats(self):
+        """
+        Récupère l'état de la file d'envoi et la latence de livraison par canal.
+
+        Returns:
+            dict: Nombre d'envois par statut et latence (p50, p99, max) des 24 dernières heures par canal
+        """
+        try:
+            conn = self._get_connection()
+
+            stats = {}
+            for row in conn.execute("SELECT canal, statut, COUNT(*) as nb FROM file_envoi_offres GROUP BY canal, statut"):
+                stats.setdefault(row['canal'], {'statuts': {}})['statuts'][row['statut']] = row['nb']
+
+            for channel in stats:
+                latencies = [row[0] for row in conn.execute('''
+                    SELECT latence_ms FROM file_envoi_offres
+                    WHERE canal = ? AND statut = 'envoye' AND date_envoi >= datetime('now', '-1 day')
+                    ORDER BY latence_ms
+                ''', (channel,))]
+                if latencies:
+                    stats[channel]['latence_ms'] = {
+                        'p50': latencies[max(0, math.ceil(0.50 * len(latencies)) - 1)],
+                        'p99': latencies[max(0, math.ceil(0.99 * len(latencies)) - 1)],
+                        'max': latencies[-1]
+                    }
+
+            conn.close()
+            return {'success': True, 'channels': stats}
+
+        except Exception as e:
+            logger.error(f"Erreur lors de la récupération des statistiques d'envoi: {str(e)}")
+            return {'success': False, 'error': str(e)}
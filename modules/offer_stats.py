@@ -0,0 +1,100 @@
+"""
+Module du résumé journalier des offres
+
+Ce module maintient la table offres_stats_jour, qui compte les offres par jour de
+génération, par règle et par statut. Elle est tenue à jour par des triggers sur
+offres_client, de sorte que les statistiques du programme de fidélité se calculent
+sur quelques centaines de lignes au lieu de parcourir toutes les offres.
+Les offres sans date de génération sont comptées sous le jour ''.
+"""
+
+import logging
+
+# Configuration du logging
+logger = logging.getLogger(__name__)
+
+OFFER_DAILY_STATS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS offres_stats_jour (
+        jour DATE NOT NULL,
+        regle_id INTEGER NOT NULL,
+        statut TEXT NOT NULL,
+        nb_offres INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (jour, regle_id, statut)
+    )
+'''
+
+
+def _increment(prefix, delta):
+    """
+    Construit l'instruction ajoutant delta au compteur de l'offre NEW ou OLD.
+
+    Args:
+        prefix (str): 'NEW' ou 'OLD'
+        delta (int): +1 ou -1
+
+    Returns:
+        str: Instruction SQL d'upsert
+    """
+    return f'''
+        INSERT INTO offres_stats_jour (jour, regle_id, statut, nb_offres)
+        VALUES (COALESCE(date({prefix}.date_generation), ''), {prefix}.regle_id, COALESCE({prefix}.statut, 'generee'), {delta})
+        ON CONFLICT(jour, regle_id, statut) DO UPDATE SET nb_offres = nb_offres + excluded.nb_offres;
+    '''
+
+
+# Triggers de maintenance de offres_stats_jour
+OFFER_DAILY_STATS_TRIGGERS = {
+    'offres_stats_jour_insert': f'''
+        CREATE TRIGGER IF NOT EXISTS offres_stats_jour_insert
+        AFTER INSERT ON offres_client
+        BEGIN
+            {_increment('NEW', 1)}
+        END
+    ''',
+    'offres_stats_jour_update': f'''
+        CREATE TRIGGER IF NOT EXISTS offres_stats_jour_update
+        AFTER UPDATE OF statut, regle_id, date_generation ON offres_client
+        BEGIN
+            {_increment('OLD', -1)}
+            {_increment('NEW', 1)}
+        END
+    ''',
+    'offres_stats_jour_delete': f'''
+        CREATE TRIGGER IF NOT EXISTS offres_stats_jour_delete
+        AFTER DELETE ON offres_client
+        BEGIN
+            {_increment('OLD', -1)}
+        END
+    '''
+}
+
+
+def ensure_offer_daily_stats(conn, commit=True):
+    """
+    Crée la table offres_stats_jour et ses triggers s'ils sont absents.
+
+    La table est initialisée à partir des offres existantes lors de sa création.
+
+    Args:
+        conn (sqlite3.Connection): Connexion à la base de données
+        commit (bool): Valider la transaction (False: l'appelant la valide, comme migrate())
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'offres_stats_jour'"
+    ).fetchone()
+
+    conn.execute(OFFER_DAILY_STATS_TABLE)
+    for trigger_sql in OFFER_DAILY_STATS_TRIGGERS.values():
+        conn.execute(trigger_sql)
+
+    if not exists:
+        conn.execute('''
+            INSERT INTO offres_stats_jour (jour, regle_id, statut, nb_offres)
+            SELECT COALESCE(date(date_generation), ''), regle_id, COALESCE(statut, 'generee'), COUNT(*)
+            FROM offres_client
+            GROUP BY 1, 2, 3
+        ''')
+        logger.info("Table offres_stats_jour créée et initialisée")
+
+    if commit:
+        conn.commit()
@@ -0,0 +1,439 @@
+"""
+Cache des résultats de requêtes en lecture
+
+Les résultats des requêtes de lecture fréquentes (indicateurs des tableaux de bord,
+listes des filtres, calendrier) sont conservés en mémoire, indexés par la requête
+normalisée et ses paramètres, avec éviction LRU bornée en nombre d'entrées et en taille.
+
+Chaque table d'une base a un numéro de version, incrémenté à la validation de toute
+écriture sur cette table par une connexion du pool (voir db_pool), y compris les tables
+modifiées par les triggers de la table écrite. Un résultat n'est servi que si les versions
+des tables lues par sa requête n'ont pas changé depuis son calcul.
+
+Les écritures d'autres processus (génération de données, planificateur) ne sont pas
+visibles: les entrées expirent après QUERY_CACHE_MAX_AGE secondes.
+"""
+
+import logging
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+# Configuration du logging
+logger = logging.getLogger(__name__)
+
+# Limites du cache: nombre d'entrées, taille estimée totale (octets) et âge maximal (secondes)
+QUERY_CACHE_MAX_ENTRIES = 1024
+QUERY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+QUERY_CACHE_MAX_AGE = 300
+
+# Requêtes dont les tables lues ou écrites sont mémorisées (par base)
+TABLES_MEMO_MAX_ENTRIES = 4096
+
+# Bases dont la structure est mémorisée (chaque rafraîchissement de la réplique de lecture
+# est une nouvelle base: les plus anciennes sont évincées)
+SCHEMAS_MAX_ENTRIES = 32
+
+# Premier mot-clé des requêtes de lecture mises en cache
+READ_KEYWORDS = ('SELECT', 'WITH')
+
+# Premier mot-clé des requêtes qui modifient les données ou le schéma
+WRITE_KEYWORDS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+SCHEMA_KEYWORDS = ('CREATE', 'DROP', 'ALTER')
+
+WRITE_TARGET_RE = re.compile(
+    r'\b(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+'
+    r'(?:main\.)?["`\[]?(\w+)',
+    re.IGNORECASE
+)
+IDENTIFIER_RE = re.compile(r'[A-Za-z_]\w*')
+WHITESPACE_RE = re.compile(r'\s+')
+
+# DDL qui ne touche que le schéma temporaire de la connexion (tables de travail)
+TEMP_DDL_RE = re.compile(
+    r'^\s*(?:CREATE\s+(?:TEMP|TEMPORARY)\b'
+    r'|(?:CREATE(?:\s+UNIQUE)?|DROP)\s+(?:TABLE|INDEX|VIEW|TRIGGER)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?["`\[]?temp["`\]]?\.'
+    r'|ALTER\s+TABLE\s+["`\[]?temp["`\]]?\.)',
+    re.IGNORECASE
+)
+
+
+def first_keyword(sql):
+    """Premier mot-clé d'une requête SQL, en majuscules"""
+    match = IDENTIFIER_RE.search(sql)
+    return match.group(0).upper() if match else ''
+
+
+def normalize_sql(sql):
+    """Normalise une requête pour l'indexation du cache (espaces et point-virgule final)"""
+    return WHITESPACE_RE.sub(' ', sql).strip().rstrip(';').strip()
+
+
+def _estimate_size(result):
+    """Taille estimée d'un résultat en mémoire (octets)"""
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(deep=True).sum())
+
+    size = sys.getsizeof(result)
+    for row in result:
+        values = row.values() if isinstance(row, dict) else row
+        size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in values)
+    return size
+
+
+def _copy_result(result):
+    """Copie d'un résultat, pour que l'appelant ne modifie pas l'entrée du cache"""
+    if isinstance(result, pd.DataFrame):
+        return result.copy()
+    return [dict(row) if isinstance(row, dict) else row for row in result]
+
+
+class QueryCache:
+    """
+    Cache LRU des résultats de requêtes, invalidé par version de table.
+    """
+
+    def __init__(self, max_entries=QUERY_CACHE_MAX_ENTRIES, max_bytes=QUERY_CACHE_MAX_BYTES,
+                 max_age=QUERY_CACHE_MAX_AGE):
+        """
+        Initialise le cache.
+
+        Args:
+            max_entries (int): Nombre maximal d'entrées
+            max_bytes (int): Taille estimée maximale des résultats conservés (octets)
+            max_age (int): Âge maximal d'une entrée (secondes)
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.enabled = True
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Versions des tables par (base, table) et version du schéma par base
+        self._versions = {}
+        self._schema_versions = {}
+        # Structure des bases (LRU): tables et vues connues, tables écrites par les triggers
+        self._schemas = OrderedDict()
+        # Tables lues ou écrites par requête, par (base, lecture/écriture, requête)
+        self._tables_memo = {}
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'stale': 0,
+            'bypassed': 0,
+            'evictions': 0,
+            'invalidations': 0
+        }
+
+    def _schema(self, conn, db_path):
+        """
+        Tables et vues d'une base, avec les dépendances des vues et des triggers.
+
+        Returns:
+            dict: {'tables': set, 'views': {vue: tables}, 'triggers': {table: tables écrites}}
+        """
+        with self._lock:
+            schema = self._schemas.get(db_path)
+            if schema is not None:
+                self._schemas.move_to_end(db_path)
+                return schema
+            schema_version = self._schema_versions.get(db_path, 0)
+
+        # Lecture de sqlite_master hors verrou
+        objects = conn.execute(
+            "SELECT type, name, tbl_name, sql FROM sqlite_master WHERE type IN ('table', 'view', 'trigger')"
+        ).fetchall()
+        tables = {row[1].lower() for row in objects if row[0] == 'table'}
+        views = {row[1].lower(): row[3] or '' for row in objects if row[0] == 'view'}
+        names = tables | set(views)
+
+        # Tables lues par chaque vue (vues imbriquées comprises)
+        view_tables = {}
+        for view in views:
+            pending, seen = [view], set()
+            while pending:
+                current = pending.pop()
+                for name in {token.lower() for token in IDENTIFIER_RE.findall(views[current])} & names:
+                    if name in views and name not in seen:
+                        seen.add(name)
+                        pending.append(name)
+                    elif name in tables:
+                        view_tables.setdefault(view, set()).add(name)
+
+        # Tables écrites par les triggers de chaque table (corps du trigger, après BEGIN)
+        triggers = {}
+        for row in objects:
+            if row[0] == 'trigger' and row[3]:
+                body = re.split(r'\bBEGIN\b', row[3], maxsplit=1, flags=re.IGNORECASE)[-1]
+                targets = {target.lower() for target in WRITE_TARGET_RE.findall(body)} & tables
+                triggers.setdefault(row[2].lower(), set()).update(targets)
+
+        schema = {'tables': tables, 'views': view_tables, 'triggers': triggers}
+        with self._lock:
+            # Structure lue avant une modification du schéma: utilisée, mais pas conservée
+            if self._schema_versions.get(db_path, 0) == schema_version:
+                self._schemas[db_path] = schema
+                while len(self._schemas) > SCHEMAS_MAX_ENTRIES:
+                    self._schemas.popitem(last=False)
+        return schema
+
+    def _memoized_tables(self, conn, db_path, sql, write):
+        """Tables lues (ou écrites) par une requête, mémorisées par texte de requête"""
+        key = (db_path, write, sql)
+        with self._lock:
+            tables = self._tables_memo.get(key)
+            schema_version = self._schema_versions.get(db_path, 0)
+        if tables is None:
+            tables = self.tables_written(conn, db_path, sql) if write else self.tables_read(conn, db_path, sql)
+            with self._lock:
+                if self._schema_versions.get(db_path, 0) == schema_version:
+                    if len(self._tables_memo) >= TABLES_MEMO_MAX_ENTRIES:
+                        self._tables_memo.clear()
+                    self._tables_memo[key] = frozenset(tables)
+        return tables
+
+    def tables_read(self, conn, db_path, sql):
+        """
+        Tables dont dépend le résultat d'une requête.
+
+        L'ensemble est volontairement large: tout identifiant de la requête qui nomme une
+        table ou une vue de la base est retenu.
+        """
+        schema = self._schema(conn, db_path)
+        tokens = {token.lower() for token in IDENTIFIER_RE.findall(sql)}
+        tables = tokens & schema['tables']
+        for view in tokens & set(schema['views']):
+            tables |= schema['views'][view]
+        return tables
+
+    def tables_written(self, conn, db_path, sql):
+        """
+        Tables modifiées par une requête d'écriture, triggers compris.
+        """
+        schema = self._schema(conn, db_path)
+        tables = {target.lower() for target in WRITE_TARGET_RE.findall(sql)} & schema['tables']
+        if not tables:
+            # Cible non reconnue: toutes les tables citées sont considérées comme modifiées
+            tables = {token.lower() for token in IDENTIFIER_RE.findall(sql)} & schema['tables']
+
+        pending = list(tables)
+        while pending:
+            for target in schema['triggers'].get(pending.pop(), ()):
+                if target not in tables:
+                    tables.add(target)
+                    pending.append(target)
+        return tables
+
+    def invalidate(self, db_path, tables=None):
+        """
+        Incrémente la version de tables d'une base (de tout le schéma si tables est None).
+
+        Args:
+            db_path (str): Chemin vers la base de données SQLite
+            tables (iterable, optional): Tables modifiées
+        """
+        with self._lock:
+            if tables is None:
+                self._schema_versions[db_path] = self._schema_versions.get(db_path, 0) + 1
+                self._schemas.pop(db_path, None)
+                for key in [key for key in self._tables_memo if key[0] == db_path]:
+                    del self._tables_memo[key]
+            else:
+                for table in tables:
+                    key = (db_path, table)
+                    self._versions[key] = self._versions.get(key, 0) + 1
+            self._stats['invalidations'] += 1
+
+    def _versions_of(self, db_path, tables):
+        return (
+            self._schema_versions.get(db_path, 0),
+            tuple(sorted((table, self._versions.get((db_path, table), 0)) for table in tables))
+        )
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry['size']
+            self._stats['evictions'] += 1
+
+    def get_or_compute(self, conn, sql, params, compute):
+        """
+        Retourne le résultat en cache d'une requête de lecture, ou le calcule et le conserve.
+
+        Le cache est ignoré pour les connexions hors pool (écritures non suivies), pour les
+        requêtes qui ne sont pas des lectures et pendant une transaction (la connexion
+        verrait ses propres écritures non validées).
+
+        Args:
+            conn (sqlite3.Connection): Connexion du pool
+            sql (str): Requête SQL
+            params (tuple|list|dict): Paramètres de la requête
+            compute (callable): Fonction sans argument qui exécute la requête
+
+        Returns:
+            Résultat de compute() (liste de lignes ou DataFrame)
+        """
+        db_path = getattr(conn, 'db_path', None)
+        if (not self.enabled or db_path is None or conn.in_transaction
+                or first_keyword(sql) not in READ_KEYWORDS):
+            with self._lock:
+                self._stats['bypassed'] += 1
+            return compute()
+
+        if isinstance(params, dict):
+            params = tuple(sorted(params.items()))
+        key = (db_path, normalize_sql(sql), tuple(params or ()))
+        tables = self._memoized_tables(conn, db_path, sql, write=False)
+        now = time.monotonic()
+
+        with self._lock:
+            versions = self._versions_of(db_path, tables)
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry['versions'] == versions and now - entry['created'] <= self.max_age:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return _copy_result(entry['result'])
+                del self._entries[key]
+                self._bytes -= entry['size']
+                self._stats['stale'] += 1
+            self._stats['misses'] += 1
+
+        # Calcul hors verrou: les versions relevées avant le calcul rendent l'entrée
+        # obsolète si une écriture est validée pendant la requête
+        result = compute()
+        size = _estimate_size(result)
+
+        # Un résultat trop volumineux évincerait une grande partie du cache
+        if size <= self.max_bytes // 4:
+            with self._lock:
+                previous = self._entries.pop(key, None)
+                if previous is not None:
+                    self._bytes -= previous['size']
+                self._entries[key] = {
+                    'result': result,
+                    'versions': versions,
+                    'created': now,
+                    'size': size
+                }
+                self._bytes += size
+                self._evict()
+
+        return _copy_result(result)
+
+    def clear(self):
+        """Vide le cache (les versions des tables sont conservées)."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """
+        Retourne les statistiques du cache.
+
+        Returns:
+            dict: Succès, échecs, entrées obsolètes, évictions, taille et taux de succès
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        stats['max_entries'] = self.max_entries
+        stats['max_bytes'] = self.max_bytes
+        stats['max_age'] = self.max_age
+        return stats
+
+
+# Cache partagé par l'application
+_cache = QueryCache()
+
+
+def record_write(conn, db_path, sql):
+    """
+    Tables à invalider après une écriture d'une connexion du pool.
+
+    Args:
+        conn (sqlite3.Connection): Connexion ayant exécuté la requête
+        db_path (str): Chemin vers la base de données SQLite
+        sql (str): Requête exécutée
+
+    Returns:
+        set: Tables modifiées, ou None si la requête modifie le schéma (tout invalider)
+    """
+    keyword = first_keyword(sql)
+    if keyword in SCHEMA_KEYWORDS:
+        # Les tables temporaires sont propres à la connexion: rien à invalider
+        if TEMP_DDL_RE.match(sql):
+            return set()
+        return None
+    if keyword not in WRITE_KEYWORDS:
+        return set()
+    if keyword == 'WITH' and not WRITE_TARGET_RE.search(sql):
+        return set()
+    return _cache._memoized_tables(conn, db_path, sql, write=True)
+
+
+def invalidate_tables(db_path, tables=None):
+    """
+    Invalide les résultats en cache dépendant de tables d'une base.
+
+    Args:
+        db_path (str): Chemin vers la base de données SQLite
+        tables (iterable, optional): Tables modifiées (toute la base si None)
+    """
+    _cache.invalidate(db_path, tables)
+
+
+def cached_execute(conn, sql, params=()):
+    """
+    Exécute une requête de lecture et retourne toutes ses lignes, depuis le cache si possible.
+
+    Args:
+        conn (sqlite3.Connection): Connexion du pool
+        sql (str): Requête SQL
+        params (tuple|list|dict): Paramètres de la requête
+
+    Returns:
+        list: Lignes du résultat (comme fetchall())
+    """
+    return _cache.get_or_compute(conn, sql, params, lambda: conn.execute(sql, params).fetchall())
+
+
+def cached_read_sql(conn, sql, params=None):
+    """
+    Équivalent de pd.read_sql_query, depuis le cache si possible.
+
+    Args:
+        conn (sqlite3.Connection): Connexion du pool
+        sql (str): Requête SQL
+        params (tuple|list|dict, optional): Paramètres de la requête
+
+    Returns:
+        DataFrame: Résultat de la requête
+    """
+    # Connexion du miroir analytique: résultat lu en colonnes, hors cache (voir analytics_mirror)
+    if hasattr(conn, 'read_sql_query'):
+        return conn.read_sql_query(sql, params)
+    return _cache.get_or_compute(conn, sql, params, lambda: pd.read_sql_query(sql, conn, params=params))
+
+
+def get_query_cache():
+    """Retourne le cache partagé (configuration et statistiques)."""
+    return _cache
+
+
+def get_query_cache_stats():
+    """
+    Retourne les statistiques du cache partagé.
+
+    Returns:
+        dict: Statistiques du cache
+    """
+    return _cache.stats()
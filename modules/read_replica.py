@@ -0,0 +1,421 @@
+"""
+Réplique de lecture de la base de fidélité
+
+Les requêtes longues des tableaux de bord et des exports partagent la base avec
+l'ingestion des tickets et l'évaluation des règles. Ce module maintient une copie de
+la base, rafraîchie périodiquement, sur laquelle ces lectures s'exécutent pendant que
+les écritures restent sur la base principale.
+
+La copie est faite par l'API de sauvegarde de SQLite en une seule étape: elle lit un
+instantané cohérent dans une transaction de lecture qui, la base principale étant en
+WAL, ne bloque pas les écrivains. Elle est écrite dans un fichier temporaire puis
+substituée à la réplique par un renommage atomique: les lectures en cours terminent sur
+l'ancien fichier, les connexions suivantes ouvrent le nouveau. La réplique n'est jamais
+modifiée en place, ses lecteurs ne prennent donc aucun verrou partagé avec les écrivains.
+
+La date de modification du fichier de la réplique est celle de son instantané: le retard
+est lisible par tous les processus, et un processus ne recopie pas une réplique que
+l'un des autres vient de rafraîchir.
+
+Les lectures passent par get_replica_connection(): connexion en lecture seule sur la
+réplique si elle date de moins de REPLICA_SETTINGS['max_lag'] secondes, connexion du
+pool sur la base principale sinon. data_lag() donne l'âge des données lues par une
+connexion, affiché par les tableaux de bord.
+
+L'intervalle de rafraîchissement est allongé pour les grosses bases: la copie ne doit
+pas occuper plus de REPLICA_SETTINGS['max_refresh_share'] du temps. Après un échec
+(notamment sous Windows, où la réplique ne peut pas être remplacée tant qu'un lecteur
+la tient ouverte), les tentatives suivantes sont espacées et l'échec n'est journalisé
+qu'une fois.
+
+Usage:
+    python modules/read_replica.py modules/fidelity_db.sqlite
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from urllib.request import pathname2url
+
+try:
+    from modules.db_pool import get_connection, DEFAULT_DB_PATH, POOL_SETTINGS
+except ImportError:
+    from db_pool import get_connection, DEFAULT_DB_PATH, POOL_SETTINGS
+
+# Configuration du logging
+logger = logging.getLogger(__name__)
+
+REPLICA_SETTINGS = {
+    'enabled': os.environ.get('LOYALTY_READ_REPLICA', '1') != '0',
+    'refresh_interval': 60,     # secondes minimum entre deux instantanés
+    'max_refresh_share': 0.05,  # part maximale du temps passée à copier la base
+    'max_lag': 900              # retard (secondes) au-delà duquel les lectures repassent sur la base principale
+}
+
+# Tentatives de remplacement de la réplique tenue ouverte par un lecteur (Windows)
+REPLACE_RETRIES = 5
+REPLACE_RETRY_DELAY = 0.2
+
+# Pragmas du pool utiles en lecture seule
+READ_PRAGMAS = ('mmap_size', 'cache_size', 'temp_store')
+
+_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_refresh_thread = None
+_fallback_reason = None
+# Dernier rafraîchissement de ce processus: durée de la copie, échecs consécutifs
+_refresh_state = {'duration_s': None, 'failures': 0, 'last_error': None}
+
+
+class ReplicaConnection(sqlite3.Connection):
+    """
+    Connexion en lecture seule sur la réplique.
+
+    db_path identifie l'instantané lu (fichier et date) pour le cache des requêtes: les
+    résultats d'un instantané ne sont pas servis pour le suivant, y compris lorsque la
+    réplique a été rafraîchie par un autre processus.
+    """
+
+    db_path = None
+    snapshot = None
+
+
+def configure_replica(settings=None):
+    """
+    Configure la réplique de lecture, à appeler une fois au démarrage de l'application.
+
+    Args:
+        settings (dict, optional): Paramètres de REPLICA_SETTINGS à modifier
+    """
+    for key, value in (settings or {}).items():
+        if key not in REPLICA_SETTINGS:
+            raise ValueError(f"Paramètre de réplique inconnu: {key}")
+        REPLICA_SETTINGS[key] = value
+
+
+def replica_path_for(db_path=DEFAULT_DB_PATH):
+    """
+    Fichier de la réplique d'une base, à côté de celle-ci.
+
+    Args:
+        db_path (str): Base de données SQLite principale
+
+    Returns:
+        str: Chemin absolu de la réplique (ex: modules/fidelity_db.replica.sqlite)
+    """
+    root, extension = os.path.splitext(os.path.abspath(db_path))
+    return f"{root}.replica{extension or '.sqlite'}"
+
+
+def _snapshot_time(replica_path):
+    """Date (epoch) de l'instantané de la réplique, None si elle n'existe pas"""
+    try:
+        return os.path.getmtime(replica_path)
+    except OSError:
+        return None
+
+
+def replica_lag(db_path=DEFAULT_DB_PATH):
+    """
+    Retard de la réplique sur la base principale.
+
+    Args:
+        db_path (str): Base de données SQLite principale
+
+    Returns:
+        float: Secondes depuis l'instantané de la réplique (None si elle n'existe pas)
+    """
+    snapshot = _snapshot_time(replica_path_for(db_path))
+    if snapshot is None:
+        return None
+    return max(0.0, time.time() - snapshot)
+
+
+def _open_replica(replica_path, snapshot, row_factory=None):
+    """
+    Ouvre une connexion en lecture seule sur la réplique.
+
+    Les connexions ne sont pas conservées par un pool: une connexion ouverte avant le
+    renommage continuerait de lire l'instantané précédent.
+    """
+    uri = f"file:{pathname2url(replica_path)}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, factory=ReplicaConnection, check_same_thread=False)
+    conn.db_path = f"{replica_path}@{snapshot}"
+    conn.snapshot = snapshot
+    conn.row_factory = row_factory
+    for pragma in READ_PRAGMAS:
+        if pragma in POOL_SETTINGS:
+            conn.execute(f"PRAGMA {pragma} = {POOL_SETTINGS[pragma]}")
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+def data_lag(conn):
+    """
+    Âge des données lues par une connexion de lecture.
+
+    Args:
+        conn: Connexion retournée par get_replica_connection() ou get_analytics_connection()
+
+    Returns:
+        float: Secondes depuis l'instantané lu (None pour la base principale)
+    """
+    snapshot = getattr(conn, 'snapshot', None)
+    if snapshot is None:
+        return None
+    return max(0.0, time.time() - snapshot)
+
+
+def refresh_interval():
+    """
+    Intervalle entre deux rafraîchissements de la réplique.
+
+    Au moins REPLICA_SETTINGS['refresh_interval'], allongé pour que la copie n'occupe pas
+    plus de REPLICA_SETTINGS['max_refresh_share'] du temps, et doublé à chaque échec
+    consécutif (sans dépasser max_lag).
+
+    Returns:
+        float: Secondes
+    """
+    interval = REPLICA_SETTINGS['refresh_interval']
+    duration = _refresh_state['duration_s']
+    if duration is not None and REPLICA_SETTINGS['max_refresh_share'] > 0:
+        interval = max(interval, duration / REPLICA_SETTINGS['max_refresh_share'])
+    if _refresh_state['failures']:
+        interval = min(interval * 2 ** _refresh_state['failures'], max(interval, REPLICA_SETTINGS['max_lag']))
+    return interval
+
+
+def _replace_replica(temp_path, replica_path):
+    """
+    Substitue l'instantané à la réplique.
+
+    Sous Windows, le remplacement échoue (PermissionError) tant qu'une connexion tient la
+    réplique ouverte: les lectures étant courtes, il est retenté quelques fois.
+    """
+    for attempt in range(1, REPLACE_RETRIES + 1):
+        try:
+            os.replace(temp_path, replica_path)
+            return
+        except PermissionError:
+            if attempt == REPLACE_RETRIES:
+                raise
+            time.sleep(REPLACE_RETRY_DELAY * attempt)
+
+
+def _record_refresh(error=None, duration_s=None):
+    """Met à jour l'état du rafraîchissement et journalise une fois chaque série d'échecs"""
+    if error is None:
+        if _refresh_state['failures']:
+            logger.info(f"Réplique de lecture de nouveau rafraîchie après {_refresh_state['failures']} échecs")
+        _refresh_state.update(duration_s=duration_s, failures=0, last_error=None)
+        return
+
+    if error != _refresh_state['last_error']:
+        logger.error(f"Erreur lors du rafraîchissement de la réplique de lecture: {error}")
+    else:
+        logger.debug(f"Rafraîchissement de la réplique de lecture toujours en échec: {error}")
+    _refresh_state['failures'] += 1
+    _refresh_state['last_error'] = error
+
+
+def get_replica_connection(db_path=DEFAULT_DB_PATH, row_factory=None):
+    """
+    Retourne une connexion pour les lectures longues (tableaux de bord, exports).
+
+    La connexion lit la réplique si elle est activée et date de moins de
+    REPLICA_SETTINGS['max_lag'] secondes, la base principale (connexion du pool) sinon.
+    Dans les deux cas, close() la libère.
+
+    Args:
+        db_path (str): Base de données SQLite principale
+        row_factory (callable, optional): Fabrique de lignes (ex: sqlite3.Row)
+
+    Returns:
+        sqlite3.Connection: Connexion de lecture
+    """
+    global _fallback_reason
+
+    if REPLICA_SETTINGS['enabled']:
+        replica_path = replica_path_for(db_path)
+        snapshot = _snapshot_time(replica_path)
+        if snapshot is not None and time.time() - snapshot <= REPLICA_SETTINGS['max_lag']:
+            try:
+                conn = _open_replica(replica_path, snapshot, row_factory)
+                _fallback_reason = None
+                return conn
+            except sqlite3.Error as e:
+                reason = f"réplique illisible ({str(e)})"
+        elif snapshot is None:
+            reason = "réplique de lecture absente"
+        else:
+            reason = f"réplique de lecture en retard de {int(time.time() - snapshot)} s"
+        # Signalé une fois par changement de cause, pas à chaque requête
+        if reason != _fallback_reason:
+            logger.warning(f"Lectures analytiques sur la base principale: {reason}")
+            _fallback_reason = reason
+
+    return get_connection(db_path, row_factory)
+
+
+def refresh_replica(db_path=DEFAULT_DB_PATH, min_age=0):
+    """
+    Remplace la réplique par un instantané de la base principale.
+
+    Args:
+        db_path (str): Base de données SQLite principale
+        min_age (float): Ne rien faire si la réplique date de moins de min_age secondes
+            (rafraîchie entre-temps par un autre processus)
+
+    Returns:
+        dict: Résultat du rafraîchissement (durée, taille, ou raison de l'abandon)
+    """
+    replica_path = replica_path_for(db_path)
+    temp_path = f"{replica_path}.{os.getpid()}.tmp"
+
+    with _refresh_lock:
+        lag = replica_lag(db_path)
+        if min_age and lag is not None and lag < min_age:
+            return {'success': True, 'skipped': True, 'lag_seconds': round(lag, 1)}
+        if not os.path.exists(db_path):
+            return {'success': False, 'error': f"Base de données introuvable: {db_path}"}
+
+        start = time.perf_counter()
+        try:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+            source = sqlite3.connect(db_path, timeout=POOL_SETTINGS.get('busy_timeout', 5000) / 1000)
+            try:
+                # En WAL, la transaction de lecture de la sauvegarde ne bloque pas les écrivains
+                source.execute(f"PRAGMA journal_mode = {POOL_SETTINGS.get('journal_mode', 'WAL')}")
+                target = sqlite3.connect(temp_path)
+                try:
+                    snapshot = time.time()
+                    # Une seule étape (pages=-1): instantané cohérent, sans recommencer la copie
+                    # à chaque écriture comme le ferait une copie par pages
+                    source.backup(target)
+                    # Réplique en lecture seule: journal classique, sans fichiers -wal/-shm à créer
+                    target.execute("PRAGMA journal_mode = DELETE")
+                    page_size, page_count = (target.execute("PRAGMA page_size").fetchone()[0],
+                                             target.execute("PRAGMA page_count").fetchone()[0])
+                finally:
+                    target.close()
+            finally:
+                source.close()
+
+            os.utime(temp_path, (snapshot, snapshot))
+            _replace_replica(temp_path, replica_path)
+        except (sqlite3.Error, OSError) as e:
+            if isinstance(e, PermissionError):
+                error = f"réplique tenue ouverte par un lecteur, remplacement impossible ({str(e)})"
+            else:
+                error = str(e)
+            _record_refresh(error)
+            try:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            except OSError:
+                pass
+            return {'success': False, 'error': error, 'failures': _refresh_state['failures']}
+
+        duration_s = time.perf_counter() - start
+        _record_refresh(duration_s=duration_s)
+
+    duration_ms = round(duration_s * 1000, 1)
+    logger.info(f"Réplique de lecture rafraîchie en {duration_ms} ms ({page_count} pages)")
+    return {
+        'success': True,
+        'replica_path': replica_path,
+        'snapshot': datetime.fromtimestamp(snapshot).isoformat(),
+        'size_bytes': page_size * page_count,
+        'duration_ms': duration_ms
+    }
+
+
+def _refresh_loop(db_path):
+    """Boucle du thread de rafraîchissement périodique"""
+    while True:
+        interval = refresh_interval()
+        try:
+            # Marge d'une seconde: ne pas sauter un cycle pour un instantané à peine plus récent
+            refresh_replica(db_path, min_age=max(interval - 1, 0))
+        except Exception as e:
+            logger.error(f"Exception lors du rafraîchissement de la réplique de lecture: {str(e)}")
+        time.sleep(refresh_interval())
+
+
+def start_replica_refresh(db_path=DEFAULT_DB_PATH):
+    """
+    Démarre le rafraîchissement périodique de la réplique si elle est activée.
+
+    Args:
+        db_path (str): Base de données SQLite principale
+
+    Returns:
+        bool: True si le thread de rafraîchissement a été démarré
+    """
+    global _refresh_thread
+
+    if not REPLICA_SETTINGS['enabled']:
+        return False
+
+    with _lock:
+        if _refresh_thread is not None and _refresh_thread.is_alive():
+            return False
+        _refresh_thread = threading.Thread(
+            target=_refresh_loop, args=(db_path,), name='replique-lecture', daemon=True
+        )
+        _refresh_thread.start()
+    return True
+
+
+def get_replica_status(db_path=DEFAULT_DB_PATH):
+    """
+    Retourne l'état de la réplique de lecture (activation, instantané, retard).
+
+    Args:
+        db_path (str): Base de données SQLite principale
+
+    Returns:
+        dict: État de la réplique
+    """
+    replica_path = replica_path_for(db_path)
+    snapshot = _snapshot_time(replica_path)
+    lag = replica_lag(db_path)
+    return {
+        'enabled': REPLICA_SETTINGS['enabled'],
+        'replica_path': replica_path,
+        'snapshot': datetime.fromtimestamp(snapshot).isoformat() if snapshot is not None else None,
+        'lag_seconds': round(lag, 1) if lag is not None else None,
+        'refresh_interval': round(refresh_interval(), 1),
+        'max_lag': REPLICA_SETTINGS['max_lag'],
+        'last_error': _refresh_state['last_error'],
+        'consecutive_failures': _refresh_state['failures'],
+        'in_use': REPLICA_SETTINGS['enabled'] and lag is not None and lag <= REPLICA_SETTINGS['max_lag'],
+        'size_bytes': os.path.getsize(replica_path) if snapshot is not None else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rafraîchissement de la réplique de lecture SQLite")
+    parser.add_argument('db', nargs='?', default=DEFAULT_DB_PATH, help="Base de données SQLite principale")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    result = refresh_replica(args.db)
+    if not result['success']:
+        print(f"Échec du rafraîchissement: {result['error']}")
+        return 1
+
+    print(f"Réplique {result['replica_path']} ({result['size_bytes']} octets) en {result['duration_ms']} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
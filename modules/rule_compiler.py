@@ -0,0 +1,426 @@
+"""
+Module de compilation des règles de fidélité
+
+Ce module regroupe les règles actives par source de données et par fenêtre temporelle
+(periode_jours) afin de calculer tous les agrégats par client en une seule passe sur
+les transactions, puis d'évaluer les conditions de toutes les règles sur ces agrégats.
+"""
+
+import logging
+import time
+
+try:
+    from modules.client_stats import STATS_WINDOWS
+    from modules.offer_codes import offer_code_sql, execute_with_code_retry
+    from modules.rule_engine import RuleEngine, QueryProfiler, combine_conditions, segment_condition, query_plan
+except ImportError:
+    from client_stats import STATS_WINDOWS
+    from offer_codes import offer_code_sql, execute_with_code_retry
+    from rule_engine import RuleEngine, QueryProfiler, combine_conditions, segment_condition, query_plan
+
+# Configuration du logging
+logger = logging.getLogger(__name__)
+
+# Source de données nécessaire à chaque type de règle
+# (les agrégats de transactions sur les fenêtres standard sont lus dans client_stats)
+RULE_SOURCES = {
+    'nombre_achats': 'transactions',
+    'montant_cumule': 'transactions',
+    'inactivite': 'transactions',
+    'produit_specifique': 'details',
+    'categorie_specifique': 'details',
+    'premiere_visite': 'clients',
+    'anniversaire': 'clients'
+}
+
+# Nombre maximal de règles réunies dans une même requête UNION ALL
+# (SQLite limite le nombre de SELECT composés à 500)
+MAX_RULES_PER_STATEMENT = 100
+
+
+class RuleCompiler:
+    """
+    Compile un ensemble de règles de fidélité en un plan d'exécution à passe unique.
+
+    Le plan comprend une table temporaire d'agrégats par groupe (source, periode_jours)
+    et une condition par règle évaluée sur ces agrégats.
+    """
+
+    def __init__(self, loyalty_manager, validity_days=30):
+        """
+        Initialise le compilateur de règles.
+
+        Args:
+            loyalty_manager (LoyaltyManager): Gestionnaire de fidélité
+            validity_days (int): Durée de validité des offres générées (en jours)
+        """
+        self.loyalty_manager = loyalty_manager
+        self.validity_days = validity_days
+        self.rule_engine = RuleEngine(validity_days)
+
+    def compile(self, rules):
+        """
+        Construit le plan d'exécution des règles.
+
+        Args:
+            rules (list): Règles actives (dictionnaires issus de regles_fidelite)
+
+        Returns:
+            dict: Plan avec les groupes d'agrégats et les conditions par règle
+        """
+        groups = {}
+        predicates = []
+
+        for rule in rules:
+            source = RULE_SOURCES.get(rule['type_regle'])
+            if source is None:
+                logger.warning(f"Type de règle non pris en charge par le compilateur: {rule['type_regle']}")
+                continue
+
+            group = None
+            if source != 'clients':
+                # Les règles d'inactivité portent sur tout l'historique du client
+                periode = None if rule['type_regle'] == 'inactivite' else rule.get('periode_jours')
+                periode = int(periode) if periode else None
+                
+                # Les fenêtres standard sont déjà matérialisées dans client_stats
+                if source == 'transactions' and (periode is None or periode in STATS_WINDOWS):
+                    source = 'client_stats'
+                key = (source, periode)
+                if key not in groups:
+                    groups[key] = {
+                        'table': f"regles_agg_{len(groups) + 1}",
+                        'source': source,
+                        'periode_jours': key[1],
+                        'rules': []
+                    }
+                group = groups[key]
+                group['rules'].append(rule)
+
+            predicates.append(self._compile_predicate(rule, group))
+
+        for group in groups.values():
+            group['sql'], group['params'] = self._compile_group(group)
+
+        return {
+            'groups': list(groups.values()),
+            'predicates': predicates
+        }
+
+    def _compile_group(self, group):
+        """
+        Génère la requête d'agrégation d'un groupe de règles.
+
+        Args:
+            group (dict): Groupe de règles partageant la même source et la même fenêtre
+
+        Returns:
+            tuple: (requête SQL, paramètres)
+        """
+        params = []
+        period_condition = ''
+        if group['periode_jours']:
+            period_condition = "AND t.date_transaction >= date('now', ?)"
+
+        if group['source'] == 'client_stats':
+            suffix = f"{group['periode_jours']}j" if group['periode_jours'] else 'total'
+            query = f'''
+                SELECT
+                    cs.client_id,
+                    cs.nb_achats_{suffix} as nb_achats,
+                    cs.montant_{suffix} as montant_cumule,
+                    cs.derniere_visite
+                FROM client_stats cs
+            '''
+            return query, params
+
+        if group['source'] == 'transactions':
+            query = f'''
+                SELECT
+                    t.client_id,
+                    COUNT(DISTINCT t.transaction_id) as nb_achats,
+                    SUM(t.montant_total) as montant_cumule,
+                    MAX(t.date_transaction) as derniere_visite
+                FROM transactions t
+                WHERE 1=1 {period_condition}
+                GROUP BY t.client_id
+            '''
+            if period_condition:
+                params.append(f"-{group['periode_jours']} days")
+            return query, params
+
+        # Une colonne par règle indiquant si le client a acheté le produit ou la catégorie
+        columns = []
+        product_ids = []
+        category_ids = []
+        for rule in group['rules']:
+            if rule['type_regle'] == 'produit_specifique':
+                columns.append(f"MAX(CASE WHEN dt.produit_id = ? THEN 1 ELSE 0 END) as r_{rule['regle_id']}")
+                product_ids.append(int(rule['condition_valeur']))
+            else:
+                columns.append(f"MAX(CASE WHEN p.categorie_id = ? THEN 1 ELSE 0 END) as r_{rule['regle_id']}")
+                category_ids.append(int(rule['condition_valeur']))
+            params.append(int(rule['condition_valeur']))
+
+        # Ne parcourir que les lignes concernant au moins une des règles du groupe
+        filters = []
+        if product_ids:
+            filters.append(f"dt.produit_id IN ({','.join(['?'] * len(product_ids))})")
+        if category_ids:
+            filters.append(f"p.categorie_id IN ({','.join(['?'] * len(category_ids))})")
+        params.extend(product_ids + category_ids)
+
+        product_join = 'JOIN produits p ON dt.produit_id = p.produit_id' if category_ids else ''
+        query = f'''
+            SELECT
+                t.client_id,
+                {', '.join(columns)}
+            FROM transactions t
+            JOIN details_transactions dt ON t.transaction_id = dt.transaction_id
+            {product_join}
+            WHERE ({' OR '.join(filters)})
+            {period_condition}
+            GROUP BY t.client_id
+        '''
+        if period_condition:
+            params.append(f"-{group['periode_jours']} days")
+        return query, params
+
+    def _compile_predicate(self, rule, group):
+        """
+        Génère la requête des clients éligibles à une règle.
+
+        Args:
+            rule (dict): Informations sur la règle
+            group (dict): Groupe d'agrégats de la règle (None pour les règles sur les clients)
+
+        Returns:
+            dict: Requête SQL et paramètres de la condition
+        """
+        evaluator = self.rule_engine.evaluator(rule['type_regle'])
+        segment_sql, segment_params = segment_condition(rule)
+        commentaire = evaluator.offer_comment(rule)
+        expiration = f"date('now', '+{self.validity_days} days')"
+        rule_type = rule['type_regle']
+        join = f"JOIN temp.{group['table']} a ON c.client_id = a.client_id" if group else ''
+
+        # Conditions sur la fiche du client (statut, inscription, anniversaire): celles du moteur
+        conditions = evaluator.client_conditions(rule)
+        if rule_type in ('nombre_achats', 'montant_cumule'):
+            conditions = [evaluator.threshold_condition(rule, f"a.{evaluator.aggregate_column}")] + conditions
+        elif rule_type == 'inactivite':
+            conditions = [evaluator.inactivity_condition(rule, 'a')] + conditions
+        elif rule_type in ('produit_specifique', 'categorie_specifique'):
+            conditions = [(f"a.r_{rule['regle_id']} = 1", [])] + conditions
+        elif rule_type == 'anniversaire':
+            # Anniversaire: l'offre expire 30 jours après le prochain anniversaire
+            anniversaire = "date(strftime('%Y', 'now') || strftime('-%m-%d', c.date_naissance))"
+            expiration = f'''date(
+                    CASE WHEN {anniversaire} < date('now')
+                         THEN date({anniversaire}, '+1 year')
+                         ELSE {anniversaire}
+                    END,
+                    '+{self.validity_days} days'
+                )'''
+        condition, condition_params = combine_conditions(conditions)
+
+        query = f'''
+            SELECT
+                c.client_id,
+                ? as regle_id,
+                ? as recompense_id,
+                {expiration} as date_expiration,
+                ? as commentaire
+            FROM clients c
+            {join}
+            WHERE {condition}
+            {segment_sql}
+            AND NOT EXISTS (
+                SELECT 1 FROM offres_client oc
+                WHERE oc.client_id = c.client_id AND oc.regle_id = ?
+            )
+        '''
+        params = ([rule['regle_id'], rule['recompense_id'], commentaire] + condition_params
+                  + segment_params + [rule['regle_id']])
+
+        return {
+            'regle_id': rule['regle_id'],
+            'sql': query,
+            'params': params
+        }
+
+    def _create_aggregates(self, conn, plan, empty=False):
+        """
+        Crée les tables temporaires d'agrégats du plan.
+
+        Args:
+            conn (sqlite3.Connection): Connexion à la base de données
+            plan (dict): Plan compilé
+            empty (bool): Créer uniquement la structure des tables (sans parcourir les données)
+
+        Returns:
+            dict: Durée de calcul de chaque groupe (en ms)
+        """
+        durations = {}
+        for group in plan['groups']:
+            start_time = time.perf_counter()
+            conn.execute(f"DROP TABLE IF EXISTS temp.{group['table']}")
+            limit = 'LIMIT 0' if empty else ''
+            conn.execute(
+                f"CREATE TEMP TABLE {group['table']} AS SELECT * FROM ({group['sql']}) {limit}",
+                group['params']
+            )
+            conn.execute(f"CREATE UNIQUE INDEX temp.idx_{group['table']}_client ON {group['table']}(client_id)")
+            durations[group['table']] = round((time.perf_counter() - start_time) * 1000)
+        return durations
+
+    def _drop_aggregates(self, conn, plan):
+        """
+        Supprime les tables temporaires du plan.
+
+        Args:
+            conn (sqlite3.Connection): Connexion à la base de données
+            plan (dict): Plan compilé
+        """
+        for group in plan['groups']:
+            conn.execute(f"DROP TABLE IF EXISTS temp.{group['table']}")
+        conn.execute("DROP TABLE IF EXISTS temp.regles_eligibles")
+
+    def evaluate(self, conn, rules):
+        """
+        Évalue toutes les règles en une passe et génère les offres des clients éligibles.
+
+        Les agrégats sont calculés une fois par groupe, les conditions de toutes les
+        règles alimentent une table temporaire de clients éligibles, puis les offres
+        sont insérées en une seule instruction.
+
+        Args:
+            conn (sqlite3.Connection): Connexion à la base de données
+            rules (list): Règles actives à évaluer
+
+        Returns:
+            dict: Nombre d'offres générées par règle, durées des étapes, instructions exécutées
+                  et plan d'exécution de chaque règle (agrégation de son groupe puis condition)
+        """
+        plan = self.compile(rules)
+
+        # Plan d'exécution de chaque règle: agrégation de son groupe puis condition
+        plans_by_rule = {}
+        for group in plan['groups']:
+            group_plan = query_plan(conn, group['sql'], group['params'])
+            for rule in group['rules']:
+                plans_by_rule[rule['regle_id']] = list(group_plan)
+
+        with QueryProfiler(conn) as profiler:
+            try:
+                scan_durations = self._create_aggregates(conn, plan)
+
+                for predicate in plan['predicates']:
+                    plans_by_rule.setdefault(predicate['regle_id'], []).extend(
+                        query_plan(conn, predicate['sql'], predicate['params'])
+                    )
+
+                # Évaluer les conditions de toutes les règles
+                start_time = time.perf_counter()
+                conn.execute("DROP TABLE IF EXISTS temp.regles_eligibles")
+                conn.execute('''
+                    CREATE TEMP TABLE regles_eligibles (
+                        client_id INTEGER,
+                        regle_id INTEGER,
+                        recompense_id INTEGER,
+                        date_expiration DATE,
+                        commentaire TEXT
+                    )
+                ''')
+                predicates = plan['predicates']
+                for i in range(0, len(predicates), MAX_RULES_PER_STATEMENT):
+                    batch = predicates[i:i + MAX_RULES_PER_STATEMENT]
+                    params = []
+                    for predicate in batch:
+                        params.extend(predicate['params'])
+                    conn.execute(
+                        'INSERT INTO regles_eligibles ' + ' UNION ALL '.join(p['sql'] for p in batch),
+                        params
+                    )
+                predicate_ms = round((time.perf_counter() - start_time) * 1000)
+
+                # Générer toutes les offres en une seule instruction
+                start_time = time.perf_counter()
+                execute_with_code_retry(conn, f'''
+                    INSERT INTO offres_client (
+                        client_id, regle_id, recompense_id, date_generation, date_expiration,
+                        statut, code_unique, commentaire
+                    )
+                    SELECT
+                        e.client_id, e.regle_id, e.recompense_id, date('now'), e.date_expiration, 'generee',
+                        {offer_code_sql('e.regle_id', 'e.client_id')},
+                        e.commentaire
+                    FROM temp.regles_eligibles e
+                ''', [])
+                insert_ms = round((time.perf_counter() - start_time) * 1000)
+
+                offers_by_rule = {
+                    row[0]: row[1] for row in conn.execute(
+                        'SELECT regle_id, COUNT(*) FROM temp.regles_eligibles GROUP BY regle_id'
+                    )
+                }
+            finally:
+                self._drop_aggregates(conn, plan)
+
+        logger.info(
+            f"Évaluation compilée: {len(rules)} règles, {len(plan['groups'])} parcours des transactions, "
+            f"conditions en {predicate_ms} ms, insertion en {insert_ms} ms"
+        )
+
+        return {
+            'offers_by_rule': offers_by_rule,
+            'scan_ms': scan_durations,
+            'predicate_ms': predicate_ms,
+            'insert_ms': insert_ms,
+            'vm_steps': profiler.vm_steps,
+            'plans_by_rule': plans_by_rule
+        }
+
+    def explain(self, conn, rules):
+        """
+        Décrit le plan compilé: requêtes générées et plan d'exécution SQLite de chaque étape.
+
+        Args:
+            conn (sqlite3.Connection): Connexion à la base de données
+            rules (list): Règles actives à compiler
+
+        Returns:
+            dict: Étapes du plan avec leur requête et leur EXPLAIN QUERY PLAN
+        """
+        plan = self.compile(rules)
+        steps = []
+
+        try:
+            for group in plan['groups']:
+                steps.append({
+                    'step': 'agregation',
+                    'table': group['table'],
+                    'source': group['source'],
+                    'periode_jours': group['periode_jours'],
+                    'regles': [rule['regle_id'] for rule in group['rules']],
+                    'sql': group['sql'].strip(),
+                    'plan': query_plan(conn, group['sql'], group['params'])
+                })
+
+            # Les conditions s'appuient sur les tables d'agrégats: créer leur structure seule
+            self._create_aggregates(conn, plan, empty=True)
+            for predicate in plan['predicates']:
+                steps.append({
+                    'step': 'condition',
+                    'regles': [predicate['regle_id']],
+                    'sql': predicate['sql'].strip(),
+                    'plan': query_plan(conn, predicate['sql'], predicate['params'])
+                })
+        finally:
+            self._drop_aggregates(conn, plan)
+
+        return {
+            'total_rules': len(plan['predicates']),
+            'total_scans': len(plan['groups']),
+            'steps': steps
+        }
@@ -0,0 +1,791 @@
+"""
+Moteur d'évaluation des règles de fidélité
+
+Chaque type de règle (type_regle) est pris en charge par un évaluateur enregistré dans
+RULE_EVALUATORS. Un évaluateur fournit:
+- la requête des clients éligibles à une règle (évaluation de tous les clients) ;
+- la condition d'éligibilité d'un client (évaluation au scan de ticket) ;
+- le commentaire enregistré avec les offres générées.
+
+Les deux formes de l'éligibilité sont construites à partir des mêmes conditions
+(client_conditions pour la fiche du client, puis la condition propre au type de règle):
+un client reçoit les mêmes offres au scan de ticket et à l'évaluation de tous les clients.
+
+Le gestionnaire de fidélité (API, page /loyalty/run-rules, planificateur), l'évaluation
+parallèle et le compilateur de règles passent tous par ce moteur. Un nouveau type de
+règle s'ajoute en déclarant un évaluateur avec @register_evaluator (et en l'autorisant
+dans la contrainte CHECK de regles_fidelite.type_regle).
+"""
+
+import json
+import logging
+import re
+import time
+
+try:
+    from modules.client_stats import STATS_WINDOWS, birthday_condition
+    from modules.offer_codes import offer_code_sql, execute_with_code_retry
+except ImportError:
+    from client_stats import STATS_WINDOWS, birthday_condition
+    from offer_codes import offer_code_sql, execute_with_code_retry
+
+# Configuration du logging
+logger = logging.getLogger(__name__)
+
+# Durée de validité par défaut des offres générées (en jours)
+OFFER_VALIDITY_DAYS = 30
+
+# Évaluateurs enregistrés par type de règle
+RULE_EVALUATORS = {}
+
+# Nombre d'instructions de la machine virtuelle SQLite entre deux relevés du profileur
+PROFILE_STEP = 1000
+
+
+def register_evaluator(rule_type):
+    """
+    Décorateur enregistrant un évaluateur pour un type de règle.
+
+    Args:
+        rule_type (str): Valeur de regles_fidelite.type_regle prise en charge
+
+    Returns:
+        function: Décorateur de classe
+    """
+    def decorator(cls):
+        cls.rule_type = rule_type
+        RULE_EVALUATORS[rule_type] = cls
+        return cls
+    return decorator
+
+
+def segment_condition(rule):
+    """
+    Construit la condition SQL de ciblage par segment d'une règle.
+
+    Args:
+        rule (dict): Informations sur la règle
+
+    Returns:
+        tuple: (condition SQL, paramètres)
+    """
+    if not rule.get('segments_cibles'):
+        return '', []
+
+    try:
+        segments = json.loads(rule['segments_cibles'])
+    except (ValueError, TypeError):
+        return '', []
+
+    if not segments:
+        return '', []
+
+    placeholders = ','.join(['?' for _ in segments])
+    return f"AND c.segment IN ({placeholders})", list(segments)
+
+
+def period_condition(rule, alias='t'):
+    """
+    Construit la condition SQL de période d'une règle sur les transactions.
+
+    Args:
+        rule (dict): Informations sur la règle
+        alias (str): Alias de la table des transactions dans la requête
+
+    Returns:
+        tuple: (condition SQL, paramètres)
+    """
+    if not rule.get('periode_jours'):
+        return '', []
+
+    return f"AND {alias}.date_transaction >= date('now', ?)", [f"-{int(rule['periode_jours'])} days"]
+
+
+def combine_conditions(conditions):
+    """
+    Réunit des conditions SQL par AND.
+
+    Args:
+        conditions (list): Conditions (fragment SQL, paramètres)
+
+    Returns:
+        tuple: (condition SQL, paramètres)
+    """
+    if not conditions:
+        return '1', []
+
+    sql = ' AND '.join(f"({fragment})" for fragment, _ in conditions)
+    params = [param for _, fragment_params in conditions for param in fragment_params]
+    return sql, params
+
+
+def scope_condition(column, scope):
+    """
+    Construit la condition SQL limitant l'évaluation à un sous-ensemble de clients.
+
+    Args:
+        column (str): Colonne portant l'identifiant client
+        scope (list): Restrictions (fragment SQL appliqué à la colonne, paramètres) ou None
+
+    Returns:
+        tuple: (condition SQL, paramètres)
+    """
+    if not scope:
+        return '', []
+
+    conditions = []
+    params = []
+    for fragment, fragment_params in scope:
+        conditions.append(f"AND {column} {fragment}")
+        params.extend(fragment_params)
+    return ' '.join(conditions), params
+
+
+def purchase_aggregate(rule, scope=None):
+    """
+    Construit la requête du nombre d'achats et du montant cumulé par client sur la période d'une règle.
+
+    Les périodes standard (30, 90, 365 jours ou sans limite) sont lues dans client_stats ;
+    les autres périodes sont agrégées à partir des transactions.
+
+    Args:
+        rule (dict): Informations sur la règle
+        scope (list, optional): Restrictions à un sous-ensemble de clients
+
+    Returns:
+        tuple: (requête SQL retournant client_id, nb_achats, montant_cumule ; paramètres)
+    """
+    periode = int(rule['periode_jours']) if rule.get('periode_jours') else None
+
+    if periode is None or periode in STATS_WINDOWS:
+        suffix = f"{periode}j" if periode else 'total'
+        scope_sql, scope_params = scope_condition('cs.client_id', scope)
+        query = f'''
+            SELECT
+                cs.client_id,
+                cs.nb_achats_{suffix} as nb_achats,
+                cs.montant_{suffix} as montant_cumule
+            FROM client_stats cs
+            WHERE 1=1 {scope_sql}
+        '''
+        return query, scope_params
+
+    period_sql, period_params = period_condition(rule)
+    scope_sql, scope_params = scope_condition('t.client_id', scope)
+    query = f'''
+        SELECT
+            t.client_id,
+            COUNT(DISTINCT t.transaction_id) as nb_achats,
+            SUM(t.montant_total) as montant_cumule
+        FROM transactions t
+        WHERE 1=1 {period_sql}
+        {scope_sql}
+        GROUP BY t.client_id
+    '''
+    return query, period_params + scope_params
+
+
+def query_plan(conn, query, params):
+    """
+    Exécute EXPLAIN QUERY PLAN sur une requête.
+
+    Args:
+        conn (sqlite3.Connection): Connexion à la base de données
+        query (str): Requête SQL
+        params (list): Paramètres de la requête
+
+    Returns:
+        list: Lignes du plan d'exécution
+    """
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+
+
+def full_scans(plan):
+    """
+    Repère les parcours complets de tables dans un plan d'exécution.
+
+    Les parcours de sous-requêtes matérialisées et les parcours d'index ne sont pas signalés.
+
+    Args:
+        plan (list): Lignes du plan d'exécution (voir query_plan)
+
+    Returns:
+        list: Tables (ou alias) parcourues entièrement
+    """
+    subqueries = set()
+    scans = []
+    for detail in plan:
+        match = re.match(r'(?:MATERIALIZE|CO-ROUTINE) (\S+)', detail)
+        if match:
+            subqueries.add(match.group(1))
+            continue
+        match = re.fullmatch(r'SCAN (\S+)', detail)
+        if match and match.group(1) not in subqueries and match.group(1) not in scans:
+            scans.append(match.group(1))
+    return scans
+
+
+class QueryProfiler:
+    """
+    Mesure la durée et le nombre d'instructions de la machine virtuelle SQLite exécutées
+    sur une connexion (progress_handler), à une précision de PROFILE_STEP instructions.
+
+    Utilisation:
+        with QueryProfiler(conn) as profiler:
+            conn.execute(...)
+        profiler.vm_steps, profiler.duration_ms
+    """
+
+    def __init__(self, conn, step=PROFILE_STEP):
+        self.conn = conn
+        self.step = step
+        self.vm_steps = 0
+        self.duration_ms = 0
+
+    def _count(self):
+        self.vm_steps += self.step
+        # Une valeur non nulle interromprait la requête
+        return 0
+
+    def __enter__(self):
+        self.conn.set_progress_handler(self._count, self.step)
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration_ms = int((time.perf_counter() - self.start_time) * 1000)
+        self.conn.set_progress_handler(None, 0)
+        return False
+
+
+class RuleEvaluator:
+    """
+    Évaluateur d'un type de règle.
+
+    Les requêtes d'éligibilité retournent les colonnes client_id et date_expiration des
+    clients éligibles n'ayant pas encore reçu l'offre de la règle. Les conditions par client
+    s'évaluent sur une ligne de clients (alias c) jointe à client_stats (alias cs).
+    """
+
+    rule_type = None
+
+    # L'éligibilité ne change qu'avec de nouvelles transactions: l'évaluation peut être
+    # restreinte aux clients actifs depuis la dernière évaluation de la règle
+    incremental = False
+
+    def __init__(self, validity_days=OFFER_VALIDITY_DAYS):
+        """
+        Initialise l'évaluateur.
+
+        Args:
+            validity_days (int): Durée de validité des offres générées (en jours)
+        """
+        self.validity_days = validity_days
+
+    def expiration_sql(self):
+        """Expression SQL de la date d'expiration des offres"""
+        return f"date('now', '+{self.validity_days} days')"
+
+    def offer_comment(self, rule):
+        """Commentaire enregistré avec les offres de la règle"""
+        return "Offre programme de fidélité"
+
+    def eligibility(self, rule, scope=None):
+        """
+        Construit la requête des clients éligibles à la règle.
+
+        Args:
+            rule (dict): Informations sur la règle
+            scope (list, optional): Restrictions de l'évaluation à un sous-ensemble de clients
+
+        Returns:
+            tuple: (requête SQL, paramètres)
+        """
+        raise NotImplementedError
+
+    def client_conditions(self, rule):
+        """
+        Conditions d'éligibilité portant sur la fiche du client (alias c).
+
+        Communes à la requête d'éligibilité, à la condition par client et au compilateur
+        de règles.
+
+        Args:
+            rule (dict): Informations sur la règle
+
+        Returns:
+            list: Conditions (fragment SQL, paramètres)
+        """
+        return [("c.statut = 'actif'", [])]
+
+    def client_predicate(self, rule):
+        """
+        Construit la condition d'éligibilité d'un client à la règle (hors ciblage par segment).
+
+        Par défaut, les conditions sur la fiche du client.
+
+        Args:
+            rule (dict): Informations sur la règle
+
+        Returns:
+            tuple: (condition SQL, paramètres)
+        """
+        return combine_conditions(self.client_conditions(rule))
+
+
+class PurchaseAggregateEvaluator(RuleEvaluator):
+    """Règles à seuil sur les agrégats d'achats du client (nombre ou montant)"""
+
+    incremental = True
+
+    # Colonne de l'agrégat comparée au seuil de la règle
+    aggregate_column = None
+
+    # Préfixe des colonnes de client_stats pour les périodes standard
+    stats_column = None
+
+    # Agrégat SQL sur les transactions pour les périodes non standard
+    transactions_aggregate = None
+
+    def threshold_condition(self, rule, column):
+        """
+        Condition de seuil de la règle sur un agrégat d'achats.
+
+        Args:
+            rule (dict): Informations sur la règle
+            column (str): Expression SQL de l'agrégat
+
+        Returns:
+            tuple: (condition SQL, paramètres)
+        """
+        return f"{column} >= ?", [float(rule['condition_valeur'])]
+
+    def eligibility(self, rule, scope=None):
+        aggregate, aggregate_params = purchase_aggregate(rule, scope)
+        threshold_sql, threshold_params = self.threshold_condition(rule, f"achats.{self.aggregate_column}")
+        client_sql, client_params = combine_conditions(self.client_conditions(rule))
+        segment_sql, segment_params = segment_condition(rule)
+
+        query = f'''
+            SELECT
+                c.client_id,
+                {self.expiration_sql()} as date_expiration
+            FROM clients c
+            JOIN ({aggregate}) achats ON c.client_id = achats.client_id
+            LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
+            WHERE {threshold_sql}
+            AND oc.offre_id IS NULL
+            AND {client_sql}
+            {segment_sql}
+        '''
+        params = aggregate_params + [rule['regle_id']] + threshold_params + client_params + segment_params
+        return query, params
+
+    def client_predicate(self, rule):
+        periode = int(rule['periode_jours']) if rule.get('periode_jours') else None
+
+        if periode is None or periode in STATS_WINDOWS:
+            suffix = f"{periode}j" if periode else 'total'
+            column = f"cs.{self.stats_column}_{suffix}"
+            params = []
+        else:
+            # Sans achat sur la période, le client est absent de l'agrégat de purchase_aggregate:
+            # la sous-requête ne retourne alors aucune ligne (NULL) plutôt qu'un agrégat nul
+            column = f'''(
+                SELECT {self.transactions_aggregate} FROM transactions t
+                WHERE t.client_id = c.client_id AND t.date_transaction >= date('now', ?)
+                HAVING COUNT(*) > 0
+            )'''
+            params = [f"-{periode} days"]
+
+        threshold_sql, threshold_params = self.threshold_condition(rule, column)
+        return combine_conditions(self.client_conditions(rule) + [(threshold_sql, params + threshold_params)])
+
+
+@register_evaluator('nombre_achats')
+class PurchaseCountEvaluator(PurchaseAggregateEvaluator):
+    """Clients éligibles selon le nombre d'achats"""
+
+    aggregate_column = 'nb_achats'
+    stats_column = 'nb_achats'
+    transactions_aggregate = 'COUNT(*)'
+
+    def offer_comment(self, rule):
+        return f"Offre générée après {rule['condition_valeur']} achats"
+
+
+@register_evaluator('montant_cumule')
+class CumulativeAmountEvaluator(PurchaseAggregateEvaluator):
+    """Clients éligibles selon le montant cumulé d'achats"""
+
+    aggregate_column = 'montant_cumule'
+    stats_column = 'montant'
+    transactions_aggregate = 'SUM(t.montant_total)'
+
+    def offer_comment(self, rule):
+        return f"Offre générée après {rule['condition_valeur']}€ d'achats cumulés"
+
+
+class PurchasedItemEvaluator(RuleEvaluator):
+    """Règles sur l'achat d'un article donné dans la période de la règle"""
+
+    incremental = True
+
+    # Jointure et condition désignant l'article acheté (paramètre: condition_valeur)
+    item_join = ''
+    item_condition = None
+
+    def eligibility(self, rule, scope=None):
+        period_sql, period_params = period_condition(rule)
+        client_sql, client_params = combine_conditions(self.client_conditions(rule))
+        segment_sql, segment_params = segment_condition(rule)
+        scope_sql, scope_params = scope_condition('t.client_id', scope)
+
+        query = f'''
+            SELECT DISTINCT
+                c.client_id,
+                {self.expiration_sql()} as date_expiration
+            FROM clients c
+            JOIN transactions t ON c.client_id = t.client_id
+            JOIN details_transactions dt ON t.transaction_id = dt.transaction_id
+            {self.item_join}
+            LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
+            WHERE {self.item_condition}
+            {period_sql}
+            {scope_sql}
+            AND oc.offre_id IS NULL
+            AND {client_sql}
+            {segment_sql}
+        '''
+        params = ([rule['regle_id'], int(rule['condition_valeur'])] + period_params + scope_params
+                  + client_params + segment_params)
+        return query, params
+
+    def client_predicate(self, rule):
+        period_sql, period_params = period_condition(rule)
+        predicate = f'''EXISTS (
+            SELECT 1 FROM transactions t
+            JOIN details_transactions dt ON t.transaction_id = dt.transaction_id
+            {self.item_join}
+            WHERE t.client_id = c.client_id AND {self.item_condition}
+            {period_sql}
+        )'''
+        item_params = [int(rule['condition_valeur'])] + period_params
+        return combine_conditions(self.client_conditions(rule) + [(predicate, item_params)])
+
+
+@register_evaluator('produit_specifique')
+class SpecificProductEvaluator(PurchasedItemEvaluator):
+    """Clients éligibles selon l'achat d'un produit spécifique"""
+
+    item_condition = 'dt.produit_id = ?'
+
+    def offer_comment(self, rule):
+        return f"Offre générée après achat du produit #{rule['condition_valeur']}"
+
+
+@register_evaluator('categorie_specifique')
+class SpecificCategoryEvaluator(PurchasedItemEvaluator):
+    """Clients éligibles selon l'achat dans une catégorie spécifique"""
+
+    item_join = 'JOIN produits p ON dt.produit_id = p.produit_id'
+    item_condition = 'p.categorie_id = ?'
+
+    def offer_comment(self, rule):
+        return f"Offre générée après achat dans catégorie #{rule['condition_valeur']}"
+
+
+@register_evaluator('premiere_visite')
+class FirstVisitEvaluator(RuleEvaluator):
+    """Nouveaux clients inscrits dans les X jours"""
+
+    def offer_comment(self, rule):
+        return "Offre de bienvenue"
+
+    def client_conditions(self, rule):
+        return [
+            ("c.date_inscription >= date('now', ?)", [f"-{int(rule['condition_valeur'])} days"]),
+            ("c.date_inscription <= datetime('now')", []),
+            ("c.consentement_marketing = 1", [])
+        ] + super().client_conditions(rule)
+
+    def eligibility(self, rule, scope=None):
+        client_sql, client_params = combine_conditions(self.client_conditions(rule))
+        segment_sql, segment_params = segment_condition(rule)
+        scope_sql, scope_params = scope_condition('c.client_id', scope)
+
+        query = f'''
+            SELECT
+                c.client_id,
+                {self.expiration_sql()} as date_expiration
+            FROM clients c
+            LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
+            WHERE {client_sql}
+            AND oc.offre_id IS NULL
+            {scope_sql}
+            {segment_sql}
+        '''
+        params = [rule['regle_id']] + client_params + scope_params + segment_params
+        return query, params
+
+
+@register_evaluator('anniversaire')
+class BirthdayEvaluator(RuleEvaluator):
+    """Clients dont l'anniversaire approche ; l'offre expire 30 jours après le prochain anniversaire"""
+
+    def offer_comment(self, rule):
+        return "Offre d'anniversaire"
+
+    def client_conditions(self, rule):
+        birthday = birthday_condition('c.jour_anniversaire', int(rule['condition_valeur']))
+        return [birthday] + super().client_conditions(rule)
+
+    def eligibility(self, rule, scope=None):
+        client_sql, client_params = combine_conditions(self.client_conditions(rule))
+        segment_sql, segment_params = segment_condition(rule)
+        scope_sql, scope_params = scope_condition('c.client_id', scope)
+
+        # Recherche de plage sur idx_clients_jour_anniversaire
+        query = f'''
+            SELECT
+                a.client_id,
+                date(
+                    CASE WHEN a.anniversaire < date('now')
+                         THEN date(a.anniversaire, '+1 year')
+                         ELSE a.anniversaire
+                    END,
+                    '+{self.validity_days} days'
+                ) as date_expiration
+            FROM (
+                SELECT
+                    c.client_id,
+                    date(strftime('%Y', 'now') || strftime('-%m-%d', c.date_naissance)) as anniversaire
+                FROM clients c
+                LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
+                WHERE {client_sql}
+                AND oc.offre_id IS NULL
+                {scope_sql}
+                {segment_sql}
+            ) a
+        '''
+        params = [rule['regle_id']] + client_params + scope_params + segment_params
+        return query, params
+
+
+@register_evaluator('inactivite')
+class InactivityEvaluator(RuleEvaluator):
+    """Clients sans achat depuis X jours"""
+
+    def offer_comment(self, rule):
+        return "Offre pour client inactif"
+
+    def inactivity_condition(self, rule, alias='cs'):
+        """
+        Condition d'inactivité sur la date de dernière visite.
+
+        Args:
+            rule (dict): Informations sur la règle
+            alias (str): Alias de la table portant la colonne derniere_visite
+
+        Returns:
+            tuple: (condition SQL, paramètres)
+        """
+        return f"{alias}.derniere_visite <= date('now', ?)", [f"-{int(rule['condition_valeur'])} days"]
+
+    def eligibility(self, rule, scope=None):
+        inactivity_sql, inactivity_params = self.inactivity_condition(rule)
+        client_sql, client_params = combine_conditions(self.client_conditions(rule))
+        segment_sql, segment_params = segment_condition(rule)
+        scope_sql, scope_params = scope_condition('c.client_id', scope)
+
+        query = f'''
+            SELECT
+                c.client_id,
+                {self.expiration_sql()} as date_expiration
+            FROM clients c
+            JOIN client_stats cs ON c.client_id = cs.client_id
+            LEFT JOIN offres_client oc ON c.client_id = oc.client_id AND oc.regle_id = ?
+            WHERE {inactivity_sql}
+            AND oc.offre_id IS NULL
+            AND {client_sql}
+            {scope_sql}
+            {segment_sql}
+        '''
+        params = [rule['regle_id']] + inactivity_params + client_params + scope_params + segment_params
+        return query, params
+
+    def client_predicate(self, rule):
+        return combine_conditions(self.client_conditions(rule) + [self.inactivity_condition(rule)])
+
+
+class RuleEngine:
+    """
+    Évalue les règles de fidélité avec les évaluateurs enregistrés.
+
+    Un client ne reçoit qu'une offre par règle, quel que soit le statut de l'offre déjà
+    générée (y compris expirée).
+    """
+
+    def __init__(self, validity_days=OFFER_VALIDITY_DAYS):
+        """
+        Initialise le moteur de règles.
+
+        Args:
+            validity_days (int): Durée de validité des offres générées (en jours)
+        """
+        self.validity_days = validity_days
+
+    def get_active_rules(self, conn):
+        """
+        Récupère les règles actives à la date du jour, par priorité décroissante.
+
+        Args:
+            conn (sqlite3.Connection): Connexion à la base de données
+
+        Returns:
+            list: Règles actives (dictionnaires)
+        """
+        cursor = conn.execute('''
+            SELECT * FROM regles_fidelite
+            WHERE est_active = 1
+            AND (date_debut IS NULL OR date_debut <= date('now'))
+            AND (date_fin IS NULL OR date_fin >= date('now'))
+            ORDER BY priorite DESC
+        ''')
+
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def evaluator(self, rule_type):
+        """
+        Retourne l'évaluateur d'un type de règle.
+
+        Args:
+            rule_type (str): Type de règle
+
+        Returns:
+            RuleEvaluator: Évaluateur du type de règle
+
+        Raises:
+            ValueError: Si aucun évaluateur n'est enregistré pour ce type
+        """
+        if rule_type not in RULE_EVALUATORS:
+            raise ValueError(f"Type de règle inconnu: {rule_type}")
+
+        return RULE_EVALUATORS[rule_type](self.validity_days)
+
+    def supports_incremental(self, rule):
+        """Indique si l'évaluation de la règle peut être restreinte aux clients actifs"""
+        evaluator = RULE_EVALUATORS.get(rule['type_regle'])
+        return bool(evaluator and evaluator.incremental)
+
+    def eligibility_query(self, rule, scope=None):
+        """
+        Construit la requête des clients éligibles à une règle n'ayant pas encore reçu son offre.
+
+        Args:
+            rule (dict): Informations sur la règle
+            scope (list, optional): Restrictions de l'évaluation à un sous-ensemble de clients
+
+        Returns:
+            tuple: (requête SQL retournant client_id et date_expiration, paramètres, commentaire de l'offre)
+        """
+        evaluator = self.evaluator(rule['type_regle'])
+        query, params = evaluator.eligibility(rule, scope)
+        return query, params, evaluator.offer_comment(rule)
+
+    def client_predicate(self, rule):
+        """
+        Construit la condition SQL d'éligibilité d'un client à une règle, ciblage par segment compris.
+
+        Les règles d'un type inconnu ne sont jamais satisfaites.
+
+        Args:
+            rule (dict): Informations sur la règle
+
+        Returns:
+            tuple: (condition SQL, paramètres)
+        """
+        if rule['type_regle'] not in RULE_EVALUATORS:
+            logger.warning(f"Type de règle inconnu: {rule['type_regle']}")
+            return '0', []
+
+        predicate, params = self.evaluator(rule['type_regle']).client_predicate(rule)
+        segment_sql, segment_params = segment_condition(rule)
+        return f"{predicate} {segment_sql}", params + segment_params
+
+    def insert_offers(self, conn, rule, eligible_query, params, commentaire):
+        """
+        Génère en une seule instruction INSERT ... SELECT les offres d'une règle.
+
+        La requête d'éligibilité doit retourner les colonnes client_id et date_expiration.
+        Le code unique est attribué dans la même instruction, ce qui évite la mise à jour
+        globale des offres sans code après l'évaluation.
+
+        Args:
+            conn (sqlite3.Connection): Connexion à la base de données
+            rule (dict): Informations sur la règle évaluée
+            eligible_query (str): Requête SELECT des clients éligibles
+            params (list): Paramètres de la requête d'éligibilité
+            commentaire (str): Commentaire enregistré avec chaque offre
+
+        Returns:
+            int: Nombre d'offres générées
+        """
+        cursor = execute_with_code_retry(conn, f'''
+            INSERT INTO offres_client (
+                client_id, regle_id, recompense_id, date_generation, date_expiration,
+                statut, code_unique, commentaire
+            )
+            SELECT
+                e.client_id, ?, ?, date('now'), e.date_expiration, 'generee',
+                {offer_code_sql('?', 'e.client_id')},
+                ?
+            FROM ({eligible_query}) e
+        ''', [rule['regle_id'], rule['recompense_id'], rule['regle_id'], commentaire] + list(params))
+
+        return cursor.rowcount
+
+    def evaluate_rule(self, conn, rule, scope=None):
+        """
+        Évalue une règle et génère les offres des clients éligibles, avec son profil d'exécution.
+
+        Les clients éligibles sont d'abord placés dans une table temporaire, ce qui sépare
+        le coût de la sélection de celui de l'insertion des offres.
+
+        Args:
+            conn (sqlite3.Connection): Connexion à la base de données
+            rule (dict): Informations sur la règle à évaluer
+            scope (list, optional): Restrictions de l'évaluation à un sous-ensemble de clients
+
+        Returns:
+            dict: Résultat de l'évaluation (offres générées, clients éligibles, profil)
+        """
+        query, params, commentaire = self.eligibility_query(rule, scope)
+        plan = query_plan(conn, query, params)
+
+        try:
+            with QueryProfiler(conn) as selection:
+                conn.execute("DROP TABLE IF EXISTS temp.regle_eligibles")
+                conn.execute(f"CREATE TEMP TABLE regle_eligibles AS {query}", params)
+            eligible = conn.execute("SELECT COUNT(*) FROM temp.regle_eligibles").fetchone()[0]
+
+            with QueryProfiler(conn) as insertion:
+                offers_generated = self.insert_offers(
+                    conn, rule, "SELECT client_id, date_expiration FROM temp.regle_eligibles", [], commentaire
+                )
+        finally:
+            conn.execute("DROP TABLE IF EXISTS temp.regle_eligibles")
+
+        return {
+            'clients_evaluated': eligible,
+            'offers_generated': offers_generated,
+            'profile': {
+                'clients_eligible': eligible,
+                'vm_steps': selection.vm_steps + insertion.vm_steps,
+                'select_ms': selection.duration_ms,
+                'insert_ms': insertion.duration_ms,
+                'plan': plan,
+                'full_scans': full_scans(plan)
+            }
+        }
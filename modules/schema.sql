@@ -585,29 +585,6 @@ BEGIN
     );
 END;
 
--- Déclencheur pour vérifier et mettre à jour le niveau de fidélité
-CREATE TRIGGER check_fidelity_level AFTER UPDATE OF points_actuels ON cartes_fidelite
-BEGIN
-    UPDATE cartes_fidelite
-    SET niveau_fidelite = (
-        SELECT nom
-        FROM niveaux_fidelite
-        WHERE points_minimum <= NEW.points_actuels
-        AND (points_maximum IS NULL OR points_maximum >= NEW.points_actuels)
-        ORDER BY points_minimum DESC
-        LIMIT 1
-    )
-    WHERE carte_id = NEW.carte_id
-    AND niveau_fidelite != (
-        SELECT nom
-        FROM niveaux_fidelite
-        WHERE points_minimum <= NEW.points_actuels
-        AND (points_maximum IS NULL OR points_maximum >= NEW.points_actuels)
-        ORDER BY points_minimum DESC
-        LIMIT 1
-    );
-END;
-
 -- Déclencheur pour calculer le hash du ticket lors de l'insertion
 CREATE TRIGGER generate_ticket_hash BEFORE INSERT ON tickets_caisse
 WHEN NEW.ticket_hash IS NULL
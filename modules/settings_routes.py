@@ -11,6 +11,13 @@ from datetime import datetime
 import threading
 import time
 
+try:
+    from modules.db_pool import DEFAULT_DB_PATH
+    from modules.read_replica import get_replica_status
+except ImportError:
+    from db_pool import DEFAULT_DB_PATH
+    from read_replica import get_replica_status
+
 # Configuration du logging
 logger = logging.getLogger(__name__)
 
@@ -361,6 +368,12 @@ def system_info():
     except:
         info['ollama']['version'] = 'Inconnue'
     
+    # Réplique de lecture des tableaux de bord et exports (retard sur la base principale)
+    try:
+        info['read_replica'] = get_replica_status(DEFAULT_DB_PATH)
+    except Exception as e:
+        logger.warning(f"Impossible de lire l'état de la réplique de lecture: {e}")
+    
     return jsonify(info)
 
 # Fonction pour démarrer Ollama (si nécessaire)
@@ -2,6 +2,11 @@ import pandas as pd
 import sqlite3
 import os
 
+try:
+    from modules.db_pool import get_connection, DEFAULT_DB_PATH
+except ImportError:
+    from db_pool import get_connection, DEFAULT_DB_PATH
+
 def update_store_locations(df):
     """
     Met à jour les coordonnées des points de vente dans la base de données 
@@ -49,8 +54,7 @@ def update_store_locations(df):
             break
     
     # Préparer la connexion à la base de données
-    db_path = 'modules/fidelity_db.sqlite'
-    conn = sqlite3.connect(db_path)
+    conn = get_connection(DEFAULT_DB_PATH)
     cursor = conn.cursor()
     
     # Statistiques
@@ -119,8 +123,7 @@ def verify_store_locations():
     Returns:
         dict: Statistiques des localisations
     """
-    db_path = 'modules/fidelity_db.sqlite'
-    conn = sqlite3.connect(db_path)
+    conn = get_connection(DEFAULT_DB_PATH)
     
     try:
         cursor = conn.cursor()
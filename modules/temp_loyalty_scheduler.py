@@ -2,6 +2,7 @@
 import schedule
 import time
 from loyalty_manager import LoyaltyManager
+from offer_delivery import OfferDeliveryService
 import logging
 from datetime import datetime
 
@@ -14,11 +15,38 @@ logger = logging.getLogger(__name__)
 # Initialiser le gestionnaire de fidélité
 loyalty_manager = LoyaltyManager()
 
+# Service d'envoi des offres (workers par canal)
+delivery_service = OfferDeliveryService(loyalty_manager.db_path)
+
+def refresh_client_stats_task():
+    # Tache pour recalculer les statistiques clients (fenetres glissantes)
+    logger.info("Démarrage de la tâche de recalcul des statistiques clients")
+    try:
+        result = loyalty_manager.refresh_client_stats()
+        if result['success']:
+            logger.info(f"Statistiques recalculées pour {result['clients_refreshed']} clients en {result['duration_ms']} ms")
+        else:
+            logger.error(f"Échec du recalcul des statistiques clients: {result.get('error', 'Erreur inconnue')}")
+    except Exception as e:
+        logger.error(f"Exception lors du recalcul des statistiques clients: {str(e)}")
+
+def recompute_levels_task():
+    # Tache pour recalculer les niveaux de fidelite de toutes les cartes
+    logger.info("Démarrage de la tâche de recalcul des niveaux de fidélité")
+    try:
+        result = loyalty_manager.recompute_loyalty_levels()
+        if result['success']:
+            logger.info(f"Niveaux recalculés: {result['cards_updated']} cartes modifiées sur {result['cards_checked']} en {result['duration_ms']} ms")
+        else:
+            logger.error(f"Échec du recalcul des niveaux: {result.get('error', 'Erreur inconnue')}")
+    except Exception as e:
+        logger.error(f"Exception lors du recalcul des niveaux: {str(e)}")
+
 def evaluate_rules_task():
     # Tache pour evaluer les regles de fidelite
     logger.info("Démarrage de la tâche d'évaluation des règles")
     try:
-        result = loyalty_manager.evaluate_all_rules()
+        result = loyalty_manager.evaluate_all_rules(incremental=True)
         if result['success']:
             stats = result['stats']
             logger.info(f"Évaluation terminée: {stats['total_offers_generated']} offres générées pour {stats['total_clients_evaluated']} clients")
@@ -33,7 +61,7 @@ def check_expired_offers_task():
     try:
         result = loyalty_manager.check_expired_offers()
         if result['success']:
-            logger.info(f"{result['offers_expired']} offres marquées comme expirées")
+            logger.info(f"{result['offers_expired']} offres marquées comme expirées en {result['duration_ms']} ms")
         else:
             logger.error(f"Échec de la vérification des offres expirées: {result.get('error', 'Erreur inconnue')}")
     except Exception as e:
@@ -45,7 +73,7 @@ def send_pending_offers_task():
     try:
         result = loyalty_manager.send_offers(channel='email')
         if result['success']:
-            logger.info(f"{result['offers_sent']} offres envoyées")
+            logger.info(f"{result['offers_queued']} offres mises en file d'envoi")
         else:
             logger.error(f"Échec de l'envoi des offres: {result.get('error', 'Erreur inconnue')}")
     except Exception as e:
@@ -53,6 +81,8 @@ def send_pending_offers_task():
 
 def setup_schedules():
     # Configure les taches planifiees
+    schedule.every().day.at("01:30").do(refresh_client_stats_task)
+    schedule.every().day.at("00:30").do(recompute_levels_task)
     schedule.every().day.at("02:00").do(evaluate_rules_task)
     schedule.every().day.at("01:00").do(check_expired_offers_task)
     schedule.every().day.at("10:00").do(send_pending_offers_task)
@@ -66,7 +96,12 @@ def run_scheduler():
     # Configurer les tâches planifiées
     setup_schedules()
     
+    # Démarrer les workers d'envoi des offres
+    delivery_service.start()
+    
     # Exécuter les tâches au démarrage
+    refresh_client_stats_task()
+    recompute_levels_task()
     evaluate_rules_task()
     check_expired_offers_task()
     send_pending_offers_task()
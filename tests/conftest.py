@@ -0,0 +1,102 @@
+"""
+Fixtures des tests du programme de fidélité
+
+La base de test est générée par init_database/generate_volume_data.py, avec le schéma
+de la base de l'application et une graine fixe, comme celles du banc d'essai. Chaque
+test travaille sur sa propre copie.
+
+Usage:
+    python -m pytest tests
+"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PROJECT_DIR, 'modules'))
+sys.path.append(os.path.join(PROJECT_DIR, 'init_database'))
+
+from loyalty_manager import LoyaltyManager
+# Pool utilisé par les gestionnaires (importés sous modules. lorsque c'est possible)
+try:
+    from modules.db_pool import close_connections
+except ImportError:
+    from db_pool import close_connections
+import generate_volume_data as generator
+
+APP_DB_PATH = os.path.join(PROJECT_DIR, 'modules', 'fidelity_db.sqlite')
+
+# Une règle de chaque type, dont une période hors des fenêtres de client_stats
+# (nom, description, type_regle, condition_valeur, periode_jours, action_type, action_valeur, segments_cibles, priorite)
+TEST_RULES = [
+    ("Montant cumulé", "5 % dès 1000 euros d'achats", 'montant_cumule', '1000', 365,
+     'reduction_pourcentage', '5', '["premium"]', 2),
+    ("Nouvel achat", "Premier achat d'un nouveau client", 'premiere_visite', '365', None,
+     'reduction_pourcentage', '10', None, 1),
+    ("Produit phare", "Réduction sur un produit", 'produit_specifique', '16', 30,
+     'reduction_pourcentage', '25', None, 1),
+    ("Catégorie", "Achat dans une catégorie", 'categorie_specifique', '3', 90,
+     'reduction_pourcentage', '15', None, 1),
+    ("Cadeau d'anniversaire", "Cadeau de l'enseigne", 'anniversaire', '30', None,
+     'offre_cadeau', '', None, 1),
+    ("Relance des inactifs", "Relancer les inactifs", 'inactivite', '60', None,
+     'reduction_montant', '10', None, 0),
+    ("Achats réguliers", "Bonus de points", 'nombre_achats', '5', 365,
+     'offre_points', '100', None, 3),
+    ("Achats du trimestre", "Bonus trimestriel", 'nombre_achats', '3', 45,
+     'offre_points', '50', None, 2),
+]
+
+
+@pytest.fixture(scope='session')
+def generated_db(tmp_path_factory):
+    """Base générée une fois pour la session, avec les règles de test et le schéma à jour"""
+    path = str(tmp_path_factory.mktemp('fidelite') / 'generated.sqlite')
+    generator.generate_volume_data(generator.parse_args([
+        '--db', path, '--schema', APP_DB_PATH, '--force', '--seed', '42',
+        '--clients', '1000', '--transactions', '15000',
+    ]))
+
+    conn = sqlite3.connect(path)
+    conn.executemany('''
+        INSERT INTO regles_fidelite (
+            nom, description, type_regle, condition_valeur, periode_jours,
+            action_type, action_valeur, segments_cibles, priorite, est_active
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+    ''', TEST_RULES)
+    conn.commit()
+    conn.close()
+
+    # Migrations du schéma (index, tables dérivées) à la première connexion du gestionnaire
+    LoyaltyManager(path)._get_connection().close()
+    close_connections(path)
+    return path
+
+
+@pytest.fixture
+def db_copy(generated_db, tmp_path):
+    """Retourne une fonction créant une copie de la base générée"""
+    def copy(name):
+        # Sauvegarde SQLite plutôt que copie de fichier: inclut le contenu encore dans le WAL
+        target = str(tmp_path / f"{name}.sqlite")
+        source = sqlite3.connect(generated_db)
+        destination = sqlite3.connect(target)
+        source.backup(destination)
+        destination.close()
+        source.close()
+        return target
+
+    yield copy
+    close_connections()
+    LoyaltyManager.invalidate_rules_cache()
+
+
+def offer_pairs(db_path):
+    """Offres d'une base, sous forme de couples (client, règle)"""
+    conn = sqlite3.connect(db_path)
+    pairs = set(conn.execute("SELECT client_id, regle_id FROM offres_client"))
+    conn.close()
+    return pairs
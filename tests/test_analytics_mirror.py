@@ -0,0 +1,73 @@
+"""
+Tests du miroir analytique DuckDB
+"""
+
+import sqlite3
+
+import pytest
+
+pytest.importorskip('duckdb')
+
+import analytics_mirror
+
+
+@pytest.fixture
+def mirror(db_copy, tmp_path):
+    """Base SQLite de test et miroir synchronisé entièrement"""
+    path = db_copy('mirror')
+    mirror_path = str(tmp_path / 'mirror.duckdb')
+    result = analytics_mirror.refresh_mirror(path, mirror_path, full=True)
+    assert result['success']
+    yield path, mirror_path
+    analytics_mirror.close_mirror()
+
+
+def mirror_clients(mirror_path):
+    cursor = analytics_mirror._mirror_database(mirror_path).cursor()
+    try:
+        return {row[0]: row[1:] for row in cursor.execute("SELECT client_id, segment, ville FROM clients").fetchall()}
+    finally:
+        cursor.close()
+
+
+def source_clients(path):
+    conn = sqlite3.connect(path)
+    clients = {row[0]: row[1:] for row in conn.execute("SELECT client_id, segment, ville FROM clients")}
+    conn.close()
+    return clients
+
+
+def test_clients_are_synced_incrementally(mirror):
+    path, mirror_path = mirror
+
+    result = analytics_mirror.refresh_mirror(path, mirror_path)
+    assert result['success']
+    assert result['rows_copied']['clients'] == 0
+
+    conn = sqlite3.connect(path)
+    client_id = conn.execute("SELECT MIN(client_id) FROM clients").fetchone()[0]
+    conn.execute("UPDATE clients SET ville = 'Nantes', segment = 'vip' WHERE client_id = ?", (client_id,))
+    conn.execute('''
+        INSERT INTO clients (uuid, nom, prenom, email, date_inscription)
+        VALUES ('00000000-0000-0000-0000-000000000001', 'Martin', 'Léa', 'lea.martin@example.com', datetime('now'))
+    ''')
+    conn.commit()
+    conn.close()
+
+    result = analytics_mirror.refresh_mirror(path, mirror_path)
+    assert result['success']
+    assert result['rows_copied']['clients'] == 2
+    assert mirror_clients(mirror_path) == source_clients(path)
+
+
+def test_deleted_clients_trigger_full_copy(mirror):
+    path, mirror_path = mirror
+
+    conn = sqlite3.connect(path)
+    conn.execute("DELETE FROM clients WHERE client_id = (SELECT MAX(client_id) FROM clients)")
+    conn.commit()
+    conn.close()
+
+    result = analytics_mirror.refresh_mirror(path, mirror_path)
+    assert result['success']
+    assert mirror_clients(mirror_path) == source_clients(path)
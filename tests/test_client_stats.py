@@ -0,0 +1,71 @@
+"""
+Tests des statistiques clients matérialisées (client_stats)
+"""
+
+import sqlite3
+
+from client_stats import ClientStatsManager, OBSOLETE_CLIENT_STATS_TRIGGERS, _favourite_category_query
+
+
+def favourite_categories(db_path):
+    """Catégorie favorite stockée et catégorie favorite recalculée, par client"""
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(f'''
+        SELECT client_id, categorie_favorite_id, {_favourite_category_query('client_stats.client_id')}
+        FROM client_stats
+    ''').fetchall()
+    conn.close()
+    return {client_id: (stored, expected) for client_id, stored, expected in rows}
+
+
+def test_ticket_lines_do_not_recompute_favourite_category(db_copy):
+    path = db_copy('triggers')
+    conn = sqlite3.connect(path)
+    triggers = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    conn.close()
+
+    assert 'client_stats_transaction_insert' in triggers
+    assert not triggers & set(OBSOLETE_CLIENT_STATS_TRIGGERS)
+
+
+def test_refresh_favourite_categories(db_copy):
+    path = db_copy('favourite')
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE client_stats SET categorie_favorite_id = NULL")
+    client_id = conn.execute("SELECT client_id FROM client_stats ORDER BY client_id LIMIT 1").fetchone()[0]
+    conn.commit()
+    conn.close()
+
+    manager = ClientStatsManager(path)
+    result = manager.refresh_favourite_categories([client_id])
+    assert result['success']
+    assert result['clients_refreshed'] == 1
+
+    categories = favourite_categories(path)
+    assert categories[client_id][0] == categories[client_id][1] is not None
+    assert all(stored is None for other, (stored, _) in categories.items() if other != client_id)
+
+    assert manager.refresh_favourite_categories()['success']
+    assert all(stored == expected for stored, expected in favourite_categories(path).values())
+
+
+def test_failed_refresh_rolls_back_and_releases_connection(db_copy):
+    path = db_copy('refresh_rollback')
+    conn = sqlite3.connect(path)
+    count = conn.execute("SELECT COUNT(*) FROM client_stats").fetchone()[0]
+    # Les statistiques sont supprimées puis recalculées: le recalcul échoue à mi-transaction
+    conn.execute('''
+        CREATE TRIGGER test_client_stats_refuse BEFORE INSERT ON client_stats
+        BEGIN SELECT RAISE(ABORT, 'statistiques indisponibles'); END
+    ''')
+    conn.commit()
+    conn.close()
+
+    assert not ClientStatsManager(path).refresh()['success']
+
+    # Transaction annulée et verrou d'écriture rendu
+    conn = sqlite3.connect(path, timeout=0)
+    conn.execute("BEGIN IMMEDIATE")
+    assert conn.execute("SELECT COUNT(*) FROM client_stats").fetchone()[0] == count
+    conn.rollback()
+    conn.close()
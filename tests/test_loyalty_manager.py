@@ -0,0 +1,246 @@
+"""
+Tests du gestionnaire de fidélité: évaluation des règles au scan de ticket
+(evaluate_rules_for_client), opérations sur les points et fiche du client
+"""
+
+import sqlite3
+from datetime import datetime, timedelta
+
+from loyalty_manager import LoyaltyManager
+
+
+def most_active_client(db_path):
+    """Client actif ayant le plus de transactions"""
+    conn = sqlite3.connect(db_path)
+    client_id = conn.execute('''
+        SELECT t.client_id FROM transactions t
+        JOIN clients c ON c.client_id = t.client_id
+        WHERE c.statut = 'actif'
+        GROUP BY t.client_id ORDER BY COUNT(*) DESC, t.client_id LIMIT 1
+    ''').fetchone()[0]
+    conn.close()
+    return client_id
+
+
+def update_client(db_path, client_id, **values):
+    """Modifie la fiche d'un client"""
+    conn = sqlite3.connect(db_path)
+    assignments = ', '.join(f"{column} = ?" for column in values)
+    conn.execute(f"UPDATE clients SET {assignments} WHERE client_id = ?", list(values.values()) + [client_id])
+    conn.commit()
+    conn.close()
+
+
+def client_offers(db_path, client_id):
+    """Règles des offres d'un client"""
+    conn = sqlite3.connect(db_path)
+    rules = {row[0] for row in conn.execute("SELECT regle_id FROM offres_client WHERE client_id = ?", (client_id,))}
+    conn.close()
+    return rules
+
+
+def client_card(db_path, client_id):
+    """Solde, niveau et numéro de la carte active d'un client (None si aucune)"""
+    conn = sqlite3.connect(db_path)
+    card = conn.execute('''
+        SELECT points_actuels, niveau_fidelite, numero_carte FROM cartes_fidelite
+        WHERE client_id = ? AND statut = 'active'
+    ''', (client_id,)).fetchone()
+    conn.close()
+    return card
+
+
+def rule_types(result):
+    return {rule['rule_type'] for rule in result['rules_applied']}
+
+
+def test_scan_generates_offers_once(db_copy):
+    path = db_copy('scan')
+    client_id = most_active_client(path)
+    manager = LoyaltyManager(path)
+
+    result = manager.evaluate_rules_for_client(client_id)
+    assert result['success']
+    assert 'nombre_achats' in rule_types(result)
+    assert result['offers_generated'] == len(result['rules_applied'])
+    assert client_offers(path, client_id) == {rule['rule_id'] for rule in result['rules_applied']}
+
+    # Une seule offre par règle et par client
+    again = manager.evaluate_rules_for_client(client_id)
+    assert again['success']
+    assert again['offers_generated'] == 0
+
+
+def test_scan_ignores_inactive_client(db_copy):
+    path = db_copy('inactive')
+    client_id = most_active_client(path)
+    update_client(path, client_id, statut='inactif')
+
+    result = LoyaltyManager(path).evaluate_rules_for_client(client_id)
+    assert result['success']
+    assert result['offers_generated'] == 0
+    assert client_offers(path, client_id) == set()
+
+
+def test_scan_welcome_offer_follows_registration_and_consent(db_copy):
+    path = db_copy('welcome')
+    client_id = most_active_client(path)
+    manager = LoyaltyManager(path)
+
+    # Inscrit depuis plus d'un an: pas d'offre de bienvenue, même avec des achats récents
+    update_client(path, client_id, date_inscription='2000-01-01 10:00:00', consentement_marketing=1)
+    assert 'premiere_visite' not in rule_types(manager.evaluate_rules_for_client(client_id))
+
+    # Inscrit récemment sans consentement marketing
+    recent = (datetime.now() - timedelta(days=3)).strftime('%Y-%m-%d %H:%M:%S')
+    update_client(path, client_id, date_inscription=recent, consentement_marketing=0)
+    assert 'premiere_visite' not in rule_types(manager.evaluate_rules_for_client(client_id))
+
+    # Inscrit récemment avec consentement
+    update_client(path, client_id, consentement_marketing=1)
+    assert 'premiere_visite' in rule_types(manager.evaluate_rules_for_client(client_id))
+
+
+def test_failed_operation_rolls_back_and_releases_connection(db_copy):
+    path = db_copy('rollback')
+    client_id = most_active_client(path)
+
+    conn = sqlite3.connect(path)
+    points = conn.execute("SELECT points_actuels FROM cartes_fidelite WHERE client_id = ?", (client_id,)).fetchone()[0]
+    # L'historique est écrit après la mise à jour de la carte: l'opération échoue à mi-transaction
+    conn.execute('''
+        CREATE TRIGGER test_historique_points_refuse BEFORE INSERT ON historique_points
+        BEGIN SELECT RAISE(ABORT, 'historique indisponible'); END
+    ''')
+    conn.commit()
+    conn.close()
+
+    result = LoyaltyManager(path).add_points(client_id, 50)
+    assert not result['success']
+
+    # Transaction annulée et verrou d'écriture rendu
+    conn = sqlite3.connect(path, timeout=0)
+    conn.execute("BEGIN IMMEDIATE")
+    assert conn.execute("SELECT points_actuels FROM cartes_fidelite WHERE client_id = ?", (client_id,)).fetchone()[0] == points
+    conn.rollback()
+    conn.close()
+
+
+def test_client_loyalty_info(db_copy):
+    path = db_copy('info')
+    client_id = most_active_client(path)
+    manager = LoyaltyManager(path)
+    manager.evaluate_rules_for_client(client_id)
+    manager.add_points(client_id, 10, comment="Geste commercial")
+
+    result = manager.get_client_loyalty_info(client_id)
+    assert result['success'], result.get('error')
+    info = result['client_info']
+    assert info['date_inscription']
+    assert info['offres']
+    assert info['historique_points'][0]['description'] == "Geste commercial"
+    assert info['statistiques']['nb_transactions'] > 0
+
+
+def test_points_batch_resolves_overdraws_in_order(db_copy):
+    path = db_copy('batch_overdraw')
+    client_id = most_active_client(path)
+    points = client_card(path, client_id)[0]
+
+    result = LoyaltyManager(path).apply_points_batch([
+        {'client_id': client_id, 'points': points + 1, 'type_operation': 'utilisation'},
+        {'client_id': client_id, 'points': 10},
+        {'client_id': client_id, 'points': points + 10, 'type_operation': 'utilisation'},
+        {'client_id': client_id, 'points': 1, 'type_operation': 'utilisation'},
+        {'client_id': client_id, 'points': 5, 'type_operation': 'bonus', 'comment': "Bonus de test"},
+    ])
+    assert result['success'], result.get('error')
+    assert (result['applied'], result['rejected']) == (3, 2)
+    assert [r['success'] for r in result['results']] == [False, True, True, False, True]
+    assert {r['error'] for r in result['results'] if not r['success']} == {'Points insuffisants'}
+    assert [r['new_total'] for r in result['results'] if r['success']] == [points + 10, 0, 5]
+    assert client_card(path, client_id)[0] == 5
+
+    conn = sqlite3.connect(path)
+    history = conn.execute('''
+        SELECT description, solde_apres FROM historique_points
+        WHERE client_id = ? ORDER BY historique_id DESC LIMIT 1
+    ''', (client_id,)).fetchone()
+    conn.close()
+    assert history == ("Bonus de test", 5)
+
+
+def test_points_batch_creates_missing_cards(db_copy):
+    path = db_copy('batch_cards')
+    conn = sqlite3.connect(path)
+    new_client, spender = [row[0] for row in conn.execute("SELECT client_id FROM clients ORDER BY client_id LIMIT 2")]
+    conn.execute("DELETE FROM cartes_fidelite WHERE client_id IN (?, ?)", (new_client, spender))
+    conn.commit()
+    conn.close()
+
+    result = LoyaltyManager(path).apply_points_batch([
+        {'client_id': new_client, 'points': 20},
+        {'client_id': new_client, 'points': 5, 'type_operation': 'utilisation'},
+        {'client_id': spender, 'points': 5, 'type_operation': 'utilisation'},
+    ])
+    assert result['success'], result.get('error')
+    assert result['cards_created'] == 1
+    assert [r.get('new_total') for r in result['results']] == [20, 15, None]
+    assert result['results'][2]['error'] == "Carte de fidélité non trouvée pour le client"
+
+    points, level, number = client_card(path, new_client)
+    assert (points, level, number) == (15, result['results'][1]['loyalty_level'], f"FID{new_client:06d}")
+    assert client_card(path, spender) is None
+
+
+def set_card(db_path, client_id, **values):
+    """Modifie la carte d'un client"""
+    conn = sqlite3.connect(db_path)
+    assignments = ', '.join(f"{column} = ?" for column in values)
+    conn.execute(f"UPDATE cartes_fidelite SET {assignments} WHERE client_id = ?", list(values.values()) + [client_id])
+    conn.commit()
+    conn.close()
+
+
+def test_recompute_levels_updates_changed_cards(db_copy):
+    path = db_copy('levels')
+    manager = LoyaltyManager(path)
+    assert manager.recompute_loyalty_levels()['success']
+
+    client_id = most_active_client(path)
+    set_card(path, client_id, points_actuels=1000000, niveau_fidelite='bronze')
+    expected = manager._calculate_loyalty_level(1000000)
+    assert expected != 'bronze'
+
+    result = manager.recompute_loyalty_levels(chunk_size=100)
+    assert result['success'], result.get('error')
+    assert result['cards_updated'] == 1
+    assert result['cards_checked'] == sum(result['by_level'].values())
+    assert client_card(path, client_id)[1] == expected
+
+    conn = sqlite3.connect(path)
+    details = conn.execute('''
+        SELECT details FROM evenements_client
+        WHERE client_id = ? AND type_evenement = 'changement_niveau'
+        ORDER BY evenement_id DESC LIMIT 1
+    ''', (client_id,)).fetchone()[0]
+    conn.close()
+    assert '"nouveau_niveau":"%s"' % expected in details
+
+
+def test_recompute_levels_skips_cards_changed_meanwhile(db_copy, monkeypatch):
+    path = db_copy('levels_race')
+    manager = LoyaltyManager(path)
+    client_id = most_active_client(path)
+    set_card(path, client_id, points_actuels=1000000, niveau_fidelite='bronze')
+
+    # Le solde de la carte change entre la lecture et l'écriture des niveaux
+    levels_for_points = manager._levels_for_points
+    def concurrent_levels(conn, points, current_levels):
+        set_card(path, client_id, points_actuels=0)
+        return levels_for_points(conn, points, current_levels)
+    monkeypatch.setattr(manager, '_levels_for_points', concurrent_levels)
+
+    result = manager.recompute_loyalty_levels()
+    assert result['success'], result.get('error')
+    assert client_card(path, client_id)[:2] == (0, 'bronze')
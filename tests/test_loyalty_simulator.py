@@ -0,0 +1,42 @@
+"""
+Tests du simulateur de règles: ses prévisions correspondent aux offres du moteur
+"""
+
+import sqlite3
+
+from loyalty_manager import LoyaltyManager
+from loyalty_simulator import RuleSimulator
+
+
+def active_rules(db_path):
+    """Règles actives de la base, par identifiant"""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    rules = {row['regle_id']: dict(row) for row in conn.execute("SELECT * FROM regles_fidelite WHERE est_active = 1")}
+    conn.close()
+    return rules
+
+
+def test_simulation_matches_engine_for_every_rule_type(db_copy):
+    path = db_copy('simulation')
+    rules = active_rules(path)
+    simulator = RuleSimulator(path)
+    predicted = {}
+    for regle_id, rule in rules.items():
+        result = simulator.simulate(rule)
+        assert result['success'], result.get('error')
+        predicted[regle_id] = result['eligible_clients']
+
+    evaluation = LoyaltyManager(path).evaluate_all_rules()
+    assert evaluation['success'], evaluation.get('error')
+    generated = {detail['rule_id']: detail['offers_generated'] for detail in evaluation['stats']['rules_details']}
+
+    mismatches = {
+        (rules[regle_id]['type_regle'], rules[regle_id]['nom']): (predicted[regle_id], generated.get(regle_id))
+        for regle_id in rules if predicted[regle_id] != generated.get(regle_id)
+    }
+    assert not mismatches
+    assert {rule['type_regle'] for rule in rules.values()} >= {
+        'montant_cumule', 'premiere_visite', 'produit_specifique', 'categorie_specifique',
+        'anniversaire', 'inactivite', 'nombre_achats'
+    }
@@ -0,0 +1,61 @@
+"""
+Tests des migrations du schéma
+"""
+
+import sqlite3
+
+import migrations
+from client_stats import ensure_client_stats
+
+
+def table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def test_database_is_up_to_date(db_copy):
+    conn = sqlite3.connect(db_copy('latest'))
+    assert migrations.get_schema_version(conn) == migrations.LATEST_VERSION
+    assert migrations.migrate(conn) == {'success': True, 'version': migrations.LATEST_VERSION, 'applied': []}
+    conn.close()
+
+
+def test_failed_step_is_not_recorded(db_copy, monkeypatch):
+    conn = sqlite3.connect(db_copy('failed'))
+    conn.execute("DROP TABLE client_stats")
+    conn.execute("DELETE FROM schema_versions WHERE version = 5")
+    conn.commit()
+
+    def failing_step(conn):
+        ensure_client_stats(conn, commit=False)
+        raise sqlite3.OperationalError("étape interrompue")
+
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [(5, 'statistiques_clients', failing_step)])
+    monkeypatch.setattr(migrations, 'LATEST_VERSION', migrations.LATEST_VERSION + 1)
+
+    result = migrations.migrate(conn)
+    assert not result['success']
+    assert not table_exists(conn, 'client_stats')
+    assert not conn.execute("SELECT 1 FROM schema_versions WHERE version = 5").fetchone()
+    conn.close()
+
+
+def test_offer_lookup_uses_code_index(db_copy):
+    conn = sqlite3.connect(db_copy('offer_index'))
+    conn.execute('''
+        CREATE INDEX idx_offres_client_utilisables ON offres_client(client_id, date_expiration)
+        WHERE statut IN ('generee', 'envoyee')
+    ''')
+    conn.execute("DELETE FROM schema_versions WHERE version = 12")
+    conn.commit()
+
+    assert [step['version'] for step in migrations.migrate(conn)['applied']] == [12]
+    assert not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_offres_client_utilisables'").fetchone()
+
+    # Recherche de use_offer
+    plan = ' '.join(row[3] for row in conn.execute('''
+        EXPLAIN QUERY PLAN
+        SELECT oc.* FROM offres_client oc
+        WHERE oc.code_unique = ? AND oc.statut IN ('generee', 'envoyee') AND oc.date_expiration >= date('now')
+    ''', ('OF-1-1-00000000',)))
+    assert 'idx_offres_client_code_unique' in plan
+    conn.close()
@@ -0,0 +1,228 @@
+"""
+Tests du service d'envoi des offres, avec des bouchons SMTP et HTTP en mémoire
+"""
+
+import json
+import socketserver
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import offer_delivery
+from offer_delivery import EmailChannel, HttpChannel, OfferDeliveryService, enqueue_offers
+
+
+class SmtpStubHandler(socketserver.StreamRequestHandler):
+    """Serveur SMTP minimal: refuse temporairement les destinataires de server.rejected"""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply('220 bouchon SMTP')
+        data = None
+        recipient = None
+
+        for line in self.rfile:
+            if data is not None:
+                if line == b'.\r\n':
+                    self.server.received.append(recipient)
+                    data = None
+                    self.reply('250 OK')
+                continue
+
+            command = line[:4].upper()
+            if command == b'RCPT':
+                recipient = line.decode().split(':', 1)[1].strip().strip('<>')
+                if recipient in self.server.rejected:
+                    self.reply('451 4.3.0 Boîte temporairement indisponible')
+                else:
+                    self.reply('250 OK')
+            elif command == b'DATA':
+                data = []
+                self.reply('354 Fin avec <CRLF>.<CRLF>')
+            elif command == b'QUIT':
+                self.reply('221 Au revoir')
+                break
+            else:
+                self.reply('250 OK')
+
+
+class GatewayStubHandler(BaseHTTPRequestHandler):
+    """Passerelle HTTP minimale: répond server.status et enregistre les lots reçus"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.batches.append(json.loads(body)['messages'])
+        self.send_response(self.server.status)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def smtp_server():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SmtpStubHandler)
+    server.daemon_threads = True
+    server.received = []
+    server.rejected = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def gateway():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), GatewayStubHandler)
+    server.batches = []
+    server.status = 200
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def queue_offers(path, count, channel='email'):
+    """Crée count offres pour des clients joignables et les met en file; retourne les clients"""
+    conn = sqlite3.connect(path)
+    clients = conn.execute('''
+        SELECT client_id, email FROM clients
+        WHERE email IS NOT NULL AND telephone IS NOT NULL
+        ORDER BY client_id LIMIT ?
+    ''', (count,)).fetchall()
+    regle_id = conn.execute("SELECT MIN(regle_id) FROM regles_fidelite").fetchone()[0]
+
+    offer_ids = []
+    for client_id, _ in clients:
+        cursor = conn.execute('''
+            INSERT INTO offres_client (client_id, regle_id, date_expiration, statut, code_unique, commentaire)
+            VALUES (?, ?, date('now', '+30 days'), 'generee', ?, 'Offre de test')
+        ''', (client_id, regle_id, f"TEST-{client_id}"))
+        offer_ids.append(cursor.lastrowid)
+
+    assert enqueue_offers(conn, offer_ids, channel) == count
+    conn.commit()
+    conn.close()
+    return dict(clients)
+
+
+def deliveries(path):
+    """État de la file par client: (statut, tentatives, délai avant la prochaine tentative en secondes)"""
+    conn = sqlite3.connect(path)
+    rows = conn.execute('''
+        SELECT oc.client_id, f.statut, f.tentatives,
+               ROUND((julianday(f.prochaine_tentative) - julianday('now')) * 86400)
+        FROM file_envoi_offres f
+        JOIN offres_client oc ON f.offre_id = oc.offre_id
+    ''').fetchall()
+    conn.close()
+    return {row[0]: row[1:] for row in rows}
+
+
+def make_due(path):
+    """Avance l'horloge de la file: toutes les nouvelles tentatives deviennent dues"""
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE file_envoi_offres SET prochaine_tentative = datetime('now')")
+    conn.commit()
+    conn.close()
+
+
+def email_service(path, smtp_server):
+    host, port = smtp_server.server_address
+    return OfferDeliveryService(path, channels={'email': EmailChannel(host, port)})
+
+
+def test_offers_are_delivered(db_copy, smtp_server):
+    path = db_copy('delivered')
+    clients = queue_offers(path, 3)
+
+    result = email_service(path, smtp_server).drain()
+    assert result == {'email': {'sent': 3, 'failed': 0}}
+    assert sorted(smtp_server.received) == sorted(clients.values())
+    assert {state[:2] for state in deliveries(path).values()} == {('envoye', 1)}
+
+    conn = sqlite3.connect(path)
+    statuses = conn.execute(
+        "SELECT statut, canal_envoi FROM offres_client WHERE client_id IN (SELECT value FROM json_each(?))",
+        (json.dumps(list(clients)),)
+    ).fetchall()
+    conn.close()
+    assert set(statuses) == {('envoyee', 'email')}
+
+
+def test_transient_failure_is_retried_with_doubled_delay(db_copy, smtp_server):
+    path = db_copy('transient')
+    clients = queue_offers(path, 2)
+    rejected_client, delivered_client = clients
+    smtp_server.rejected.add(clients[rejected_client])
+    service = email_service(path, smtp_server)
+
+    assert service.drain() == {'email': {'sent': 1, 'failed': 1}}
+    state = deliveries(path)
+    assert state[delivered_client][:2] == ('envoye', 1)
+    assert state[rejected_client][:2] == ('en_attente', 1)
+    assert state[rejected_client][2] == pytest.approx(offer_delivery.RETRY_BASE_DELAY, abs=2)
+
+    make_due(path)
+    assert service.drain() == {'email': {'sent': 0, 'failed': 1}}
+    assert deliveries(path)[rejected_client][:2] == ('en_attente', 2)
+    assert deliveries(path)[rejected_client][2] == pytest.approx(2 * offer_delivery.RETRY_BASE_DELAY, abs=2)
+
+    smtp_server.rejected.clear()
+    make_due(path)
+    assert service.drain() == {'email': {'sent': 1, 'failed': 0}}
+    assert deliveries(path)[rejected_client][:2] == ('envoye', 3)
+
+
+def test_missing_contact_fails_immediately(db_copy, smtp_server):
+    path = db_copy('missing_email')
+    clients = queue_offers(path, 2)
+    missing_client = min(clients)
+
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE clients SET email = NULL WHERE client_id = ?", (missing_client,))
+    conn.commit()
+    conn.close()
+
+    assert email_service(path, smtp_server).drain() == {'email': {'sent': 1, 'failed': 1}}
+    assert deliveries(path)[missing_client][:2] == ('echec', 1)
+
+
+def test_missing_contact_fails_when_gateway_is_down(db_copy, gateway):
+    path = db_copy('gateway_down')
+    clients = queue_offers(path, 3, channel='sms')
+    missing_client = min(clients)
+
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE clients SET telephone = NULL WHERE client_id = ?", (missing_client,))
+    conn.commit()
+    conn.close()
+
+    gateway.status = 503
+    url = f"http://127.0.0.1:{gateway.server_address[1]}/sms"
+    service = OfferDeliveryService(path, channels={'sms': HttpChannel('sms', url, 'telephone')})
+
+    assert service.drain() == {'sms': {'sent': 0, 'failed': 3}}
+    assert len(gateway.batches) == 1 and len(gateway.batches[0]) == 2
+
+    state = deliveries(path)
+    assert state.pop(missing_client)[:2] == ('echec', 1)
+    assert {entry[:2] for entry in state.values()} == {('en_attente', 1)}
+
+
+def test_delivery_is_abandoned_after_max_attempts(db_copy, smtp_server, monkeypatch):
+    path = db_copy('exhausted')
+    clients = queue_offers(path, 1)
+    smtp_server.rejected.update(clients.values())
+    monkeypatch.setattr(offer_delivery, 'RETRY_BASE_DELAY', 0)
+
+    # Sans délai, chaque nouvelle tentative est due aussitôt: drain() les enchaîne jusqu'à l'abandon
+    result = email_service(path, smtp_server).drain()
+    assert result == {'email': {'sent': 0, 'failed': offer_delivery.MAX_ATTEMPTS}}
+    assert list(deliveries(path).values())[0][:2] == ('echec', offer_delivery.MAX_ATTEMPTS)
@@ -0,0 +1,75 @@
+"""
+Tests du cache des requêtes en lecture
+"""
+
+import sqlite3
+import threading
+
+from query_cache import QueryCache, SCHEMAS_MAX_ENTRIES, TABLES_MEMO_MAX_ENTRIES, record_write
+
+
+def memory_database():
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    conn.execute("CREATE TABLE clients (client_id INTEGER PRIMARY KEY)")
+    conn.execute("CREATE TABLE transactions (transaction_id INTEGER PRIMARY KEY, client_id INTEGER)")
+    return conn
+
+
+def test_schemas_are_bounded():
+    cache = QueryCache()
+    conn = memory_database()
+
+    # Une base par rafraîchissement de la réplique de lecture
+    for refresh in range(SCHEMAS_MAX_ENTRIES * 3):
+        db_path = f"replica.sqlite@{refresh}"
+        assert cache.tables_read(conn, db_path, "SELECT * FROM clients") == {'clients'}
+
+    assert len(cache._schemas) == SCHEMAS_MAX_ENTRIES
+    assert f"replica.sqlite@{SCHEMAS_MAX_ENTRIES * 3 - 1}" in cache._schemas
+
+
+def test_concurrent_lookups_and_invalidations():
+    cache = QueryCache()
+    conn = memory_database()
+    errors = []
+
+    def lookups():
+        try:
+            for index in range(TABLES_MEMO_MAX_ENTRIES // 2):
+                tables = cache._memoized_tables(conn, 'db', f"SELECT * FROM transactions WHERE client_id = {index}", False)
+                assert tables == {'transactions'}
+        except Exception as e:
+            errors.append(e)
+
+    def invalidations():
+        try:
+            for _ in range(200):
+                cache.invalidate('db')
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=lookups) for _ in range(4)] + [threading.Thread(target=invalidations)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(cache._tables_memo) <= TABLES_MEMO_MAX_ENTRIES
+
+
+def test_temp_ddl_does_not_invalidate():
+    conn = memory_database()
+
+    for sql in (
+        "CREATE TEMP TABLE regle_eligibles AS SELECT client_id FROM clients",
+        "CREATE TEMPORARY TABLE IF NOT EXISTS niveaux_recalcules (carte_id INTEGER PRIMARY KEY)",
+        "DROP TABLE IF EXISTS temp.regles_eligibles",
+        "CREATE INDEX temp.idx_regles_agg ON regles_agg_1(client_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS temp.idx_niveaux ON niveaux_recalcules(carte_id)",
+    ):
+        assert record_write(conn, 'db', sql) == set()
+
+    # Le schéma principal reste invalidé en entier
+    assert record_write(conn, 'db', "CREATE TABLE temp_archive AS SELECT * FROM temp.regles_eligibles") is None
+    assert record_write(conn, 'db', "DROP INDEX IF EXISTS idx_offres_client_utilisables") is None
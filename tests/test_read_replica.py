@@ -0,0 +1,55 @@
+"""
+Tests de la réplique de lecture
+"""
+
+import os
+
+import pytest
+
+import read_replica
+
+
+@pytest.fixture
+def replica_state(monkeypatch):
+    """État de rafraîchissement propre au test"""
+    state = {'duration_s': None, 'failures': 0, 'last_error': None}
+    monkeypatch.setattr(read_replica, '_refresh_state', state)
+    monkeypatch.setattr(read_replica, 'REPLACE_RETRY_DELAY', 0)
+    return state
+
+
+def test_reads_from_refreshed_replica(db_copy, replica_state):
+    path = db_copy('replica')
+    result = read_replica.refresh_replica(path)
+    assert result['success']
+    assert replica_state['duration_s'] is not None
+
+    conn = read_replica.get_replica_connection(path)
+    assert isinstance(conn, read_replica.ReplicaConnection)
+    assert conn.execute("SELECT COUNT(*) FROM clients").fetchone()[0] > 0
+    assert read_replica.data_lag(conn) < 60
+    conn.close()
+
+
+def test_blocked_replace_backs_off(db_copy, replica_state, monkeypatch):
+    path = db_copy('blocked')
+    assert read_replica.refresh_replica(path)['success']
+    interval = read_replica.refresh_interval()
+
+    def replace(source, target):
+        raise PermissionError("fichier utilisé par un autre processus")
+
+    monkeypatch.setattr(read_replica.os, 'replace', replace)
+    for failures in (1, 2):
+        result = read_replica.refresh_replica(path)
+        assert not result['success']
+        assert result['failures'] == failures
+    assert 'tenue ouverte' in replica_state['last_error']
+    assert read_replica.refresh_interval() == 4 * interval
+    assert not [name for name in os.listdir(os.path.dirname(path)) if name.endswith('.tmp')]
+
+    monkeypatch.undo()
+    monkeypatch.setattr(read_replica, '_refresh_state', replica_state)
+    assert read_replica.refresh_replica(path)['success']
+    assert replica_state['failures'] == 0
+    assert read_replica.get_replica_status(path)['last_error'] is None
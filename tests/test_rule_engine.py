@@ -0,0 +1,42 @@
+"""
+Tests du moteur de règles: les chemins d'évaluation produisent les mêmes offres
+"""
+
+import sqlite3
+
+from loyalty_manager import LoyaltyManager
+
+from conftest import offer_pairs
+
+
+def evaluate_each_client(db_path):
+    """Évalue les règles client par client, comme au scan de ticket"""
+    conn = sqlite3.connect(db_path)
+    client_ids = [row[0] for row in conn.execute("SELECT client_id FROM clients ORDER BY client_id")]
+    conn.close()
+
+    manager = LoyaltyManager(db_path)
+    for client_id in client_ids:
+        assert manager.evaluate_rules_for_client(client_id)['success']
+
+
+def test_client_evaluation_matches_full_evaluation(db_copy):
+    full_path = db_copy('full')
+    assert LoyaltyManager(full_path).evaluate_all_rules()['success']
+
+    client_path = db_copy('client')
+    evaluate_each_client(client_path)
+
+    expected = offer_pairs(full_path)
+    assert expected
+    assert offer_pairs(client_path) == expected
+
+
+def test_compiled_evaluation_matches_full_evaluation(db_copy):
+    full_path = db_copy('full')
+    assert LoyaltyManager(full_path).evaluate_all_rules()['success']
+
+    compiled_path = db_copy('compiled')
+    assert LoyaltyManager(compiled_path).evaluate_all_rules(compiled=True)['success']
+
+    assert offer_pairs(compiled_path) == offer_pairs(full_path)